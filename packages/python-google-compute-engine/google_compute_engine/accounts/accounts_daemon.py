@@ -26,6 +26,7 @@ from google_compute_engine import constants
 from google_compute_engine import file_utils
 from google_compute_engine import logger
 from google_compute_engine import metadata_watcher
+from google_compute_engine import tracing
 from google_compute_engine.accounts import accounts_utils
 from google_compute_engine.accounts import oslogin_utils
 
@@ -41,7 +42,7 @@ class AccountsDaemon(object):
   def __init__(
       self, groups=None, remove=False, gpasswd_add_cmd=None,
       gpasswd_remove_cmd=None, groupadd_cmd=None, useradd_cmd=None,
-      userdel_cmd=None, usermod_cmd=None, debug=False):
+      userdel_cmd=None, usermod_cmd=None, debug=False, context=None):
     """Constructor.
 
     Args:
@@ -54,17 +55,26 @@ class AccountsDaemon(object):
       gpasswd_add_cmd: string, command to add an user to a group.
       gpasswd_remove_cmd: string, command to remove an user from a group.
       debug: bool, True if debug output should write to the console.
+      context: MetadataContext object, the watcher and logger of the guest
+          agent hosting the daemon. The agent watches metadata and calls the
+          handler, so the daemon does not start watching.
     """
-    facility = logging.handlers.SysLogHandler.LOG_DAEMON
-    self.logger = logger.Logger(
-        name='google-accounts', debug=debug, facility=facility)
-    self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    if context:
+      self.logger = context.logger
+      self.watcher = context.watcher
+    else:
+      facility = logging.handlers.SysLogHandler.LOG_DAEMON
+      self.logger = logger.Logger(
+          name='google-accounts', debug=debug, facility=facility)
+      self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
     self.utils = accounts_utils.AccountsUtils(
         logger=self.logger, groups=groups, remove=remove,
         gpasswd_add_cmd=gpasswd_add_cmd, gpasswd_remove_cmd=gpasswd_remove_cmd,
         groupadd_cmd=groupadd_cmd, useradd_cmd=useradd_cmd,
         userdel_cmd=userdel_cmd, usermod_cmd=usermod_cmd)
     self.oslogin = oslogin_utils.OsLoginUtils(logger=self.logger)
+    if context:
+      return
 
     try:
       with file_utils.LockFile(LOCKFILE):
@@ -269,20 +279,40 @@ class AccountsDaemon(object):
     Args:
       result: json, the deserialized contents of the metadata server.
     """
-    self.logger.debug('Checking for changes to user accounts.')
-    configured_users = self.utils.GetConfiguredUsers()
-    enable_oslogin = self._GetEnableOsLoginValue(result)
-    enable_two_factor = self._GetEnableTwoFactorValue(result)
-    if enable_oslogin:
-      desired_users = {}
-      self.oslogin.UpdateOsLogin(True, two_factor_desired=enable_two_factor)
-    else:
-      desired_users = self._GetAccountsData(result)
-      self.oslogin.UpdateOsLogin(False)
-    remove_users = sorted(set(configured_users) - set(desired_users.keys()))
-    self._UpdateUsers(desired_users)
-    self._RemoveUsers(remove_users)
-    self.utils.SetConfiguredUsers(desired_users.keys())
+    with tracing.Span('accounts_reconcile'):
+      self.logger.debug('Checking for changes to user accounts.')
+      configured_users = self.utils.GetConfiguredUsers()
+      enable_oslogin = self._GetEnableOsLoginValue(result)
+      enable_two_factor = self._GetEnableTwoFactorValue(result)
+      if enable_oslogin:
+        desired_users = {}
+        self.oslogin.UpdateOsLogin(True, two_factor_desired=enable_two_factor)
+      else:
+        desired_users = self._GetAccountsData(result)
+        self.oslogin.UpdateOsLogin(False)
+      remove_users = sorted(set(configured_users) - set(desired_users.keys()))
+      self._UpdateUsers(desired_users)
+      self._RemoveUsers(remove_users)
+      self.utils.SetConfiguredUsers(desired_users.keys())
+
+
+def GetOptions(instance_config):
+  """Get the accounts daemon options from the instance configuration.
+
+  Args:
+    instance_config: ConfigManager object, the instance configuration.
+
+  Returns:
+    dict, the keyword arguments for the accounts daemon.
+  """
+  options = {
+      'remove': instance_config.GetOptionBool('Accounts', 'deprovision_remove'),
+  }
+  for option in (
+      'groups', 'useradd_cmd', 'userdel_cmd', 'usermod_cmd', 'groupadd_cmd',
+      'gpasswd_add_cmd', 'gpasswd_remove_cmd'):
+    options[option] = instance_config.GetOptionString('Accounts', option)
+  return options
 
 
 def main():
@@ -292,18 +322,11 @@ def main():
       help='print debug output to the console.')
   (options, _) = parser.parse_args()
   instance_config = config_manager.ConfigManager()
+  tracing.Configure(
+      'accounts_daemon',
+      trace_file=instance_config.GetOptionString('Tracing', 'trace_file'))
   if instance_config.GetOptionBool('Daemons', 'accounts_daemon'):
-    AccountsDaemon(
-        groups=instance_config.GetOptionString('Accounts', 'groups'),
-        remove=instance_config.GetOptionBool('Accounts', 'deprovision_remove'),
-        useradd_cmd=instance_config.GetOptionString('Accounts', 'useradd_cmd'),
-        userdel_cmd=instance_config.GetOptionString('Accounts', 'userdel_cmd'),
-        usermod_cmd=instance_config.GetOptionString('Accounts', 'usermod_cmd'),
-        groupadd_cmd=instance_config.GetOptionString(
-            'Accounts', 'groupadd_cmd'),
-        gpasswd_add_cmd=instance_config.GetOptionString('Accounts', 'gpasswd_add_cmd'),
-        gpasswd_remove_cmd=instance_config.GetOptionString('Accounts', 'gpasswd_remove_cmd'),
-        debug=bool(options.debug))
+    AccountsDaemon(debug=bool(options.debug), **GetOptions(instance_config))
 
 
 if __name__ == '__main__':
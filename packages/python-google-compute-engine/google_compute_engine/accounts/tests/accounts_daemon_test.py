@@ -99,6 +99,43 @@ class AccountsDaemonTest(unittest.TestCase):
       ]
       self.assertEqual(mocks.mock_calls, expected_calls)
 
+  @mock.patch('google_compute_engine.accounts.accounts_daemon.oslogin_utils')
+  @mock.patch('google_compute_engine.accounts.accounts_daemon.accounts_utils')
+  @mock.patch('google_compute_engine.accounts.accounts_daemon.metadata_watcher')
+  @mock.patch('google_compute_engine.accounts.accounts_daemon.logger')
+  @mock.patch('google_compute_engine.accounts.accounts_daemon.file_utils')
+  def testAccountsDaemonContext(
+      self, mock_lock, mock_logger, mock_watcher, mock_utils, mock_oslogin):
+    mock_context = mock.Mock()
+    daemon = accounts_daemon.AccountsDaemon(context=mock_context)
+    self.assertEqual(daemon.logger, mock_context.logger)
+    self.assertEqual(daemon.watcher, mock_context.watcher)
+    mock_utils.AccountsUtils.assert_called_once_with(
+        logger=mock_context.logger, groups=None, remove=False,
+        gpasswd_add_cmd=None, gpasswd_remove_cmd=None, groupadd_cmd=None,
+        useradd_cmd=None, userdel_cmd=None, usermod_cmd=None)
+    mock_logger.Logger.assert_not_called()
+    mock_watcher.MetadataWatcher.assert_not_called()
+    mock_lock.LockFile.assert_not_called()
+
+  def testGetOptions(self):
+    mock_config = mock.Mock()
+    mock_config.GetOptionBool.return_value = True
+    mock_config.GetOptionString.side_effect = lambda section, option: option
+    self.assertEqual(
+        accounts_daemon.GetOptions(mock_config), {
+            'groups': 'groups',
+            'remove': True,
+            'useradd_cmd': 'useradd_cmd',
+            'userdel_cmd': 'userdel_cmd',
+            'usermod_cmd': 'usermod_cmd',
+            'groupadd_cmd': 'groupadd_cmd',
+            'gpasswd_add_cmd': 'gpasswd_add_cmd',
+            'gpasswd_remove_cmd': 'gpasswd_remove_cmd',
+        })
+    mock_config.GetOptionBool.assert_called_once_with(
+        'Accounts', 'deprovision_remove')
+
   def testHasExpired(self):
 
     def _GetTimestamp(days):
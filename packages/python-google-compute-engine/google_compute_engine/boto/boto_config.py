@@ -47,15 +47,22 @@ class BotoConfig(object):
       'not edit this file directly. If you need to add items to this file, '
       'create or edit %s instead and then re-run google_instance_setup.')
 
-  def __init__(self, project_id=None, debug=False):
+  def __init__(self, project_id=None, debug=False, context=None):
     """Constructor.
 
     Args:
       project_id: string, the project ID to use in the config file.
       debug: bool, True if debug output should write to the console.
+      context: MetadataContext object, the metadata snapshot, watcher and
+          logger of the calling process.
     """
-    self.logger = logger.Logger(name='boto-setup', debug=debug)
-    self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    self.context = context
+    if context:
+      self.logger = context.logger
+      self.watcher = context.watcher
+    else:
+      self.logger = logger.Logger(name='boto-setup', debug=debug)
+      self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
     self._CreateConfig(project_id)
 
   def _GetProjectId(self):
@@ -64,6 +71,8 @@ class BotoConfig(object):
     Returns:
       string, the project ID if one is found.
     """
+    if self.context:
+      return self.context.Get('project/projectId')
     project_id_key = 'project/project-id'
     return self.watcher.GetMetadata(
         metadata_key=project_id_key, recursive=False)
@@ -18,6 +18,7 @@
 from boto import auth_handler
 from google_compute_engine import logger
 from google_compute_engine import metadata_watcher
+from google_compute_engine import token_provider
 
 GS_SCOPES = set([
     'https://www.googleapis.com/auth/devstorage.read_only',
@@ -41,6 +42,7 @@ class ComputeAuth(auth_handler.AuthHandler):
     self.logger = logger.Logger(name='compute-auth')
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
     self.service_account = config.get('GoogleCompute', 'service_account', '')
+    self.token_provider = token_provider.GetTokenProvider(logger=self.logger)
     self.scopes = None
     if provider.name == 'google' and self.service_account:
       self.scopes = self._GetGsScopes()
@@ -58,11 +60,8 @@ class ComputeAuth(auth_handler.AuthHandler):
 
   def _GetAccessToken(self):
     """Return an OAuth 2.0 access token for Google Storage."""
-    service_accounts = self.watcher.GetMetadata(metadata_key=self.metadata_key)
-    try:
-      return service_accounts[self.service_account]['token']['access_token']
-    except KeyError:
-      return None
+    token = self.token_provider.GetToken(self.service_account)
+    return token.access_token if token else None
 
   def add_auth(self, http_request):
     http_request.headers['Authorization'] = 'OAuth %s' % self._GetAccessToken()
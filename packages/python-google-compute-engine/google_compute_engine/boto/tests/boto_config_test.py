@@ -88,6 +88,24 @@ class BotoConfigTest(unittest.TestCase):
         metadata_key='project/project-id', recursive=False)
     mock_config.SetOption.assert_not_called()
 
+  @mock.patch('google_compute_engine.boto.boto_config.metadata_watcher')
+  @mock.patch('google_compute_engine.boto.boto_config.logger')
+  @mock.patch('google_compute_engine.boto.boto_config.config_manager')
+  def testCreateConfigContext(self, mock_config, mock_logger, mock_watcher):
+    mock_config_instance = mock.Mock()
+    mock_config.ConfigManager.return_value = mock_config_instance
+    mock_context = mock.Mock()
+    mock_context.Get.return_value = self.project_id
+
+    config = boto_config.BotoConfig(context=mock_context)
+    self.assertEqual(config.logger, mock_context.logger)
+    mock_context.Get.assert_called_once_with('project/projectId')
+    mock_context.watcher.GetMetadata.assert_not_called()
+    mock_logger.Logger.assert_not_called()
+    mock_watcher.MetadataWatcher.assert_not_called()
+    mock_config_instance.SetOption.assert_any_call(
+        'GSUtil', 'default_project_id', self.project_id)
+
 
 if __name__ == '__main__':
   unittest.main()
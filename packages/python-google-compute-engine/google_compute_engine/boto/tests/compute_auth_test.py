@@ -74,23 +74,20 @@ class ComputeAuthTest(unittest.TestCase):
     with self.assertRaises(compute_auth.auth_handler.NotReadyToAuthenticate):
       compute_auth.ComputeAuth(None, self.mock_config, self.mock_provider)
 
-  @mock.patch('google_compute_engine.boto.compute_auth.metadata_watcher')
-  def testGetAccessToken(self, mock_watcher):
+  def testGetAccessToken(self):
     mock_auth = mock.create_autospec(compute_auth.ComputeAuth)
-    mock_auth.watcher = mock_watcher
-    mock_auth.metadata_key = self.metadata_key
+    mock_auth.token_provider = mock.Mock()
     mock_auth.service_account = self.service_account
-    mock_watcher.GetMetadata.side_effect = [
-        {self.service_account: {'token': {'access_token': 'test'}}},
-        {},
-    ]
+    mock_token = mock.Mock(access_token='test')
+    mock_auth.token_provider.GetToken.side_effect = [mock_token, None]
 
     self.assertEqual(
         compute_auth.ComputeAuth._GetAccessToken(mock_auth), 'test')
     self.assertEqual(
         compute_auth.ComputeAuth._GetAccessToken(mock_auth), None)
-    expected_calls = [mock.call(metadata_key=self.metadata_key)] * 2
-    self.assertEqual(mock_watcher.GetMetadata.mock_calls, expected_calls)
+    expected_calls = [mock.call(self.service_account)] * 2
+    self.assertEqual(
+        mock_auth.token_provider.GetToken.mock_calls, expected_calls)
 
   @mock.patch('google_compute_engine.boto.compute_auth.metadata_watcher')
   def testAddAuth(self, mock_watcher):
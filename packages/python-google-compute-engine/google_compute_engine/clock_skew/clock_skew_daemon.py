@@ -18,12 +18,12 @@
 import logging.handlers
 import optparse
 
+from google_compute_engine import compat
 from google_compute_engine import config_manager
 from google_compute_engine import constants
 from google_compute_engine import file_utils
 from google_compute_engine import logger
 from google_compute_engine import metadata_watcher
-from google_compute_engine.compat import distro_utils
 
 LOCKFILE = constants.LOCALSTATEDIR + '/lock/google_clock_skew.lock'
 
@@ -33,16 +33,25 @@ class ClockSkewDaemon(object):
 
   drift_token = 'instance/virtual-clock/drift-token'
 
-  def __init__(self, debug=False):
+  def __init__(self, debug=False, context=None):
     """Constructor.
 
     Args:
       debug: bool, True if debug output should write to the console.
+      context: MetadataContext object, the watcher and logger of the guest
+          agent hosting the daemon. The agent watches metadata and calls the
+          handler, so the daemon does not start watching.
     """
-    facility = logging.handlers.SysLogHandler.LOG_DAEMON
-    self.logger = logger.Logger(
-        name='google-clock-skew', debug=debug, facility=facility)
-    self.distro_utils = distro_utils.Utils(debug=debug)
+    if context:
+      self.logger = context.logger
+    else:
+      facility = logging.handlers.SysLogHandler.LOG_DAEMON
+      self.logger = logger.Logger(
+          name='google-clock-skew', debug=debug, facility=facility)
+    self.distro_utils = compat.GetDistroUtils().Utils(debug=debug)
+    if context:
+      self.watcher = context.watcher
+      return
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
     try:
       with file_utils.LockFile(LOCKFILE):
@@ -22,10 +22,12 @@ from google_compute_engine.test_compat import unittest
 
 class ClockSkewDaemonTest(unittest.TestCase):
 
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.compat.GetDistroUtils')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.metadata_watcher')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.logger.Logger')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.file_utils.LockFile')
-  def testClockSkewDaemon(self, mock_lock, mock_logger, mock_watcher):
+  def testClockSkewDaemon(
+      self, mock_lock, mock_logger, mock_watcher, mock_distro_utils):
     mocks = mock.Mock()
     mocks.attach_mock(mock_lock, 'lock')
     mocks.attach_mock(mock_logger, 'logger')
@@ -48,10 +50,12 @@ class ClockSkewDaemonTest(unittest.TestCase):
       ]
       self.assertEqual(mocks.mock_calls, expected_calls)
 
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.compat.GetDistroUtils')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.metadata_watcher')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.logger.Logger')
   @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.file_utils.LockFile')
-  def testClockSkewDaemonError(self, mock_lock, mock_logger, mock_watcher):
+  def testClockSkewDaemonError(
+      self, mock_lock, mock_logger, mock_watcher, mock_distro_utils):
     mocks = mock.Mock()
     mocks.attach_mock(mock_lock, 'lock')
     mocks.attach_mock(mock_logger, 'logger')
@@ -69,8 +73,23 @@ class ClockSkewDaemonTest(unittest.TestCase):
       ]
       self.assertEqual(mocks.mock_calls, expected_calls)
 
-  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.distro_utils')
-  def testHandleClockSync(self, mock_distro_utils):
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.compat.GetDistroUtils')
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.metadata_watcher')
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.logger.Logger')
+  @mock.patch('google_compute_engine.clock_skew.clock_skew_daemon.file_utils.LockFile')
+  def testClockSkewDaemonContext(
+      self, mock_lock, mock_logger, mock_watcher, mock_distro_utils):
+    mock_context = mock.Mock()
+    daemon = clock_skew_daemon.ClockSkewDaemon(context=mock_context)
+    self.assertEqual(daemon.logger, mock_context.logger)
+    self.assertEqual(daemon.watcher, mock_context.watcher)
+    mock_distro_utils.return_value.Utils.assert_called_once_with(debug=False)
+    mock_logger.assert_not_called()
+    mock_watcher.MetadataWatcher.assert_not_called()
+    mock_lock.assert_not_called()
+
+  def testHandleClockSync(self):
+    mock_distro_utils = mock.Mock()
     mock_sync = mock.create_autospec(clock_skew_daemon.ClockSkewDaemon)
     mock_logger = mock.Mock()
     mock_sync.logger = mock_logger
@@ -15,48 +15,152 @@
 
 """A module for resolving compatibility issues between Python 2 and Python 3."""
 
+import json
 import logging
+import os
 import subprocess
 import sys
+import tempfile
+
+DISTRO_CACHE = '/run/google-compute-engine/distro.json'
+OS_RELEASE = '/etc/os-release'
+
+_distro = None
+
+
+def _LinuxDistribution():
+  """Detect the Linux distribution from the release files.
+
+  Returns:
+    tuple, the distribution name, version and codename.
+  """
+  # The distro module is imported on first use since importing and running it
+  # reads and parses the release files and may run lsb_release.
+  if sys.version_info >= (3, 7):
+    import distro
+  else:
+    import platform as distro
+  return distro.linux_distribution()
+
+
+def _GetOsReleaseMtime():
+  """Get the modification time of the os-release file.
+
+  Returns:
+    float, the modification time or None if the file is not readable.
+  """
+  try:
+    return os.stat(OS_RELEASE).st_mtime
+  except OSError:
+    return None
+
+
+def _ReadDistroCache(mtime):
+  """Read the distribution detected by an earlier process.
+
+  Args:
+    mtime: float, the current modification time of the os-release file.
+
+  Returns:
+    tuple, the distribution name and major version or None if not cached.
+  """
+  try:
+    with open(DISTRO_CACHE) as cache:
+      cached = json.load(cache)
+    if cached['os_release_mtime'] == mtime:
+      return str(cached['name']), str(cached['version'])
+  except (IOError, OSError, ValueError, KeyError, TypeError):
+    pass
+  return None
+
+
+def _WriteDistroCache(name, version, mtime):
+  """Cache the detected distribution for later processes, ignoring errors.
+
+  Args:
+    name: string, the lowercase distribution name.
+    version: string, the major version of the distribution.
+    mtime: float, the modification time of the os-release file.
+  """
+  cached = {'name': name, 'version': version, 'os_release_mtime': mtime}
+  directory = os.path.dirname(DISTRO_CACHE)
+  temp_path = None
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory, 0o755)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as cache:
+      json.dump(cached, cache)
+    # Processes run by other users, such as gsutil, read the cache.
+    os.chmod(temp_path, 0o644)
+    os.rename(temp_path, DISTRO_CACHE)
+  except (IOError, OSError):
+    if temp_path and os.path.exists(temp_path):
+      os.remove(temp_path)
+
+
+def GetDistro():
+  """Get the Linux distribution, detecting it once per process.
+
+  The result is also cached on disk until the os-release file changes, so
+  later processes skip the detection. Without an os-release file, such as on
+  EL6, changes cannot be detected and the disk cache is not used.
+
+  Returns:
+    tuple, the lowercase distribution name and major version.
+  """
+  global _distro
+  if _distro is not None:
+    return _distro
+  if 'freebsd' in sys.platform:
+    # Note: Do not use .version() method which is from either platform or
+    # distro. platform.version() and distro.version() return different values.
+    # platform.version() returns 'FreeBSD 11.2-RELEASE-p9.....'.
+    # distro.version() returns '11.2'.
+    # The version is not used for FreeBSD.
+    _distro = ('freebsd', None)
+    return _distro
+  mtime = _GetOsReleaseMtime()
+  if mtime is not None:
+    _distro = _ReadDistroCache(mtime)
+  if _distro is None:
+    distribution = _LinuxDistribution()
+    _distro = (distribution[0].lower(), distribution[1].split('.')[0])
+    if mtime is not None:
+      _WriteDistroCache(_distro[0], _distro[1], mtime)
+  return _distro
+
+
+def GetDistroUtils():
+  """Import the distro specific utilities module for this distribution.
+
+  Returns:
+    module, the distro_lib utils module with a Utils class.
+  """
+  distro_name, distro_version = GetDistro()
+  if 'centos' in distro_name and distro_version == '6':
+    package = 'el_6'
+  elif 'centos' in distro_name:
+    package = 'el_7'
+  elif 'red hat enterprise linux' in distro_name and distro_version == '6':
+    package = 'el_6'
+  elif 'red hat enterprise linux' in distro_name:
+    package = 'el_7'
+  elif 'fedora' in distro_name:
+    package = 'el_7'
+  elif 'debian' in distro_name:
+    package = 'debian_9'
+  elif 'suse' in distro_name:
+    package = 'sles_12'
+  elif 'freebsd' in distro_name:
+    package = 'freebsd_11'
+  else:
+    # Default to Debian 9.
+    package = 'debian_9'
+  return __import__(
+      'google_compute_engine.distro_lib.%s.utils' % package,
+      fromlist=['Utils'])
 
-if sys.version_info >= (3, 7):
-  import distro
-else:
-  import platform as distro
-
-if 'freebsd' in sys.platform:
-  # Note: Do not use .version() method which is from either platform or distro.
-  # platform.version() and distro.version() return different values.
-  # platform.version() returns 'FreeBSD 11.2-RELEASE-p9.....'.
-  # distro.version() returns '11.2'.
-  distro_name = 'freebsd'
-  # distro_version is not used for FreeBSD later in this code.
-  distro_version = None
-else:
-  distribution = distro.linux_distribution()
-  distro_name = distribution[0].lower()
-  distro_version = distribution[1].split('.')[0]
-distro_utils = None
-
-if 'centos' in distro_name and distro_version == '6':
-  import google_compute_engine.distro_lib.el_6.utils as distro_utils
-elif 'centos' in distro_name:
-  import google_compute_engine.distro_lib.el_7.utils as distro_utils
-elif 'red hat enterprise linux' in distro_name and distro_version == '6':
-  import google_compute_engine.distro_lib.el_6.utils as distro_utils
-elif 'red hat enterprise linux' in distro_name:
-  import google_compute_engine.distro_lib.el_7.utils as distro_utils
-elif 'fedora' in distro_name:
-  import google_compute_engine.distro_lib.el_7.utils as distro_utils
-elif 'debian' in distro_name:
-  import google_compute_engine.distro_lib.debian_9.utils as distro_utils
-elif 'suse' in distro_name:
-  import google_compute_engine.distro_lib.sles_12.utils as distro_utils
-elif 'freebsd' in distro_name:
-  import google_compute_engine.distro_lib.freebsd_11.utils as distro_utils
-else:
-  # Default to Debian 9.
-  import google_compute_engine.distro_lib.debian_9.utils as distro_utils
 
 RETRY_LIMIT = 3
 TIMEOUT = 10
@@ -15,7 +15,9 @@
 
 """A library for retrieving and modifying configuration settings."""
 
+import json
 import os
+import tempfile
 import textwrap
 
 from google_compute_engine import constants
@@ -23,6 +25,147 @@ from google_compute_engine import file_utils
 from google_compute_engine.compat import parser
 
 CONFIG = constants.SYSCONFDIR + '/instance_configs.cfg'
+SNAPSHOT_DIR = '/run/google-compute-engine/config'
+
+_snapshots = {}
+
+
+def _GetSnapshotKey(config_file):
+  """Get the key identifying the current contents of a config file.
+
+  Args:
+    config_file: string, the location of the config file.
+
+  Returns:
+    list, the modification time and size of the file or None if missing.
+  """
+  try:
+    stat = os.stat(config_file)
+  except OSError:
+    return None
+  return [stat.st_mtime, stat.st_size]
+
+
+def _GetSnapshotPath(config_file):
+  """Get the location of the compiled snapshot of a config file.
+
+  Args:
+    config_file: string, the location of the config file.
+
+  Returns:
+    string, the location of the snapshot.
+  """
+  name = os.path.abspath(config_file).strip('/').replace('/', '_')
+  return os.path.join(SNAPSHOT_DIR, name + '.json')
+
+
+def _LoadSnapshot(config, config_file, key):
+  """Populate a parser from the snapshot of an unchanged config file.
+
+  Args:
+    config: Parser object, the parser to populate.
+    config_file: string, the location of the config file.
+    key: list, the current modification time and size of the file.
+
+  Returns:
+    bool, True if the parser was populated from a current snapshot.
+  """
+  snapshot = _snapshots.get(config_file)
+  if not snapshot or snapshot['key'] != key:
+    try:
+      with open(_GetSnapshotPath(config_file)) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    except (IOError, OSError, ValueError):
+      return False
+  if not isinstance(snapshot, dict) or snapshot.get('key') != key:
+    return False
+  # A snapshot that fails partway must not leave the parser partly filled.
+  loaded = parser.RawConfigParser()
+  try:
+    for section, options in snapshot['sections']:
+      loaded.add_section(section)
+      for option, value in options:
+        loaded.set(section, option, value)
+  except (parser.Error, KeyError, TypeError, ValueError):
+    return False
+  if _HasPercent(snapshot['sections']):
+    return False
+  for section in loaded.sections():
+    if not config.has_section(section):
+      config.add_section(section)
+    for option, value in loaded.items(section):
+      config.set(section, option, value)
+  _snapshots[config_file] = snapshot
+  return True
+
+
+def _HasPercent(sections):
+  """Check whether any raw value of a config holds a percent sign.
+
+  Args:
+    sections: list, pairs of a section name and its option value pairs.
+
+  Returns:
+    bool, True if a value holds a percent sign.
+  """
+  return any(
+      '%' in (value or '') for _, options in sections for _, value in options)
+
+
+def _SaveSnapshot(config, config_file, key):
+  """Compile a parsed config file into a snapshot, ignoring errors.
+
+  Args:
+    config: Parser object, the parsed contents of the config file.
+    config_file: string, the location of the config file.
+    key: list, the modification time and size of the parsed file.
+  """
+  # Options in the DEFAULT section apply to every section and would be
+  # copied into each of them, so those files are always parsed. Values with
+  # a percent sign cannot be set on an interpolating parser without changing
+  # how they read, so those files are always parsed too.
+  if key is None or config.defaults():
+    return
+  sections = [
+      [section, config.items(section, raw=True)]
+      for section in config.sections()]
+  if _HasPercent(sections):
+    return
+  snapshot = {'key': key, 'sections': sections}
+  _snapshots[config_file] = snapshot
+  temp_path = None
+  try:
+    if not os.path.isdir(SNAPSHOT_DIR):
+      os.makedirs(SNAPSHOT_DIR, 0o755)
+    fd, temp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR)
+    with os.fdopen(fd, 'w') as snapshot_file:
+      json.dump(snapshot, snapshot_file)
+    os.chmod(temp_path, 0o644)
+    os.rename(temp_path, _GetSnapshotPath(config_file))
+  except (IOError, OSError):
+    if temp_path and os.path.exists(temp_path):
+      os.remove(temp_path)
+
+
+def ReadConfig(config, config_file):
+  """Read a config file, reusing its compiled snapshot if it is unchanged.
+
+  The snapshot holds the parsed sections keyed by the modification time and
+  size of the file. It is kept in memory and in a JSON file shared with
+  other processes, so each version of a config file is only parsed once.
+
+  Args:
+    config: Parser object, the parser to read the config file into.
+    config_file: string, the location of the config file.
+
+  Raises:
+    parser.Error: the config file could not be parsed.
+  """
+  key = _GetSnapshotKey(config_file)
+  if key is not None and _LoadSnapshot(config, config_file, key):
+    return
+  config.read(config_file)
+  _SaveSnapshot(config, config_file, key)
 
 
 class ConfigManager(object):
@@ -38,7 +181,7 @@ class ConfigManager(object):
     self.config_file = config_file or CONFIG
     self.config_header = config_header
     self.config = parser.Parser()
-    self.config.read(self.config_file)
+    ReadConfig(self.config, self.config_file)
 
   def _AddHeader(self, fp):
     """Create a file header in the config.
@@ -109,3 +252,5 @@ class ConfigManager(object):
         if self.config_header:
           self._AddHeader(config_fp)
         self.config.write(config_fp)
+      # Readers of the written file load the snapshot instead of parsing.
+      _SaveSnapshot(self.config, config_file, _GetSnapshotKey(config_file))
@@ -30,9 +30,12 @@ class Utils(utils.Utils):
       interface: string, the output device names for enabling IPv6.
       logger: logger object, used to write to SysLog and serial port.
       dhclient_script: string, the path to a dhclient script used by dhclient.
+
+    Returns:
+      bool, True if dhclient configured IPv6.
     """
     helpers.CallEnableRouteAdvertisements(interfaces, logger)
-    helpers.CallDhclientIpv6(interfaces, logger)
+    return helpers.CallDhclientIpv6(interfaces, logger)
 
   def DisableIpv6(self, interfaces, logger):
     """Disable Ipv6 by giving up the DHCP lease using dhclient.
@@ -40,8 +43,12 @@ class Utils(utils.Utils):
     Args:
       interface: string, the output device names for enabling IPv6.
       logger: logger object, used to write to SysLog and serial port.
+
+    Returns:
+      bool, True if dhclient released the IPv6 lease.
     """
-    helpers.CallDhclientIpv6(interfaces, logger, None, release_lease=True)
+    return helpers.CallDhclientIpv6(
+        interfaces, logger, None, release_lease=True)
 
   def EnableNetworkInterfaces(self, interfaces, logger, dhclient_script=None):
     """Enable the list of network interfaces.
@@ -50,8 +57,11 @@ class Utils(utils.Utils):
       interfaces: list of string, the output device names to enable.
       logger: logger object, used to write to SysLog and serial port.
       dhclient_script: string, the path to a dhclient script used by dhclient.
+
+    Returns:
+      bool, True if dhclient enabled the interfaces.
     """
-    helpers.CallDhclient(interfaces, logger)
+    return helpers.CallDhclient(interfaces, logger)
 
   def HandleClockSync(self, logger):
     """Sync the software clock with the hypervisor clock.
@@ -40,8 +40,11 @@ class Utils(utils.Utils):
       interfaces: list of string, the output device names to enable.
       logger: logger object, used to write to SysLog and serial port.
       dhclient_script: string, the path to a dhclient script used by dhclient.
+
+    Returns:
+      bool, True if dhclient enabled the interfaces.
     """
-    helpers.CallDhclient(interfaces, logger)
+    return helpers.CallDhclient(interfaces, logger)
 
   def HandleClockSync(self, logger):
     """Sync the software clock with the hypervisor clock.
@@ -16,9 +16,53 @@
 """Distro helpers."""
 
 import os
+import signal
+import socket
 import subprocess
 import time
 
+from google_compute_engine.distro_lib import netlink_utils
+
+PROC_SYS = '/proc/sys'
+
+# Deadlines, in seconds, for dhclient child processes. dhclient gives up on a
+# DHCPv4 lease after 60 seconds by default and continues in the background.
+DHCLIENT_TIMEOUT = 120
+DHCLIENT_IPV6_TIMEOUT = 5
+
+
+def CheckCall(command, timeout=None):
+  """Run a command and wait for it to complete within a deadline.
+
+  When the deadline passes, the command is sent SIGTERM and then SIGKILL if it
+  does not exit within one second.
+
+  Args:
+    command: list of string, the command and its arguments.
+    timeout: int, the deadline in seconds or None to wait indefinitely.
+
+  Raises:
+    subprocess.CalledProcessError: the command failed or timed out.
+  """
+  process = subprocess.Popen(command)
+  if timeout is None:
+    process.wait()
+  else:
+    deadline = time.time() + timeout
+    while process.poll() is None:
+      if time.time() >= deadline:
+        process.terminate()
+        grace = time.time() + 1
+        while process.poll() is None and time.time() < grace:
+          time.sleep(0.05)
+        if process.poll() is None:
+          process.kill()
+          process.wait()
+        raise subprocess.CalledProcessError(-signal.SIGTERM, command)
+      time.sleep(0.05)
+  if process.returncode:
+    raise subprocess.CalledProcessError(process.returncode, command)
+
 
 def CallDhclient(
     interfaces, logger, dhclient_script=None):
@@ -28,6 +72,9 @@ def CallDhclient(
     interfaces: list of string, the output device names to enable.
     logger: logger object, used to write to SysLog and serial port.
     dhclient_script: string, the path to a dhclient script used by dhclient.
+
+  Returns:
+    bool, True if dhclient enabled the interfaces.
   """
   logger.info('Enabling the Ethernet interfaces %s.', interfaces)
 
@@ -37,10 +84,12 @@ def CallDhclient(
     dhclient_command += ['-sf', dhclient_script]
 
   try:
-    subprocess.check_call(dhclient_command + ['-x'] + interfaces)
-    subprocess.check_call(dhclient_command + interfaces)
+    CheckCall(dhclient_command + ['-x'] + interfaces, timeout=DHCLIENT_TIMEOUT)
+    CheckCall(dhclient_command + interfaces, timeout=DHCLIENT_TIMEOUT)
   except subprocess.CalledProcessError:
     logger.warning('Could not enable interfaces %s.', interfaces)
+    return False
+  return True
 
 
 def CallDhclientIpv6(interfaces, logger, dhclient_script=None,
@@ -52,26 +101,55 @@ def CallDhclientIpv6(interfaces, logger, dhclient_script=None,
     logger: logger object, used to write to SysLog and serial port.
     dhclient_script: string, the path to a dhclient script used by dhclient.
     release_lease: Release the IPv6 lease.
+
+  Returns:
+    bool, True if dhclient configured or released IPv6.
   """
   logger.info('Calling Dhclient for IPv6 configuration '
               'on the Ethernet interfaces %s.', interfaces)
 
-  timeout_command = ['timeout', '5']
   dhclient_command = ['dhclient']
 
   if release_lease:
     try:
-      subprocess.check_call(
-          timeout_command + dhclient_command + [
-              '-6', '-r', '-v'] + interfaces)
+      CheckCall(
+          dhclient_command + ['-6', '-r', '-v'] + interfaces,
+          timeout=DHCLIENT_IPV6_TIMEOUT)
     except subprocess.CalledProcessError:
       logger.warning('Could not release IPv6 lease on interface %s.',
                      interfaces)
-    return
+      return False
+    return True
 
-  # Check for a 'tentative' IPv6 address which would prevent `dhclient -6` from
-  # succeeding below. This should only take 1 second, but we try for up to 5.
-  command = ['ip', '-6', '-o', 'a', 's', 'dev', interfaces[0], 'scope',
+  # Wait for a 'tentative' IPv6 address which would prevent `dhclient -6` from
+  # succeeding below. This should only take 1 second, but we wait for up to 5.
+  try:
+    netlink_utils.WaitForIpv6Dad(interfaces[0], logger, timeout=5)
+  except (IOError, OSError, socket.error) as e:
+    logger.info('Could not watch IPv6 address events: %s.', e)
+    _PollTentativeIpv6(interfaces[0], logger)
+
+  if dhclient_script and os.path.exists(dhclient_script):
+    dhclient_command += ['-sf', dhclient_script]
+
+  try:
+    CheckCall(
+        dhclient_command + ['-1', '-6', '-v'] + interfaces,
+        timeout=DHCLIENT_IPV6_TIMEOUT)
+  except subprocess.CalledProcessError:
+    logger.warning('Could not enable IPv6 on interface %s.', interfaces)
+    return False
+  return True
+
+
+def _PollTentativeIpv6(interface, logger):
+  """Poll for a 'tentative' IPv6 link address when netlink is unavailable.
+
+  Args:
+    interface: string, the output device name.
+    logger: logger object, used to write to SysLog and serial port.
+  """
+  command = ['ip', '-6', '-o', 'a', 's', 'dev', interface, 'scope',
              'link', 'tentative']
   for i in range(5):
     output = ''
@@ -86,15 +164,6 @@ def CallDhclientIpv6(interfaces, logger, dhclient_script=None,
     else:
       break
 
-  if dhclient_script and os.path.exists(dhclient_script):
-    dhclient_command += ['-sf', dhclient_script]
-
-  try:
-    subprocess.check_call(
-        timeout_command + dhclient_command + ['-1', '-6', '-v'] + interfaces)
-  except subprocess.CalledProcessError:
-    logger.warning('Could not enable IPv6 on interface %s.', interfaces)
-
 
 def CallEnableRouteAdvertisements(interfaces, logger):
   """Enable route advertisements.
@@ -103,11 +172,13 @@ def CallEnableRouteAdvertisements(interfaces, logger):
     interfaces: list of string, the output device names to enable.
     logger: logger object, used to write to SysLog and serial port.
   """
+  sysctls = []
   for interface in interfaces:
     accept_ra = (
         'net.ipv6.conf.{interface}.accept_ra_rt_info_max_plen'.format(
             interface=interface))
-    CallSysctl(logger, accept_ra, 128)
+    sysctls.append((accept_ra, 128))
+  SetSysctls(logger, sysctls)
 
 def CallHwclock(logger):
   """Sync clock using hwclock.
@@ -160,6 +231,62 @@ def CallSysctl(logger, name, value):
   except subprocess.CalledProcessError:
     logger.warning('Unable to configure sysctl %s.', name)
 
+def _GetSysctlPath(name):
+  """Get the /proc/sys path of a sysctl variable.
+
+  Args:
+    name: string, the sysctl variable name using '.' or '/' as separators.
+
+  Returns:
+    string, the path of the sysctl variable under /proc/sys.
+  """
+  if '/' not in name:
+    name = name.replace('.', '/')
+  return os.path.join(PROC_SYS, name)
+
+
+def SetSysctls(logger, sysctls):
+  """Write a batch of sysctl variables, skipping values already set.
+
+  Variables are written directly to /proc/sys. Systems without /proc/sys, such
+  as BSD, fall back to calling sysctl for each variable.
+
+  Args:
+    logger: logger object, used to write to SysLog and serial port.
+    sysctls: list of tuples, the sysctl variable names and values.
+
+  Returns:
+    list of string, the names of the sysctl variables that were changed.
+  """
+  if not os.path.isdir(PROC_SYS):
+    for name, value in sysctls:
+      CallSysctl(logger, name, value)
+    return [name for name, _ in sysctls]
+
+  changed = []
+  for name, value in sysctls:
+    path = _GetSysctlPath(name)
+    value = str(value)
+    try:
+      with open(path) as sysctl:
+        current = sysctl.read()
+    except (IOError, OSError):
+      current = None
+    # Multi-value variables separate values with tabs when read.
+    if current is not None and current.split() == value.split():
+      continue
+    try:
+      with open(path, 'w') as sysctl:
+        sysctl.write(value)
+    except (IOError, OSError) as e:
+      logger.warning('Unable to configure sysctl %s. %s.', name, str(e))
+    else:
+      changed.append(name)
+  if changed:
+    logger.info('Configured sysctls %s.', changed)
+  return changed
+
+
 def SystemctlRestart(service, logger):
   """Restart a service using systemctl.
 
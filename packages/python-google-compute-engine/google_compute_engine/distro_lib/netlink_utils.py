@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utilities for reading Linux network address events over rtnetlink."""
+
+import select
+import socket
+import struct
+import time
+
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTMGRP_IPV6_IFADDR = 0x100
+IFA_ADDRESS = 1
+IFA_FLAGS = 8
+IFA_F_DADFAILED = 0x08
+IFA_F_TENTATIVE = 0x40
+RT_SCOPE_LINK = 253
+
+NLMSG_HEADER = struct.Struct('=LHHLL')
+IFADDRMSG = struct.Struct('=BBBBL')
+RTATTR_HEADER = struct.Struct('=HH')
+IFA_FLAGS_VALUE = struct.Struct('=L')
+
+
+def _Align(length):
+  """Round a netlink length up to the four byte alignment boundary."""
+  return (length + 3) & ~3
+
+
+def _GetInterfaceIndex(interface):
+  """Get the kernel index of a network interface.
+
+  Args:
+    interface: string, the network interface name.
+
+  Returns:
+    int, the interface index.
+
+  Raises:
+    IOError: the interface does not exist.
+  """
+  with open('/sys/class/net/%s/ifindex' % interface) as ifindex:
+    return int(ifindex.read().strip())
+
+
+def ParseAddressMessages(data):
+  """Parse rtnetlink address messages.
+
+  Args:
+    data: bytes, one or more netlink messages read from the socket.
+
+  Returns:
+    list of tuples (message type, index, scope, flags, address). The message
+        type is None for a NLMSG_DONE or NLMSG_ERROR message, which end a dump.
+  """
+  messages = []
+  offset = 0
+  while offset + NLMSG_HEADER.size <= len(data):
+    length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+    if length < NLMSG_HEADER.size:
+      break
+    end = offset + length
+    if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+      messages.append((None, None, None, None, None))
+    elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+      body = offset + NLMSG_HEADER.size
+      _, _, flags, scope, index = IFADDRMSG.unpack_from(data, body)
+      address = None
+      attr = body + IFADDRMSG.size
+      while attr + RTATTR_HEADER.size <= end:
+        attr_length, attr_type = RTATTR_HEADER.unpack_from(data, attr)
+        if attr_length < RTATTR_HEADER.size:
+          break
+        value = data[attr + RTATTR_HEADER.size:attr + attr_length]
+        if attr_type == IFA_ADDRESS:
+          address = value
+        elif attr_type == IFA_FLAGS and len(value) >= IFA_FLAGS_VALUE.size:
+          flags = IFA_FLAGS_VALUE.unpack_from(value)[0]
+        attr += _Align(attr_length)
+      messages.append((msg_type, index, scope, flags, address))
+    offset += _Align(length)
+  return messages
+
+
+def _OpenAddressSocket():
+  """Open a netlink socket subscribed to IPv6 address events.
+
+  Returns:
+    socket, the bound netlink socket.
+
+  Raises:
+    socket.error: netlink is not supported on this system.
+  """
+  family = getattr(socket, 'AF_NETLINK', None)
+  if family is None:
+    raise socket.error('Netlink sockets are not supported.')
+  sock = socket.socket(family, socket.SOCK_RAW, NETLINK_ROUTE)
+  try:
+    sock.bind((0, RTMGRP_IPV6_IFADDR))
+  except socket.error:
+    sock.close()
+    raise
+  return sock
+
+
+def _RequestAddressDump(sock):
+  """Request a dump of the configured IPv6 addresses.
+
+  Args:
+    sock: socket, the netlink socket.
+  """
+  body = IFADDRMSG.pack(socket.AF_INET6, 0, 0, 0, 0)
+  header = NLMSG_HEADER.pack(
+      NLMSG_HEADER.size + len(body), RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP,
+      1, 0)
+  sock.send(header + body)
+
+
+def WaitForIpv6Dad(interface, logger, timeout=5):
+  """Wait for IPv6 link-local addresses to complete duplicate address detection.
+
+  Subscribes to address events before dumping the current addresses, so a
+  tentative address that completes DAD between the two steps is not missed.
+
+  Args:
+    interface: string, the network interface name.
+    logger: logger object, used to write to SysLog and serial port.
+    timeout: float, the number of seconds to wait.
+
+  Returns:
+    bool, True if no link-local address on the interface is tentative.
+
+  Raises:
+    IOError: the interface does not exist.
+    socket.error: netlink is not supported on this system.
+  """
+  index = _GetInterfaceIndex(interface)
+  deadline = time.time() + timeout
+  tentative = set()
+  dumping = True
+  sock = _OpenAddressSocket()
+  try:
+    _RequestAddressDump(sock)
+    while True:
+      remaining = deadline - time.time()
+      if not dumping and not tentative:
+        return True
+      if remaining <= 0:
+        logger.warning('Timed out waiting for IPv6 DAD on %s.', interface)
+        return False
+      readable, _, _ = select.select([sock], [], [], remaining)
+      if not readable:
+        continue
+      data = sock.recv(65536)
+      for msg_type, msg_index, scope, flags, address in (
+          ParseAddressMessages(data)):
+        if msg_type is None:
+          dumping = False
+          continue
+        if msg_index != index or scope != RT_SCOPE_LINK:
+          continue
+        if msg_type == RTM_NEWADDR and flags & IFA_F_DADFAILED:
+          logger.warning('IPv6 DAD failed on %s.', interface)
+          tentative.discard(address)
+        elif msg_type == RTM_NEWADDR and flags & IFA_F_TENTATIVE:
+          if address not in tentative:
+            logger.info(
+                'Waiting for tentative IPv6 link address on %s.', interface)
+          tentative.add(address)
+        else:
+          tentative.discard(address)
+  finally:
+    sock.close()
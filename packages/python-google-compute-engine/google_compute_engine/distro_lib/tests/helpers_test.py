@@ -15,7 +15,10 @@
 
 """Unittest for helpers.py module."""
 
+import os
+import shutil
 import subprocess
+import tempfile
 
 from google_compute_engine.distro_lib import helpers
 from google_compute_engine.test_compat import mock
@@ -27,8 +30,37 @@ class HelpersTest(unittest.TestCase):
   def setUp(self):
     self.mock_logger = mock.Mock()
 
+  def testCheckCall(self):
+    helpers.CheckCall(['true'])
+    helpers.CheckCall(['true'], timeout=5)
+
+  def testCheckCallError(self):
+    with self.assertRaises(subprocess.CalledProcessError):
+      helpers.CheckCall(['false'])
+    with self.assertRaises(subprocess.CalledProcessError):
+      helpers.CheckCall(['false'], timeout=5)
+
+  def testCheckCallTimeout(self):
+    with self.assertRaises(subprocess.CalledProcessError) as context:
+      helpers.CheckCall(['sleep', '10'], timeout=0.1)
+    self.assertLess(context.exception.returncode, 0)
+
+  @mock.patch('google_compute_engine.distro_lib.helpers.time')
+  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.Popen')
+  def testCheckCallKill(self, mock_popen, mock_time):
+    mock_process = mock.Mock()
+    mock_process.poll.return_value = None
+    mock_popen.return_value = mock_process
+    mock_time.time.side_effect = [0, 1, 2, 3, 4]
+
+    with self.assertRaises(subprocess.CalledProcessError):
+      helpers.CheckCall(['test'], timeout=1)
+    mock_process.terminate.assert_called_once_with()
+    mock_process.kill.assert_called_once_with()
+    mock_process.wait.assert_called_once_with()
+
   @mock.patch('google_compute_engine.distro_lib.helpers.os.path.exists')
-  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_call')
+  @mock.patch('google_compute_engine.distro_lib.helpers.CheckCall')
   def testCallDhclient(self, mock_call, mock_exists):
     mocks = mock.Mock()
     mocks.attach_mock(mock_exists, 'exists')
@@ -41,33 +73,40 @@ class HelpersTest(unittest.TestCase):
         subprocess.CalledProcessError(1, 'Test'),
     ]
 
-    helpers.CallDhclient(['a', 'b'], self.mock_logger, 'test_script')
-    helpers.CallDhclient(['c', 'd'], self.mock_logger, 'test_script')
-    helpers.CallDhclient(['e', 'f'], self.mock_logger, None)
-    helpers.CallDhclient(['g', 'h'], self.mock_logger, None)
+    self.assertTrue(
+        helpers.CallDhclient(['a', 'b'], self.mock_logger, 'test_script'))
+    self.assertTrue(
+        helpers.CallDhclient(['c', 'd'], self.mock_logger, 'test_script'))
+    self.assertTrue(helpers.CallDhclient(['e', 'f'], self.mock_logger, None))
+    self.assertFalse(helpers.CallDhclient(['g', 'h'], self.mock_logger, None))
 
     expected_calls = [
         mock.call.logger.info(mock.ANY, ['a', 'b']),
         mock.call.exists('test_script'),
-        mock.call.call(['dhclient', '-x', 'a', 'b']),
-        mock.call.call(['dhclient', 'a', 'b']),
+        mock.call.call(['dhclient', '-x', 'a', 'b'], timeout=mock.ANY),
+        mock.call.call(['dhclient', 'a', 'b'], timeout=mock.ANY),
         mock.call.logger.info(mock.ANY, ['c', 'd']),
         mock.call.exists('test_script'),
-        mock.call.call(['dhclient', '-sf', 'test_script', '-x', 'c', 'd']),
-        mock.call.call(['dhclient', '-sf', 'test_script', 'c', 'd']),
+        mock.call.call(
+            ['dhclient', '-sf', 'test_script', '-x', 'c', 'd'],
+            timeout=mock.ANY),
+        mock.call.call(
+            ['dhclient', '-sf', 'test_script', 'c', 'd'], timeout=mock.ANY),
         mock.call.logger.info(mock.ANY, ['e', 'f']),
-        mock.call.call(['dhclient', '-x', 'e', 'f']),
-        mock.call.call(['dhclient', 'e', 'f']),
+        mock.call.call(['dhclient', '-x', 'e', 'f'], timeout=mock.ANY),
+        mock.call.call(['dhclient', 'e', 'f'], timeout=mock.ANY),
         mock.call.logger.info(mock.ANY, ['g', 'h']),
-        mock.call.call(['dhclient', '-x', 'g', 'h']),
+        mock.call.call(['dhclient', '-x', 'g', 'h'], timeout=mock.ANY),
         mock.call.logger.warning(mock.ANY, ['g', 'h']),
     ]
 
     self.assertEqual(mocks.mock_calls, expected_calls)
 
+  @mock.patch('google_compute_engine.distro_lib.helpers.netlink_utils.WaitForIpv6Dad')
   @mock.patch('google_compute_engine.distro_lib.helpers.os.path.exists')
-  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_call')
-  def testCallDhclientIpv6NonExistentScript(self, mock_call, mock_exists):
+  @mock.patch('google_compute_engine.distro_lib.helpers.CheckCall')
+  def testCallDhclientIpv6NonExistentScript(
+      self, mock_call, mock_exists, mock_dad):
     mock_logger = mock.Mock()
 
     mock_exists.side_effect = [False]
@@ -75,12 +114,13 @@ class HelpersTest(unittest.TestCase):
     mock_call.assert_has_calls(
         [
             mock.call.call(
-                ['timeout', '5', 'dhclient', '-1', '-6', '-v', 'a', 'b']),
+                ['dhclient', '-1', '-6', '-v', 'a', 'b'], timeout=5),
         ])
 
+  @mock.patch('google_compute_engine.distro_lib.helpers.netlink_utils.WaitForIpv6Dad')
   @mock.patch('google_compute_engine.distro_lib.helpers.os.path.exists')
-  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_call')
-  def testCallDhclientIpv6(self, mock_call, mock_exists):
+  @mock.patch('google_compute_engine.distro_lib.helpers.CheckCall')
+  def testCallDhclientIpv6(self, mock_call, mock_exists, mock_dad):
     mock_logger = mock.Mock()
     mock_exists.side_effect = [True]
     mock_call.side_effect = [
@@ -92,40 +132,32 @@ class HelpersTest(unittest.TestCase):
         subprocess.CalledProcessError(1, 'Test'),
     ]
 
-    helpers.CallDhclientIpv6(['a', 'b'], mock_logger, 'test_script')
-    helpers.CallDhclientIpv6(['c', 'd'], mock_logger, None)
-    helpers.CallDhclientIpv6(['e', 'f'], mock_logger, None)
-    helpers.CallDhclientIpv6(
-        ['g', 'h'], mock_logger, 'test_script', release_lease=True)
-    helpers.CallDhclientIpv6(['i', 'j'], mock_logger, None, release_lease=True)
-    helpers.CallDhclientIpv6(['k', 'l'], mock_logger, None, release_lease=True)
+    self.assertTrue(
+        helpers.CallDhclientIpv6(['a', 'b'], mock_logger, 'test_script'))
+    self.assertTrue(helpers.CallDhclientIpv6(['c', 'd'], mock_logger, None))
+    self.assertFalse(helpers.CallDhclientIpv6(['e', 'f'], mock_logger, None))
+    self.assertTrue(helpers.CallDhclientIpv6(
+        ['g', 'h'], mock_logger, 'test_script', release_lease=True))
+    self.assertTrue(helpers.CallDhclientIpv6(
+        ['i', 'j'], mock_logger, None, release_lease=True))
+    self.assertFalse(helpers.CallDhclientIpv6(
+        ['k', 'l'], mock_logger, None, release_lease=True))
 
     expected_calls = [
         mock.call.call(
             [
-                'timeout', '5','dhclient', '-sf', 'test_script', '-1', '-6',
-                '-v', 'a', 'b',
-            ]),
+                'dhclient', '-sf', 'test_script', '-1', '-6', '-v', 'a', 'b',
+            ], timeout=5),
         mock.call.call(
-            [
-                'timeout', '5', 'dhclient', '-1', '-6', '-v', 'c', 'd',
-            ]),
+            ['dhclient', '-1', '-6', '-v', 'c', 'd'], timeout=5),
         mock.call.call(
-            [
-                'timeout', '5', 'dhclient', '-1', '-6', '-v', 'e', 'f',
-             ]),
+            ['dhclient', '-1', '-6', '-v', 'e', 'f'], timeout=5),
         mock.call.call(
-            [
-                'timeout', '5', 'dhclient', '-6', '-r', '-v', 'g', 'h',
-            ]),
+            ['dhclient', '-6', '-r', '-v', 'g', 'h'], timeout=5),
         mock.call.call(
-            [
-                'timeout', '5', 'dhclient', '-6', '-r', '-v', 'i', 'j',
-            ]),
+            ['dhclient', '-6', '-r', '-v', 'i', 'j'], timeout=5),
         mock.call.call(
-            [
-                'timeout', '5', 'dhclient', '-6', '-r', '-v', 'k', 'l',
-            ]),
+            ['dhclient', '-6', '-r', '-v', 'k', 'l'], timeout=5),
     ]
 
     self.assertEqual(mock_call.mock_calls, expected_calls)
@@ -138,18 +170,50 @@ class HelpersTest(unittest.TestCase):
             mock.call.warning(mock.ANY, ['k', 'l']),
         ])
 
-  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_call')
-  def testEnableRouteAdvertisements(self, mock_call):
+  @mock.patch('google_compute_engine.distro_lib.helpers._PollTentativeIpv6')
+  @mock.patch('google_compute_engine.distro_lib.helpers.netlink_utils.WaitForIpv6Dad')
+  @mock.patch('google_compute_engine.distro_lib.helpers.CheckCall')
+  def testCallDhclientIpv6Dad(self, mock_call, mock_dad, mock_poll):
+    mocks = mock.Mock()
+    mocks.attach_mock(mock_call, 'call')
+    mocks.attach_mock(mock_dad, 'dad')
+    mocks.attach_mock(mock_poll, 'poll')
+    mock_dad.side_effect = [True, helpers.socket.error('Test Error')]
+
+    helpers.CallDhclientIpv6(['a'], self.mock_logger)
+    helpers.CallDhclientIpv6(['b'], self.mock_logger)
+    expected_calls = [
+        mock.call.dad('a', self.mock_logger, timeout=5),
+        mock.call.call(['dhclient', '-1', '-6', '-v', 'a'], timeout=5),
+        mock.call.dad('b', self.mock_logger, timeout=5),
+        mock.call.poll('b', self.mock_logger),
+        mock.call.call(['dhclient', '-1', '-6', '-v', 'b'], timeout=5),
+    ]
+    self.assertEqual(mocks.mock_calls, expected_calls)
+
+  @mock.patch('google_compute_engine.distro_lib.helpers.time.sleep')
+  @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_output')
+  def testPollTentativeIpv6(self, mock_output, mock_sleep):
+    command = [
+        'ip', '-6', '-o', 'a', 's', 'dev', 'a', 'scope', 'link', 'tentative']
+    mock_output.side_effect = [b'tentative\n', b'']
+
+    helpers._PollTentativeIpv6('a', self.mock_logger)
+    self.assertEqual(
+        mock_output.mock_calls, [mock.call(command), mock.call(command)])
+    mock_sleep.assert_called_once_with(1)
+
+  @mock.patch('google_compute_engine.distro_lib.helpers.SetSysctls')
+  def testEnableRouteAdvertisements(self, mock_sysctls):
     mock_logger = mock.Mock()
     interfaces = ['foo', 'bar', 'baz']
     helpers.CallEnableRouteAdvertisements(interfaces, mock_logger)
-    mock_call.assert_has_calls([
-        mock.call(
-            [
-                'sysctl', '-w',
-                'net.ipv6.conf.%s.accept_ra_rt_info_max_plen=128' % interface,
-            ])
-        for interface in interfaces])
+    mock_sysctls.assert_called_once_with(
+        mock_logger,
+        [
+            ('net.ipv6.conf.%s.accept_ra_rt_info_max_plen' % interface, 128)
+            for interface in interfaces
+        ])
 
   @mock.patch('google_compute_engine.distro_lib.helpers.subprocess.check_call')
   def testCallHwclock(self, mock_call):
@@ -238,3 +302,45 @@ class HelpersTest(unittest.TestCase):
     mock_call.side_effect = subprocess.CalledProcessError(1, 'Test')
     helpers.CallSysctl(mock_logger, 'fail', 1)
     mock_logger.assert_has_calls([mock.call.warning(mock.ANY, 'fail')])
+
+  def testSetSysctls(self):
+    proc_sys = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, proc_sys)
+    os.makedirs(os.path.join(proc_sys, 'net', 'ipv4'))
+    os.makedirs(os.path.join(proc_sys, 'vm'))
+    sysctls = {
+        'vm/overcommit_memory': '0\n',
+        'vm/swappiness': '60\n',
+        'net/ipv4/tcp_rmem': '4096\t87380\t6291456\n',
+    }
+    for name, value in sysctls.items():
+      with open(os.path.join(proc_sys, name), 'w') as sysctl:
+        sysctl.write(value)
+
+    with mock.patch.object(helpers, 'PROC_SYS', proc_sys):
+      changed = helpers.SetSysctls(
+          self.mock_logger, [
+              ('vm.overcommit_memory', 1),
+              ('vm.swappiness', 60),
+              ('net.ipv4.tcp_rmem', '4096 87380 6291456'),
+              ('vm/missing/dir', 1),
+          ])
+    self.assertEqual(changed, ['vm.overcommit_memory'])
+    with open(os.path.join(proc_sys, 'vm', 'overcommit_memory')) as sysctl:
+      self.assertEqual(sysctl.read(), '1')
+    expected_calls = [
+        mock.call.warning(mock.ANY, 'vm/missing/dir', mock.ANY),
+        mock.call.info(mock.ANY, ['vm.overcommit_memory']),
+    ]
+    self.assertEqual(self.mock_logger.mock_calls, expected_calls)
+
+  @mock.patch('google_compute_engine.distro_lib.helpers.CallSysctl')
+  def testSetSysctlsNoProcSys(self, mock_sysctl):
+    with mock.patch.object(helpers, 'PROC_SYS', '/nonexistent/proc/sys'):
+      changed = helpers.SetSysctls(self.mock_logger, [('a.b', 1), ('c.d', 2)])
+    self.assertEqual(changed, ['a.b', 'c.d'])
+    expected_calls = [
+        mock.call(self.mock_logger, 'a.b', 1),
+        mock.call(self.mock_logger, 'c.d', 2),
+    ]
+    self.assertEqual(mock_sysctl.mock_calls, expected_calls)
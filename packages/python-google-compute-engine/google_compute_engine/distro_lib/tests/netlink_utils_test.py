@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for netlink_utils.py module."""
+
+import socket
+import struct
+
+from google_compute_engine.distro_lib import netlink_utils
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+LINK = netlink_utils.RT_SCOPE_LINK
+TENTATIVE = netlink_utils.IFA_F_TENTATIVE
+
+
+def _AddressMessage(msg_type, index, flags, scope=LINK, address=b'\xfe\x80' * 8,
+                    extended_flags=None):
+  """Build an rtnetlink address message."""
+  attrs = struct.pack('=HH', 4 + len(address), netlink_utils.IFA_ADDRESS)
+  attrs += address + b'\x00' * (-len(address) % 4)
+  if extended_flags is not None:
+    attrs += struct.pack('=HHL', 8, netlink_utils.IFA_FLAGS, extended_flags)
+  body = struct.pack('=BBBBL', socket.AF_INET6, 64, flags, scope, index)
+  body += attrs
+  return struct.pack('=LHHLL', 16 + len(body), msg_type, 0, 0, 0) + body
+
+
+def _DoneMessage():
+  return struct.pack('=LHHLL', 20, netlink_utils.NLMSG_DONE, 0, 0, 0) + (
+      b'\x00' * 4)
+
+
+class NetlinkUtilsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.mock_socket = mock.Mock()
+
+  def testParseAddressMessages(self):
+    data = (
+        _AddressMessage(netlink_utils.RTM_NEWADDR, 2, TENTATIVE)
+        + _AddressMessage(netlink_utils.RTM_DELADDR, 3, 0, address=b'\x01')
+        + _AddressMessage(
+            netlink_utils.RTM_NEWADDR, 2, 0, extended_flags=TENTATIVE | 0x100)
+        + _DoneMessage())
+    expected = [
+        (netlink_utils.RTM_NEWADDR, 2, LINK, TENTATIVE, b'\xfe\x80' * 8),
+        (netlink_utils.RTM_DELADDR, 3, LINK, 0, b'\x01'),
+        (netlink_utils.RTM_NEWADDR, 2, LINK, TENTATIVE | 0x100,
+         b'\xfe\x80' * 8),
+        (None, None, None, None, None),
+    ]
+    self.assertEqual(netlink_utils.ParseAddressMessages(data), expected)
+
+  def testParseAddressMessagesTruncated(self):
+    self.assertEqual(netlink_utils.ParseAddressMessages(b''), [])
+    self.assertEqual(netlink_utils.ParseAddressMessages(b'\x00' * 20), [])
+
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.select.select')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._OpenAddressSocket')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._GetInterfaceIndex')
+  def testWaitForIpv6Dad(self, mock_index, mock_open, mock_select):
+    mock_index.return_value = 2
+    mock_open.return_value = self.mock_socket
+    mock_select.return_value = ([self.mock_socket], [], [])
+    self.mock_socket.recv.side_effect = [
+        # The dump reports a tentative link address on the interface and
+        # tentative addresses that are ignored on other interfaces or scopes.
+        _AddressMessage(netlink_utils.RTM_NEWADDR, 2, TENTATIVE)
+        + _AddressMessage(netlink_utils.RTM_NEWADDR, 3, TENTATIVE)
+        + _AddressMessage(netlink_utils.RTM_NEWADDR, 2, TENTATIVE, scope=0,
+                          address=b'\x01'),
+        _DoneMessage(),
+        # Duplicate address detection completes.
+        _AddressMessage(netlink_utils.RTM_NEWADDR, 2, 0),
+    ]
+
+    self.assertTrue(
+        netlink_utils.WaitForIpv6Dad('eth0', self.mock_logger, timeout=5))
+    self.assertEqual(self.mock_socket.recv.call_count, 3)
+    self.mock_socket.send.assert_called_once_with(mock.ANY)
+    self.mock_socket.close.assert_called_once_with()
+    self.mock_logger.info.assert_called_once_with(mock.ANY, 'eth0')
+
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.select.select')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._OpenAddressSocket')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._GetInterfaceIndex')
+  def testWaitForIpv6DadNoTentative(self, mock_index, mock_open, mock_select):
+    mock_index.return_value = 2
+    mock_open.return_value = self.mock_socket
+    mock_select.return_value = ([self.mock_socket], [], [])
+    self.mock_socket.recv.side_effect = [
+        _AddressMessage(netlink_utils.RTM_NEWADDR, 2, 0) + _DoneMessage(),
+    ]
+
+    self.assertTrue(
+        netlink_utils.WaitForIpv6Dad('eth0', self.mock_logger, timeout=5))
+    self.mock_logger.info.assert_not_called()
+
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.select.select')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._OpenAddressSocket')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._GetInterfaceIndex')
+  def testWaitForIpv6DadFailed(self, mock_index, mock_open, mock_select):
+    mock_index.return_value = 2
+    mock_open.return_value = self.mock_socket
+    mock_select.return_value = ([self.mock_socket], [], [])
+    self.mock_socket.recv.side_effect = [
+        _AddressMessage(netlink_utils.RTM_NEWADDR, 2, TENTATIVE)
+        + _DoneMessage(),
+        _AddressMessage(
+            netlink_utils.RTM_NEWADDR, 2,
+            TENTATIVE | netlink_utils.IFA_F_DADFAILED),
+    ]
+
+    self.assertTrue(
+        netlink_utils.WaitForIpv6Dad('eth0', self.mock_logger, timeout=5))
+    self.mock_logger.warning.assert_called_once_with(mock.ANY, 'eth0')
+
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.time.time')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.select.select')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._OpenAddressSocket')
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils._GetInterfaceIndex')
+  def testWaitForIpv6DadTimeout(
+      self, mock_index, mock_open, mock_select, mock_time):
+    mock_index.return_value = 2
+    mock_open.return_value = self.mock_socket
+    mock_select.return_value = ([], [], [])
+    mock_time.side_effect = [0, 1, 3, 6]
+
+    self.assertFalse(
+        netlink_utils.WaitForIpv6Dad('eth0', self.mock_logger, timeout=5))
+    self.assertEqual(mock_select.call_count, 2)
+    self.mock_logger.warning.assert_called_once_with(mock.ANY, 'eth0')
+    self.mock_socket.close.assert_called_once_with()
+
+  @mock.patch('google_compute_engine.distro_lib.netlink_utils.socket')
+  def testOpenAddressSocketUnsupported(self, mock_socket):
+    del mock_socket.AF_NETLINK
+    mock_socket.error = socket.error
+    with self.assertRaises(socket.error):
+      netlink_utils._OpenAddressSocket()
+
+
+if __name__ == '__main__':
+  unittest.main()
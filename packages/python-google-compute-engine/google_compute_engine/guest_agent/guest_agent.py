@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Host the guest environment daemons in a single process."""
+
+import functools
+import logging.handlers
+import optparse
+import random
+import threading
+import time
+
+from google_compute_engine import config_manager
+from google_compute_engine import file_utils
+from google_compute_engine import logger
+from google_compute_engine import metadata_watcher
+from google_compute_engine import tracing
+from google_compute_engine.accounts import accounts_daemon
+from google_compute_engine.clock_skew import clock_skew_daemon
+from google_compute_engine.networking import network_daemon
+
+BACKOFF = 1
+MAX_BACKOFF = 300
+
+
+class Component(object):
+  """A daemon hosted by the guest agent on its own thread.
+
+  The component creates its daemon once it holds the lock file of the daemon,
+  so it does not run alongside the standalone daemon. Metadata values that
+  arrive while the handler runs are coalesced and only the latest one is
+  handled next. When creating the daemon or handling a value fails, the
+  component waits with exponential backoff, creates the daemon again and
+  handles the latest value again.
+  """
+
+  def __init__(
+      self, name, lockfile, factory, handler, context, metadata_key='',
+      changes_only=False, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+    """Constructor.
+
+    Args:
+      name: string, the name of the daemon used in log messages.
+      lockfile: string, the file locked while the daemon runs.
+      factory: callable, creates the daemon given the metadata context.
+      handler: string, the name of the daemon method handling metadata.
+      context: MetadataContext object, the watcher and logger of the agent.
+      metadata_key: string, the slash separated path of the metadata value
+          handled by the daemon in the metadata contents, or an empty string
+          for the whole contents.
+      changes_only: bool, True if a value equal to the last one is not
+          handled again.
+      backoff: float, the seconds to wait before the first restart.
+      max_backoff: float, the most seconds to wait between restarts.
+    """
+    self.name = name
+    self.lockfile = lockfile
+    self.factory = factory
+    self.handler = handler
+    self.context = context
+    self.logger = context.logger
+    self.metadata_key = metadata_key
+    self.changes_only = changes_only
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.delay = backoff
+    self.value = None
+    self.pending = False
+    self.condition = threading.Condition()
+    self.thread = None
+
+  def Update(self, value):
+    """Queue a metadata value for the daemon without waiting for it.
+
+    Args:
+      value: json, the deserialized metadata value of the component.
+    """
+    if value is None:
+      return
+    with self.condition:
+      if self.changes_only and value == self.value:
+        return
+      self.value = value
+      self.pending = True
+      self.condition.notify()
+
+  def Start(self):
+    """Run the daemon on a background thread."""
+    self.thread = threading.Thread(target=self.Run, name=self.name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Run(self):
+    """Run the daemon, restarting it with backoff when it fails."""
+    while True:
+      try:
+        self._RunDaemon()
+      except (IOError, OSError) as e:
+        self.logger.warning(str(e))
+      except Exception as e:
+        self.logger.exception(
+            'Exception running the %s daemon. %s.', self.name, e)
+      with self.condition:
+        # The value that failed is handled again by the restarted daemon.
+        self.pending = self.value is not None
+      self.logger.info(
+          'Restarting the %s daemon in %s seconds.', self.name, self.delay)
+      time.sleep(self.delay)
+      self.delay = min(self.delay * 2, self.max_backoff)
+
+  def _TakeValue(self):
+    """Wait for a metadata value that was not handled yet.
+
+    Returns:
+      json, the latest metadata value of the component.
+    """
+    with self.condition:
+      while not self.pending:
+        self.condition.wait()
+      self.pending = False
+      return self.value
+
+  def _RunDaemon(self):
+    """Create the daemon and pass it metadata values while holding its lock."""
+    with file_utils.LockFile(self.lockfile):
+      self.logger.info('Starting the %s daemon.', self.name)
+      daemon = self.factory(context=self.context)
+      handler = getattr(daemon, self.handler)
+      while True:
+        handler(self._TakeValue())
+        self.delay = self.backoff
+
+
+class GuestAgent(object):
+  """Host the enabled guest daemons with one metadata watcher and logger."""
+
+  def __init__(self, instance_config, debug=False):
+    """Constructor.
+
+    Args:
+      instance_config: ConfigManager object, the instance configuration.
+      debug: bool, True if debug output should write to the console.
+    """
+    facility = logging.handlers.SysLogHandler.LOG_DAEMON
+    self.logger = logger.Logger(
+        name='google-guest-agent', debug=debug, facility=facility)
+    self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    self.context = metadata_watcher.MetadataContext(
+        self.watcher, logger=self.logger)
+    self.components = self._GetComponents(instance_config, debug)
+    if not self.components:
+      self.logger.info('No guest daemons are enabled.')
+      return
+
+    self.logger.info('Starting Google Guest Agent.')
+    for component in self.components:
+      component.Start()
+    timeout = 60 + random.randint(0, 30)
+    self.watcher.WatchMetadata(
+        self.HandleMetadata, recursive=True, timeout=timeout)
+
+  def _GetComponents(self, instance_config, debug):
+    """Get the daemons enabled in the Daemons section of the configuration.
+
+    Args:
+      instance_config: ConfigManager object, the instance configuration.
+      debug: bool, True if debug output should write to the console.
+
+    Returns:
+      list, the Component objects of the enabled daemons.
+    """
+    components = []
+    if instance_config.GetOptionBool('Daemons', 'accounts_daemon'):
+      # Accounts are updated on every response, including watch timeouts, so
+      # expired SSH keys are removed.
+      components.append(Component(
+          'accounts', accounts_daemon.LOCKFILE,
+          functools.partial(
+              accounts_daemon.AccountsDaemon, debug=debug,
+              **accounts_daemon.GetOptions(instance_config)),
+          'HandleAccounts', self.context))
+    if instance_config.GetOptionBool('Daemons', 'network_daemon'):
+      # Network interfaces are handled on every response, including watch
+      # timeouts, so forwarded IP routes removed outside the agent are
+      # restored.
+      components.append(Component(
+          'network', network_daemon.LOCKFILE,
+          functools.partial(
+              network_daemon.NetworkDaemon, debug=debug,
+              **network_daemon.GetOptions(instance_config)),
+          'HandleNetworkInterfaces', self.context,
+          metadata_key='instance/networkInterfaces'))
+    if instance_config.GetOptionBool('Daemons', 'clock_skew_daemon'):
+      components.append(Component(
+          'clock_skew', clock_skew_daemon.LOCKFILE,
+          functools.partial(clock_skew_daemon.ClockSkewDaemon, debug=debug),
+          'HandleClockSync', self.context,
+          metadata_key='instance/virtualClock/driftToken', changes_only=True))
+    return components
+
+  def HandleMetadata(self, result):
+    """Pass updated metadata contents to the hosted daemons.
+
+    Args:
+      result: json, the deserialized contents of the metadata server.
+    """
+    self.context.metadata_dict = result
+    for component in self.components:
+      if component.metadata_key:
+        component.Update(self.context.Get(component.metadata_key))
+      else:
+        component.Update(result)
+
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option(
+      '-d', '--debug', action='store_true', dest='debug',
+      help='print debug output to the console.')
+  (options, _) = parser.parse_args()
+  instance_config = config_manager.ConfigManager()
+  tracing.Configure(
+      'guest_agent',
+      trace_file=instance_config.GetOptionString('Tracing', 'trace_file'))
+  GuestAgent(instance_config, debug=bool(options.debug))
+
+
+if __name__ == '__main__':
+  main()
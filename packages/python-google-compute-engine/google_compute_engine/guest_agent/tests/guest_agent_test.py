@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for guest_agent.py module."""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from google_compute_engine import file_utils
+from google_compute_engine import metadata_watcher
+from google_compute_engine.accounts import accounts_daemon
+from google_compute_engine.clock_skew import clock_skew_daemon
+from google_compute_engine.guest_agent import guest_agent
+from google_compute_engine.networking import network_daemon
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class ComponentTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.context = metadata_watcher.MetadataContext(
+        mock.Mock(), logger=self.mock_logger)
+    self.test_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.test_dir)
+    self.lockfile = os.path.join(self.test_dir, 'test.lock')
+    self.handled = []
+    self.event = threading.Event()
+    self.mock_daemon = mock.Mock()
+    self.mock_daemon.Handle.side_effect = self._Handle
+    self.mock_factory = mock.Mock(return_value=self.mock_daemon)
+
+  def _Handle(self, value):
+    self.handled.append(value)
+    self.event.set()
+
+  def _Component(self, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return guest_agent.Component(
+        'test', self.lockfile, self.mock_factory, 'Handle', self.context,
+        **kwargs)
+
+  def _WaitForHandled(self, count):
+    while len(self.handled) < count:
+      self.assertTrue(self.event.wait(5))
+      self.event.clear()
+
+  def testUpdate(self):
+    component = self._Component()
+    component.Update(None)
+    self.assertFalse(component.pending)
+    component.Update({'a': 1})
+    component.Update({'a': 2})
+    self.assertTrue(component.pending)
+    self.assertEqual(component.value, {'a': 2})
+    component.pending = False
+    component.Update({'a': 2})
+    self.assertTrue(component.pending)
+
+  def testUpdateChangesOnly(self):
+    component = self._Component(changes_only=True)
+    component.Update('token')
+    self.assertTrue(component.pending)
+    component.pending = False
+    component.Update('token')
+    self.assertFalse(component.pending)
+    component.Update('new')
+    self.assertTrue(component.pending)
+
+  def testRun(self):
+    component = self._Component()
+    component.Update('foo')
+    component.Start()
+    self._WaitForHandled(1)
+    component.Update('bar')
+    self._WaitForHandled(2)
+    self.assertEqual(self.handled, ['foo', 'bar'])
+    self.mock_factory.assert_called_once_with(context=self.context)
+    self.mock_logger.info.assert_called_once_with(
+        'Starting the %s daemon.', 'test')
+
+  def testRunRestart(self):
+    handle = self.mock_daemon.Handle.side_effect
+    self.mock_daemon.Handle.side_effect = [ValueError('Test Error'), None]
+    self.mock_factory.side_effect = [
+        RuntimeError('Test Error'), self.mock_daemon, self.mock_daemon]
+    component = self._Component()
+    component.Update('foo')
+    component.Start()
+    # The value is handled again after the daemon is restarted.
+    while self.mock_daemon.Handle.call_count < 2:
+      self.event.wait(0.01)
+    self.mock_daemon.Handle.side_effect = handle
+    component.Update('bar')
+    self._WaitForHandled(1)
+    self.assertEqual(self.handled, ['bar'])
+    self.assertEqual(
+        self.mock_daemon.Handle.mock_calls[:2],
+        [mock.call('foo'), mock.call('foo')])
+    self.assertEqual(self.mock_factory.call_count, 3)
+    self.assertEqual(self.mock_logger.exception.call_count, 2)
+    self.mock_logger.info.assert_any_call(
+        'Restarting the %s daemon in %s seconds.', 'test', 0.02)
+    # A handled value resets the backoff.
+    self.assertEqual(component.delay, 0.01)
+
+  def testRunLocked(self):
+    component = self._Component()
+    component.Update('foo')
+    with file_utils.LockFile(self.lockfile):
+      component.Start()
+      while not self.mock_logger.warning.called:
+        self.event.wait(0.01)
+      self.mock_factory.assert_not_called()
+    self._WaitForHandled(1)
+    self.assertEqual(self.handled, ['foo'])
+
+
+class GuestAgentTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.mock_config = mock.Mock()
+    self.mock_config.GetOptionBool.return_value = True
+    self.mock_config.GetOptionString.return_value = None
+
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.Component.Start')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.metadata_watcher.MetadataWatcher')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.logger.Logger')
+  def testGuestAgent(self, mock_logger, mock_watcher, mock_start):
+    mock_logger.return_value = self.mock_logger
+    with mock.patch.object(
+        guest_agent.GuestAgent, 'HandleMetadata') as mock_handle:
+      agent = guest_agent.GuestAgent(self.mock_config, debug=True)
+    mock_logger.assert_called_once_with(
+        name='google-guest-agent', debug=True, facility=mock.ANY)
+    self.assertEqual(agent.context.watcher, mock_watcher.return_value)
+    self.assertEqual(agent.context.logger, self.mock_logger)
+    self.assertEqual(
+        [(c.name, c.lockfile, c.handler, c.metadata_key, c.changes_only)
+         for c in agent.components], [
+             ('accounts', accounts_daemon.LOCKFILE, 'HandleAccounts', '',
+              False),
+             ('network', network_daemon.LOCKFILE, 'HandleNetworkInterfaces',
+              'instance/networkInterfaces', False),
+             ('clock_skew', clock_skew_daemon.LOCKFILE, 'HandleClockSync',
+              'instance/virtualClock/driftToken', True),
+         ])
+    self.assertEqual(mock_start.call_count, 3)
+    mock_watcher.return_value.WatchMetadata.assert_called_once_with(
+        mock_handle, recursive=True, timeout=mock.ANY)
+
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.Component.Start')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.metadata_watcher.MetadataWatcher')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.logger.Logger')
+  def testGuestAgentToggles(self, mock_logger, mock_watcher, mock_start):
+    mock_logger.return_value = self.mock_logger
+    self.mock_config.GetOptionBool.side_effect = (
+        lambda section, option: option == 'clock_skew_daemon')
+    agent = guest_agent.GuestAgent(self.mock_config)
+    self.assertEqual([c.name for c in agent.components], ['clock_skew'])
+    self.mock_config.GetOptionBool.assert_any_call(
+        'Daemons', 'accounts_daemon')
+    self.mock_config.GetOptionBool.assert_any_call('Daemons', 'network_daemon')
+    self.assertEqual(mock_start.call_count, 1)
+
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.Component.Start')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.metadata_watcher.MetadataWatcher')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.logger.Logger')
+  def testGuestAgentDisabled(self, mock_logger, mock_watcher, mock_start):
+    mock_logger.return_value = self.mock_logger
+    self.mock_config.GetOptionBool.return_value = False
+    agent = guest_agent.GuestAgent(self.mock_config)
+    self.assertEqual(agent.components, [])
+    self.mock_logger.info.assert_called_once_with(
+        'No guest daemons are enabled.')
+    mock_start.assert_not_called()
+    mock_watcher.return_value.WatchMetadata.assert_not_called()
+
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.Component.Start')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.metadata_watcher.MetadataWatcher')
+  @mock.patch('google_compute_engine.guest_agent.guest_agent.logger.Logger')
+  def testHandleMetadataTimeout(self, mock_logger, mock_watcher, mock_start):
+    mock_logger.return_value = self.mock_logger
+    self.mock_config.GetOptionBool.side_effect = (
+        lambda section, option: option == 'network_daemon')
+    agent = guest_agent.GuestAgent(self.mock_config)
+    network = agent.components[0]
+    result = {'instance': {'networkInterfaces': [{'mac': 'a'}]}}
+    agent.HandleMetadata(result)
+    network.pending = False
+    # An unchanged response after a watch timeout is handled again.
+    agent.HandleMetadata(result)
+    self.assertTrue(network.pending)
+
+  def testHandleMetadata(self):
+    mock_agent = mock.create_autospec(guest_agent.GuestAgent)
+    mock_agent.context = metadata_watcher.MetadataContext(
+        mock.Mock(), logger=self.mock_logger)
+    mock_accounts = mock.Mock(metadata_key='')
+    mock_network = mock.Mock(metadata_key='instance/networkInterfaces')
+    mock_clock = mock.Mock(metadata_key='instance/virtualClock/driftToken')
+    mock_agent.components = [mock_accounts, mock_network, mock_clock]
+    result = {'instance': {'networkInterfaces': [{'mac': 'a'}]}}
+
+    guest_agent.GuestAgent.HandleMetadata(mock_agent, result)
+    self.assertEqual(mock_agent.context.metadata_dict, result)
+    mock_accounts.Update.assert_called_once_with(result)
+    mock_network.Update.assert_called_once_with([{'mac': 'a'}])
+    mock_clock.Update.assert_called_once_with(None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A client writing guest attributes to the metadata server in the background.
+
+Guest attributes are key value pairs in namespaces that the guest publishes
+for other tools to read, such as the SSH host keys of the instance.
+"""
+
+import logging
+import socket
+import threading
+import time
+
+from google_compute_engine.compat import httpclient
+
+METADATA_HOST = 'metadata.google.internal'
+GUEST_ATTRIBUTES_PATH = '/computeMetadata/v1/instance/guest-attributes'
+MAX_CONNECTIONS = 2
+RETRY_LIMIT = 5
+BACKOFF = 1
+MAX_BACKOFF = 30
+TIMEOUT = 10
+
+_shared_writer = None
+_shared_lock = threading.Lock()
+
+
+class GuestAttributesWriter(object):
+  """Queues guest attribute writes and sends them over persistent connections.
+
+  Each worker thread keeps one HTTP/1.1 connection to the metadata server
+  open across writes. Writes to different keys are sent concurrently by the
+  workers. A key written again before it was sent is only sent with its
+  latest value, and a key is never sent by two workers at once. Failed
+  writes are retried with exponential backoff.
+  """
+
+  def __init__(
+      self, logger=None, host=METADATA_HOST, port=80,
+      max_connections=MAX_CONNECTIONS, retry_limit=RETRY_LIMIT,
+      backoff=BACKOFF, max_backoff=MAX_BACKOFF, timeout=TIMEOUT):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      host: string, the host name of the metadata server.
+      port: int, the port of the metadata server.
+      max_connections: int, the number of concurrent connections.
+      retry_limit: int, the number of times a failed write is retried.
+      backoff: float, the seconds to wait before the first retry.
+      max_backoff: float, the most seconds to wait between retries.
+      timeout: float, the seconds to wait for the metadata server.
+    """
+    self.logger = logger or logging
+    self.host = host
+    self.port = port
+    self.max_connections = max_connections
+    self.retry_limit = retry_limit
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.timeout = timeout
+    self.pending = {}
+    self.order = []
+    self.sending = set()
+    self.workers = []
+    self.condition = threading.Condition()
+
+  def Write(self, namespace, key, value):
+    """Queue a guest attribute write without waiting for it to be sent.
+
+    Args:
+      namespace: string, the namespace of the guest attribute.
+      key: string, the name of the guest attribute.
+      value: string, the value of the guest attribute.
+    """
+    with self.condition:
+      if (namespace, key) not in self.pending:
+        self.order.append((namespace, key))
+      self.pending[(namespace, key)] = value
+      if len(self.workers) < self.max_connections:
+        worker = threading.Thread(target=self._RunWorker)
+        worker.daemon = True
+        worker.start()
+        self.workers.append(worker)
+      self.condition.notify_all()
+
+  def Flush(self, timeout=None):
+    """Wait for queued writes to be sent.
+
+    Args:
+      timeout: float, the most seconds to wait or None to wait until done.
+
+    Returns:
+      bool, True if every queued write was sent or given up on.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self.condition:
+      while self.pending or self.sending:
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          return False
+        self.condition.wait(remaining)
+    return True
+
+  def _TakeWrite(self):
+    """Wait for a queued write whose key is not being sent by another worker.
+
+    Returns:
+      tuple, the namespace, key and value of the guest attribute.
+    """
+    with self.condition:
+      while True:
+        for item in self.order:
+          if item not in self.sending:
+            self.order.remove(item)
+            self.sending.add(item)
+            return item + (self.pending.pop(item),)
+        self.condition.wait()
+
+  def _FinishWrite(self, namespace, key):
+    """Mark a guest attribute as no longer being sent.
+
+    Args:
+      namespace: string, the namespace of the guest attribute.
+      key: string, the name of the guest attribute.
+    """
+    with self.condition:
+      self.sending.discard((namespace, key))
+      self.condition.notify_all()
+
+  def _Put(self, connection, namespace, key, value):
+    """Send a guest attribute over a connection.
+
+    Args:
+      connection: HTTPConnection object, the connection to the metadata
+          server.
+      namespace: string, the namespace of the guest attribute.
+      key: string, the name of the guest attribute.
+      value: string, the value of the guest attribute.
+
+    Returns:
+      int, the HTTP status code of the response.
+    """
+    path = '%s/%s/%s' % (GUEST_ATTRIBUTES_PATH, namespace, key)
+    headers = {'Metadata-Flavor': 'Google'}
+    connection.request('PUT', path, value.encode('utf-8'), headers)
+    response = connection.getresponse()
+    # The response is read completely so the connection can be reused.
+    response.read()
+    return response.status
+
+  def _Send(self, connection, namespace, key, value):
+    """Send a guest attribute, retrying failures with backoff.
+
+    Args:
+      connection: HTTPConnection object, the connection to the metadata
+          server.
+      namespace: string, the namespace of the guest attribute.
+      key: string, the name of the guest attribute.
+      value: string, the value of the guest attribute.
+    """
+    delay = self.backoff
+    reconnected = False
+    attempt = 0
+    while True:
+      try:
+        status = self._Put(connection, namespace, key, value)
+      except (httpclient.HTTPException, socket.error) as e:
+        connection.close()
+        error = e
+        if not reconnected:
+          # The server may have closed the idle connection, so reconnect
+          # once without waiting.
+          reconnected = True
+          continue
+      else:
+        if status == httpclient.OK:
+          self.logger.debug('Wrote guest attribute %s/%s.', namespace, key)
+          return
+        error = 'HTTP status %s' % status
+        # Client errors other than too many requests are not retried.
+        if status < 500 and status != 429:
+          break
+      if attempt >= self.retry_limit:
+        break
+      attempt += 1
+      time.sleep(delay)
+      delay = min(delay * 2, self.max_backoff)
+    self.logger.info(
+        'Unable to write guest attribute %s/%s. %s.', namespace, key, error)
+
+  def _RunWorker(self):
+    """Send queued writes over one persistent connection."""
+    connection = httpclient.HTTPConnection(
+        self.host, self.port, timeout=self.timeout)
+    while True:
+      namespace, key, value = self._TakeWrite()
+      try:
+        self._Send(connection, namespace, key, value)
+      except Exception as e:
+        self.logger.warning(
+            'Exception writing guest attribute %s/%s. %s.', namespace, key, e)
+      finally:
+        self._FinishWrite(namespace, key)
+
+
+def GetGuestAttributesWriter(logger=None):
+  """Get the guest attributes writer shared within this process.
+
+  Args:
+    logger: logger object, used by the writer if it is created.
+
+  Returns:
+    GuestAttributesWriter, the shared guest attributes writer.
+  """
+  global _shared_writer
+  with _shared_lock:
+    if _shared_writer is None:
+      _shared_writer = GuestAttributesWriter(logger=logger)
+    return _shared_writer
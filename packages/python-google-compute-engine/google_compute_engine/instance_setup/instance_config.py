@@ -26,6 +26,7 @@ import os
 
 from google_compute_engine import config_manager
 from google_compute_engine import constants
+from google_compute_engine import tracing
 from google_compute_engine.compat import parser
 from google_compute_engine.compat import stringio
 
@@ -76,6 +77,7 @@ class InstanceConfig(config_manager.ConfigManager):
       },
       'InstanceSetup': {
           'host_key_types': 'ecdsa,ed25519,rsa',
+          'local_ssd_profile': '',
           'optimize_local_ssd': 'true',
           'network_enabled': 'true',
           # WARNING: Do not change the value of 'set_boto_config' without first
@@ -91,9 +93,19 @@ class InstanceConfig(config_manager.ConfigManager):
       },
       'MetadataScripts': {
           'run_dir': '',
+          'run_in_memory': 'false',
           'startup': 'true',
           'shutdown': 'true',
           'default_shell': '/bin/bash',
+          'cache_scripts': 'false',
+          'download_part_size': '',
+          'download_max_parts': '',
+          'stage_shutdown_scripts': 'false',
+          'script_timeout': '',
+          'script_cpu_limit': '',
+          'script_memory_limit': '',
+          'script_output_rate_limit': '',
+          'script_output_log_dir': '',
       },
       'NetworkInterfaces': {
           'setup': 'true',
@@ -101,6 +113,9 @@ class InstanceConfig(config_manager.ConfigManager):
           'dhcp_command': '',
           'dhclient_script': '/sbin/google-dhclient-script',
       },
+      'Tracing': {
+          'trace_file': tracing.TRACE_FILE,
+      },
   }
 
   def __init__(self, logger=logging, instance_config_metadata=None):
@@ -142,7 +157,7 @@ class InstanceConfig(config_manager.ConfigManager):
       if os.path.exists(config_file):
         config = parser.Parser()
         try:
-          config.read(config_file)
+          config_manager.ReadConfig(config, config_file)
         except parser.Error as e:
           self.logger.error('Error parsing config file: %s', str(e))
         else:
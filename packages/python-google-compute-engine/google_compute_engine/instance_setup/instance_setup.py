@@ -15,6 +15,7 @@
 
 """Run initialization code the first time the instance boots."""
 
+import functools
 import logging.handlers
 import optparse
 import os
@@ -22,26 +23,28 @@ import re
 import shutil
 import subprocess
 import tempfile
+import time
 
+from google_compute_engine import compat
+from google_compute_engine import config_manager
 from google_compute_engine import constants
 from google_compute_engine import file_utils
+from google_compute_engine import guest_attributes
 from google_compute_engine import logger
 from google_compute_engine import metadata_watcher
+from google_compute_engine import task_graph
+from google_compute_engine import tracing
+from google_compute_engine import worker_pool
 from google_compute_engine.boto import boto_config
-from google_compute_engine.compat import distro_name
-from google_compute_engine.compat import urlerror
-from google_compute_engine.compat import urlrequest
+from google_compute_engine.distro_lib import helpers
 from google_compute_engine.instance_setup import instance_config
+from google_compute_engine.instance_setup import local_ssd
+from google_compute_engine.instance_setup import multiqueue
 
 
-class PutRequest(urlrequest.Request):
-  def get_method(self):
-    return 'PUT'
-
-
-GUEST_ATTRIBUTES_URL = ('http://metadata.google.internal/computeMetadata/v1/'
-                        'instance/guest-attributes')
 HOSTKEY_NAMESPACE = 'hostkeys'
+# Boot waits on instance setup, so queued writes only get a short grace period.
+GUEST_ATTRIBUTES_TIMEOUT = 5
 
 
 class InstanceSetup(object):
@@ -58,45 +61,91 @@ class InstanceSetup(object):
     self.logger = logger.Logger(
         name='instance-setup', debug=self.debug, facility=facility)
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
-    self.metadata_dict = None
+    self.metadata = metadata_watcher.MetadataContext(
+        self.watcher, logger=self.logger)
     self.instance_config = instance_config.InstanceConfig(logger=self.logger)
 
+    tasks = []
     if self.instance_config.GetOptionBool('InstanceSetup', 'network_enabled'):
-      self.metadata_dict = self.watcher.GetMetadata()
-      instance_config_metadata = self._GetInstanceConfig()
-      self.instance_config = instance_config.InstanceConfig(
-          logger=self.logger, instance_config_metadata=instance_config_metadata)
-
-      if self.instance_config.GetOptionBool('InstanceSetup', 'set_host_keys'):
-        host_key_types = self.instance_config.GetOptionString(
-            'InstanceSetup', 'host_key_types')
-        self._SetSshHostKeys(host_key_types=host_key_types)
-
-      if self.instance_config.GetOptionBool('InstanceSetup', 'set_boto_config'):
-        self._SetupBotoConfig()
-
-      self._DisableOvercommit()
-
-    if self.instance_config.GetOptionBool(
-        'InstanceSetup', 'optimize_local_ssd'):
-      self._RunScript('google_optimize_local_ssd')
-
-    if self.instance_config.GetOptionBool('InstanceSetup', 'set_multiqueue'):
-      self._RunScript('google_set_multiqueue')
+      tasks.extend([
+          task_graph.Task('metadata', self._UpdateInstanceConfig),
+          task_graph.Task(
+              'host_keys', self._SetupSshHostKeys, after=['metadata']),
+          task_graph.Task(
+              'boto_config',
+              functools.partial(
+                  self._RunIfEnabled, 'set_boto_config',
+                  self._SetupBotoConfig),
+              after=['metadata']),
+          task_graph.Task(
+              'overcommit', self._DisableOvercommit, after=['metadata']),
+      ])
+    # Local SSD and multiqueue tuning only wait for the instance config from
+    # metadata and run alongside the other steps.
+    tasks.extend([
+        task_graph.Task(
+            'local_ssd',
+            functools.partial(
+                self._RunIfEnabled, 'optimize_local_ssd',
+                self._OptimizeLocalSsd),
+            after=['metadata']),
+        task_graph.Task(
+            'multiqueue',
+            functools.partial(
+                self._RunIfEnabled, 'set_multiqueue', self._SetMultiqueue),
+            after=['metadata']),
+    ])
+    task_graph.RunTasks(tasks, logger=self.logger)
+
+    writer = guest_attributes.GetGuestAttributesWriter(logger=self.logger)
+    if not writer.Flush(timeout=GUEST_ATTRIBUTES_TIMEOUT):
+      self.logger.warning('Timed out writing guest attributes.')
 
     try:
       self.instance_config.WriteConfig()
     except (IOError, OSError) as e:
       self.logger.warning(str(e))
 
-  def _DisableOvercommit(self, distro=distro_name):
-    """Disable overcommit accounting on E2 machine types."""
+  def _UpdateInstanceConfig(self):
+    """Retrieve metadata and apply the instance configuration it specifies."""
+    self.metadata.Fetch()
+    instance_config_metadata = self._GetInstanceConfig()
+    self.instance_config = instance_config.InstanceConfig(
+        logger=self.logger, instance_config_metadata=instance_config_metadata)
+
+  def _SetupSshHostKeys(self):
+    """Regenerate SSH host keys if enabled in the instance config."""
+    if self.instance_config.GetOptionBool('InstanceSetup', 'set_host_keys'):
+      host_key_types = self.instance_config.GetOptionString(
+          'InstanceSetup', 'host_key_types')
+      self._SetSshHostKeys(host_key_types=host_key_types)
+
+  def _RunIfEnabled(self, option, func, *args):
+    """Run a setup step if its option is enabled in the instance config.
+
+    Args:
+      option: string, the option in the InstanceSetup section.
+      func: callable, the setup step.
+      *args: the arguments passed to the setup step.
+    """
+    if self.instance_config.GetOptionBool('InstanceSetup', option):
+      func(*args)
+
+  def _DisableOvercommit(self, distro=None):
+    """Disable overcommit accounting on E2 machine types.
 
+    Args:
+      distro: string, the distribution name or None to detect it.
+    """
     # Expected machine type format:
     # 'projects/00000000000/machineTypes/n1-standard-1'
-    machine_type = self.metadata_dict['instance']['machineType'].split('/')[-1]
-    if machine_type.startswith('e2-') and 'bsd' not in distro:
-      subprocess.call(['sysctl', 'vm.overcommit_memory=1'])
+    machine_type = self.metadata.Get('instance/machineType', '')
+    machine_type = machine_type.split('/')[-1]
+    if not machine_type.startswith('e2-'):
+      return
+    distro = distro or compat.GetDistro()[0]
+    if 'bsd' not in distro:
+      helpers.SetSysctls(self.logger, [('vm.overcommit_memory', 1)])
 
   def _GetInstanceConfig(self):
     """Get the instance configuration specified in metadata.
@@ -104,34 +153,28 @@ class InstanceSetup(object):
     Returns:
       string, the instance configuration data.
     """
-    try:
-      instance_data = self.metadata_dict['instance']['attributes']
-    except KeyError:
+    instance_data = self.metadata.Get('instance/attributes')
+    if instance_data is None:
       instance_data = {}
       self.logger.warning('Instance attributes were not found.')
 
-    try:
-      project_data = self.metadata_dict['project']['attributes']
-    except KeyError:
+    project_data = self.metadata.Get('project/attributes')
+    if project_data is None:
       project_data = {}
       self.logger.warning('Project attributes were not found.')
 
     return (instance_data.get('google-instance-configs')
             or project_data.get('google-instance-configs'))
 
-  def _RunScript(self, script):
-    """Run a script and log the streamed script output.
+  def _OptimizeLocalSsd(self):
+    """Tune the block queues and interrupts of local SSDs."""
+    profile = local_ssd.ParseProfile(self.instance_config.GetOptionString(
+        'InstanceSetup', 'local_ssd_profile'))
+    local_ssd.LocalSsd(logger=self.logger, profile=profile).Run()
 
-    Args:
-      script: string, the file location of an executable script.
-    """
-    process = subprocess.Popen(
-        script, shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
-    while True:
-      for line in iter(process.stdout.readline, b''):
-        self.logger.info(line.decode('utf-8').rstrip('\n'))
-      if process.poll() is not None:
-        break
+  def _SetMultiqueue(self):
+    """Spread virtio-net queues and their interrupts across CPUs."""
+    multiqueue.Multiqueue(logger=self.logger).Run()
 
   def _GetInstanceId(self):
     """Get the instance ID for this VM.
@@ -139,11 +182,11 @@ class InstanceSetup(object):
     Returns:
       string, the instance ID for the VM.
     """
-    try:
-      return str(self.metadata_dict['instance']['id'])
-    except KeyError:
+    instance_id = self.metadata.Get('instance/id')
+    if instance_id is None:
       self.logger.warning('Instance ID was not found in metadata.')
       return None
+    return str(instance_id)
 
   def _GenerateSshKey(self, key_type, key_dest):
     """Generate a new SSH key.
@@ -162,10 +205,14 @@ class InstanceSetup(object):
     command = ['ssh-keygen', '-t', key_type, '-f', temp_key, '-N', '', '-q']
     try:
       self.logger.info('Generating SSH key %s.', key_dest)
+      start_time = time.time()
       subprocess.check_call(command)
     except subprocess.CalledProcessError:
       self.logger.warning('Could not create SSH key %s.', key_dest)
       return
+    self.logger.info(
+        'Generated SSH key %s in %.3f seconds.', key_dest,
+        time.time() - start_time)
 
     shutil.move(temp_key, key_dest)
     shutil.move('%s.pub' % temp_key, '%s.pub' % key_dest)
@@ -182,19 +229,15 @@ class InstanceSetup(object):
     else:
       return key_values[0], key_values[1]
 
-  def _WriteHostKeyToGuestAttributes(self, key_type, key_value):
-    """Write a host key to guest attributes, ignoring errors."""
-    headers = {'Metadata-Flavor': 'Google'}
-    url = '%s/%s/%s' % (GUEST_ATTRIBUTES_URL, HOSTKEY_NAMESPACE, key_type)
-    key_value = key_value.encode('utf-8')
-    req = PutRequest(url, key_value, headers)
-    try:
-      response = urlrequest.urlopen(req)
-      self.logger.debug(response)
-      self.logger.info('Wrote %s host key to guest attributes.', key_type)
-    except urlerror.HTTPError:
-      self.logger.info('Unable to write %s host key to guest attributes.',
-                       key_type)
+  def _WriteHostKeysToGuestAttributes(self, host_keys):
+    """Queue host keys to be written to guest attributes in the background.
+
+    Args:
+      host_keys: list, tuples of the key type and public key string.
+    """
+    writer = guest_attributes.GetGuestAttributesWriter(logger=self.logger)
+    for key_type, key_value in host_keys:
+      writer.Write(HOSTKEY_NAMESPACE, key_type, key_value)
 
   def _StartSshd(self):
     """Initialize the SSH daemon."""
@@ -232,13 +275,19 @@ class InstanceSetup(object):
       key_files = [f for f in os.listdir(key_dir) if file_regex.match(f)]
       key_types = host_key_types.split(',') if host_key_types else []
       key_types_files = ['ssh_host_%s_key' % key_type for key_type in key_types]
-      for key_file in set(key_files) | set(key_types_files):
-        key_type = file_regex.match(key_file).group('type')
-        key_dest = os.path.join(key_dir, key_file)
-        key_data = self._GenerateSshKey(key_type, key_dest)
-        if key_data:
-          self._WriteHostKeyToGuestAttributes(key_data[0], key_data[1])
+      keys = [
+          (file_regex.match(key_file).group('type'),
+           os.path.join(key_dir, key_file))
+          for key_file in sorted(set(key_files) | set(key_types_files))]
+      # Keys are generated concurrently since each ssh-keygen is single
+      # threaded and RSA key generation dominates on small machines.
+      host_keys = worker_pool.ParallelMap(
+          lambda key: self._GenerateSshKey(*key), keys,
+          max_workers=len(keys), logger=self.logger)
       self._StartSshd()
+      host_keys = [key_data for key_data in host_keys if key_data]
+      if host_keys:
+        self._WriteHostKeysToGuestAttributes(host_keys)
       self.instance_config.SetOption(section, 'instance_id', str(instance_id))
 
   def _GetNumericProjectId(self):
@@ -247,17 +296,18 @@ class InstanceSetup(object):
     Returns:
       string, the numeric project ID.
     """
-    try:
-      return str(self.metadata_dict['project']['numericProjectId'])
-    except KeyError:
+    project_id = self.metadata.Get('project/numericProjectId')
+    if project_id is None:
       self.logger.warning('Numeric project ID was not found in metadata.')
       return None
+    return str(project_id)
 
   def _SetupBotoConfig(self):
     """Set the boto config so GSUtil works with provisioned service accounts."""
     project_id = self._GetNumericProjectId()
     try:
-      boto_config.BotoConfig(project_id, debug=self.debug)
+      boto_config.BotoConfig(
+          project_id, debug=self.debug, context=self.metadata)
     except (IOError, OSError) as e:
       self.logger.warning(str(e))
 
@@ -268,7 +318,12 @@ def main():
       '-d', '--debug', action='store_true', dest='debug',
       help='print debug output to the console.')
   (options, _) = parser.parse_args()
-  InstanceSetup(debug=bool(options.debug))
+  instance_config = config_manager.ConfigManager()
+  tracing.Configure(
+      'instance_setup',
+      trace_file=instance_config.GetOptionString('Tracing', 'trace_file'))
+  with tracing.Span('instance_setup'):
+    InstanceSetup(debug=bool(options.debug))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tune the block queues and interrupts of local SSDs."""
+
+import logging.handlers
+import optparse
+import os
+import re
+
+from google_compute_engine import logger
+from google_compute_engine.instance_setup import multiqueue
+
+NVME_MODEL = 'nvme_card'
+SCSI_MODEL = 'EphemeralDisk'
+QUEUE_SETTINGS = ('scheduler', 'nr_requests', 'read_ahead_kb', 'rq_affinity')
+# The scheduler setting lists the schedulers to use in order of preference.
+PROFILES = {
+    'nvme': {
+        'scheduler': 'none,noop',
+        'nr_requests': '256',
+        'read_ahead_kb': '128',
+        'rq_affinity': '2',
+        'irq_affinity': 'true',
+    },
+    'scsi': {
+        'scheduler': 'none,noop',
+        'nr_requests': '256',
+        'read_ahead_kb': '128',
+        'rq_affinity': '2',
+        'irq_affinity': 'true',
+    },
+}
+
+
+def ParseProfile(value):
+  """Parse profile overrides such as nr_requests=512,read_ahead_kb=0.
+
+  Args:
+    value: string, comma separated settings. Scheduler choices are separated
+        with colons, such as scheduler=none:noop.
+
+  Returns:
+    dict, the setting values.
+  """
+  profile = {}
+  for item in (value or '').split(','):
+    name, _, setting = item.partition('=')
+    if name.strip() and setting.strip():
+      profile[name.strip()] = setting.strip().replace(':', ',')
+  return profile
+
+
+class LocalSsd(object):
+  """Apply a tuning profile to local SSDs and verify the result.
+
+  Local SSDs are identified by their model in sysfs. The profile for each
+  kind of device sets the I/O scheduler, the request queue size, the read
+  ahead and the completion CPU affinity of the block queue. The interrupts
+  of the device queues are spread across the online CPUs.
+  """
+
+  def __init__(self, logger=logging, sysfs='/sys', procfs='/proc',
+               profile=None, dry_run=False):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      sysfs: string, the mount point of sysfs.
+      procfs: string, the mount point of procfs.
+      profile: dict, settings overriding the default profiles.
+      dry_run: bool, True if the plan is logged without being applied.
+    """
+    self.logger = logger
+    self.sysfs = sysfs
+    self.procfs = procfs
+    self.dry_run = dry_run
+    self.profiles = {}
+    for kind, settings in PROFILES.items():
+      self.profiles[kind] = dict(settings)
+      self.profiles[kind].update(profile or {})
+
+  def _GetDevices(self):
+    """Get the local SSD block devices.
+
+    Returns:
+      list, tuples of the block device name, the kind of device and the
+          name of the controller whose interrupts serve the device.
+    """
+    devices = []
+    block_dir = os.path.join(self.sysfs, 'block')
+    try:
+      names = sorted(os.listdir(block_dir))
+    except OSError:
+      return devices
+    for name in names:
+      device_dir = os.path.join(block_dir, name, 'device')
+      model = multiqueue.ReadFile(os.path.join(device_dir, 'model'))
+      nvme = re.match(r'^(nvme\d+)n\d+$', name)
+      if nvme and model == NVME_MODEL:
+        devices.append((name, 'nvme', nvme.group(1)))
+      elif name.startswith('sd') and model == SCSI_MODEL:
+        virtio = re.search(r'/(virtio\d+)/', os.path.realpath(device_dir))
+        devices.append((name, 'scsi', virtio.group(1) if virtio else None))
+    return devices
+
+  def _GetInterrupts(self):
+    """Get the NVMe and virtio-scsi queue interrupts from /proc/interrupts.
+
+    Returns:
+      dict, mapping controller names to their queue interrupt numbers in
+          queue order.
+    """
+    queues = {}
+    contents = multiqueue.ReadFile(
+        os.path.join(self.procfs, 'interrupts')) or ''
+    pattern = re.compile(
+        r'^\s*(\d+):.*\s(?:(nvme\d+)q|(virtio\d+)-request\.)(\d+)$')
+    for line in contents.splitlines():
+      match = pattern.match(line)
+      if not match:
+        continue
+      irq, nvme, virtio, queue = match.groups()
+      # The first NVMe queue is the admin queue.
+      if nvme and queue == '0':
+        continue
+      queues.setdefault(nvme or virtio, []).append((int(queue), irq))
+    return dict(
+        (controller, [irq for _, irq in sorted(irqs)])
+        for controller, irqs in queues.items())
+
+  def _GetScheduler(self, path, choices):
+    """Select the first available scheduler from a list of choices.
+
+    Args:
+      path: string, the path of the queue scheduler file.
+      choices: string, comma separated scheduler names in preference order.
+
+    Returns:
+      string, the scheduler name or None if none of the choices is available.
+    """
+    available = multiqueue.ReadFile(path) or ''
+    available = available.replace('[', '').replace(']', '')
+    for choice in choices.split(','):
+      if choice in available.split():
+        return choice
+    return None
+
+  def GetPlan(self):
+    """Compute the settings for each local SSD.
+
+    Returns:
+      list, tuples of the path of a sysfs or procfs file and the value to
+          write to it.
+    """
+    plan = []
+    devices = self._GetDevices()
+    if not devices:
+      return plan
+    cpus = multiqueue.ParseCpuList(multiqueue.ReadFile(
+        os.path.join(self.sysfs, 'devices/system/cpu/online')))
+    interrupts = self._GetInterrupts()
+    controllers = set()
+    for name, kind, controller in devices:
+      profile = self.profiles[kind]
+      queue_dir = os.path.join(self.sysfs, 'block', name, 'queue')
+      for setting in QUEUE_SETTINGS:
+        value = profile.get(setting)
+        path = os.path.join(queue_dir, setting)
+        if value and setting == 'scheduler':
+          value = self._GetScheduler(path, value)
+        if value:
+          plan.append((path, value))
+      irq_affinity = profile.get('irq_affinity', '').lower() == 'true'
+      if not irq_affinity or not cpus or controller in controllers:
+        continue
+      # Devices sharing a controller share its interrupts.
+      controllers.add(controller)
+      for index, irq in enumerate(interrupts.get(controller, [])):
+        path = os.path.join(self.procfs, 'irq', irq, 'smp_affinity_list')
+        plan.append((path, str(cpus[index % len(cpus)])))
+    return plan
+
+  def ApplyPlan(self, plan):
+    """Write the local SSD settings.
+
+    Args:
+      plan: list, tuples of the path of a sysfs or procfs file and the value
+          to write to it.
+    """
+    failures = multiqueue.WritePlan(
+        plan, logger=self.logger, dry_run=self.dry_run)
+    # Settings that did not take effect are reported by Verify.
+    for path, value, e in failures:
+      self.logger.debug('Could not write %s to %s. %s.', value, path, e)
+
+  def _GetApplied(self, path):
+    """Read a setting in the form it is written.
+
+    Args:
+      path: string, the path of a sysfs or procfs file.
+
+    Returns:
+      string, the current value or None if not readable.
+    """
+    value = multiqueue.ReadFile(path)
+    if value and os.path.basename(path) == 'scheduler':
+      selected = re.search(r'\[(.+?)\]', value)
+      return selected.group(1) if selected else value
+    if value and os.path.basename(path) == 'smp_affinity_list':
+      return ','.join(str(cpu) for cpu in multiqueue.ParseCpuList(value))
+    return value
+
+  def Verify(self, plan):
+    """Check which settings took effect.
+
+    Args:
+      plan: list, tuples of the path of a sysfs or procfs file and the value
+          written to it.
+
+    Returns:
+      list, tuples of the path, the expected value and the current value of
+          each setting that does not match.
+    """
+    mismatches = []
+    for path, value in plan:
+      applied = self._GetApplied(path)
+      if applied != value:
+        mismatches.append((path, value, applied))
+    return mismatches
+
+  def Run(self):
+    """Apply the profile to local SSDs and report the settings in effect.
+
+    Returns:
+      list, tuples of the path, the expected value and the current value of
+          each setting that does not match.
+    """
+    plan = self.GetPlan()
+    if not plan:
+      self.logger.info('No local SSDs found.')
+      return []
+    self.ApplyPlan(plan)
+    if self.dry_run:
+      return []
+    for name, kind, _ in self._GetDevices():
+      queue_dir = os.path.join(self.sysfs, 'block', name, 'queue')
+      settings = [
+          '%s=%s' % (setting, self._GetApplied(os.path.join(
+              queue_dir, setting)))
+          for setting in QUEUE_SETTINGS]
+      self.logger.info(
+          'Local SSD %s (%s): %s.', name, kind, ', '.join(settings))
+    mismatches = self.Verify(plan)
+    for path, value, applied in mismatches:
+      self.logger.warning(
+          'Local SSD setting %s is %s instead of %s.', path, applied, value)
+    return mismatches
+
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option(
+      '-d', '--debug', action='store_true', dest='debug',
+      help='print debug output to the console.')
+  parser.add_option(
+      '-n', '--dry-run', action='store_true', dest='dry_run',
+      help='print the local SSD settings without applying them.')
+  parser.add_option(
+      '--profile', dest='profile',
+      help='settings overriding the default profile, such as nr_requests=512.')
+  (options, _) = parser.parse_args()
+  facility = logging.handlers.SysLogHandler.LOG_DAEMON
+  local_ssd_logger = logger.Logger(
+      name='local-ssd', debug=bool(options.debug or options.dry_run),
+      facility=facility)
+  LocalSsd(
+      logger=local_ssd_logger, profile=ParseProfile(options.profile),
+      dry_run=bool(options.dry_run)).Run()
+
+
+if __name__ == '__main__':
+  main()
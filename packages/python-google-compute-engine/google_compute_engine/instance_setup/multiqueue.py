@@ -0,0 +1,435 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Configure virtio-net queues and their IRQ affinity for multiqueue."""
+
+import array
+import fcntl
+import logging.handlers
+import optparse
+import os
+import re
+import socket
+import struct
+import time
+
+from google_compute_engine import logger
+
+SIOCETHTOOL = 0x8946
+ETHTOOL_GCHANNELS = 0x3c
+ETHTOOL_SCHANNELS = 0x3d
+# struct ethtool_channels: cmd, max_rx, max_tx, max_other, max_combined,
+# rx_count, tx_count, other_count and combined_count.
+CHANNELS_FORMAT = '9I'
+WATCH_INTERVAL = 5
+
+
+def ParseCpuList(cpu_list):
+  """Parse a CPU list such as 0-3,8 from sysfs.
+
+  Args:
+    cpu_list: string, the CPU list.
+
+  Returns:
+    list, the sorted CPU numbers.
+  """
+  cpus = set()
+  for item in (cpu_list or '').strip().split(','):
+    if not item:
+      continue
+    start, _, end = item.partition('-')
+    try:
+      cpus.update(range(int(start), int(end or start) + 1))
+    except ValueError:
+      continue
+  return sorted(cpus)
+
+
+def ReadFile(path):
+  """Read the contents of a sysfs or procfs file.
+
+  Args:
+    path: string, the path of the file.
+
+  Returns:
+    string, the stripped file contents or None if not readable.
+  """
+  try:
+    with open(path) as f:
+      return f.read().strip()
+  except (IOError, OSError):
+    return None
+
+
+def WritePlan(plan, logger=logging, dry_run=False):
+  """Write settings to sysfs and procfs files.
+
+  Args:
+    plan: list, tuples of the path of a sysfs or procfs file and the value
+        to write to it.
+    logger: logger object, used to write to SysLog and serial port.
+    dry_run: bool, True if the settings are logged without being written.
+
+  Returns:
+    list, tuples of the path, the value and the error of each setting that
+        could not be written.
+  """
+  failures = []
+  for path, value in plan:
+    if dry_run:
+      logger.info('Would write %s to %s.', value, path)
+      continue
+    try:
+      with open(path, 'w') as f:
+        f.write(value)
+    except (IOError, OSError) as e:
+      failures.append((path, value, e))
+  return failures
+
+
+def _FormatCpuMask(cpus):
+  """Format CPUs as a hexadecimal mask in comma separated 32 bit words.
+
+  Args:
+    cpus: iterable, the CPU numbers in the mask.
+
+  Returns:
+    string, the CPU mask.
+  """
+  mask = 0
+  for cpu in cpus:
+    mask |= 1 << cpu
+  words = []
+  while True:
+    words.append('%08x' % (mask & 0xffffffff))
+    mask >>= 32
+    if not mask:
+      break
+  return ','.join(reversed(words))
+
+
+class Multiqueue(object):
+  """Spread virtio-net queues and their interrupts across CPUs.
+
+  Each network interface is set to use its maximum number of combined
+  queues. Queues are assigned CPUs on the NUMA node of the device first, and
+  one hyperthread of each physical core before its siblings. The interrupts
+  of each queue are pinned to its CPU. Transmit packet steering (XPS) maps
+  every CPU to a queue, and receive packet steering (RPS) spreads receive
+  processing across the NUMA node when there are fewer queues than CPUs.
+  """
+
+  def __init__(self, logger=logging, sysfs='/sys', procfs='/proc',
+               dry_run=False):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      sysfs: string, the mount point of sysfs.
+      procfs: string, the mount point of procfs.
+      dry_run: bool, True if the plan is logged without being applied.
+    """
+    self.logger = logger
+    self.sysfs = sysfs
+    self.procfs = procfs
+    self.dry_run = dry_run
+
+  def _GetOnlineCpus(self):
+    """Get the online CPUs.
+
+    Returns:
+      list, the sorted CPU numbers.
+    """
+    path = os.path.join(self.sysfs, 'devices/system/cpu/online')
+    return ParseCpuList(ReadFile(path))
+
+  def _GetCpuNodes(self):
+    """Get the NUMA node of each CPU.
+
+    Returns:
+      dict, mapping CPU numbers to NUMA node numbers.
+    """
+    nodes = {}
+    node_dir = os.path.join(self.sysfs, 'devices/system/node')
+    try:
+      names = os.listdir(node_dir)
+    except OSError:
+      return nodes
+    for name in names:
+      match = re.match(r'^node(\d+)$', name)
+      if match:
+        cpu_list = ReadFile(os.path.join(node_dir, name, 'cpulist'))
+        for cpu in ParseCpuList(cpu_list):
+          nodes[cpu] = int(match.group(1))
+    return nodes
+
+  def _GetCpuOrder(self, cpus, cpu_nodes, node):
+    """Order CPUs so queues are spread by NUMA node and physical core.
+
+    Args:
+      cpus: list, the online CPU numbers.
+      cpu_nodes: dict, mapping CPU numbers to NUMA node numbers.
+      node: int, the NUMA node of the device or None if unknown.
+
+    Returns:
+      list, the CPU numbers in the order they are assigned to queues.
+    """
+    def _Key(cpu):
+      path = os.path.join(
+          self.sysfs, 'devices/system/cpu/cpu%s/topology' % cpu,
+          'thread_siblings_list')
+      siblings = [
+          sibling for sibling in ParseCpuList(ReadFile(path))
+          if sibling in cpus]
+      thread = siblings.index(cpu) if cpu in siblings else 0
+      remote = node is not None and cpu_nodes.get(cpu, node) != node
+      return (remote, thread, cpu)
+    return sorted(cpus, key=_Key)
+
+  def _GetDevices(self):
+    """Get the virtio-net devices and their network interfaces.
+
+    Returns:
+      list, tuples of the virtio device name, the network interface name and
+          the NUMA node of the device or None if unknown.
+    """
+    devices = []
+    driver_dir = os.path.join(self.sysfs, 'bus/virtio/drivers/virtio_net')
+    try:
+      names = sorted(os.listdir(driver_dir))
+    except OSError:
+      return devices
+    for name in names:
+      if not name.startswith('virtio'):
+        continue
+      device_dir = os.path.realpath(os.path.join(driver_dir, name))
+      numa_node = ReadFile(
+          os.path.join(os.path.dirname(device_dir), 'numa_node'))
+      try:
+        node = int(numa_node) if numa_node else None
+      except ValueError:
+        node = None
+      if node is not None and node < 0:
+        node = None
+      try:
+        interfaces = sorted(os.listdir(os.path.join(device_dir, 'net')))
+      except OSError:
+        continue
+      for interface in interfaces:
+        devices.append((name, interface, node))
+    return devices
+
+  def _GetInterrupts(self):
+    """Get the virtio queue interrupts from /proc/interrupts.
+
+    Returns:
+      dict, mapping tuples of the virtio device name and queue number to
+          the interrupt numbers of the queue.
+    """
+    interrupts = {}
+    contents = ReadFile(os.path.join(self.procfs, 'interrupts')) or ''
+    pattern = re.compile(r'^\s*(\d+):.*\s(virtio\d+)-(?:input|output)\.(\d+)$')
+    for line in contents.splitlines():
+      match = pattern.match(line)
+      if match:
+        irq, device, queue = match.groups()
+        interrupts.setdefault((device, int(queue)), []).append(irq)
+    return interrupts
+
+  def _Ethtool(self, interface, data):
+    """Run an ethtool ioctl on a network interface.
+
+    Args:
+      interface: string, the network interface name.
+      data: bytes, the ethtool command structure.
+
+    Returns:
+      bytes, the command structure updated by the kernel.
+    """
+    buf = array.array('B', data)
+    address, _ = buf.buffer_info()
+    request = struct.pack('16sP', interface.encode('utf-8'), address)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+      fcntl.ioctl(sock.fileno(), SIOCETHTOOL, request)
+    finally:
+      sock.close()
+    return bytes(bytearray(buf))
+
+  def _SetChannels(self, interface):
+    """Set a network interface to its maximum number of combined queues.
+
+    Args:
+      interface: string, the network interface name.
+
+    Returns:
+      int, the number of combined queues or None if unknown.
+    """
+    try:
+      channels = list(struct.unpack(CHANNELS_FORMAT, self._Ethtool(
+          interface, struct.pack(CHANNELS_FORMAT, ETHTOOL_GCHANNELS,
+                                 *([0] * 8)))))
+    except (IOError, OSError) as e:
+      self.logger.warning(
+          'Could not get the queue count of %s. %s.', interface, e)
+      return None
+    max_combined, combined = channels[4], channels[8]
+    if not max_combined or combined == max_combined:
+      return combined or None
+    if self.dry_run:
+      self.logger.info(
+          'Would set %s to %s combined queues.', interface, max_combined)
+      return max_combined
+    channels[0] = ETHTOOL_SCHANNELS
+    channels[8] = max_combined
+    try:
+      self._Ethtool(interface, struct.pack(CHANNELS_FORMAT, *channels))
+    except (IOError, OSError) as e:
+      self.logger.warning(
+          'Could not set %s to %s combined queues. %s.', interface,
+          max_combined, e)
+      return combined or None
+    self.logger.info('Set %s to %s combined queues.', interface, max_combined)
+    return max_combined
+
+  def _GetQueueCount(self, interface):
+    """Get the number of transmit queues of a network interface from sysfs.
+
+    Args:
+      interface: string, the network interface name.
+
+    Returns:
+      int, the number of transmit queues.
+    """
+    try:
+      names = os.listdir(
+          os.path.join(self.sysfs, 'class/net', interface, 'queues'))
+    except OSError:
+      return 0
+    return len([name for name in names if name.startswith('tx-')])
+
+  def GetPlan(self):
+    """Compute the queue and interrupt settings for each network interface.
+
+    Returns:
+      list, tuples of the path of a sysfs or procfs file and the value to
+          write to it.
+    """
+    plan = []
+    cpus = self._GetOnlineCpus()
+    if not cpus:
+      return plan
+    cpu_nodes = self._GetCpuNodes()
+    interrupts = self._GetInterrupts()
+    for device, interface, node in self._GetDevices():
+      queues = self._SetChannels(interface) or self._GetQueueCount(interface)
+      if not queues:
+        continue
+      order = self._GetCpuOrder(cpus, cpu_nodes, node)
+      queue_dir = os.path.join(self.sysfs, 'class/net', interface, 'queues')
+      for queue in range(queues):
+        cpu = order[queue % len(order)]
+        for irq in interrupts.get((device, queue), []):
+          path = os.path.join(self.procfs, 'irq', irq, 'smp_affinity_list')
+          plan.append((path, str(cpu)))
+        xps_cpus = order[queue::queues]
+        plan.append((
+            os.path.join(queue_dir, 'tx-%s' % queue, 'xps_cpus'),
+            _FormatCpuMask(xps_cpus or [cpu])))
+        if queues < len(cpus) and cpu in cpu_nodes:
+          rps_cpus = [
+              other for other in cpus
+              if cpu_nodes.get(other) == cpu_nodes[cpu]]
+        elif queues < len(cpus):
+          rps_cpus = cpus
+        else:
+          rps_cpus = []
+        plan.append((
+            os.path.join(queue_dir, 'rx-%s' % queue, 'rps_cpus'),
+            _FormatCpuMask(rps_cpus)))
+    return plan
+
+  def ApplyPlan(self, plan):
+    """Write the queue and interrupt settings.
+
+    Args:
+      plan: list, tuples of the path of a sysfs or procfs file and the value
+          to write to it.
+
+    Returns:
+      int, the number of settings that could not be written.
+    """
+    failures = WritePlan(plan, logger=self.logger, dry_run=self.dry_run)
+    for path, value, e in failures:
+      self.logger.warning('Could not write %s to %s. %s.', value, path, e)
+    return len(failures)
+
+  def Run(self):
+    """Compute and apply the queue and interrupt settings."""
+    start_time = time.time()
+    plan = self.GetPlan()
+    if not plan:
+      self.logger.info('No virtio-net queues found.')
+      return
+    failures = self.ApplyPlan(plan)
+    if not self.dry_run:
+      self.logger.info(
+          'Applied %s multiqueue settings in %.3f seconds with %s failures.',
+          len(plan) - failures, time.time() - start_time, failures)
+
+  def WatchCpus(self, interval=WATCH_INTERVAL):
+    """Apply the settings again whenever the online CPUs change.
+
+    Args:
+      interval: int, the number of seconds between checks for CPU hotplug.
+    """
+    path = os.path.join(self.sysfs, 'devices/system/cpu/online')
+    online = None
+    while True:
+      current = ReadFile(path)
+      if current != online:
+        if online is not None:
+          self.logger.info('Online CPUs changed to %s.', current)
+        online = current
+        self.Run()
+      time.sleep(interval)
+
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option(
+      '-d', '--debug', action='store_true', dest='debug',
+      help='print debug output to the console.')
+  parser.add_option(
+      '-n', '--dry-run', action='store_true', dest='dry_run',
+      help='print the multiqueue settings without applying them.')
+  parser.add_option(
+      '--watch', action='store_true', dest='watch',
+      help='apply the settings again when CPUs are hotplugged.')
+  (options, _) = parser.parse_args()
+  facility = logging.handlers.SysLogHandler.LOG_DAEMON
+  multiqueue_logger = logger.Logger(
+      name='multiqueue', debug=bool(options.debug or options.dry_run),
+      facility=facility)
+  multiqueue = Multiqueue(
+      logger=multiqueue_logger, dry_run=bool(options.dry_run))
+  if options.watch:
+    multiqueue.WatchCpus()
+  else:
+    multiqueue.Run()
+
+
+if __name__ == '__main__':
+  main()
@@ -15,10 +15,15 @@
 
 """Unittest for instance_setup.py module."""
 
+import json
 import subprocess
+import threading
 
+from google_compute_engine import metadata_watcher
+from google_compute_engine.boto import boto_config
 from google_compute_engine.instance_setup import instance_setup
 from google_compute_engine.test_compat import builtin
+from google_compute_engine.test_compat import httpserver
 from google_compute_engine.test_compat import mock
 from google_compute_engine.test_compat import unittest
 
@@ -32,30 +37,31 @@ class InstanceSetupTest(unittest.TestCase):
     self.mock_setup.debug = False
     self.mock_setup.instance_config = self.mock_instance_config
     self.mock_setup.logger = self.mock_logger
+    self.mock_setup.metadata = metadata_watcher.MetadataContext(
+        mock.Mock(), logger=self.mock_logger)
 
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.guest_attributes')
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.task_graph.RunTasks')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.instance_config')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.metadata_watcher')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.logger')
-  def testInstanceSetup(self, mock_logger, mock_watcher, mock_config):
+  def testInstanceSetup(
+      self, mock_logger, mock_watcher, mock_config, mock_run_tasks,
+      mock_guest_attributes):
     mock_setup = mock.create_autospec(instance_setup.InstanceSetup)
     mocks = mock.Mock()
     mocks.attach_mock(mock_logger, 'logger')
     mocks.attach_mock(mock_watcher, 'watcher')
     mocks.attach_mock(mock_config, 'config')
-    mocks.attach_mock(mock_setup, 'setup')
+    mocks.attach_mock(mock_run_tasks, 'run_tasks')
+    mocks.attach_mock(mock_guest_attributes, 'guest_attributes')
+    mock_writer = mock_guest_attributes.GetGuestAttributesWriter.return_value
+    mock_writer.Flush.return_value = True
     mock_logger_instance = mock.Mock()
     mock_logger.Logger.return_value = mock_logger_instance
-    mock_watcher_instance = mock.Mock()
-    mock_watcher_instance.GetMetadata.return_value = {
-        'hello': 'world',
-        'instance': {'machineType': 'fake'},
-    }
-    mock_watcher.MetadataWatcher.return_value = mock_watcher_instance
     mock_config_instance = mock.Mock()
     mock_config_instance.GetOptionBool.return_value = True
-    mock_config_instance.GetOptionString.return_value = 'type'
     mock_config.InstanceConfig.return_value = mock_config_instance
-    mock_setup._GetInstanceConfig.return_value = 'config'
 
     instance_setup.InstanceSetup.__init__(mock_setup)
     expected_calls = [
@@ -63,47 +69,54 @@ class InstanceSetupTest(unittest.TestCase):
         mock.call.logger.Logger(
             name=mock.ANY, debug=False, facility=mock.ANY),
         mock.call.watcher.MetadataWatcher(logger=mock_logger_instance),
+        mock.call.watcher.MetadataContext(
+            mock_watcher.MetadataWatcher.return_value,
+            logger=mock_logger_instance),
         mock.call.config.InstanceConfig(logger=mock_logger_instance),
         # Check network access for reaching the metadata server.
         mock.call.config.InstanceConfig().GetOptionBool(
             'InstanceSetup', 'network_enabled'),
-        mock.call.watcher.MetadataWatcher().GetMetadata(),
-        # Get the instance config if specified in metadata.
-        mock.call.setup._GetInstanceConfig(),
-        mock.call.config.InstanceConfig(
-            logger=mock_logger_instance, instance_config_metadata='config'),
-        # Setup for SSH host keys if necessary.
-        mock.call.config.InstanceConfig().GetOptionBool(
-            'InstanceSetup', 'set_host_keys'),
-        mock.call.config.InstanceConfig().GetOptionString(
-            'InstanceSetup', 'host_key_types'),
-        mock.call.setup._SetSshHostKeys(host_key_types='type'),
-        # Setup for the boto config if necessary.
-        mock.call.config.InstanceConfig().GetOptionBool(
-            'InstanceSetup', 'set_boto_config'),
-        mock.call.setup._SetupBotoConfig(),
-        mock.call.setup._DisableOvercommit(),
-        # Setup for local SSD.
-        mock.call.config.InstanceConfig().GetOptionBool(
-            'InstanceSetup', 'optimize_local_ssd'),
-        mock.call.setup._RunScript('google_optimize_local_ssd'),
-        # Setup for multiqueue virtio driver.
-        mock.call.config.InstanceConfig().GetOptionBool(
-            'InstanceSetup', 'set_multiqueue'),
-        mock.call.setup._RunScript('google_set_multiqueue'),
+        # Run the setup steps.
+        mock.call.run_tasks(mock.ANY, logger=mock_logger_instance),
+        # Wait for queued guest attribute writes.
+        mock.call.guest_attributes.GetGuestAttributesWriter(
+            logger=mock_logger_instance),
+        mock.call.guest_attributes.GetGuestAttributesWriter().Flush(
+            timeout=instance_setup.GUEST_ATTRIBUTES_TIMEOUT),
         # Write the updated config file.
         mock.call.config.InstanceConfig().WriteConfig(),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
-    self.assertEqual(mock_setup.metadata_dict, {
-        'hello': 'world',
-        'instance':{'machineType': 'fake'},
-    })
 
+    tasks = mock_run_tasks.call_args[0][0]
+    self.assertEqual(
+        [(task.name, task.after) for task in tasks], [
+            ('metadata', []),
+            ('host_keys', ['metadata']),
+            ('boto_config', ['metadata']),
+            ('overcommit', ['metadata']),
+            ('local_ssd', ['metadata']),
+            ('multiqueue', ['metadata']),
+        ])
+    for task in tasks:
+      task.func()
+    expected_calls = [
+        mock.call._UpdateInstanceConfig(),
+        mock.call._SetupSshHostKeys(),
+        mock.call._RunIfEnabled('set_boto_config', mock_setup._SetupBotoConfig),
+        mock.call._DisableOvercommit(),
+        mock.call._RunIfEnabled(
+            'optimize_local_ssd', mock_setup._OptimizeLocalSsd),
+        mock.call._RunIfEnabled('set_multiqueue', mock_setup._SetMultiqueue),
+    ]
+    self.assertEqual(mock_setup.mock_calls, expected_calls)
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.guest_attributes')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.instance_config')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.metadata_watcher')
   @mock.patch('google_compute_engine.instance_setup.instance_setup.logger')
-  def testInstanceSetupException(self, mock_logger, mock_watcher, mock_config):
+  def testInstanceSetupException(
+      self, mock_logger, mock_watcher, mock_config, mock_guest_attributes):
     mock_setup = mock.create_autospec(instance_setup.InstanceSetup)
     mocks = mock.Mock()
     mocks.attach_mock(mock_logger, 'logger')
@@ -116,28 +129,153 @@ class InstanceSetupTest(unittest.TestCase):
     mock_config_instance.GetOptionBool.return_value = False
     mock_config_instance.WriteConfig.side_effect = IOError('Test Error')
     mock_config.InstanceConfig.return_value = mock_config_instance
+    mock_writer = mock_guest_attributes.GetGuestAttributesWriter.return_value
+    mock_writer.Flush.return_value = False
+    mock_setup._RunIfEnabled.side_effect = (
+        lambda option, func, *args: mock_config_instance.GetOptionBool(
+            'InstanceSetup', option))
 
     instance_setup.InstanceSetup.__init__(mock_setup)
     expected_calls = [
         mock.call.logger.Logger(
             name=mock.ANY, debug=False, facility=mock.ANY),
         mock.call.watcher.MetadataWatcher(logger=mock_logger_instance),
+        mock.call.watcher.MetadataContext(
+            mock_watcher.MetadataWatcher.return_value,
+            logger=mock_logger_instance),
         mock.call.config.InstanceConfig(logger=mock_logger_instance),
         mock.call.config.InstanceConfig().GetOptionBool(
             'InstanceSetup', 'network_enabled'),
+    ]
+    self.assertEqual(mocks.mock_calls[:5], expected_calls)
+    option_calls = sorted(
+        call for call in mocks.mock_calls[5:-3]
+        if call[0] == 'config.InstanceConfig().GetOptionBool')
+    expected_option_calls = [
         mock.call.config.InstanceConfig().GetOptionBool(
             'InstanceSetup', 'optimize_local_ssd'),
         mock.call.config.InstanceConfig().GetOptionBool(
             'InstanceSetup', 'set_multiqueue'),
-        mock.call.config.InstanceConfig().WriteConfig(),
-        mock.call.logger.Logger().warning('Test Error'),
     ]
-    self.assertEqual(mocks.mock_calls, expected_calls)
-    self.assertIsNone(mock_setup.metadata_dict)
+    self.assertEqual(option_calls, expected_option_calls)
+    self.assertEqual(
+        mocks.mock_calls[-3:], [
+            mock.call.logger.Logger().warning(
+                'Timed out writing guest attributes.'),
+            mock.call.config.InstanceConfig().WriteConfig(),
+            mock.call.logger.Logger().warning('Test Error'),
+        ])
+    mock_setup._UpdateInstanceConfig.assert_not_called()
+    mock_watcher.MetadataContext.return_value.Fetch.assert_not_called()
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.helpers.SetSysctls')
+  @mock.patch('google_compute_engine.boto.boto_config.config_manager')
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.instance_config')
+  def testMetadataFetchedOnce(
+      self, mock_config, mock_boto_config, mock_sysctls):
+    metadata = {
+        'instance': {
+            'attributes': {'google-instance-configs': 'config'},
+            'id': 123,
+            'machineType': 'projects/123/machineTypes/e2-standard-2',
+        },
+        'project': {
+            'attributes': {},
+            'numericProjectId': 456,
+            'projectId': 'project',
+        },
+    }
+    requests = []
+
+    class Handler(httpserver.BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        requests.append(self.path)
+        body = json.dumps(metadata).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    server = httpserver.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    url = 'http://127.0.0.1:%s/computeMetadata/v1' % server.server_address[1]
+
+    setup = instance_setup.InstanceSetup.__new__(instance_setup.InstanceSetup)
+    setup.debug = False
+    setup.logger = self.mock_logger
+    with mock.patch.object(metadata_watcher, 'METADATA_SERVER', url):
+      setup.watcher = metadata_watcher.MetadataWatcher(logger=self.mock_logger)
+      setup.metadata = metadata_watcher.MetadataContext(
+          setup.watcher, logger=self.mock_logger)
+      setup._UpdateInstanceConfig()
+      self.assertEqual(setup._GetInstanceId(), '123')
+      setup._DisableOvercommit('debian')
+      setup._SetupBotoConfig()
+      # The project ID is read from the snapshot when it is not passed in.
+      boto_config.BotoConfig(context=setup.metadata)
+
+    # The boot steps share the snapshot from a single metadata request.
+    self.assertEqual(len(requests), 1)
+    mock_config.InstanceConfig.assert_called_once_with(
+        logger=self.mock_logger, instance_config_metadata='config')
+    mock_sysctls.assert_called_once_with(
+        self.mock_logger, [('vm.overcommit_memory', 1)])
+    mock_set_option = mock_boto_config.ConfigManager.return_value.SetOption
+    mock_set_option.assert_any_call('GSUtil', 'default_project_id', '456')
+    mock_set_option.assert_any_call('GSUtil', 'default_project_id', 'project')
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.instance_config')
+  def testUpdateInstanceConfig(self, mock_config):
+    mock_watcher = self.mock_setup.metadata.watcher
+    mock_watcher.GetMetadata.return_value = {'hello': 'world'}
+    self.mock_setup._GetInstanceConfig.return_value = 'config'
+
+    instance_setup.InstanceSetup._UpdateInstanceConfig(self.mock_setup)
+    self.assertEqual(
+        self.mock_setup.metadata.metadata_dict, {'hello': 'world'})
+    mock_config.InstanceConfig.assert_called_once_with(
+        logger=self.mock_logger, instance_config_metadata='config')
+    self.assertEqual(
+        self.mock_setup.instance_config,
+        mock_config.InstanceConfig.return_value)
+
+  def testSetupSshHostKeys(self):
+    self.mock_instance_config.GetOptionBool.return_value = True
+    self.mock_instance_config.GetOptionString.return_value = 'type'
+    instance_setup.InstanceSetup._SetupSshHostKeys(self.mock_setup)
+    self.mock_instance_config.GetOptionBool.assert_called_once_with(
+        'InstanceSetup', 'set_host_keys')
+    self.mock_setup._SetSshHostKeys.assert_called_once_with(
+        host_key_types='type')
+
+    self.mock_setup._SetSshHostKeys.reset_mock()
+    self.mock_instance_config.GetOptionBool.return_value = False
+    instance_setup.InstanceSetup._SetupSshHostKeys(self.mock_setup)
+    self.mock_setup._SetSshHostKeys.assert_not_called()
+
+  def testRunIfEnabled(self):
+    mock_step = mock.Mock()
+    self.mock_instance_config.GetOptionBool.side_effect = [True, False]
+    instance_setup.InstanceSetup._RunIfEnabled(
+        self.mock_setup, 'set_multiqueue', mock_step, 'script')
+    instance_setup.InstanceSetup._RunIfEnabled(
+        self.mock_setup, 'set_multiqueue', mock_step, 'script')
+    mock_step.assert_called_once_with('script')
+    self.assertEqual(
+        self.mock_instance_config.GetOptionBool.mock_calls,
+        [mock.call('InstanceSetup', 'set_multiqueue')] * 2)
 
   def testGetInstanceConfig(self):
     instance_config = 'test'
-    self.mock_setup.metadata_dict = {
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'attributes': {
                 'google-instance-configs': instance_config,
@@ -156,7 +294,7 @@ class InstanceSetupTest(unittest.TestCase):
 
   def testGetInstanceConfigProject(self):
     instance_config = 'test'
-    self.mock_setup.metadata_dict = {
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'attributes': {}
         },
@@ -172,7 +310,7 @@ class InstanceSetupTest(unittest.TestCase):
     self.mock_logger.warning.assert_not_called()
 
   def testGetInstanceConfigNone(self):
-    self.mock_setup.metadata_dict = {
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'attributes': {}
         },
@@ -185,39 +323,38 @@ class InstanceSetupTest(unittest.TestCase):
     self.mock_logger.warning.assert_not_called()
 
   def testGetInstanceConfigNoMetadata(self):
-    self.mock_setup.metadata_dict = {}
+    self.mock_setup.metadata.metadata_dict = {}
     self.assertIsNone(
         instance_setup.InstanceSetup._GetInstanceConfig(self.mock_setup))
     self.assertEqual(self.mock_logger.warning.call_count, 2)
 
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.subprocess')
-  def testRunScript(self, mock_subprocess):
-    mock_readline = mock.Mock()
-    mock_readline.side_effect = [bytes(b'a\n'), bytes(b'b\n'), bytes(b'')]
-    mock_stdout = mock.Mock()
-    mock_stdout.readline = mock_readline
-    mock_process = mock.Mock()
-    mock_process.poll.return_value = 0
-    mock_process.stdout = mock_stdout
-    mock_subprocess.Popen.return_value = mock_process
-    script = '/tmp/script.py'
-
-    instance_setup.InstanceSetup._RunScript(self.mock_setup, script)
-    expected_calls = [mock.call('a'), mock.call('b')]
-    self.assertEqual(self.mock_logger.info.mock_calls, expected_calls)
-    mock_subprocess.Popen.assert_called_once_with(
-        script, shell=True, stderr=mock_subprocess.STDOUT,
-        stdout=mock_subprocess.PIPE)
-    mock_process.poll.assert_called_once_with()
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.local_ssd')
+  def testOptimizeLocalSsd(self, mock_local_ssd):
+    self.mock_instance_config.GetOptionString.return_value = 'a=b'
+    mock_local_ssd.ParseProfile.return_value = {'a': 'b'}
+    instance_setup.InstanceSetup._OptimizeLocalSsd(self.mock_setup)
+    self.mock_instance_config.GetOptionString.assert_called_once_with(
+        'InstanceSetup', 'local_ssd_profile')
+    mock_local_ssd.ParseProfile.assert_called_once_with('a=b')
+    mock_local_ssd.LocalSsd.assert_called_once_with(
+        logger=self.mock_logger, profile={'a': 'b'})
+    mock_local_ssd.LocalSsd.return_value.Run.assert_called_once_with()
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.multiqueue')
+  def testSetMultiqueue(self, mock_multiqueue):
+    instance_setup.InstanceSetup._SetMultiqueue(self.mock_setup)
+    mock_multiqueue.Multiqueue.assert_called_once_with(logger=self.mock_logger)
+    mock_multiqueue.Multiqueue.return_value.Run.assert_called_once_with()
 
   def testGetInstanceId(self):
-    self.mock_setup.metadata_dict = {'instance': {'attributes': {}, 'id': 123}}
+    self.mock_setup.metadata.metadata_dict = {
+        'instance': {'attributes': {}, 'id': 123}}
     self.assertEqual(
         instance_setup.InstanceSetup._GetInstanceId(self.mock_setup), '123')
     self.mock_logger.warning.assert_not_called()
 
   def testGetInstanceIdNotFound(self):
-    self.mock_setup.metadata_dict = {'instance': {'attributes': {}}}
+    self.mock_setup.metadata.metadata_dict = {'instance': {'attributes': {}}}
     self.assertIsNone(
         instance_setup.InstanceSetup._GetInstanceId(self.mock_setup))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
@@ -254,6 +391,7 @@ class InstanceSetupTest(unittest.TestCase):
           mock.call.logger.info(mock.ANY, key_dest),
           mock.call.call(
               ['ssh-keygen', '-t', key_type, '-f', temp_dest, '-N', '', '-q']),
+          mock.call.logger.info(mock.ANY, key_dest, mock.ANY),
           mock.call.move(temp_dest, key_dest),
           mock.call.move('%s.pub' % temp_dest, '%s.pub' % key_dest),
           mock.call.permissions(key_dest, mode=0o600),
@@ -337,33 +475,6 @@ class InstanceSetupTest(unittest.TestCase):
     instance_setup.InstanceSetup._SetSshHostKeys(self.mock_setup)
     self.mock_instance_config.SetOption.assert_not_called()
 
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.urlrequest.urlopen')
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.PutRequest')
-  def testWriteHostKeyToGuestAttributes(self, mock_put, mock_urlopen):
-    key_type = 'ssh-rsa'
-    key_value = 'asdfasdf'
-    encoded_key_value = key_value.encode('utf-8')
-    expected_url = ('http://metadata.google.internal/computeMetadata/v1/'
-                    'instance/guest-attributes/hostkeys/%s' % key_type)
-    headers = {'Metadata-Flavor': 'Google'}
-
-    instance_setup.InstanceSetup._WriteHostKeyToGuestAttributes(
-        self.mock_setup, key_type, key_value)
-    self.mock_logger.info.assert_called_with(
-        'Wrote %s host key to guest attributes.', key_type)
-    mock_put.assert_called_with(expected_url, encoded_key_value, headers)
-
-    mock_urlopen.side_effect = instance_setup.urlerror.HTTPError(
-        'http://foo', 403, 'Forbidden', {}, None)
-    instance_setup.InstanceSetup._WriteHostKeyToGuestAttributes(
-        self.mock_setup, key_type, key_value)
-    self.mock_logger.info.assert_called_with(
-        'Unable to write %s host key to guest attributes.', key_type)
-
-  def testPutRequest(self):
-    put_request = instance_setup.PutRequest('http://example.com/')
-    self.assertEqual(put_request.get_method(), 'PUT')
-
   @mock.patch('google_compute_engine.instance_setup.instance_setup.os.listdir')
   def testSetSshHostKeysFirstBoot(self, mock_listdir):
     self.mock_instance_config.GetOptionString.return_value = None
@@ -393,11 +504,53 @@ class InstanceSetupTest(unittest.TestCase):
     ]
 
     self.assertEqual(sorted(mock_generate_key.mock_calls), expected_calls)
+    self.mock_setup._StartSshd.assert_called_once_with()
+    self.mock_setup._WriteHostKeysToGuestAttributes.assert_called_once_with(
+        [('ssh-rsa', 'asdfasdf')] * 4)
     self.mock_instance_config.SetOption.assert_called_once_with(
         'Instance', 'instance_id', '123')
 
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.os.listdir')
+  def testSetSshHostKeysConcurrent(self, mock_listdir):
+    self.mock_instance_config.GetOptionString.return_value = None
+    self.mock_setup._GetInstanceId.return_value = '123'
+    mock_listdir.return_value = ['ssh_host_ecdsa_key', 'ssh_host_rsa_key']
+    started = []
+    running = threading.Event()
+
+    def _GenerateSshKey(key_type, key_dest):
+      started.append(key_type)
+      if len(started) == 2:
+        running.set()
+      # Each key waits until both keys are being generated.
+      self.assertTrue(running.wait(5))
+      if key_type == 'rsa':
+        return None
+      return ('ecdsa-sha2-nistp256', 'asdf')
+
+    self.mock_setup._GenerateSshKey.side_effect = _GenerateSshKey
+
+    instance_setup.InstanceSetup._SetSshHostKeys(self.mock_setup)
+    self.mock_setup._StartSshd.assert_called_once_with()
+    self.mock_setup._WriteHostKeysToGuestAttributes.assert_called_once_with(
+        [('ecdsa-sha2-nistp256', 'asdf')])
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.guest_attributes')
+  def testWriteHostKeysToGuestAttributes(self, mock_guest_attributes):
+    mock_writer = mock_guest_attributes.GetGuestAttributesWriter.return_value
+    host_keys = [('ssh-rsa', 'foo'), ('ssh-ed25519', 'bar')]
+    instance_setup.InstanceSetup._WriteHostKeysToGuestAttributes(
+        self.mock_setup, host_keys)
+    mock_guest_attributes.GetGuestAttributesWriter.assert_called_once_with(
+        logger=self.mock_logger)
+    self.assertEqual(
+        mock_writer.Write.mock_calls, [
+            mock.call('hostkeys', 'ssh-rsa', 'foo'),
+            mock.call('hostkeys', 'ssh-ed25519', 'bar'),
+        ])
+
   def testGetNumericProjectId(self):
-    self.mock_setup.metadata_dict = {
+    self.mock_setup.metadata.metadata_dict = {
         'project': {
             'attributes': {},
             'numericProjectId': 123,
@@ -409,7 +562,7 @@ class InstanceSetupTest(unittest.TestCase):
     self.mock_logger.warning.assert_not_called()
 
   def testGetNumericProjectIdNotFound(self):
-    self.mock_setup.metadata_dict = {'project': {'attributes': {}}}
+    self.mock_setup.metadata.metadata_dict = {'project': {'attributes': {}}}
     self.assertIsNone(
         instance_setup.InstanceSetup._GetNumericProjectId(self.mock_setup))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
@@ -420,7 +573,8 @@ class InstanceSetupTest(unittest.TestCase):
     mock_project_id.return_value = '123'
     self.mock_setup._GetNumericProjectId = mock_project_id
     instance_setup.InstanceSetup._SetupBotoConfig(self.mock_setup)
-    mock_boto.assert_called_once_with('123', debug=False)
+    mock_boto.assert_called_once_with(
+        '123', debug=False, context=self.mock_setup.metadata)
 
   @mock.patch('google_compute_engine.instance_setup.instance_setup.boto_config.BotoConfig')
   def testSetupBotoConfigLocked(self, mock_boto):
@@ -428,36 +582,41 @@ class InstanceSetupTest(unittest.TestCase):
     instance_setup.InstanceSetup._SetupBotoConfig(self.mock_setup)
     self.mock_logger.warning.assert_called_once_with('Test Error')
 
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.subprocess')
-  def testDisableOvercommitNonE2(self, mock_subprocess):
-    self.mock_setup.metadata_dict = {
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.compat.GetDistro')
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.helpers.SetSysctls')
+  def testDisableOvercommitNonE2(self, mock_sysctls, mock_distro):
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'machineType': 'projects/00000000000/machineTypes/n1-standard-1',
         }
     }
     instance_setup.InstanceSetup._DisableOvercommit(self.mock_setup)
-    mock_subprocess.call.assert_not_called()
-
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.subprocess')
-  def testDisableOvercommitE2(self, mock_subprocess):
-    self.mock_setup.metadata_dict = {
+    mock_sysctls.assert_not_called()
+    # The distribution is only detected for E2 machine types.
+    mock_distro.assert_not_called()
+
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.compat.GetDistro')
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.helpers.SetSysctls')
+  def testDisableOvercommitE2(self, mock_sysctls, mock_distro):
+    mock_distro.return_value = ('debian', '10')
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'machineType': 'projects/00000000000/machineTypes/e2-standard-1',
         }
     }
     instance_setup.InstanceSetup._DisableOvercommit(self.mock_setup)
-    mock_subprocess.call.assert_called_once_with(
-        ['sysctl', 'vm.overcommit_memory=1'])
+    mock_sysctls.assert_called_once_with(
+        self.mock_logger, [('vm.overcommit_memory', 1)])
 
-  @mock.patch('google_compute_engine.instance_setup.instance_setup.subprocess')
-  def testDisableOvercommitBSD(self, mock_subprocess):
-    self.mock_setup.metadata_dict = {
+  @mock.patch('google_compute_engine.instance_setup.instance_setup.helpers.SetSysctls')
+  def testDisableOvercommitBSD(self, mock_sysctls):
+    self.mock_setup.metadata.metadata_dict = {
         'instance': {
             'machineType': 'projects/00000000000/machineTypes/e2-standard-1',
         }
     }
     instance_setup.InstanceSetup._DisableOvercommit(self.mock_setup, 'bsd')
-    mock_subprocess.call.assert_not_called()
+    mock_sysctls.assert_not_called()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for local_ssd.py module."""
+
+import os
+import shutil
+import tempfile
+
+from google_compute_engine.instance_setup import local_ssd
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+INTERRUPTS = """\
+           CPU0       CPU1
+  30:          0          0   PCI-MSI  nvme0q0
+  31:         10          0   PCI-MSI  nvme0q1
+  32:          0         10   PCI-MSI  nvme0q2
+  33:          0          0   PCI-MSI  nvme1q1
+  40:          0          0   PCI-MSI  virtio2-request.0
+  41:          0          0   PCI-MSI  virtio2-request.1
+  42:          0          0   PCI-MSI  virtio2-request.2
+"""
+
+
+class LocalSsdTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.sysfs = os.path.join(self.temp_dir, 'sys')
+    self.procfs = os.path.join(self.temp_dir, 'proc')
+    self._WriteFile(self.procfs, 'interrupts', INTERRUPTS)
+    for irq in (30, 31, 32, 33, 40, 41, 42):
+      self._WriteFile(self.procfs, 'irq/%s/smp_affinity_list' % irq, '0-1')
+    self._WriteFile(self.sysfs, 'devices/system/cpu/online', '0-1\n')
+    self._AddDevice('nvme0n1', local_ssd.NVME_MODEL)
+    self._AddDevice('nvme0n2', local_ssd.NVME_MODEL)
+    self._AddDevice('nvme1n1', 'nvme_card-pd')
+    self._AddDevice(
+        'sdb', local_ssd.SCSI_MODEL, scheduler='noop [deadline] cfq',
+        parent='devices/pci0000:00/0000:00:03.0/virtio2/host0/target0:0:2')
+    self._AddDevice('sda', 'PersistentDisk')
+    self.local_ssd = local_ssd.LocalSsd(
+        logger=self.mock_logger, sysfs=self.sysfs, procfs=self.procfs)
+
+  def _WriteFile(self, root, path, contents):
+    path = os.path.join(root, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write(contents)
+
+  def _ReadFile(self, root, path):
+    with open(os.path.join(root, path)) as f:
+      return f.read()
+
+  def _AddDevice(
+      self, name, model, scheduler='[mq-deadline] kyber none', parent=None):
+    block_dir = os.path.join(self.sysfs, 'block', name)
+    device_dir = os.path.join(self.sysfs, parent or 'devices/%s' % name)
+    self._WriteFile(device_dir, 'model', model + '\n')
+    os.makedirs(block_dir)
+    os.symlink(device_dir, os.path.join(block_dir, 'device'))
+    for setting, value in (
+        ('scheduler', scheduler), ('nr_requests', '64'),
+        ('read_ahead_kb', '4096'), ('rq_affinity', '1')):
+      self._WriteFile(block_dir, 'queue/%s' % setting, value + '\n')
+
+  def _Relative(self, plan):
+    return [
+        (os.path.relpath(path, self.temp_dir), value) for path, value in plan]
+
+  def testParseProfile(self):
+    self.assertEqual(
+        local_ssd.ParseProfile(
+            ' nr_requests=512, scheduler=kyber:none,bad,empty='),
+        {'nr_requests': '512', 'scheduler': 'kyber,none'})
+    self.assertEqual(local_ssd.ParseProfile(None), {})
+
+  def testGetPlan(self):
+    self.assertEqual(self._Relative(self.local_ssd.GetPlan()), [
+        ('sys/block/nvme0n1/queue/scheduler', 'none'),
+        ('sys/block/nvme0n1/queue/nr_requests', '256'),
+        ('sys/block/nvme0n1/queue/read_ahead_kb', '128'),
+        ('sys/block/nvme0n1/queue/rq_affinity', '2'),
+        ('proc/irq/31/smp_affinity_list', '0'),
+        ('proc/irq/32/smp_affinity_list', '1'),
+        ('sys/block/nvme0n2/queue/scheduler', 'none'),
+        ('sys/block/nvme0n2/queue/nr_requests', '256'),
+        ('sys/block/nvme0n2/queue/read_ahead_kb', '128'),
+        ('sys/block/nvme0n2/queue/rq_affinity', '2'),
+        ('sys/block/sdb/queue/scheduler', 'noop'),
+        ('sys/block/sdb/queue/nr_requests', '256'),
+        ('sys/block/sdb/queue/read_ahead_kb', '128'),
+        ('sys/block/sdb/queue/rq_affinity', '2'),
+        ('proc/irq/40/smp_affinity_list', '0'),
+        ('proc/irq/41/smp_affinity_list', '1'),
+        ('proc/irq/42/smp_affinity_list', '0'),
+    ])
+
+  def testGetPlanProfile(self):
+    self.local_ssd = local_ssd.LocalSsd(
+        logger=self.mock_logger, sysfs=self.sysfs, procfs=self.procfs,
+        profile={
+            'scheduler': 'bfq', 'read_ahead_kb': '0', 'irq_affinity': 'false'
+        })
+    self.assertEqual(
+        self._Relative(self.local_ssd.GetPlan())[:3], [
+            ('sys/block/nvme0n1/queue/nr_requests', '256'),
+            ('sys/block/nvme0n1/queue/read_ahead_kb', '0'),
+            ('sys/block/nvme0n1/queue/rq_affinity', '2'),
+        ])
+    self.assertFalse(
+        [path for path, _ in self.local_ssd.GetPlan() if 'irq' in path])
+
+  def testGetPlanNoDevices(self):
+    shutil.rmtree(os.path.join(self.sysfs, 'block'))
+    self.assertEqual(self.local_ssd.GetPlan(), [])
+
+  def testRun(self):
+    self.assertEqual(self.local_ssd.Run(), [])
+    self.assertEqual(
+        self._ReadFile(self.sysfs, 'block/nvme0n1/queue/nr_requests'), '256')
+    self.assertEqual(
+        self._ReadFile(self.sysfs, 'block/nvme1n1/queue/nr_requests'), '64\n')
+    self.assertEqual(
+        self._ReadFile(self.procfs, 'irq/32/smp_affinity_list'), '1')
+    self.mock_logger.info.assert_any_call(
+        'Local SSD %s (%s): %s.', 'sdb', 'scsi',
+        'scheduler=noop, nr_requests=256, read_ahead_kb=128, rq_affinity=2')
+    self.mock_logger.warning.assert_not_called()
+
+  def testRunVerify(self):
+    mismatch_path = os.path.join(self.procfs, 'irq/31/smp_affinity_list')
+    original_apply = self.local_ssd.ApplyPlan
+
+    def _ApplyPlan(plan):
+      original_apply(plan)
+      # Simulate settings that the kernel did not accept.
+      self._WriteFile(self.procfs, 'irq/31/smp_affinity_list', '0-1\n')
+      self._WriteFile(
+          self.sysfs, 'block/nvme0n1/queue/scheduler', '[mq-deadline] none')
+
+    self.local_ssd.ApplyPlan = _ApplyPlan
+    mismatches = self.local_ssd.Run()
+    scheduler_path = os.path.join(
+        self.sysfs, 'block/nvme0n1/queue/scheduler')
+    self.assertEqual(mismatches, [
+        (scheduler_path, 'none', 'mq-deadline'),
+        (mismatch_path, '0', '0,1'),
+    ])
+    self.mock_logger.warning.assert_any_call(
+        'Local SSD setting %s is %s instead of %s.', mismatch_path, '0,1',
+        '0')
+
+  def testRunDryRun(self):
+    self.local_ssd.dry_run = True
+    self.assertEqual(self.local_ssd.Run(), [])
+    self.assertEqual(
+        self._ReadFile(self.sysfs, 'block/nvme0n1/queue/nr_requests'), '64\n')
+    self.mock_logger.info.assert_any_call(
+        'Would write %s to %s.', '256',
+        os.path.join(self.sysfs, 'block/nvme0n1/queue/nr_requests'))
+
+  def testRunNoDevices(self):
+    shutil.rmtree(os.path.join(self.sysfs, 'block'))
+    self.assertEqual(self.local_ssd.Run(), [])
+    self.mock_logger.info.assert_called_once_with('No local SSDs found.')
+
+  def testApplyPlanError(self):
+    path = os.path.join(self.temp_dir, 'missing', 'file')
+    self.local_ssd.ApplyPlan([(path, '1')])
+    self.mock_logger.debug.assert_called_once_with(
+        'Could not write %s to %s. %s.', '1', path, mock.ANY)
+    self.assertEqual(
+        self.local_ssd.Verify([(path, '1')]), [(path, '1', None)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for multiqueue.py module."""
+
+import os
+import shutil
+import struct
+import tempfile
+
+from google_compute_engine.instance_setup import multiqueue
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+INTERRUPTS = """\
+           CPU0       CPU1       CPU2       CPU3
+  24:          0          0          0          0   PCI-MSI  virtio1-config
+  25:        100          0          0          0   PCI-MSI  virtio1-input.0
+  26:          0        100          0          0   PCI-MSI  virtio1-output.0
+  27:          0          0        100          0   PCI-MSI  virtio1-input.1
+  28:          0          0          0        100   PCI-MSI  virtio1-output.1
+  29:          0          0          0          0   PCI-MSI  virtio2-input.0
+"""
+
+
+def _Channels(max_combined, combined, cmd=multiqueue.ETHTOOL_GCHANNELS):
+  return struct.pack(
+      multiqueue.CHANNELS_FORMAT, cmd, 0, 0, 1, max_combined, 0, 0, 1,
+      combined)
+
+
+class MultiqueueTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.sysfs = os.path.join(self.temp_dir, 'sys')
+    self.procfs = os.path.join(self.temp_dir, 'proc')
+    self._WriteFile(self.procfs, 'interrupts', INTERRUPTS)
+    for irq in range(24, 30):
+      self._WriteFile(self.procfs, 'irq/%s/smp_affinity_list' % irq, '0-3')
+    self._WriteCpus('0-3', siblings=['0-1', '0-1', '2-3', '2-3'])
+    self._WriteFile(self.sysfs, 'devices/system/node/node0/cpulist', '0-3')
+    self._AddDevice('virtio1', 'eth0', queues=2)
+    self.multiqueue = multiqueue.Multiqueue(
+        logger=self.mock_logger, sysfs=self.sysfs, procfs=self.procfs)
+    self.mock_ethtool = mock.Mock()
+    self.multiqueue._Ethtool = self.mock_ethtool
+    self.mock_ethtool.return_value = _Channels(2, 2)
+
+  def _WriteFile(self, root, path, contents):
+    path = os.path.join(root, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write(contents)
+
+  def _ReadFile(self, root, path):
+    with open(os.path.join(root, path)) as f:
+      return f.read()
+
+  def _WriteCpus(self, online, siblings):
+    self._WriteFile(self.sysfs, 'devices/system/cpu/online', online + '\n')
+    for cpu, sibling_list in enumerate(siblings):
+      self._WriteFile(
+          self.sysfs,
+          'devices/system/cpu/cpu%s/topology/thread_siblings_list' % cpu,
+          sibling_list + '\n')
+
+  def _AddDevice(self, name, interface, queues, numa_node='-1'):
+    pci_dir = os.path.join(self.sysfs, 'devices/pci0000:00/0000:00:0%s.0' % (
+        name[-1]))
+    os.makedirs(os.path.join(pci_dir, name, 'net', interface))
+    self._WriteFile(pci_dir, 'numa_node', numa_node + '\n')
+    driver_dir = os.path.join(self.sysfs, 'bus/virtio/drivers/virtio_net')
+    if not os.path.isdir(driver_dir):
+      os.makedirs(driver_dir)
+    os.symlink(
+        os.path.join(pci_dir, name), os.path.join(driver_dir, name))
+    for queue in range(queues):
+      self._WriteFile(
+          self.sysfs, 'class/net/%s/queues/tx-%s/xps_cpus' % (
+              interface, queue), '0')
+      self._WriteFile(
+          self.sysfs, 'class/net/%s/queues/rx-%s/rps_cpus' % (
+              interface, queue), '0')
+
+  def testParseCpuList(self):
+    self.assertEqual(
+        multiqueue.ParseCpuList('0-2,5,7-8\n'), [0, 1, 2, 5, 7, 8])
+    self.assertEqual(multiqueue.ParseCpuList(''), [])
+    self.assertEqual(multiqueue.ParseCpuList(None), [])
+    self.assertEqual(multiqueue.ParseCpuList('1,bad'), [1])
+
+  def testFormatCpuMask(self):
+    self.assertEqual(multiqueue._FormatCpuMask([]), '00000000')
+    self.assertEqual(multiqueue._FormatCpuMask([0, 3]), '00000009')
+    self.assertEqual(
+        multiqueue._FormatCpuMask([1, 32, 64]), '00000001,00000001,00000002')
+
+  def testGetPlan(self):
+    queues = os.path.join(self.sysfs, 'class/net/eth0/queues')
+    irq = os.path.join(self.procfs, 'irq')
+    # Queues use one hyperthread of each core before the siblings.
+    self.assertEqual(self.multiqueue.GetPlan(), [
+        (os.path.join(irq, '25', 'smp_affinity_list'), '0'),
+        (os.path.join(irq, '26', 'smp_affinity_list'), '0'),
+        (os.path.join(queues, 'tx-0', 'xps_cpus'), '00000003'),
+        (os.path.join(queues, 'rx-0', 'rps_cpus'), '0000000f'),
+        (os.path.join(irq, '27', 'smp_affinity_list'), '2'),
+        (os.path.join(irq, '28', 'smp_affinity_list'), '2'),
+        (os.path.join(queues, 'tx-1', 'xps_cpus'), '0000000c'),
+        (os.path.join(queues, 'rx-1', 'rps_cpus'), '0000000f'),
+    ])
+
+  def testGetPlanNuma(self):
+    shutil.rmtree(os.path.join(self.sysfs, 'devices/system/node'))
+    self._WriteFile(self.sysfs, 'devices/system/node/node0/cpulist', '0-1')
+    self._WriteFile(self.sysfs, 'devices/system/node/node1/cpulist', '2-3')
+    self._WriteCpus('0-3', siblings=['0', '1', '2', '3'])
+    self._AddDevice('virtio2', 'eth1', queues=1, numa_node='1')
+    self.mock_ethtool.side_effect = lambda interface, _: (
+        _Channels(1, 1) if interface == 'eth1' else _Channels(2, 2))
+    plan = dict(
+        (os.path.relpath(path, self.temp_dir), value)
+        for path, value in self.multiqueue.GetPlan())
+    # The queue of eth1 uses the CPUs on its NUMA node first.
+    self.assertEqual(plan['proc/irq/29/smp_affinity_list'], '2')
+    self.assertEqual(
+        plan['sys/class/net/eth1/queues/tx-0/xps_cpus'], '0000000f')
+    self.assertEqual(
+        plan['sys/class/net/eth1/queues/rx-0/rps_cpus'], '0000000c')
+    self.assertEqual(
+        plan['sys/class/net/eth0/queues/rx-1/rps_cpus'], '00000003')
+
+  def testGetPlanQueuePerCpu(self):
+    self._WriteCpus('0-1', siblings=['0', '1'])
+    plan = dict(self.multiqueue.GetPlan())
+    queues = os.path.join(self.sysfs, 'class/net/eth0/queues')
+    self.assertEqual(plan[os.path.join(queues, 'tx-1', 'xps_cpus')], '00000002')
+    # Receive packet steering is not needed with a queue for each CPU.
+    self.assertEqual(plan[os.path.join(queues, 'rx-1', 'rps_cpus')], '00000000')
+
+  def testGetPlanNoDevices(self):
+    shutil.rmtree(os.path.join(self.sysfs, 'bus'))
+    self.assertEqual(self.multiqueue.GetPlan(), [])
+    self.mock_ethtool.assert_not_called()
+
+  def testSetChannels(self):
+    self.mock_ethtool.side_effect = [
+        _Channels(4, 1), _Channels(4, 4, multiqueue.ETHTOOL_SCHANNELS)]
+    self.assertEqual(self.multiqueue._SetChannels('eth0'), 4)
+    self.assertEqual(self.mock_ethtool.mock_calls, [
+        mock.call('eth0', struct.pack(
+            multiqueue.CHANNELS_FORMAT, multiqueue.ETHTOOL_GCHANNELS,
+            *([0] * 8))),
+        mock.call('eth0', _Channels(4, 4, multiqueue.ETHTOOL_SCHANNELS)),
+    ])
+    self.mock_logger.info.assert_called_once_with(
+        'Set %s to %s combined queues.', 'eth0', 4)
+
+  def testSetChannelsUnchanged(self):
+    self.mock_ethtool.return_value = _Channels(2, 2)
+    self.assertEqual(self.multiqueue._SetChannels('eth0'), 2)
+    self.assertEqual(self.mock_ethtool.call_count, 1)
+
+  def testSetChannelsError(self):
+    self.mock_ethtool.side_effect = IOError('Test Error')
+    self.assertIsNone(self.multiqueue._SetChannels('eth0'))
+    self.mock_ethtool.side_effect = [_Channels(4, 1), IOError('Test Error')]
+    self.assertEqual(self.multiqueue._SetChannels('eth0'), 1)
+    self.assertEqual(self.mock_logger.warning.call_count, 2)
+
+  def testSetChannelsDryRun(self):
+    self.multiqueue.dry_run = True
+    self.mock_ethtool.return_value = _Channels(4, 1)
+    self.assertEqual(self.multiqueue._SetChannels('eth0'), 4)
+    self.assertEqual(self.mock_ethtool.call_count, 1)
+    self.mock_logger.info.assert_called_once_with(
+        'Would set %s to %s combined queues.', 'eth0', 4)
+
+  @mock.patch('google_compute_engine.instance_setup.multiqueue.fcntl.ioctl')
+  def testEthtool(self, mock_ioctl):
+    multiqueue.Multiqueue._Ethtool(self.multiqueue, 'eth0', _Channels(0, 0))
+    mock_ioctl.assert_called_once_with(
+        mock.ANY, multiqueue.SIOCETHTOOL, mock.ANY)
+    request = mock_ioctl.call_args[0][2]
+    self.assertTrue(request.startswith(b'eth0\0'))
+
+  def testRun(self):
+    self.multiqueue.Run()
+    self.assertEqual(
+        self._ReadFile(self.procfs, 'irq/27/smp_affinity_list'), '2')
+    self.assertEqual(
+        self._ReadFile(self.procfs, 'irq/29/smp_affinity_list'), '0-3')
+    self.assertEqual(
+        self._ReadFile(self.sysfs, 'class/net/eth0/queues/tx-1/xps_cpus'),
+        '0000000c')
+    self.mock_logger.info.assert_called_once_with(
+        'Applied %s multiqueue settings in %.3f seconds with %s failures.', 8,
+        mock.ANY, 0)
+
+  def testRunDryRun(self):
+    self.multiqueue.dry_run = True
+    self.multiqueue.Run()
+    self.assertEqual(
+        self._ReadFile(self.procfs, 'irq/27/smp_affinity_list'), '0-3')
+    self.assertEqual(self.mock_logger.info.call_count, 8)
+    self.mock_logger.info.assert_any_call(
+        'Would write %s to %s.', '2',
+        os.path.join(self.procfs, 'irq', '27', 'smp_affinity_list'))
+
+  def testRunNoQueues(self):
+    shutil.rmtree(os.path.join(self.sysfs, 'bus'))
+    self.multiqueue.Run()
+    self.mock_logger.info.assert_called_once_with('No virtio-net queues found.')
+
+  def testReadFile(self):
+    path = os.path.join(self.temp_dir, 'file')
+    with open(path, 'w') as f:
+      f.write(' 0-3\n')
+    self.assertEqual(multiqueue.ReadFile(path), '0-3')
+    self.assertIsNone(multiqueue.ReadFile(path + '.missing'))
+
+  def testWritePlan(self):
+    path = os.path.join(self.temp_dir, 'file')
+    missing = os.path.join(self.temp_dir, 'missing', 'file')
+    failures = multiqueue.WritePlan(
+        [(path, '1'), (missing, '2')], logger=self.mock_logger)
+    self.assertEqual(failures, [(missing, '2', mock.ANY)])
+    with open(path) as f:
+      self.assertEqual(f.read(), '1')
+    self.mock_logger.info.assert_not_called()
+
+  def testWritePlanDryRun(self):
+    path = os.path.join(self.temp_dir, 'file')
+    self.assertEqual(
+        multiqueue.WritePlan(
+            [(path, '1')], logger=self.mock_logger, dry_run=True), [])
+    self.assertFalse(os.path.exists(path))
+    self.mock_logger.info.assert_called_once_with(
+        'Would write %s to %s.', '1', path)
+
+  def testApplyPlanError(self):
+    path = os.path.join(self.temp_dir, 'missing', 'file')
+    self.assertEqual(self.multiqueue.ApplyPlan([(path, '1')]), 1)
+    self.mock_logger.warning.assert_called_once_with(
+        'Could not write %s to %s. %s.', '1', path, mock.ANY)
+
+  @mock.patch('google_compute_engine.instance_setup.multiqueue.time.sleep')
+  def testWatchCpus(self, mock_sleep):
+    mock_run = mock.Mock()
+    self.multiqueue.Run = mock_run
+
+    def _Sleep(_):
+      if mock_sleep.call_count == 2:
+        self._WriteCpus('0-1', siblings=[])
+      if mock_sleep.call_count == 3:
+        raise StopIteration()
+
+    mock_sleep.side_effect = _Sleep
+    with self.assertRaises(StopIteration):
+      self.multiqueue.WatchCpus(interval=1)
+    self.assertEqual(mock_run.call_count, 2)
+    self.mock_logger.info.assert_called_once_with(
+        'Online CPUs changed to %s.', '0-1')
+
+
+if __name__ == '__main__':
+  unittest.main()
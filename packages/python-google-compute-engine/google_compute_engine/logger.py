@@ -53,3 +53,63 @@ def Logger(name, debug=False, facility=None):
     logger.addHandler(syslog_handler)
 
   return logger
+
+
+class _LineRecord(logging.LogRecord):
+  """A log record for one line of output sharing the attributes of another."""
+
+  def __init__(self, template, line):
+    """Constructor.
+
+    Args:
+      template: logging.LogRecord, the record providing the attributes.
+      line: string, the line of text logged.
+    """
+    self.__dict__.update(template.__dict__)
+    self.msg = line
+
+
+def LogLines(logger, lines):
+  """Log lines at info level with one record per line.
+
+  The records are dispatched in one pass: each handler is locked once for
+  all of the lines rather than once per line, and the logger lookups run
+  once. Loggers that are not logging.Logger objects receive one info call
+  per line.
+
+  Args:
+    logger: logger object, used to write to SysLog and serial port.
+    lines: list, the lines of text to log.
+  """
+  if not isinstance(logger, logging.Logger):
+    for line in lines:
+      logger.info(line)
+    return
+  if not lines or not logger.isEnabledFor(logging.INFO):
+    return
+  # The lines share the attributes of one record, such as the time, which
+  # is much cheaper than creating a full record for each line.
+  template = logger.makeRecord(
+      logger.name, logging.INFO, '', 0, '', None, None)
+  records = []
+  for line in lines:
+    record = _LineRecord(template, line)
+    if logger.filter(record):
+      records.append(record)
+  handlers = []
+  current = logger
+  while current:
+    handlers.extend(current.handlers)
+    if not current.propagate:
+      break
+    current = current.parent
+  for handler in handlers:
+    if logging.INFO < handler.level:
+      continue
+    handler.acquire()
+    try:
+      for record in records:
+        if handler.filter(record):
+          handler.emit(record)
+    finally:
+      handler.release()
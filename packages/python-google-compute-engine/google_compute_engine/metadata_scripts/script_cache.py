@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A persistent content-addressed cache for downloaded metadata scripts."""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from google_compute_engine import constants
+from google_compute_engine import file_utils
+
+CACHE_DIR = constants.LOCALSTATEDIR + '/cache/google_compute_engine/scripts'
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+class ScriptCache(object):
+  """A cache of downloaded scripts keyed by URL.
+
+  Script contents are stored once per SHA-256 digest. An index maps each URL
+  to the digest along with the ETag and Last-Modified validators sent by the
+  server, so a cached script is only used after the server confirms it has
+  not changed. Entries are evicted in least recently used order when the
+  cache grows beyond its size limit.
+  """
+
+  def __init__(self, logger, cache_dir=CACHE_DIR, max_size=CACHE_SIZE):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      cache_dir: string, the directory storing cached scripts.
+      max_size: int, the maximum number of bytes of script contents to keep.
+    """
+    self.logger = logger
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    self.index_file = os.path.join(cache_dir, 'index.json')
+    self.lock_file = os.path.join(cache_dir, 'lock')
+    self.objects_dir = os.path.join(cache_dir, 'objects')
+
+  def _CreateCacheDir(self):
+    """Create the cache directory readable only by root."""
+    for path in (self.cache_dir, self.objects_dir):
+      if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+
+  def _ReadIndex(self):
+    """Read the cache index.
+
+    Returns:
+      dict, the cache entries keyed by URL.
+    """
+    try:
+      with open(self.index_file) as index_file:
+        index = json.load(index_file)
+    except (IOError, OSError, ValueError):
+      return {}
+    return index if isinstance(index, dict) else {}
+
+  def _WriteIndex(self, index):
+    """Atomically replace the cache index.
+
+    Args:
+      index: dict, the cache entries keyed by URL.
+    """
+    with tempfile.NamedTemporaryFile(
+        mode='w', dir=self.cache_dir, delete=False) as index_file:
+      json.dump(index, index_file)
+    os.rename(index_file.name, self.index_file)
+
+  def _GetObjectPath(self, digest):
+    """Get the path storing the script contents with a digest."""
+    return os.path.join(self.objects_dir, digest)
+
+  def _Evict(self, index):
+    """Remove least recently used entries until the cache fits its size limit.
+
+    Args:
+      index: dict, the cache entries keyed by URL, modified in place.
+    """
+    def _GetSize(entries):
+      sizes = dict((entry['digest'], entry['size']) for entry in entries)
+      return sum(sizes.values())
+
+    entries = sorted(index.items(), key=lambda item: item[1]['used'])
+    while entries and _GetSize(index.values()) > self.max_size:
+      url, _ = entries.pop(0)
+      del index[url]
+      self.logger.debug('Evicted %s from the script cache.', url)
+
+    digests = set(entry['digest'] for entry in index.values())
+    for name in os.listdir(self.objects_dir):
+      if name not in digests:
+        os.remove(self._GetObjectPath(name))
+
+  def GetValidators(self, url):
+    """Get the conditional request headers for a cached URL.
+
+    Args:
+      url: string, the URL to download.
+
+    Returns:
+      dict, the If-None-Match and If-Modified-Since headers to send. The dict
+          is empty if the URL is not cached.
+    """
+    entry = self._ReadIndex().get(url)
+    if not entry or not os.path.exists(self._GetObjectPath(entry['digest'])):
+      return {}
+    headers = {}
+    if entry.get('etag'):
+      headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+      headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+  def Restore(self, url, dest):
+    """Copy a cached script to a destination file.
+
+    Args:
+      url: string, the URL of the cached script.
+      dest: string, the path to the file for storing the script.
+
+    Returns:
+      bool, True if the cached script was copied.
+    """
+    try:
+      with file_utils.LockFile(self.lock_file, blocking=True):
+        index = self._ReadIndex()
+        entry = index.get(url)
+        if not entry:
+          return False
+        shutil.copyfile(self._GetObjectPath(entry['digest']), dest)
+        entry['used'] = time.time()
+        self._WriteIndex(index)
+    except (IOError, OSError) as e:
+      self.logger.warning('Could not read %s from the script cache. %s.', url, e)
+      return False
+    self.logger.info('Using cached copy of %s.', url)
+    return True
+
+  def Store(self, url, path, headers):
+    """Add a downloaded script to the cache.
+
+    Scripts without an ETag or Last-Modified header are not cached since they
+    cannot be revalidated.
+
+    Args:
+      url: string, the URL of the downloaded script.
+      path: string, the path to the file storing the script.
+      headers: dict, the response headers sent with the script.
+    """
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if not etag and not last_modified:
+      return
+
+    try:
+      size = os.path.getsize(path)
+      if size > self.max_size:
+        return
+      self._CreateCacheDir()
+      digest = hashlib.sha256()
+      with open(path, 'rb') as script:
+        for chunk in iter(lambda: script.read(64 * 1024), b''):
+          digest.update(chunk)
+      digest = digest.hexdigest()
+
+      with file_utils.LockFile(self.lock_file, blocking=True):
+        object_path = self._GetObjectPath(digest)
+        if not os.path.exists(object_path):
+          with tempfile.NamedTemporaryFile(
+              dir=self.objects_dir, delete=False) as temp_file:
+            temp_path = temp_file.name
+          shutil.copyfile(path, temp_path)
+          os.rename(temp_path, object_path)
+        index = self._ReadIndex()
+        index[url] = {
+            'digest': digest,
+            'etag': etag,
+            'last_modified': last_modified,
+            'size': size,
+            'used': time.time(),
+        }
+        self._Evict(index)
+        self._WriteIndex(index)
+    except (IOError, OSError) as e:
+      self.logger.warning('Could not add %s to the script cache. %s.', url, e)
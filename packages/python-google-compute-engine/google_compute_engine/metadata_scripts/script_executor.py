@@ -15,25 +15,186 @@
 
 """Execute user provided metadata scripts."""
 
+import errno
+import multiprocessing
 import os
+import re
+import signal
 import stat
 import subprocess
+import sys
+import threading
+import time
+
+from google_compute_engine import output_pump
+from google_compute_engine import task_graph
+
+KILL_TIMEOUT = 10
+
+# Python 3.2 and later start a new session between fork and exec without
+# running Python code in the child.
+NEW_SESSION = sys.version_info >= (3, 2)
+
+# Places the script in its own session and applies resource limits before
+# executing the shell. It runs as a separate program since preexec_fn is not
+# safe to use while other threads run scripts.
+EXEC_WRAPPER = '''
+import os
+import resource
+import sys
+
+try:
+  os.setsid()
+except OSError:
+  pass
+for limit, value in ((resource.RLIMIT_CPU, sys.argv[1]),
+                     (resource.RLIMIT_AS, sys.argv[2])):
+  if int(value):
+    resource.setrlimit(limit, (int(value), int(value)))
+os.execv(sys.argv[3], sys.argv[3:])
+'''
+
+
+def _ParseScriptKey(script_type, metadata_key):
+  """Parse a metadata key specifying a script.
+
+  Args:
+    script_type: string, the type of the script we are running.
+    metadata_key: string, the metadata key to parse.
+
+  Returns:
+    (int, bool): the script number, or None for an unnumbered script, and
+        True if the key specifies a URL. None if the key is not a script key.
+  """
+  regex = r'\A%s-script(?:-(\d+))?(-url)?\Z' % re.escape(script_type)
+  match = re.match(regex, metadata_key)
+  if not match:
+    return None
+  number, url = match.groups()
+  return (int(number) if number else None), bool(url)
+
+
+def GetScriptKeys(script_type, metadata_keys):
+  """Order the metadata keys specifying scripts.
+
+  The unnumbered <type>-script-url and <type>-script run first, followed by
+  <type>-script-N keys in numeric order. A URL runs before an inline script
+  with the same number.
+
+  Args:
+    script_type: string, the type of the script we are running.
+    metadata_keys: list, the metadata keys to filter.
+
+  Returns:
+    list, the script keys in execution order.
+  """
+  script_keys = []
+  for metadata_key in metadata_keys:
+    parsed = _ParseScriptKey(script_type, metadata_key)
+    if parsed:
+      number, url = parsed
+      number = -1 if number is None else number
+      script_keys.append((number, not url, metadata_key))
+  return [metadata_key for _, _, metadata_key in sorted(script_keys)]
+
+
+def GetDependencies(script_type, attribute_data):
+  """Compute the scripts each script waits for before running.
+
+  By default scripts run one at a time in the order of GetScriptKeys.
+  Consecutive numbered scripts with the same <type>-script-N-group value run
+  concurrently. A <type>-script-N-after value, a comma separated list of
+  script numbers, replaces the default ordering for script N.
+
+  Args:
+    script_type: string, the type of the script we are running.
+    attribute_data: dict, the contents of the attributes metadata.
+
+  Returns:
+    dict, a dictionary mapping each script key to the keys it runs after.
+  """
+  attribute_data = attribute_data or {}
+  script_keys = GetScriptKeys(
+      script_type, [key for key, value in attribute_data.items() if value])
+  numbers = dict(
+      (key, _ParseScriptKey(script_type, key)[0]) for key in script_keys)
+
+  steps = []
+  for key in script_keys:
+    group = None
+    if numbers[key] is not None:
+      group = attribute_data.get(
+          '%s-script-%s-group' % (script_type, numbers[key]))
+    if group and steps and steps[-1][0] == group:
+      steps[-1][1].append(key)
+    else:
+      steps.append((group, [key]))
+
+  dependencies = {}
+  previous = []
+  for _, step in steps:
+    for key in step:
+      dependencies[key] = list(previous)
+    previous = step
+
+  for key in script_keys:
+    if numbers[key] is None:
+      continue
+    after = attribute_data.get(
+        '%s-script-%s-after' % (script_type, numbers[key]))
+    if after is None:
+      continue
+    after_numbers = set(
+        int(number) for number in re.split(r'[\s,]+', after)
+        if number.isdigit())
+    # A URL still runs before the inline script with the same number.
+    dependencies[key] = [
+        dependency for dependency in script_keys
+        if numbers[dependency] in after_numbers
+        or (numbers[dependency] == numbers[key]
+            and script_keys.index(dependency) < script_keys.index(key))]
+  return dependencies
 
 
 class ScriptExecutor(object):
   """A class for executing user provided metadata scripts."""
 
-  def __init__(self, logger, script_type, default_shell=None):
+  def __init__(
+      self, logger, script_type, default_shell=None, max_workers=None,
+      timeout=None, cpu_limit=None, memory_limit=None, output_rate=None,
+      output_dir=None):
     """Constructor.
 
     Args:
       logger: logger object, used to write to SysLog and serial port.
       script_type: string, the type of the script we are running.
       default_shell: string, the default shell to execute the script.
+      max_workers: int, the maximum number of scripts running concurrently.
+          Defaults to the number of CPUs.
+      timeout: int, the number of seconds each script may run before its
+          process group is terminated.
+      cpu_limit: int, the number of seconds of CPU time each script process
+          may use.
+      memory_limit: int, the number of bytes of address space each script
+          process may use.
+      output_rate: int, the number of output lines per second each script
+          may log on average. Output is not rate limited by default.
+      output_dir: string, the directory storing the complete script output
+          of recent runs.
     """
     self.logger = logger
     self.script_type = script_type
     self.default_shell = default_shell or '/bin/bash'
+    self.max_workers = max_workers or multiprocessing.cpu_count()
+    self.timeout = timeout
+    self.cpu_limit = cpu_limit
+    self.memory_limit = memory_limit
+    self.output_rate = output_rate
+    self.output_dir = output_dir
+    self.run_log = None
+    self.start_time = time.time()
+    self.usage = []
+    self.usage_lock = threading.Lock()
 
   def _MakeExecutable(self, metadata_script):
     """Add executable permissions to a file.
@@ -44,6 +205,57 @@ class ScriptExecutor(object):
     mode = os.stat(metadata_script).st_mode
     os.chmod(metadata_script, mode | stat.S_IEXEC)
 
+  def _GetCommand(self, metadata_script):
+    """Get the command running a script in its own process group.
+
+    Args:
+      metadata_script: string, the file location of an executable script.
+
+    Returns:
+      list, the program and arguments running the script.
+    """
+    command = [self.default_shell, '-c', metadata_script]
+    if self.cpu_limit or self.memory_limit or not NEW_SESSION:
+      command = [
+          sys.executable, '-c', EXEC_WRAPPER, str(self.cpu_limit or 0),
+          str(self.memory_limit or 0)] + command
+    return command
+
+  def _WaitProcess(self, pid):
+    """Wait for a script process to exit and get its resource usage.
+
+    Args:
+      pid: int, the process ID of the script.
+
+    Returns:
+      (int, resource.struct_rusage): the exit status and resource usage.
+    """
+    while True:
+      try:
+        _, status, rusage = os.wait4(pid, 0)
+        return status, rusage
+      except OSError as e:
+        # Python before 3.5 does not retry system calls interrupted by a
+        # signal.
+        if e.errno != errno.EINTR:
+          raise
+
+  def _KillProcessGroup(self, metadata_key, pid, sig):
+    """Send a signal to the process group of a script.
+
+    Args:
+      metadata_key: string, the key specifing the metadata script.
+      pid: int, the process ID of the script leading the process group.
+      sig: int, the signal to send.
+    """
+    if sig == signal.SIGTERM:
+      self.logger.warning(
+          '%s: Timed out after %s seconds.', metadata_key, self.timeout)
+    try:
+      os.killpg(pid, sig)
+    except OSError:
+      pass
+
   def _RunScript(self, metadata_key, metadata_script):
     """Run a script and log the streamed script output.
 
@@ -51,31 +263,128 @@ class ScriptExecutor(object):
       metadata_key: string, the key specifing the metadata script.
       metadata_script: string, the file location of an executable script.
     """
+    start_time = time.time()
+    kwargs = {'start_new_session': True} if NEW_SESSION else {}
     process = subprocess.Popen(
-        metadata_script, shell=True,
-        executable=self.default_shell,
-        stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
-    while True:
-      for line in iter(process.stdout.readline, b''):
-        message = line.decode('utf-8', 'replace').rstrip('\n')
-        if message:
-          self.logger.info('%s: %s', metadata_key, message)
-      if process.poll() is not None:
-        break
+        self._GetCommand(metadata_script),
+        stderr=subprocess.STDOUT, stdout=subprocess.PIPE, **kwargs)
+    timers = []
+    if self.timeout:
+      for sig, delay in (
+          (signal.SIGTERM, self.timeout),
+          (signal.SIGKILL, self.timeout + KILL_TIMEOUT)):
+        timer = threading.Timer(
+            delay, self._KillProcessGroup,
+            args=(metadata_key, process.pid, sig))
+        timer.daemon = True
+        timer.start()
+        timers.append(timer)
+    try:
+      pump = output_pump.OutputPump(
+          self.logger, prefix=metadata_key, run_log=self.run_log,
+          rate=self.output_rate)
+      pump.Pump(process.stdout)
+      status, rusage = self._WaitProcess(process.pid)
+    finally:
+      for timer in timers:
+        timer.cancel()
+    if os.WIFSIGNALED(status):
+      process.returncode = -os.WTERMSIG(status)
+    else:
+      process.returncode = os.WEXITSTATUS(status)
+    wall_time = time.time() - start_time
     self.logger.info('%s: Return code %s.', metadata_key, process.returncode)
+    self.logger.info(
+        '%s: Wall time %.3f seconds, user CPU %.3f seconds, system CPU %.3f '
+        'seconds, max RSS %s KB.', metadata_key, wall_time, rusage.ru_utime,
+        rusage.ru_stime, rusage.ru_maxrss)
+    with self.usage_lock:
+      self.usage.append(
+          (metadata_key, process.returncode, wall_time, rusage.ru_utime,
+           rusage.ru_stime, rusage.ru_maxrss))
+
+  def _OpenRunLog(self):
+    """Open the log storing the complete output of this run.
+
+    Returns:
+      RunLog object, or None if the output is not stored.
+    """
+    if not self.output_dir:
+      return None
+    path = os.path.join(self.output_dir, '%s-script.log' % self.script_type)
+    try:
+      return output_pump.RunLog(path)
+    except (IOError, OSError) as e:
+      self.logger.warning('Could not open %s. %s.', path, e)
+      return None
+
+  def _LogUsageSummary(self):
+    """Log the resource usage of the scripts that ran, slowest first."""
+    with self.usage_lock:
+      usage = sorted(self.usage, key=lambda item: item[2], reverse=True)
+      self.usage = []
+    summary = [
+        '%s (code %s, %.3fs wall, %.3fs user, %.3fs sys, %s KB)' % item
+        for item in usage]
+    if summary:
+      self.logger.info(
+          'Finished %s scripts in %.3f seconds: %s.', self.script_type,
+          time.time() - self.start_time, ', '.join(summary))
+
+  def _GetTask(self, script_dict, metadata_key, dependencies):
+    """Get the task running a script once the scripts it runs after finish.
+
+    Args:
+      script_dict: a dictionary mapping metadata keys to script files.
+      metadata_key: string, the metadata key of the script.
+      dependencies: dict, a dictionary mapping each script key to the keys it
+          runs after.
+
+    Returns:
+      task_graph.Task, the task running the script.
+    """
+    def _Run():
+      # Scripts run after the scripts they depend on even when those fail.
+      try:
+        metadata_script = script_dict.get(metadata_key)
+        self._MakeExecutable(metadata_script)
+        self._RunScript(metadata_key, metadata_script)
+      except Exception as e:
+        self.logger.warning('Exception running %s. %s.', metadata_key, e)
+
+    return task_graph.Task(
+        metadata_key, _Run, after=dependencies.get(metadata_key))
 
-  def RunScripts(self, script_dict):
+  def RunScripts(self, script_dict, dependencies=None):
     """Run the metadata scripts; execute a URL script first if one is provided.
 
     Args:
       script_dict: a dictionary mapping metadata keys to script files.
+      dependencies: dict, a dictionary mapping each script key to the keys it
+          runs after. Scripts run one at a time when not provided.
     """
-    metadata_types = ['%s-script-url', '%s-script']
-    metadata_keys = [key % self.script_type for key in metadata_types]
-    metadata_keys = [key for key in metadata_keys if script_dict.get(key)]
+    metadata_keys = [key for key in script_dict if script_dict.get(key)]
+    metadata_keys = GetScriptKeys(self.script_type, metadata_keys)
     if not metadata_keys:
       self.logger.info('No %s scripts found in metadata.', self.script_type)
-    for metadata_key in metadata_keys:
-      metadata_script = script_dict.get(metadata_key)
-      self._MakeExecutable(metadata_script)
-      self._RunScript(metadata_key, metadata_script)
+      return
+    self.logger.info(
+        'Running first %s script %.3f seconds after starting.',
+        self.script_type, time.time() - self.start_time)
+    if dependencies is None:
+      dependencies = dict(
+          (key, metadata_keys[:index])
+          for index, key in enumerate(metadata_keys))
+    self.run_log = self._OpenRunLog()
+    try:
+      tasks = [
+          self._GetTask(script_dict, key, dependencies)
+          for key in metadata_keys]
+      task_graph.RunTasks(
+          tasks, max_workers=self.max_workers, logger=self.logger,
+          log_timings=False)
+    finally:
+      if self.run_log:
+        self.run_log.Close()
+        self.run_log = None
+    self._LogUsageSummary()
@@ -18,13 +18,50 @@
 import contextlib
 import logging.handlers
 import optparse
+import os
 import shutil
 import tempfile
+import threading
 
 from google_compute_engine import config_manager
 from google_compute_engine import logger
+from google_compute_engine import tracing
+from google_compute_engine.metadata_scripts import script_cache
 from google_compute_engine.metadata_scripts import script_executor
 from google_compute_engine.metadata_scripts import script_retriever
+from google_compute_engine.metadata_scripts import script_stager
+
+MEMORY_FILE_SYSTEMS = ('ramfs', 'tmpfs')
+MEMORY_RUN_DIRS = ('/run', '/dev/shm')
+
+
+def _GetMemoryRunDir(mounts_file='/proc/mounts'):
+  """Find a writable directory on a memory backed file system.
+
+  Scripts are executed from the directory, so file systems mounted noexec
+  are skipped.
+
+  Args:
+    mounts_file: string, the path to the table of mounted file systems.
+
+  Returns:
+    string, the directory or None if none is mounted.
+  """
+  # The last mount of a directory is the one in effect.
+  mount_options = {}
+  try:
+    with open(mounts_file) as mounts:
+      for fields in (line.split() for line in mounts):
+        if len(fields) > 3:
+          mount_options[fields[1]] = (fields[2], fields[3].split(','))
+  except (IOError, OSError):
+    return None
+  for run_dir in MEMORY_RUN_DIRS:
+    file_system, options = mount_options.get(run_dir, (None, []))
+    if (file_system in MEMORY_FILE_SYSTEMS and 'noexec' not in options
+        and os.access(run_dir, os.W_OK)):
+      return run_dir
+  return None
 
 
 @contextlib.contextmanager
@@ -49,13 +86,27 @@ class ScriptManager(object):
   """A class for retrieving and executing metadata scripts."""
 
   def __init__(
-      self, script_type, default_shell=None, run_dir=None, debug=False):
+      self, script_type, default_shell=None, run_dir=None, run_in_memory=False,
+      cache=False, stage=False, watch=False, limits=None, output_dir=None,
+      downloads=None, debug=False):
     """Constructor.
 
     Args:
       script_type: string, the metadata script type to run.
       default_shell: string, the default shell to execute the script.
       run_dir: string, the base directory location of the temporary directory.
+      run_in_memory: bool, True if scripts should be stored on a memory backed
+          file system when run_dir is not set.
+      cache: bool, True if downloaded scripts should be cached across runs.
+      stage: bool, True if shutdown scripts are staged locally ahead of time.
+      watch: bool, True if the scripts should be staged whenever metadata
+          changes instead of running them.
+      limits: dict, the timeout, cpu_limit, memory_limit and output_rate for
+          each script.
+      output_dir: string, the directory storing the complete script output
+          of recent runs.
+      downloads: dict, the part_size and max_parts for downloading large
+          scripts in parallel parts.
       debug: bool, True if debug output should write to the console.
     """
     self.script_type = script_type
@@ -63,10 +114,53 @@ class ScriptManager(object):
     name = '%s-script' % self.script_type
     facility = logging.handlers.SysLogHandler.LOG_DAEMON
     self.logger = logger.Logger(name=name, debug=debug, facility=facility)
-    self.retriever = script_retriever.ScriptRetriever(self.logger, script_type)
+    self.cache = script_cache.ScriptCache(self.logger) if cache else None
+    self.retriever = script_retriever.ScriptRetriever(
+        self.logger, script_type, cache=self.cache, **(downloads or {}))
     self.executor = script_executor.ScriptExecutor(
-        self.logger, script_type, default_shell=default_shell)
-    self._RunScripts(run_dir=run_dir)
+        self.logger, script_type, default_shell=default_shell,
+        output_dir=output_dir, **(limits or {}))
+    self.stager = None
+    if stage and script_type == 'startup':
+      # Stage the shutdown scripts while the startup scripts run.
+      retriever = script_retriever.ScriptRetriever(
+          self.logger, 'shutdown', cache=self.cache, **(downloads or {}))
+      self.stager = script_stager.ScriptStager(self.logger, retriever)
+    elif stage or watch:
+      self.stager = script_stager.ScriptStager(self.logger, self.retriever)
+    if watch:
+      self.logger.info('Staging %s scripts on metadata changes.', script_type)
+      self.stager.WatchMetadata()
+    else:
+      if run_in_memory and not run_dir:
+        run_dir = _GetMemoryRunDir()
+        self.logger.debug(
+            'Storing %s scripts in %s.', script_type, run_dir or 'tempdir')
+      self._RunScripts(run_dir=run_dir)
+
+  def _GetScripts(self, dest_dir):
+    """Retrieve the metadata scripts, using the staged copy if it is current.
+
+    Args:
+      dest_dir: string, the path to a directory for storing metadata scripts.
+
+    Returns:
+      (dict, dict): a dictionary mapping set metadata keys with associated
+          scripts, and a dictionary mapping each script key to the keys it
+          runs after.
+    """
+    metadata_dict = None
+    if self.stager and self.stager.script_type == self.script_type:
+      script_dict, dependencies, metadata_dict = (
+          self.stager.GetStagedScripts())
+      if script_dict is not None:
+        self.logger.info('Using staged %s scripts.', self.script_type)
+        return script_dict, dependencies
+    if metadata_dict is None:
+      metadata_dict = self.retriever.watcher.GetMetadata() or {}
+    script_dict = self.retriever.GetScripts(
+        dest_dir, metadata_dict=metadata_dict)
+    return script_dict, self.retriever.GetDependencies(metadata_dict)
 
   def _RunScripts(self, run_dir=None):
     """Retrieve metadata scripts and execute them.
@@ -74,15 +168,76 @@ class ScriptManager(object):
     Args:
       run_dir: string, the base directory location of the temporary directory.
     """
-    with _CreateTempDir(self.script_type, run_dir=run_dir) as dest_dir:
+    with _CreateTempDir(self.script_type, run_dir=run_dir) as dest_dir, \
+        tracing.Span('%s_scripts' % self.script_type):
+      stage_thread = None
       try:
         self.logger.info('Starting %s scripts.', self.script_type)
-        script_dict = self.retriever.GetScripts(dest_dir)
-        self.executor.RunScripts(script_dict)
+        if self.stager and self.stager.script_type != self.script_type:
+          stage_thread = threading.Thread(target=self.stager.Stage)
+          stage_thread.daemon = True
+          stage_thread.start()
+        script_dict, dependencies = self._GetScripts(dest_dir)
+        self.executor.RunScripts(script_dict, dependencies=dependencies)
       finally:
+        if stage_thread:
+          stage_thread.join()
         self.logger.info('Finished running %s scripts.', self.script_type)
 
 
+def _GetIntOptions(instance_config, options):
+  """Read integer options from the MetadataScripts section.
+
+  Args:
+    instance_config: ConfigManager object, the instance configuration.
+    options: list, tuples of the name of each value and its config option.
+
+  Returns:
+    dict, the values that are set to a valid integer.
+  """
+  values = {}
+  for name, option in options:
+    value = instance_config.GetOptionString('MetadataScripts', option)
+    try:
+      values[name] = int(value) if value else None
+    except ValueError:
+      values[name] = None
+  return dict((name, value) for name, value in values.items() if value)
+
+
+def _GetLimits(instance_config):
+  """Read the resource limits for each script from the instance config.
+
+  Args:
+    instance_config: ConfigManager object, the instance configuration.
+
+  Returns:
+    dict, the timeout, cpu_limit, memory_limit and output_rate values that
+        are set.
+  """
+  return _GetIntOptions(instance_config, (
+      ('timeout', 'script_timeout'),
+      ('cpu_limit', 'script_cpu_limit'),
+      ('memory_limit', 'script_memory_limit'),
+      ('output_rate', 'script_output_rate_limit'),
+  ))
+
+
+def _GetDownloads(instance_config):
+  """Read the parallel download settings from the instance config.
+
+  Args:
+    instance_config: ConfigManager object, the instance configuration.
+
+  Returns:
+    dict, the part_size and max_parts values that are set.
+  """
+  return _GetIntOptions(instance_config, (
+      ('part_size', 'download_part_size'),
+      ('max_parts', 'download_max_parts'),
+  ))
+
+
 def main():
   script_types = ('startup', 'shutdown')
   parser = optparse.OptionParser()
@@ -91,6 +246,9 @@ def main():
       help='print debug output to the console.')
   parser.add_option(
       '--script-type', dest='script_type', help='metadata script type.')
+  parser.add_option(
+      '--prefetch', action='store_true', dest='prefetch',
+      help='stage the scripts whenever metadata changes instead of running.')
   (options, _) = parser.parse_args()
   if options.script_type and options.script_type.lower() in script_types:
     script_type = options.script_type.lower()
@@ -100,12 +258,27 @@ def main():
     raise ValueError(message)
 
   instance_config = config_manager.ConfigManager()
+  tracing.Configure(
+      '%s-script' % script_type,
+      trace_file=instance_config.GetOptionString('Tracing', 'trace_file'))
   if instance_config.GetOptionBool('MetadataScripts', script_type):
     ScriptManager(
         script_type,
         default_shell=instance_config.GetOptionString(
             'MetadataScripts', 'default_shell'),
         run_dir=instance_config.GetOptionString('MetadataScripts', 'run_dir'),
+        run_in_memory=instance_config.GetOptionBool(
+            'MetadataScripts', 'run_in_memory'),
+        cache=instance_config.GetOptionBool('MetadataScripts', 'cache_scripts'),
+        stage=(
+            instance_config.GetOptionBool(
+                'MetadataScripts', 'stage_shutdown_scripts')
+            and instance_config.GetOptionBool('MetadataScripts', 'shutdown')),
+        watch=bool(options.prefetch),
+        limits=_GetLimits(instance_config),
+        output_dir=instance_config.GetOptionString(
+            'MetadataScripts', 'script_output_log_dir'),
+        downloads=_GetDownloads(instance_config),
         debug=bool(options.debug))
 
 
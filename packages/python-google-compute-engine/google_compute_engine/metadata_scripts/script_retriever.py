@@ -15,17 +15,34 @@
 
 """Retrieve and store user provided metadata scripts."""
 
+import base64
 import functools
+import hashlib
+import json
+import os
 import re
 import socket
+import sys
 import tempfile
 import time
 
 from google_compute_engine import metadata_watcher
+from google_compute_engine import token_provider
+from google_compute_engine import worker_pool
 from google_compute_engine.compat import httpclient
 from google_compute_engine.compat import urlerror
 from google_compute_engine.compat import urlrequest
 from google_compute_engine.compat import urlretrieve
+from google_compute_engine.metadata_scripts import script_executor
+
+DOWNLOAD_BUFFER_SIZE = 64 * 1024
+PROGRESS_INTERVAL = 10
+PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 4
+VALIDATOR_HEADERS = ('if-modified-since', 'if-none-match')
+# Python before 2.7.9 does not check SSL certificates, so compat replaces
+# urlretrieve with a curl download.
+CURL_FALLBACK = sys.version_info < (2, 7, 9)
 
 
 def _RetryOnUnavailable(func):
@@ -38,6 +55,10 @@ def _RetryOnUnavailable(func):
       try:
         response = func(*args, **kwargs)
       except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
+        if (isinstance(e, urlerror.HTTPError)
+            and e.code == httpclient.UNAUTHORIZED):
+          # A new authentication token is needed before retrying.
+          raise
         final_exception = e
         time.sleep(5)
         continue
@@ -47,121 +68,410 @@ def _RetryOnUnavailable(func):
   return Wrapper
 
 
-@_RetryOnUnavailable
-def _UrlOpenWithRetry(request):
-  """Call urlopen with retry."""
-  return urlrequest.urlopen(request)
-
-
-@_RetryOnUnavailable
-def _UrlRetrieveWithRetry(url, dest):
-  """Call urlretrieve with retry."""
-  return urlretrieve.urlretrieve(url, dest)
+def _CreateRequest(url, unredirected_headers=None, headers=None):
+  """Create a request for a URL.
+
+  Args:
+    url: string, the URL to download.
+    unredirected_headers: dict, headers that are not sent on redirect, such as
+        the authentication token.
+    headers: dict, headers that are sent with every request.
+
+  Returns:
+    urlrequest.Request, the request for the URL.
+  """
+  request = urlrequest.Request(url)
+  for name, value in sorted((unredirected_headers or {}).items()):
+    request.add_unredirected_header(name, value)
+  for name, value in sorted((headers or {}).items()):
+    request.add_header(name, value)
+  return request
+
+
+def _GetMd5Hash(response):
+  """Get the base64 encoded MD5 hash of an object sent by Google Storage.
+
+  Args:
+    response: HTTPResponse, the response to a download request.
+
+  Returns:
+    string, the MD5 hash from the x-goog-hash headers or None if not present.
+  """
+  info = response.info()
+  get_all = getattr(info, 'get_all', None) or getattr(info, 'getheaders')
+  for header in get_all('x-goog-hash') or []:
+    for value in header.split(','):
+      name, _, digest = value.strip().partition('=')
+      if name == 'md5' and digest:
+        return digest
+  return None
+
+
+def _GetContentRange(url, headers):
+  """Get the range of the first part and the size of an object.
+
+  Args:
+    url: string, the URL being downloaded.
+    headers: HTTPMessage, the headers of the response to a range request.
+
+  Returns:
+    (int, int): the offset of the last byte in the first part and the size
+        of the object.
+
+  Raises:
+    ValueError: the response does not hold the start of a known length.
+  """
+  content_range = headers.get('Content-Range') or ''
+  match = re.match(r'bytes 0-(\d+)/(\d+)$', content_range.strip())
+  if not match:
+    raise ValueError(
+        'Range request for %s returned range %s.' % (url, content_range))
+  return int(match.group(1)), int(match.group(2))
+
+
+def _HashFile(path, buffer_size=DOWNLOAD_BUFFER_SIZE):
+  """Compute the MD5 hash of a file.
+
+  Args:
+    path: string, the path to the file.
+    buffer_size: int, the number of bytes read at a time.
+
+  Returns:
+    hashlib.md5, the hash of the file contents.
+  """
+  digest = hashlib.md5()
+  with open(path, 'rb') as hashed_file:
+    for chunk in iter(lambda: hashed_file.read(buffer_size), b''):
+      digest.update(chunk)
+  return digest
 
 
 class ScriptRetriever(object):
   """A class for retrieving and storing user provided metadata scripts."""
-  token_metadata_key = 'instance/service-accounts/default/token'
-  # Cached authentication token to be used when downloading from bucket.
-  token = None
 
-  def __init__(self, logger, script_type):
+  def __init__(
+      self, logger, script_type, buffer_size=DOWNLOAD_BUFFER_SIZE, cache=None,
+      part_size=PART_SIZE, max_parts=MAX_PARTS):
     """Constructor.
 
     Args:
       logger: logger object, used to write to SysLog and serial port.
       script_type: string, the metadata script type to run.
+      buffer_size: int, the number of bytes read at a time when downloading.
+      cache: ScriptCache object, used to reuse unchanged downloaded scripts.
+      part_size: int, the number of bytes in each range request when a large
+          script is downloaded in parts.
+      max_parts: int, the maximum number of parts downloaded concurrently.
     """
     self.logger = logger
     self.script_type = script_type
+    self.buffer_size = buffer_size
+    self.cache = cache
+    self.part_size = part_size
+    self.max_parts = max_parts
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    self.token_provider = token_provider.GetTokenProvider(logger=self.logger)
 
-  def _DownloadAuthUrl(self, url, dest_dir):
-    """Download a Google Storage URL using an authentication token.
+  @_RetryOnUnavailable
+  def _StreamUrl(self, request, dest):
+    """Stream the contents of a URL to a file in chunks.
 
-    If the token cannot be fetched, fallback to unauthenticated download.
+    The first request asks for the first part of the object. A server
+    supporting range requests responds with that part and the size of the
+    object, and the remaining parts are downloaded concurrently. Other
+    servers respond with the whole object.
 
     Args:
-      url: string, the URL to download.
-      dest_dir: string, the path to a directory for storing metadata scripts.
+      request: urlrequest.Request, the request for the URL to download.
+      dest: string, the path to the file for storing the contents.
 
     Returns:
-      string, the path to the file storing the metadata script.
-    """
-    dest_file = tempfile.NamedTemporaryFile(dir=dest_dir, delete=False)
-    dest_file.close()
-    dest = dest_file.name
+      HTTPMessage, the response headers or None if the server responded that
+          the cached copy of the URL is not modified.
 
-    self.logger.info(
-        'Downloading url from %s to %s using authentication token.', url, dest)
+    Raises:
+      httpclient.IncompleteRead: the response is shorter than Content-Length.
+      ValueError: the contents do not match the MD5 hash of the object.
+    """
+    url = request.get_full_url()
+    first_request = request
+    if self.max_parts > 1:
+      headers = dict(request.headers)
+      headers['Range'] = 'bytes=0-%s' % (self.part_size - 1)
+      first_request = _CreateRequest(url, request.unredirected_hdrs, headers)
+    try:
+      response = urlrequest.urlopen(first_request)
+    except urlerror.HTTPError as e:
+      if e.code == httpclient.NOT_MODIFIED:
+        return None
+      if (e.code == httpclient.REQUESTED_RANGE_NOT_SATISFIABLE
+          and first_request is not request):
+        # An empty object has no first part.
+        response = urlrequest.urlopen(request)
+      else:
+        raise
+    try:
+      headers = response.info()
+      md5 = _GetMd5Hash(response)
+      if response.getcode() == httpclient.PARTIAL_CONTENT:
+        first_end, expected = _GetContentRange(url, headers)
+      else:
+        first_end = None
+        length = headers.get('Content-Length')
+        expected = int(length) if length and length.isdigit() else None
+      if first_end is not None and first_end + 1 < expected:
+        self._DownloadParts(
+            request, dest, response, first_end, expected, headers.get('ETag'))
+        size = expected
+        digest = _HashFile(dest, self.buffer_size) if md5 else None
+      else:
+        digest = hashlib.md5() if md5 else None
+        with open(dest, 'wb') as dest_file:
+          size = self._WriteResponse(
+              url, response, dest_file, expected, digest)
+    finally:
+      response.close()
+
+    if expected is not None and size != expected:
+      raise httpclient.IncompleteRead(b'', expected - size)
+    if digest and base64.b64encode(digest.digest()).decode('ascii') != md5:
+      raise ValueError('MD5 hash mismatch for %s.' % url)
+    return headers
+
+  def _WriteResponse(
+      self, url, response, dest_file, expected=None, digest=None):
+    """Write the body of a response to a file in chunks.
 
-    if not self.token:
-      response = self.watcher.GetMetadata(
-          self.token_metadata_key, recursive=False, retry_limit=3)
+    Args:
+      url: string, the URL being downloaded.
+      response: HTTPResponse, the response to a download request.
+      dest_file: file object, the file positioned where the body is written.
+      expected: int, the number of bytes expected or None if unknown.
+      digest: hashlib.md5, updated with the body or None to skip hashing.
 
-      if not response:
+    Returns:
+      int, the number of bytes written.
+    """
+    size = 0
+    last_progress = time.time()
+    while True:
+      chunk = response.read(self.buffer_size)
+      if not chunk:
+        break
+      dest_file.write(chunk)
+      size += len(chunk)
+      if digest:
+        digest.update(chunk)
+      now = time.time()
+      if now - last_progress >= PROGRESS_INTERVAL:
         self.logger.info(
-            'Authentication token not found. Attempting unauthenticated '
-            'download.')
-        return self._DownloadUrl(url, dest_dir)
+            'Downloaded %s of %s bytes from %s.', size,
+            expected if expected is not None else 'unknown', url)
+        last_progress = now
+    return size
 
-      self.token = '%s %s' % (
-          response.get('token_type', ''), response.get('access_token', ''))
+  @_RetryOnUnavailable
+  def _DownloadPart(self, request, dest, start, end, etag=None):
+    """Download a byte range of a URL into its offset in a file.
 
+    Args:
+      request: urlrequest.Request, the request for the URL to download.
+      dest: string, the path to the preallocated file storing the contents.
+      start: int, the offset of the first byte in the range.
+      end: int, the offset of the last byte in the range.
+      etag: string, the entity tag the object must still match.
+
+    Raises:
+      httpclient.IncompleteRead: the response is shorter than the range.
+      ValueError: the server did not respond with the requested range.
+    """
+    url = request.get_full_url()
+    headers = dict(
+        (name, value) for name, value in request.headers.items()
+        if name.lower() not in VALIDATOR_HEADERS)
+    headers['Range'] = 'bytes=%s-%s' % (start, end)
+    if etag:
+      headers['If-Match'] = etag
+    part_request = _CreateRequest(url, request.unredirected_hdrs, headers)
+    response = urlrequest.urlopen(part_request)
     try:
-      request = urlrequest.Request(url)
-      request.add_unredirected_header('Metadata-Flavor', 'Google')
-      request.add_unredirected_header('Authorization', self.token)
-      content = _UrlOpenWithRetry(request).read()
-    except Exception as e:
-      self.logger.warning('Could not download %s. %s.', url, str(e))
+      if response.getcode() != httpclient.PARTIAL_CONTENT:
+        raise ValueError(
+            'Range request for %s returned %s.' % (url, response.getcode()))
+      expected = end - start + 1
+      with open(dest, 'r+b') as dest_file:
+        dest_file.seek(start)
+        size = self._WriteResponse(url, response, dest_file, expected)
+    finally:
+      response.close()
+    if size != expected:
+      raise httpclient.IncompleteRead(b'', expected - size)
+
+  def _DownloadParts(
+      self, request, dest, response, first_end, length, etag=None):
+    """Download a URL with concurrent range requests.
+
+    Args:
+      request: urlrequest.Request, the request for the URL to download.
+      dest: string, the path to the file for storing the contents.
+      response: HTTPResponse, the response holding the first part.
+      first_end: int, the offset of the last byte in the first part.
+      length: int, the size of the object.
+      etag: string, the entity tag the object must still match.
+
+    Raises:
+      httpclient.HTTPException, socket.error, urlerror.URLError, ValueError:
+          a part could not be downloaded.
+    """
+    with open(dest, 'wb') as dest_file:
+      fallocate = getattr(os, 'posix_fallocate', None)
+      if fallocate:
+        fallocate(dest_file.fileno(), 0, length)
+      else:
+        dest_file.truncate(length)
+    parts = [(0, first_end)] + [
+        (start, min(start + self.part_size, length) - 1)
+        for start in range(first_end + 1, length, self.part_size)]
+    url = request.get_full_url()
+    self.logger.info(
+        'Downloading %s bytes from %s in %s parts.', length, url, len(parts))
+
+    def _FetchPart(part):
+      start, end = part
+      try:
+        if start:
+          self._DownloadPart(request, dest, start, end, etag=etag)
+          return None
+        # The response to the first request already holds the first part.
+        with open(dest, 'r+b') as dest_file:
+          size = self._WriteResponse(url, response, dest_file, end + 1)
+        if size != end + 1:
+          raise httpclient.IncompleteRead(b'', end + 1 - size)
+      except Exception as e:
+        return e
       return None
 
-    with open(dest, 'wb') as f:
-      f.write(content)
+    errors = worker_pool.ParallelMap(
+        _FetchPart, parts, max_workers=self.max_parts, logger=self.logger)
+    for error in errors:
+      if error:
+        raise error
 
-    return dest
+  def _DownloadAuthUrl(self, url, dest_dir):
+    """Download a Google Storage URL using an authentication token.
+
+    If the token cannot be fetched, fallback to unauthenticated download. If
+    the token is rejected, the download is retried once with a new token.
+
+    Args:
+      url: string, the URL to download.
+      dest_dir: string, the path to a directory for storing metadata scripts.
 
-  def _DownloadUrl(self, url, dest_dir):
+    Returns:
+      string, the path to the file storing the metadata script.
+    """
+    token = self.token_provider.GetToken()
+    if not token:
+      self.logger.info(
+          'Authentication token not found. Attempting unauthenticated '
+          'download.')
+      return self._DownloadUrl(url, dest_dir)
+
+    headers = {
+        'Metadata-Flavor': 'Google',
+        'Authorization': token.authorization,
+    }
+    try:
+      return self._DownloadUrl(
+          url, dest_dir, headers=headers, raise_unauthorized=True)
+    except urlerror.HTTPError:
+      self.logger.info('Authentication token rejected. Refreshing the token.')
+      self.token_provider.Invalidate(token)
+
+    token = self.token_provider.GetToken()
+    if token:
+      headers['Authorization'] = token.authorization
+    else:
+      headers = None
+    return self._DownloadUrl(url, dest_dir, headers=headers)
+
+  def _DownloadUrl(self, url, dest_dir, headers=None, raise_unauthorized=False):
     """Download a script from a given URL.
 
     Args:
       url: string, the URL to download.
       dest_dir: string, the path to a directory for storing metadata scripts.
+      headers: dict, headers that are not sent on redirect, such as the
+          authentication token.
+      raise_unauthorized: bool, True if an unauthorized response should be
+          raised instead of logged.
 
     Returns:
       string, the path to the file storing the metadata script.
+
+    Raises:
+      urlerror.HTTPError: the server responded unauthorized and
+          raise_unauthorized is True.
     """
     dest_file = tempfile.NamedTemporaryFile(dir=dest_dir, delete=False)
     dest_file.close()
     dest = dest_file.name
 
-    self.logger.info('Downloading url from %s to %s.', url, dest)
+    if headers and 'Authorization' in headers:
+      self.logger.info(
+          'Downloading url from %s to %s using authentication token.',
+          url, dest)
+    else:
+      self.logger.info('Downloading url from %s to %s.', url, dest)
+
     try:
-      _UrlRetrieveWithRetry(url, dest)
+      if CURL_FALLBACK and not headers:
+        # curl streams the script to disk without conditional requests, so
+        # the cache is not used.
+        urlretrieve.urlretrieve(url, dest)
+        self.logger.info(
+            'Downloaded %s bytes from %s.', os.path.getsize(dest), url)
+        return dest
+      validators = self.cache.GetValidators(url) if self.cache else {}
+      request = _CreateRequest(url, headers, validators)
+      response_headers = self._StreamUrl(request, dest)
+      if response_headers is None:
+        if self.cache and self.cache.Restore(url, dest):
+          return dest
+        # The cached copy is gone, so download the script unconditionally.
+        request = _CreateRequest(url, headers)
+        response_headers = self._StreamUrl(request, dest)
+      self.logger.info(
+          'Downloaded %s bytes from %s.', os.path.getsize(dest), url)
+      if self.cache:
+        self.cache.Store(url, dest, response_headers)
       return dest
     except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
+      if (raise_unauthorized and isinstance(e, urlerror.HTTPError)
+          and e.code == httpclient.UNAUTHORIZED):
+        os.remove(dest)
+        raise
       self.logger.warning('Could not download %s. %s.', url, str(e))
     except Exception as e:
       self.logger.warning('Exception downloading %s. %s.', url, str(e))
     return None
 
-  def _DownloadScript(self, url, dest_dir):
-    """Download the contents of the URL to the destination.
+  def _ResolveUrl(self, url):
+    """Get the URL to download and whether it needs an authentication token.
 
     Args:
-      url: string, the URL to download.
-      dest_dir: string, the path to a directory for storing metadata scripts.
+      url: string, the URL specified in metadata.
 
     Returns:
-      string, the path to the file storing the metadata script.
+      (string, bool): the URL to download and True if it is a Google Storage
+          URL downloaded with an authentication token.
     """
     # Check for the preferred Google Storage URL format:
     # gs://<bucket>/<object>
     if url.startswith(r'gs://'):
       # Convert the string into a standard URL.
       url = re.sub('^gs://', 'https://storage.googleapis.com/', url)
-      return self._DownloadAuthUrl(url, dest_dir)
+      return url, True
 
     header = r'http[s]?://'
     domain = r'storage\.googleapis\.com'
@@ -180,7 +490,7 @@ class ScriptRetriever(object):
     gs_regex = re.compile(r'\A%s%s\.%s/%s\Z' % (header, bucket, domain, obj))
     match = gs_regex.match(url)
     if match:
-      return self._DownloadAuthUrl(url, dest_dir)
+      return url, True
 
     # Check for the other possible Google Storage URLs:
     # http://storage.googleapis.com/<bucket>/<object>
@@ -193,14 +503,83 @@ class ScriptRetriever(object):
         r'\A%s(commondata)?%s/%s/%s\Z' % (header, domain, bucket, obj))
     match = gs_regex.match(url)
     if match:
-      return self._DownloadAuthUrl(url, dest_dir)
+      return url, True
 
     # Unauthenticated download of the object.
+    return url, False
+
+  def _DownloadScript(self, url, dest_dir):
+    """Download the contents of the URL to the destination.
+
+    Args:
+      url: string, the URL to download.
+      dest_dir: string, the path to a directory for storing metadata scripts.
+
+    Returns:
+      string, the path to the file storing the metadata script.
+    """
+    url, authenticate = self._ResolveUrl(url)
+    if authenticate:
+      return self._DownloadAuthUrl(url, dest_dir)
     return self._DownloadUrl(url, dest_dir)
 
+  def _GetAttributeScript(self, metadata_key, metadata_value, dest_dir):
+    """Store a single metadata script in a file.
+
+    Args:
+      metadata_key: string, the metadata key specifying the script.
+      metadata_value: string, the script contents or the URL to download.
+      dest_dir: string, the path to a directory for storing metadata scripts.
+
+    Returns:
+      string, the path to the file storing the metadata script.
+    """
+    self.logger.info('Found %s in metadata.', metadata_key)
+    if metadata_key.endswith('-url'):
+      downloaded_dest = self._DownloadScript(metadata_value, dest_dir)
+      if downloaded_dest is None:
+        self.logger.warning('Failed to download metadata script.')
+      return downloaded_dest
+
+    with tempfile.NamedTemporaryFile(
+        mode='w', dir=dest_dir, delete=False) as dest:
+      dest.write(metadata_value.lstrip())
+      return dest.name
+
+  def _GetScriptKeys(self, attribute_data):
+    """Get the metadata keys with a script in execution order.
+
+    Args:
+      attribute_data: dict, the contents of the attributes metadata.
+
+    Returns:
+      list, the metadata keys specifying scripts.
+    """
+    metadata_keys = [key for key, value in attribute_data.items() if value]
+    return script_executor.GetScriptKeys(self.script_type, metadata_keys)
+
+  def _GetScriptAttributes(self, metadata_dict):
+    """Get the attributes defining the scripts to run.
+
+    Instance attributes take precedence over project attributes.
+
+    Args:
+      metadata_dict: dict, the contents of the metadata server.
+
+    Returns:
+      dict, the contents of the attributes metadata.
+    """
+    for scope in ('instance', 'project'):
+      attributes = (metadata_dict.get(scope) or {}).get('attributes') or {}
+      if self._GetScriptKeys(attributes):
+        return attributes
+    return {}
+
   def _GetAttributeScripts(self, attribute_data, dest_dir):
     """Retrieve the scripts from attribute metadata.
 
+    Downloads start first and run concurrently with writing inline scripts.
+
     Args:
       attribute_data: dict, the contents of the attributes metadata.
       dest_dir: string, the path to a directory for storing metadata scripts.
@@ -208,38 +587,126 @@ class ScriptRetriever(object):
     Returns:
       dict, a dictionary mapping metadata keys to files storing scripts.
     """
-    script_dict = {}
     attribute_data = attribute_data or {}
-    metadata_key = '%s-script' % self.script_type
-    metadata_value = attribute_data.get(metadata_key)
-    if metadata_value:
-      self.logger.info('Found %s in metadata.', metadata_key)
-      with tempfile.NamedTemporaryFile(
-          mode='w', dir=dest_dir, delete=False) as dest:
-        dest.write(metadata_value.lstrip())
-        script_dict[metadata_key] = dest.name
-
-    metadata_key = '%s-script-url' % self.script_type
-    metadata_value = attribute_data.get(metadata_key)
-    if metadata_value:
-      self.logger.info('Found %s in metadata.', metadata_key)
-      downloaded_dest = self._DownloadScript(metadata_value, dest_dir)
-      if downloaded_dest is None:
-        self.logger.warning('Failed to download metadata script.')
-      script_dict[metadata_key] = downloaded_dest
+    metadata_keys = self._GetScriptKeys(attribute_data)
 
-    return script_dict
+    def _GetScript(metadata_key):
+      return self._GetAttributeScript(
+          metadata_key, attribute_data[metadata_key], dest_dir)
+
+    scripts = worker_pool.ParallelMap(
+        _GetScript, metadata_keys, max_workers=len(metadata_keys),
+        logger=self.logger)
+    return dict(zip(metadata_keys, scripts))
+
+  def GetFingerprint(self, metadata_dict):
+    """Compute a fingerprint of the metadata attributes defining the scripts.
+
+    Args:
+      metadata_dict: dict, the contents of the metadata server.
+
+    Returns:
+      string, a hex digest that changes when a script attribute changes.
+    """
+    metadata_dict = metadata_dict or {}
+    regex = r'\A%s-script(-\d+)?(-url|-after|-group)?\Z' % re.escape(
+        self.script_type)
+    values = []
+    for scope in ('instance', 'project'):
+      attributes = (metadata_dict.get(scope) or {}).get('attributes') or {}
+      values.append(sorted(
+          (key, value) for key, value in attributes.items()
+          if re.match(regex, key)))
+    return hashlib.sha256(json.dumps(values).encode('utf-8')).hexdigest()
+
+  def GetUrls(self, metadata_dict):
+    """Get the URLs of the scripts downloaded from metadata.
+
+    Args:
+      metadata_dict: dict, the contents of the metadata server.
+
+    Returns:
+      dict, a dictionary mapping metadata keys to the URLs they specify.
+    """
+    attribute_data = self._GetScriptAttributes(metadata_dict or {})
+    metadata_keys = self._GetScriptKeys(attribute_data)
+    return dict(
+        (key, attribute_data[key]) for key in metadata_keys
+        if key.endswith('-url'))
+
+  def GetValidators(self, url):
+    """Get the validators of the cached copy of a downloaded script.
+
+    Args:
+      url: string, the URL specified in metadata.
+
+    Returns:
+      dict, the conditional request headers confirming the cached copy is
+          current. The dict is empty if the script is not cached.
+    """
+    if not self.cache:
+      return {}
+    return self.cache.GetValidators(self._ResolveUrl(url)[0])
+
+  def IsUnmodified(self, url, validators, timeout=None):
+    """Check with a conditional request that a script has not changed.
+
+    Args:
+      url: string, the URL specified in metadata.
+      validators: dict, the conditional request headers of the local copy.
+      timeout: float, the number of seconds to wait for the server.
+
+    Returns:
+      bool, True if the server responded that the script is not modified.
+    """
+    if not validators:
+      return False
+    url, authenticate = self._ResolveUrl(url)
+    headers = None
+    if authenticate:
+      token = self.token_provider.GetToken()
+      if token:
+        headers = {
+            'Metadata-Flavor': 'Google',
+            'Authorization': token.authorization,
+        }
+    request = _CreateRequest(url, headers, validators)
+    try:
+      response = urlrequest.urlopen(request, timeout=timeout)
+    except urlerror.HTTPError as e:
+      return e.code == httpclient.NOT_MODIFIED
+    except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
+      self.logger.info('Could not revalidate %s. %s.', url, str(e))
+      return False
+    # The script changed, so the body is not needed.
+    response.close()
+    return False
+
+  def GetDependencies(self, metadata_dict):
+    """Compute the scripts each script runs after.
+
+    Args:
+      metadata_dict: dict, the contents of the metadata server.
+
+    Returns:
+      dict, a dictionary mapping each script key to the keys it runs after.
+    """
+    attribute_data = self._GetScriptAttributes(metadata_dict or {})
+    return script_executor.GetDependencies(self.script_type, attribute_data)
 
-  def GetScripts(self, dest_dir):
+  def GetScripts(self, dest_dir, metadata_dict=None):
     """Retrieve the scripts to execute.
 
     Args:
       dest_dir: string, the path to a directory for storing metadata scripts.
+      metadata_dict: dict, the contents of the metadata server if already
+          retrieved.
 
     Returns:
       dict, a dictionary mapping set metadata keys with associated scripts.
     """
-    metadata_dict = self.watcher.GetMetadata() or {}
+    if metadata_dict is None:
+      metadata_dict = self.watcher.GetMetadata() or {}
 
     try:
       instance_data = metadata_dict['instance']['attributes']
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stage metadata scripts locally ahead of running them."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from google_compute_engine import constants
+from google_compute_engine import worker_pool
+
+STAGING_DIR = constants.LOCALSTATEDIR + '/lib/google_compute_engine/scripts'
+FRESHNESS_TIMEOUT = 3
+
+
+class ScriptStager(object):
+  """Keeps a local copy of metadata scripts that runs without network access.
+
+  The staged copy is recorded with a fingerprint of the metadata attributes
+  it was retrieved from. Before it runs, the fingerprint is compared against
+  the current metadata using a short deadline. The staged copy is used if the
+  metadata is unchanged or could not be retrieved in time. Scripts downloaded
+  from a URL are also revalidated with a conditional request using the
+  validators of their cached copy, since the object may change without the
+  metadata changing. The scripts are retrieved again if any of them could not
+  be confirmed unchanged.
+  """
+
+  def __init__(self, logger, retriever, staging_dir=STAGING_DIR):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      retriever: ScriptRetriever object, used to retrieve the scripts.
+      staging_dir: string, the base directory storing staged scripts.
+    """
+    self.logger = logger
+    self.retriever = retriever
+    self.script_type = retriever.script_type
+    self.base_dir = staging_dir
+    self.staging_dir = os.path.join(staging_dir, self.script_type)
+    self.manifest_file = os.path.join(self.staging_dir, 'manifest.json')
+
+  def _ReadManifest(self):
+    """Read the manifest of the staged scripts.
+
+    Returns:
+      dict, the fingerprint and script file names, or None if not staged.
+    """
+    try:
+      with open(self.manifest_file) as manifest_file:
+        manifest = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+      return None
+    return manifest if isinstance(manifest, dict) else None
+
+  def _Remove(self):
+    """Remove the staged scripts."""
+    if os.path.exists(self.staging_dir):
+      shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+  def _RunWithDeadline(self, func, timeout):
+    """Run a function in the background, giving up after a deadline.
+
+    Args:
+      func: callable, the function to run.
+      timeout: float, the number of seconds to wait for the function.
+
+    Returns:
+      the result of the function or None if it did not complete in time.
+    """
+    result = []
+
+    def _Run():
+      result.append(func())
+
+    thread = threading.Thread(target=_Run)
+    thread.daemon = True
+    thread.start()
+    thread.join(max(timeout, 0))
+    return result[0] if result else None
+
+  def _GetMetadata(self, timeout):
+    """Retrieve the metadata contents, giving up after a deadline.
+
+    Args:
+      timeout: float, the number of seconds to wait for the metadata server.
+
+    Returns:
+      dict, the contents of the metadata server or None if not retrieved.
+    """
+    return self._RunWithDeadline(
+        lambda: self.retriever.watcher.GetMetadata(
+            timeout=timeout, retry_limit=0), timeout)
+
+  def _Revalidate(self, urls, timeout):
+    """Check that the scripts downloaded from URLs have not changed.
+
+    Args:
+      urls: dict, the URL and validators of each staged script downloaded
+          from a URL, keyed by metadata key.
+      timeout: float, the number of seconds to wait for the servers.
+
+    Returns:
+      bool, True if every script was confirmed unchanged in time.
+    """
+    if not urls:
+      return True
+
+    def _IsUnmodified(entry):
+      return self.retriever.IsUnmodified(
+          entry.get('url'), entry.get('validators'), timeout=timeout)
+
+    def _RevalidateAll():
+      return all(worker_pool.ParallelMap(
+          _IsUnmodified, list(urls.values()), max_workers=len(urls),
+          logger=self.logger))
+
+    return bool(self._RunWithDeadline(_RevalidateAll, timeout))
+
+  def Stage(self, metadata_dict=None):
+    """Retrieve the scripts and replace the staged copy if it is stale.
+
+    Args:
+      metadata_dict: dict, the contents of the metadata server if already
+          retrieved.
+
+    Returns:
+      bool, True if the staged copy matches the metadata.
+    """
+    if metadata_dict is None:
+      metadata_dict = self.retriever.watcher.GetMetadata() or {}
+    fingerprint = self.retriever.GetFingerprint(metadata_dict)
+    manifest = self._ReadManifest()
+    if manifest and manifest.get('fingerprint') == fingerprint:
+      return True
+
+    temp_dir = None
+    try:
+      if not os.path.isdir(self.base_dir):
+        os.makedirs(self.base_dir, 0o700)
+      temp_dir = tempfile.mkdtemp(
+          prefix=self.script_type + '-', dir=self.base_dir)
+      script_dict = self.retriever.GetScripts(
+          temp_dir, metadata_dict=metadata_dict)
+      if None in script_dict.values():
+        self.logger.warning(
+            'Failed to stage %s scripts. Removing staged copy.',
+            self.script_type)
+        self._Remove()
+        return False
+      manifest = {
+          'dependencies': self.retriever.GetDependencies(metadata_dict),
+          'fingerprint': fingerprint,
+          'scripts': dict(
+              (key, os.path.basename(path))
+              for key, path in script_dict.items()),
+          'urls': dict(
+              (key, {
+                  'url': url,
+                  'validators': self.retriever.GetValidators(url),
+              })
+              for key, url in self.retriever.GetUrls(metadata_dict).items()),
+      }
+      with open(os.path.join(temp_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+      self._Remove()
+      os.rename(temp_dir, self.staging_dir)
+      temp_dir = None
+    except (IOError, OSError) as e:
+      self.logger.warning(
+          'Could not stage %s scripts. %s.', self.script_type, e)
+      return False
+    finally:
+      if temp_dir:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    self.logger.info(
+        'Staged %s scripts in %s.', self.script_type, self.staging_dir)
+    return True
+
+  def WatchMetadata(self):
+    """Restage the scripts whenever metadata changes."""
+    self.retriever.watcher.WatchMetadata(self.Stage, recursive=True)
+
+  def GetStagedScripts(self, timeout=FRESHNESS_TIMEOUT):
+    """Get the staged scripts if they are current.
+
+    Args:
+      timeout: float, the number of seconds to wait for the freshness check,
+          including the revalidation of scripts downloaded from URLs.
+
+    Returns:
+      (dict, dict, dict): a dictionary mapping metadata keys to staged script
+          files or None if the staged copy is missing or stale, a dictionary
+          mapping each script key to the keys it runs after, and the metadata
+          retrieved for the freshness check or None if not retrieved.
+    """
+    manifest = self._ReadManifest()
+    if not manifest:
+      return None, None, None
+    deadline = time.time() + timeout
+    metadata_dict = self._GetMetadata(timeout)
+    if metadata_dict is None:
+      self.logger.warning(
+          'Could not retrieve metadata within %s seconds. Using staged %s '
+          'scripts.', timeout, self.script_type)
+    elif self.retriever.GetFingerprint(metadata_dict) != manifest.get(
+        'fingerprint'):
+      self.logger.info('Staged %s scripts are stale.', self.script_type)
+      return None, None, metadata_dict
+    elif (manifest.get('urls') is None
+          or not self._Revalidate(manifest['urls'], deadline - time.time())):
+      self.logger.info(
+          'Could not confirm staged %s scripts are current.', self.script_type)
+      return None, None, metadata_dict
+    scripts = manifest.get('scripts') or {}
+    script_dict = dict(
+        (key, os.path.join(self.staging_dir, name))
+        for key, name in scripts.items())
+    return script_dict, manifest.get('dependencies'), metadata_dict
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for script_cache.py module."""
+
+import os
+import shutil
+import tempfile
+
+from google_compute_engine.metadata_scripts import script_cache
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class ScriptCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.cache_dir = os.path.join(self.temp_dir, 'cache')
+    self.mock_logger = mock.Mock()
+    self.cache = script_cache.ScriptCache(
+        self.mock_logger, cache_dir=self.cache_dir, max_size=10)
+
+  def _WriteScript(self, content):
+    with tempfile.NamedTemporaryFile(
+        mode='wb', dir=self.temp_dir, delete=False) as script:
+      script.write(content)
+    return script.name
+
+  def _ReadScript(self, path):
+    with open(path, 'rb') as script:
+      return script.read()
+
+  def testGetValidatorsMissing(self):
+    self.assertEqual(self.cache.GetValidators('http://foo'), {})
+    self.assertFalse(self.cache.Restore('http://foo', self.temp_dir + '/dest'))
+
+  def testStoreAndRestore(self):
+    path = self._WriteScript(b'foo')
+    headers = {'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+    self.cache.Store('http://foo', path, headers)
+
+    self.assertEqual(
+        self.cache.GetValidators('http://foo'), {
+            'If-None-Match': '"1"',
+            'If-Modified-Since': 'Mon, 01 Jun 2020 00:00:00 GMT',
+        })
+    dest = os.path.join(self.temp_dir, 'dest')
+    self.assertTrue(self.cache.Restore('http://foo', dest))
+    self.assertEqual(self._ReadScript(dest), b'foo')
+    self.assertEqual(
+        os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+    self.mock_logger.warning.assert_not_called()
+
+  def testStoreWithoutValidators(self):
+    self.cache.Store('http://foo', self._WriteScript(b'foo'), {})
+    self.assertFalse(os.path.exists(self.cache_dir))
+    self.assertEqual(self.cache.GetValidators('http://foo'), {})
+
+  def testStoreTooLarge(self):
+    self.cache.Store(
+        'http://foo', self._WriteScript(b'x' * 11), {'ETag': '"1"'})
+    self.assertEqual(self.cache.GetValidators('http://foo'), {})
+
+  def testStoreDeduplicates(self):
+    self.cache.Store('http://foo', self._WriteScript(b'abc'), {'ETag': '"1"'})
+    self.cache.Store('http://bar', self._WriteScript(b'abc'), {'ETag': '"2"'})
+    objects = os.listdir(os.path.join(self.cache_dir, 'objects'))
+    self.assertEqual(len(objects), 1)
+    self.assertEqual(
+        self.cache.GetValidators('http://bar'), {'If-None-Match': '"2"'})
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_cache.time.time')
+  def testEvictLeastRecentlyUsed(self, mock_time):
+    mock_time.side_effect = [1, 2, 3, 4]
+    self.cache.Store('http://a', self._WriteScript(b'aaaa'), {'ETag': 'a'})
+    self.cache.Store('http://b', self._WriteScript(b'bbbb'), {'ETag': 'b'})
+    # Using the first script makes the second one the least recently used.
+    self.assertTrue(
+        self.cache.Restore('http://a', os.path.join(self.temp_dir, 'dest')))
+    self.cache.Store('http://c', self._WriteScript(b'cccc'), {'ETag': 'c'})
+
+    self.assertEqual(self.cache.GetValidators('http://a'), {
+        'If-None-Match': 'a'})
+    self.assertEqual(self.cache.GetValidators('http://b'), {})
+    self.assertEqual(self.cache.GetValidators('http://c'), {
+        'If-None-Match': 'c'})
+    objects = os.listdir(os.path.join(self.cache_dir, 'objects'))
+    self.assertEqual(len(objects), 2)
+    self.mock_logger.debug.assert_called_once_with(mock.ANY, 'http://b')
+
+  def testStoreReplacesChangedScript(self):
+    self.cache.Store('http://foo', self._WriteScript(b'old'), {'ETag': '1'})
+    self.cache.Store('http://foo', self._WriteScript(b'new'), {'ETag': '2'})
+    dest = os.path.join(self.temp_dir, 'dest')
+    self.assertTrue(self.cache.Restore('http://foo', dest))
+    self.assertEqual(self._ReadScript(dest), b'new')
+    objects = os.listdir(os.path.join(self.cache_dir, 'objects'))
+    self.assertEqual(len(objects), 1)
+
+  def testRestoreMissingObject(self):
+    self.cache.Store('http://foo', self._WriteScript(b'foo'), {'ETag': '1'})
+    shutil.rmtree(os.path.join(self.cache_dir, 'objects'))
+    self.assertEqual(self.cache.GetValidators('http://foo'), {})
+    dest = os.path.join(self.temp_dir, 'dest')
+    self.assertFalse(self.cache.Restore('http://foo', dest))
+    self.assertEqual(self.mock_logger.warning.call_count, 1)
+
+  def testCorruptIndex(self):
+    os.makedirs(self.cache_dir)
+    with open(os.path.join(self.cache_dir, 'index.json'), 'w') as index:
+      index.write('not json')
+    self.assertEqual(self.cache.GetValidators('http://foo'), {})
+    self.cache.Store('http://foo', self._WriteScript(b'foo'), {'ETag': '1'})
+    self.assertEqual(
+        self.cache.GetValidators('http://foo'), {'If-None-Match': '1'})
+
+
+if __name__ == '__main__':
+  unittest.main()
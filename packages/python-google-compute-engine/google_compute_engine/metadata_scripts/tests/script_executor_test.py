@@ -15,7 +15,15 @@
 
 """Unittest for script_executor.py module."""
 
+import errno
+import os
+import shutil
+import signal
 import stat
+import sys
+import tempfile
+import threading
+import time
 
 from google_compute_engine.metadata_scripts import script_executor
 from google_compute_engine.test_compat import mock
@@ -41,32 +49,189 @@ class ScriptExecutorTest(unittest.TestCase):
     self.executor._MakeExecutable(self.metadata_script)
     mock_os.chmod.assert_called_once_with(self.metadata_script, chmod_mode)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_executor.NEW_SESSION', True)
+  @mock.patch('google_compute_engine.metadata_scripts.script_executor.os.wait4')
   @mock.patch('google_compute_engine.metadata_scripts.script_executor.subprocess')
-  def testRunScript(self, mock_subprocess):
-    mock_readline = mock.Mock()
-    mock_readline.side_effect = [bytes(b'a\n'), bytes(b'b\n'), bytes(b'')]
-    mock_stdout = mock.Mock()
-    mock_stdout.readline = mock_readline
+  def testRunScript(self, mock_subprocess, mock_wait4):
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'a\nb\n')
+    os.close(write_fd)
     mock_process = mock.Mock()
-    mock_process.poll.return_value = 0
-    mock_process.stdout = mock_stdout
-    mock_process.returncode = 1
+    mock_process.pid = 123
+    mock_process.stdout = os.fdopen(read_fd, 'rb')
+    self.addCleanup(mock_process.stdout.close)
     mock_subprocess.Popen.return_value = mock_process
+    mock_rusage = mock.Mock(ru_utime=1.5, ru_stime=0.5, ru_maxrss=1024)
+    mock_wait4.return_value = (123, 1 << 8, mock_rusage)
     metadata_key = '%s-script' % self.script_type
 
     self.executor._RunScript(metadata_key, self.metadata_script)
     expected_calls = [
-        mock.call('%s: %s', metadata_key, 'a'),
-        mock.call('%s: %s', metadata_key, 'b'),
+        mock.call('%s: a' % metadata_key),
+        mock.call('%s: b' % metadata_key),
         mock.call('%s: Return code %s.', metadata_key, 1),
+        mock.call(mock.ANY, metadata_key, mock.ANY, 1.5, 0.5, 1024),
     ]
     self.assertEqual(self.mock_logger.info.mock_calls, expected_calls)
     mock_subprocess.Popen.assert_called_once_with(
-        self.metadata_script, shell=True, executable='/bin/bash',
-        stderr=mock_subprocess.STDOUT, stdout=mock_subprocess.PIPE)
-    mock_process.poll.assert_called_once_with()
+        ['/bin/bash', '-c', self.metadata_script],
+        stderr=mock_subprocess.STDOUT, stdout=mock_subprocess.PIPE,
+        start_new_session=True)
+    mock_wait4.assert_called_once_with(123, 0)
+    self.assertEqual(mock_process.returncode, 1)
+    self.assertEqual(
+        self.executor.usage, [(metadata_key, 1, mock.ANY, 1.5, 0.5, 1024)])
 
-  def testRunScripts(self):
+  @mock.patch('google_compute_engine.metadata_scripts.script_executor.os.wait4')
+  def testWaitProcessInterrupted(self, mock_wait4):
+    mock_rusage = mock.Mock()
+    mock_wait4.side_effect = [
+        OSError(errno.EINTR, 'Interrupted'), (123, 0, mock_rusage)]
+    self.assertEqual(self.executor._WaitProcess(123), (0, mock_rusage))
+    self.assertEqual(mock_wait4.call_count, 2)
+
+    mock_wait4.side_effect = OSError(errno.ECHILD, 'No child')
+    with self.assertRaises(OSError):
+      self.executor._WaitProcess(123)
+
+  def testGetCommand(self):
+    with mock.patch.object(script_executor, 'NEW_SESSION', True):
+      self.assertEqual(
+          self.executor._GetCommand('script'), ['/bin/bash', '-c', 'script'])
+      self.executor.cpu_limit = 60
+      self.assertEqual(
+          self.executor._GetCommand('script'), [
+              sys.executable, '-c', script_executor.EXEC_WRAPPER, '60', '0',
+              '/bin/bash', '-c', 'script'])
+    # Without a new session the wrapper places the script in its own session.
+    self.executor.cpu_limit = None
+    with mock.patch.object(script_executor, 'NEW_SESSION', False):
+      self.assertEqual(
+          self.executor._GetCommand('script'), [
+              sys.executable, '-c', script_executor.EXEC_WRAPPER, '0', '0',
+              '/bin/bash', '-c', 'script'])
+
+  def testRunScriptWrapperTimeout(self):
+    # The wrapper places the script in its own process group on its own.
+    script = self._WriteScript('sleep 30 &\nsleep 30\n')
+    self.executor.timeout = 0.2
+    with mock.patch.object(script_executor, 'NEW_SESSION', False):
+      self.executor._RunScript('test-script', script)
+    self.mock_logger.info.assert_any_call(
+        '%s: Return code %s.', 'test-script', -signal.SIGTERM)
+
+  def _WriteScript(self, content):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    script = os.path.join(temp_dir, 'script')
+    with open(script, 'w') as script_file:
+      script_file.write(content)
+    os.chmod(script, 0o755)
+    return script
+
+  def _GetOutput(self):
+    """Get the script output lines logged one per record."""
+    return [
+        call[1][0] for call in self.mock_logger.info.mock_calls
+        if len(call[1]) == 1]
+
+  def testRunScriptProcess(self):
+    script = self._WriteScript('echo foo\necho bar >&2\nexit 3\n')
+    self.executor._RunScript('test-script', script)
+    self.assertEqual(
+        self._GetOutput(), ['test-script: foo', 'test-script: bar'])
+    self.mock_logger.info.assert_any_call(
+        '%s: Return code %s.', 'test-script', 3)
+    self.assertEqual(len(self.executor.usage), 1)
+    self.mock_logger.warning.assert_not_called()
+
+  def testRunScriptNoRateLimit(self):
+    script = self._WriteScript('seq 1 3000\n')
+    self.executor._RunScript('test-script', script)
+    self.assertEqual(
+        self._GetOutput(), ['test-script: %s' % i for i in range(1, 3001)])
+    self.mock_logger.warning.assert_not_called()
+
+  def testRunScriptTimeout(self):
+    # The background sleep holds the output pipe open, so the script only
+    # finishes if its whole process group is terminated.
+    script = self._WriteScript('sleep 30 &\nsleep 30\n')
+    self.executor.timeout = 0.2
+    start_time = time.time()
+    self.executor._RunScript('test-script', script)
+    self.assertLess(time.time() - start_time, 10)
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, 'test-script', 0.2)
+    self.mock_logger.info.assert_any_call(
+        '%s: Return code %s.', 'test-script', -signal.SIGTERM)
+
+  def testRunScriptKill(self):
+    script = self._WriteScript('trap "" TERM\nsleep 30\n')
+    self.executor.timeout = 0.2
+    with mock.patch(
+        'google_compute_engine.metadata_scripts.script_executor.KILL_TIMEOUT',
+        0.2):
+      self.executor._RunScript('test-script', script)
+    self.mock_logger.info.assert_any_call(
+        '%s: Return code %s.', 'test-script', -signal.SIGKILL)
+
+  def testRunScriptLimits(self):
+    script = self._WriteScript('ulimit -t\nulimit -v\n')
+    self.executor.cpu_limit = 60
+    self.executor.memory_limit = 1024 * 1024 * 1024
+    self.executor._RunScript('test-script', script)
+    self.assertEqual(
+        self._GetOutput(), ['test-script: 60', 'test-script: 1048576'])
+
+  def testRunScriptRateLimit(self):
+    script = self._WriteScript('seq 1 100\n')
+    self.executor.output_rate = 1
+    self.executor._RunScript('test-script', script)
+    output = self._GetOutput()
+    self.assertEqual(output, ['test-script: %s' % i for i in range(1, 11)])
+    self.mock_logger.warning.assert_called_once_with(
+        'test-script: 90 lines suppressed.')
+
+  def testRunScriptsOutputLog(self):
+    output_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, output_dir)
+    self.executor.output_dir = output_dir
+    script_dict = {'test-script': self._WriteScript('echo foo\n')}
+    self.executor.RunScripts(script_dict)
+    self.executor.RunScripts(script_dict)
+    self.assertIsNone(self.executor.run_log)
+    self.assertEqual(
+        sorted(os.listdir(output_dir)),
+        ['test-script.log', 'test-script.log.1'])
+    with open(os.path.join(output_dir, 'test-script.log')) as log_file:
+      self.assertEqual(log_file.read(), 'test-script: foo\n')
+
+  def testRunScriptsOutputLogError(self):
+    output_dir = self._WriteScript('')
+    self.executor.output_dir = output_dir
+    self.executor._RunScript = mock.Mock()
+    self.executor._MakeExecutable = mock.Mock()
+    self.executor.RunScripts({'test-script': 'script'})
+    self.executor._RunScript.assert_called_once_with('test-script', 'script')
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, os.path.join(output_dir, 'test-script.log'), mock.ANY)
+    self.assertIsNone(self.executor.run_log)
+
+  def testLogUsageSummary(self):
+    self.executor.usage = [
+        ('test-script-1', 0, 1.0, 0.5, 0.25, 100),
+        ('test-script-2', 1, 2.0, 1.5, 0.75, 200),
+    ]
+    self.executor._LogUsageSummary()
+    self.mock_logger.info.assert_called_once_with(
+        mock.ANY, self.script_type, mock.ANY,
+        'test-script-2 (code 1, 2.000s wall, 1.500s user, 0.750s sys, 200 KB), '
+        'test-script-1 (code 0, 1.000s wall, 0.500s user, 0.250s sys, 100 KB)')
+    self.assertEqual(self.executor.usage, [])
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_executor.time.time')
+  def testRunScripts(self, mock_time):
+    mock_time.return_value = self.executor.start_time + 2.5
     self.executor._MakeExecutable = mock.Mock()
     self.executor._RunScript = mock.Mock()
     mocks = mock.Mock()
@@ -81,6 +246,7 @@ class ScriptExecutorTest(unittest.TestCase):
 
     self.executor.RunScripts(script_dict)
     expected_calls = [
+        mock.call.logger.info(mock.ANY, self.script_type, 2.5),
         mock.call.make_executable('c'),
         mock.call.run_script('%s-script-url' % self.script_type, 'c'),
         mock.call.make_executable('a'),
@@ -105,6 +271,188 @@ class ScriptExecutorTest(unittest.TestCase):
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
+  def testGetScriptKeys(self):
+    metadata_keys = [
+        'test-script-10', 'test-script', 'test-script-2-url', 'test-script-2',
+        'test-script-url', 'test-script-1', 'test-script-1-after',
+        'test-script-2-group', 'other-script', 'test-script-key',
+    ]
+    expected_keys = [
+        'test-script-url', 'test-script', 'test-script-1',
+        'test-script-2-url', 'test-script-2', 'test-script-10',
+    ]
+    self.assertEqual(
+        script_executor.GetScriptKeys(self.script_type, metadata_keys),
+        expected_keys)
+
+  def testGetDependenciesDefault(self):
+    attribute_data = {
+        'test-script': 'a',
+        'test-script-url': 'b',
+        'test-script-1': 'c',
+        'test-script-2': '',
+    }
+    expected_dependencies = {
+        'test-script-url': [],
+        'test-script': ['test-script-url'],
+        'test-script-1': ['test-script'],
+    }
+    self.assertEqual(
+        script_executor.GetDependencies(self.script_type, attribute_data),
+        expected_dependencies)
+    self.assertEqual(
+        script_executor.GetDependencies(self.script_type, None), {})
+
+  def testGetDependenciesGroup(self):
+    attribute_data = {
+        'test-script': 'a',
+        'test-script-1': 'b',
+        'test-script-1-group': 'install',
+        'test-script-2-url': 'c',
+        'test-script-2-group': 'install',
+        'test-script-3': 'd',
+        'test-script-4': 'e',
+        'test-script-4-group': 'install',
+    }
+    expected_dependencies = {
+        'test-script': [],
+        'test-script-1': ['test-script'],
+        'test-script-2-url': ['test-script'],
+        'test-script-3': ['test-script-1', 'test-script-2-url'],
+        # The group only runs scripts concurrently when they are consecutive.
+        'test-script-4': ['test-script-3'],
+    }
+    self.assertEqual(
+        script_executor.GetDependencies(self.script_type, attribute_data),
+        expected_dependencies)
+
+  def testGetDependenciesAfter(self):
+    attribute_data = {
+        'test-script-1': 'a',
+        'test-script-2-url': 'b',
+        'test-script-2': 'c',
+        'test-script-2-after': '',
+        'test-script-3': 'd',
+        'test-script-3-after': '1, 2 7 foo',
+        'test-script-4': 'e',
+    }
+    expected_dependencies = {
+        'test-script-1': [],
+        # A URL runs before the inline script with the same number.
+        'test-script-2-url': [],
+        'test-script-2': ['test-script-2-url'],
+        'test-script-3': [
+            'test-script-1', 'test-script-2-url', 'test-script-2'],
+        'test-script-4': ['test-script-3'],
+    }
+    self.assertEqual(
+        script_executor.GetDependencies(self.script_type, attribute_data),
+        expected_dependencies)
+
+  def _RunScriptGraph(self, script_dict, dependencies, max_workers=4):
+    """Run scripts with a mock _RunScript that records concurrent scripts.
+
+    Args:
+      script_dict: a dictionary mapping metadata keys to script files.
+      dependencies: dict, a dictionary mapping each script key to the keys it
+          runs after.
+      max_workers: int, the maximum number of scripts running concurrently.
+
+    Returns:
+      (list, int): the order scripts started and the maximum number of
+          scripts running concurrently.
+    """
+    self.executor.max_workers = max_workers
+    self.executor._MakeExecutable = mock.Mock()
+    lock = threading.Lock()
+    started = []
+    running = []
+    concurrency = [0]
+
+    def _RunScript(metadata_key, metadata_script):
+      with lock:
+        started.append(metadata_key)
+        running.append(metadata_key)
+        concurrency[0] = max(concurrency[0], len(running))
+      time.sleep(0.05)
+      with lock:
+        running.remove(metadata_key)
+
+    self.executor._RunScript = mock.Mock(side_effect=_RunScript)
+    self.executor.RunScripts(script_dict, dependencies=dependencies)
+    return started, concurrency[0]
+
+  def testRunScriptsParallel(self):
+    script_dict = {
+        'test-script-1': 'a',
+        'test-script-2': 'b',
+        'test-script-3': 'c',
+        'test-script-4': 'd',
+    }
+    dependencies = {
+        'test-script-1': [],
+        'test-script-2': ['test-script-1'],
+        'test-script-3': ['test-script-1'],
+        'test-script-4': ['test-script-2', 'test-script-3'],
+    }
+    started, concurrency = self._RunScriptGraph(script_dict, dependencies)
+    self.assertEqual(started[0], 'test-script-1')
+    self.assertEqual(
+        sorted(started[1:3]), ['test-script-2', 'test-script-3'])
+    self.assertEqual(started[3], 'test-script-4')
+    self.assertEqual(concurrency, 2)
+
+  def testRunScriptsMaxWorkers(self):
+    script_dict = dict(
+        ('test-script-%s' % number, 'script') for number in range(1, 6))
+    dependencies = dict((key, []) for key in script_dict)
+    started, concurrency = self._RunScriptGraph(
+        script_dict, dependencies, max_workers=2)
+    self.assertEqual(sorted(started), sorted(script_dict))
+    self.assertEqual(concurrency, 2)
+
+  def testRunScriptsSkipsMissing(self):
+    script_dict = {
+        'test-script-1': None,
+        'test-script-2': 'b',
+    }
+    dependencies = {
+        'test-script-1': [],
+        'test-script-2': ['test-script-1', 'test-script-9'],
+    }
+    started, _ = self._RunScriptGraph(script_dict, dependencies)
+    self.assertEqual(started, ['test-script-2'])
+
+  def testRunScriptsCycle(self):
+    script_dict = {
+        'test-script-1': 'a',
+        'test-script-2': 'b',
+        'test-script-3': 'c',
+    }
+    dependencies = {
+        'test-script-1': ['test-script-2'],
+        'test-script-2': ['test-script-1'],
+        'test-script-3': ['test-script-2'],
+    }
+    started, _ = self._RunScriptGraph(script_dict, dependencies)
+    self.assertEqual(
+        started, ['test-script-1', 'test-script-2', 'test-script-3'])
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, 'test-script-1')
+
+  def testRunScriptsException(self):
+    error = OSError('Error.')
+    self.executor._MakeExecutable = mock.Mock(side_effect=error)
+    self.executor._RunScript = mock.Mock()
+    self.executor.RunScripts({'test-script': 'a', 'test-script-1': 'b'})
+    # The script after the failed one still runs.
+    self.assertEqual(
+        self.mock_logger.warning.mock_calls, [
+            mock.call(mock.ANY, 'test-script', error),
+            mock.call(mock.ANY, 'test-script-1', error),
+        ])
+    self.executor._RunScript.assert_not_called()
+
 
 if __name__ == '__main__':
   unittest.main()
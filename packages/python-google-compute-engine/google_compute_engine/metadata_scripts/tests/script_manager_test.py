@@ -15,6 +15,10 @@
 
 """Unittest for script_manager.py module."""
 
+import os
+import shutil
+import tempfile
+
 from google_compute_engine.metadata_scripts import script_manager
 from google_compute_engine.test_compat import mock
 from google_compute_engine.test_compat import unittest
@@ -34,6 +38,10 @@ class ScriptManagerTest(unittest.TestCase):
     mock_logger.Logger.return_value = mock_logger_instance
     mock_retriever_instance = mock.Mock()
     mock_retriever.ScriptRetriever.return_value = mock_retriever_instance
+    metadata_dict = {'instance': {}}
+    mock_retriever_instance.watcher.GetMetadata.return_value = metadata_dict
+    test_dependencies = {'test': []}
+    mock_retriever_instance.GetDependencies.return_value = test_dependencies
     mocks = mock.Mock()
     mocks.attach_mock(mock_mkdir, 'mkdir')
     mocks.attach_mock(mock_rmtree, 'rmtree')
@@ -53,18 +61,240 @@ class ScriptManagerTest(unittest.TestCase):
     expected_calls = [
         mock.call.logger.Logger(
             name=script_name, debug=False, facility=mock.ANY),
-        mock.call.retriever.ScriptRetriever(mock_logger_instance, script_type),
+        mock.call.retriever.ScriptRetriever(
+            mock_logger_instance, script_type, cache=None),
         mock.call.executor.ScriptExecutor(
-            mock_logger_instance, script_type, default_shell=None),
+            mock_logger_instance, script_type, default_shell=None,
+            output_dir=None),
         mock.call.mkdir(prefix=script_prefix, dir=run_dir),
         mock.call.logger.Logger().info(mock.ANY, script_type),
-        mock.call.retriever.ScriptRetriever().GetScripts(test_dir),
-        mock.call.executor.ScriptExecutor().RunScripts(test_dict),
+        mock.call.retriever.ScriptRetriever().watcher.GetMetadata(),
+        mock.call.retriever.ScriptRetriever().GetScripts(
+            test_dir, metadata_dict=metadata_dict),
+        mock.call.retriever.ScriptRetriever().GetDependencies(metadata_dict),
+        mock.call.executor.ScriptExecutor().RunScripts(
+            test_dict, dependencies=test_dependencies),
         mock.call.logger.Logger().info(mock.ANY, script_type),
         mock.call.rmtree(test_dir),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_stager')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.shutil.rmtree')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.tempfile.mkdtemp')
+  def testRunScriptsStageShutdown(
+      self, mock_mkdir, mock_rmtree, mock_executor, mock_logger,
+      mock_retriever, mock_stager):
+    mock_logger_instance = mock.Mock()
+    mock_logger.Logger.return_value = mock_logger_instance
+    mock_startup_retriever = mock.Mock()
+    mock_shutdown_retriever = mock.Mock()
+    mock_retriever.ScriptRetriever.side_effect = [
+        mock_startup_retriever, mock_shutdown_retriever]
+    mock_stager_instance = mock_stager.ScriptStager.return_value
+    mock_stager_instance.script_type = 'shutdown'
+    mock_mkdir.return_value = 'test-dir'
+    mock_startup_retriever.watcher.GetMetadata.return_value = {}
+
+    script_manager.ScriptManager('startup', stage=True)
+    expected_calls = [
+        mock.call(mock_logger_instance, 'startup', cache=None),
+        mock.call(mock_logger_instance, 'shutdown', cache=None),
+    ]
+    self.assertEqual(mock_retriever.ScriptRetriever.mock_calls, expected_calls)
+    mock_stager.ScriptStager.assert_called_once_with(
+        mock_logger_instance, mock_shutdown_retriever)
+    mock_stager_instance.Stage.assert_called_once_with()
+    mock_stager_instance.GetStagedScripts.assert_not_called()
+    mock_startup_retriever.GetScripts.assert_called_once_with(
+        mock_mkdir.return_value, metadata_dict={})
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_stager')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.shutil.rmtree')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.tempfile.mkdtemp')
+  def testRunScriptsStaged(
+      self, mock_mkdir, mock_rmtree, mock_executor, mock_logger,
+      mock_retriever, mock_stager):
+    mock_retriever_instance = mock_retriever.ScriptRetriever.return_value
+    mock_executor_instance = mock_executor.ScriptExecutor.return_value
+    mock_stager_instance = mock_stager.ScriptStager.return_value
+    mock_stager_instance.script_type = 'shutdown'
+    staged_dict = {'shutdown-script': '/staged/script'}
+    staged_dependencies = {'shutdown-script': []}
+    mock_stager_instance.GetStagedScripts.return_value = (
+        staged_dict, staged_dependencies, None)
+    mock_mkdir.return_value = 'test-dir'
+
+    script_manager.ScriptManager('shutdown', stage=True)
+    mock_stager.ScriptStager.assert_called_once_with(
+        mock_logger.Logger.return_value, mock_retriever_instance)
+    mock_stager_instance.Stage.assert_not_called()
+    mock_retriever_instance.GetScripts.assert_not_called()
+    mock_executor_instance.RunScripts.assert_called_once_with(
+        staged_dict, dependencies=staged_dependencies)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_stager')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.shutil.rmtree')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.tempfile.mkdtemp')
+  def testRunScriptsStagedStale(
+      self, mock_mkdir, mock_rmtree, mock_executor, mock_logger,
+      mock_retriever, mock_stager):
+    mock_retriever_instance = mock_retriever.ScriptRetriever.return_value
+    mock_executor_instance = mock_executor.ScriptExecutor.return_value
+    mock_stager_instance = mock_stager.ScriptStager.return_value
+    mock_stager_instance.script_type = 'shutdown'
+    metadata_dict = {'instance': {}}
+    mock_stager_instance.GetStagedScripts.return_value = (
+        None, None, metadata_dict)
+    test_dict = {'shutdown-script': '/tmp/script'}
+    mock_retriever_instance.GetScripts.return_value = test_dict
+    test_dir = 'test-dir'
+    mock_mkdir.return_value = test_dir
+
+    script_manager.ScriptManager('shutdown', stage=True)
+    # The metadata from the freshness check is reused.
+    mock_retriever_instance.watcher.GetMetadata.assert_not_called()
+    mock_retriever_instance.GetScripts.assert_called_once_with(
+        test_dir, metadata_dict=metadata_dict)
+    mock_retriever_instance.GetDependencies.assert_called_once_with(
+        metadata_dict)
+    mock_executor_instance.RunScripts.assert_called_once_with(
+        test_dict,
+        dependencies=mock_retriever_instance.GetDependencies.return_value)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_stager')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.tempfile.mkdtemp')
+  def testWatch(
+      self, mock_mkdir, mock_executor, mock_logger, mock_retriever,
+      mock_stager):
+    script_manager.ScriptManager('shutdown', watch=True)
+    mock_stager.ScriptStager.assert_called_once_with(
+        mock_logger.Logger.return_value,
+        mock_retriever.ScriptRetriever.return_value)
+    mock_stager.ScriptStager().WatchMetadata.assert_called_once_with()
+    mock_mkdir.assert_not_called()
+    mock_executor.ScriptExecutor().RunScripts.assert_not_called()
+
+  def _WriteMounts(self, content):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    mounts_file = os.path.join(temp_dir, 'mounts')
+    with open(mounts_file, 'w') as mounts:
+      mounts.write(content)
+    return mounts_file
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.os.access')
+  def testGetMemoryRunDir(self, mock_access):
+    mock_access.side_effect = lambda path, mode: path != '/run'
+    mounts_file = self._WriteMounts(
+        '/dev/sda1 / ext4 rw 0 0\n'
+        'tmpfs /run tmpfs rw,nosuid 0 0\n'
+        'tmpfs /dev/shm tmpfs rw 0 0\n')
+    self.assertEqual(
+        script_manager._GetMemoryRunDir(mounts_file=mounts_file), '/dev/shm')
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.os.access')
+  def testGetMemoryRunDirNoExec(self, mock_access):
+    mock_access.return_value = True
+    mounts_file = self._WriteMounts(
+        'tmpfs /run tmpfs rw,nosuid,noexec,relatime 0 0\n'
+        'tmpfs /dev/shm tmpfs rw,nosuid,nodev 0 0\n')
+    self.assertEqual(
+        script_manager._GetMemoryRunDir(mounts_file=mounts_file), '/dev/shm')
+    mounts_file = self._WriteMounts(
+        'tmpfs /run tmpfs rw,noexec 0 0\n'
+        'tmpfs /dev/shm tmpfs rw 0 0\n'
+        'tmpfs /dev/shm tmpfs rw,noexec 0 0\n')
+    self.assertIsNone(script_manager._GetMemoryRunDir(mounts_file=mounts_file))
+
+  def testGetMemoryRunDirNotMounted(self):
+    mounts_file = self._WriteMounts('/dev/sda1 / ext4 rw 0 0\n')
+    self.assertIsNone(script_manager._GetMemoryRunDir(mounts_file=mounts_file))
+    self.assertIsNone(
+        script_manager._GetMemoryRunDir(mounts_file=mounts_file + '.missing'))
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager._GetMemoryRunDir')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.ScriptManager._RunScripts')
+  def testRunInMemory(
+      self, mock_run_scripts, mock_executor, mock_logger, mock_retriever,
+      mock_memory_run_dir):
+    mock_memory_run_dir.return_value = '/run'
+    script_manager.ScriptManager('startup', run_in_memory=True)
+    mock_run_scripts.assert_called_once_with(run_dir='/run')
+
+    mock_run_scripts.reset_mock()
+    script_manager.ScriptManager(
+        'startup', run_dir='/var/run', run_in_memory=True)
+    mock_run_scripts.assert_called_once_with(run_dir='/var/run')
+    mock_memory_run_dir.assert_called_once_with()
+
+  def testGetLimits(self):
+    mock_config = mock.Mock()
+    options = {
+        'script_timeout': '600',
+        'script_cpu_limit': 'invalid',
+        'script_memory_limit': '',
+        'script_output_rate_limit': '50',
+    }
+    mock_config.GetOptionString.side_effect = (
+        lambda section, option: options[option])
+    self.assertEqual(
+        script_manager._GetLimits(mock_config),
+        {'timeout': 600, 'output_rate': 50})
+
+  def testGetDownloads(self):
+    mock_config = mock.Mock()
+    options = {'download_part_size': '1048576', 'download_max_parts': ''}
+    mock_config.GetOptionString.side_effect = (
+        lambda section, option: options[option])
+    self.assertEqual(
+        script_manager._GetDownloads(mock_config), {'part_size': 1048576})
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_stager')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.ScriptManager._RunScripts')
+  def testDownloads(
+      self, mock_run_scripts, mock_stager, mock_logger, mock_retriever):
+    downloads = {'part_size': 1048576, 'max_parts': 8}
+    script_manager.ScriptManager('startup', stage=True, downloads=downloads)
+    mock_retriever.ScriptRetriever.assert_has_calls([
+        mock.call(
+            mock_logger.Logger.return_value, 'startup', cache=None,
+            part_size=1048576, max_parts=8),
+        mock.call(
+            mock_logger.Logger.return_value, 'shutdown', cache=None,
+            part_size=1048576, max_parts=8),
+    ])
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_retriever')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.logger')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.script_executor')
+  @mock.patch('google_compute_engine.metadata_scripts.script_manager.ScriptManager._RunScripts')
+  def testLimits(
+      self, mock_run_scripts, mock_executor, mock_logger, mock_retriever):
+    limits = {'timeout': 600, 'memory_limit': 1024}
+    script_manager.ScriptManager(
+        'startup', limits=limits, output_dir='/var/log/scripts')
+    mock_executor.ScriptExecutor.assert_called_once_with(
+        mock_logger.Logger.return_value, 'startup', default_shell=None,
+        output_dir='/var/log/scripts', timeout=600, memory_limit=1024)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -15,11 +15,24 @@
 
 """Unittest for script_retriever.py module."""
 
+import base64
+import email.message
+import hashlib
+import io
+import os
+import re
+import shutil
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 
+from google_compute_engine import token_provider
 from google_compute_engine.compat import urlerror
+from google_compute_engine.metadata_scripts import script_cache
 from google_compute_engine.metadata_scripts import script_retriever
-from google_compute_engine.test_compat import builtin
+from google_compute_engine.test_compat import httpserver
 from google_compute_engine.test_compat import mock
 from google_compute_engine.test_compat import unittest
 
@@ -28,168 +41,554 @@ class ScriptRetrieverTest(unittest.TestCase):
 
   def setUp(self):
     self.script_type = 'test'
-    self.dest_dir = '/tmp'
-    self.dest = '/tmp/file'
+    self.dest_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.dest_dir)
     self.mock_logger = mock.Mock()
     self.mock_watcher = mock.Mock()
     self.retriever = script_retriever.ScriptRetriever(
         self.mock_logger, self.script_type)
+    self.retriever.token_provider = token_provider.TokenProvider(
+        logger=self.mock_logger)
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
-  def testDownloadAuthUrl(self, mock_urlopen, mock_request, mock_tempfile):
-    auth_url = 'https://storage.googleapis.com/fake/url'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    self.retriever.token = 'bar'
+  def _CreateResponse(self, content, length=True, md5=None, chunks=None):
+    """Create a mock HTTP response that returns content in chunks.
 
-    mock_open = mock.mock_open()
-    with mock.patch('%s.open' % builtin, mock_open):
-      self.assertEqual(
-          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
-
-    mock_tempfile.assert_called_once_with(dir=self.dest_dir, delete=False)
-    mock_tempfile.close.assert_called_once_with()
+    Args:
+      content: bytes, the body of the response.
+      length: bool, True if the response includes a Content-Length header.
+      md5: string, the base64 encoded MD5 sent in the x-goog-hash header.
+      chunks: list, the chunks returned by read or None to split the content
+          by the requested size.
 
-    self.mock_logger.info.assert_called_once_with(
-        mock.ANY, auth_url, self.dest)
-    mock_request.assert_called_with(auth_url)
-    mocked_request = mock_request()
-    mocked_request.add_unredirected_header.assert_called_with(
-        'Authorization', 'bar')
-    mock_urlopen.assert_called_with(mocked_request)
-    urlopen_read = mock_urlopen().read(return_value=b'foo')
-    self.mock_logger.warning.assert_not_called()
+    Returns:
+      mock.Mock, the response object.
+    """
+    headers = email.message.Message()
+    if length:
+      headers['Content-Length'] = str(len(content))
+    headers['x-goog-hash'] = 'crc32c=n03x6A=='
+    if md5:
+      headers['x-goog-hash'] = 'md5=%s' % md5
+    body = io.BytesIO(content)
+    response = mock.Mock()
+    response.info.return_value = headers
+    if chunks is None:
+      response.read.side_effect = body.read
+    else:
+      response.read.side_effect = chunks + [b'']
+    return response
 
-    mock_open.assert_called_once_with(self.dest, 'wb')
-    handle = mock_open()
-    handle.write.assert_called_once_with(urlopen_read)
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadAuthUrl(self, mock_urlopen):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    content = b'#!/bin/bash\necho foo\n'
+    md5 = base64.b64encode(hashlib.md5(content).digest()).decode('ascii')
+    mock_urlopen.return_value = self._CreateResponse(content, md5=md5)
+    self.retriever.token_provider.tokens['default'] = token_provider.Token(
+        'default', 'foo', 'bar', time.time() + 3600)
+
+    dest = self.retriever._DownloadAuthUrl(auth_url, self.dest_dir)
+    self.assertEqual(os.path.dirname(dest), self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content)
+
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(request.get_full_url(), auth_url)
+    self.assertEqual(request.unredirected_hdrs, {
+        'Authorization': 'foo bar', 'Metadata-flavor': 'Google'})
+    expected_calls = [
+        mock.call.info(mock.ANY, auth_url, dest),
+        mock.call.info(mock.ANY, len(content), auth_url),
+    ]
+    self.assertEqual(self.mock_logger.mock_calls, expected_calls)
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
   @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
   def testDownloadAuthUrlExceptionAndToken(
-      self, mock_get_metadata, mock_request, mock_tempfile):
+      self, mock_get_metadata, mock_request):
     auth_url = 'https://storage.googleapis.com/fake/url'
     metadata_prefix = 'http://metadata.google.internal/computeMetadata/v1/'
     token_url = metadata_prefix + 'instance/service-accounts/default/token'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    self.retriever.token = None
 
     mock_get_metadata.return_value = {
-        'token_type': 'foo', 'access_token': 'bar'}
-    mock_request.return_value = mock_request
+        'token_type': 'foo', 'access_token': 'bar', 'expires_in': 3600}
     mock_request.side_effect = urlerror.URLError('Error.')
 
     self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
 
-    mock_get_metadata.return_value = mock_get_metadata
     # GetMetadata includes a prefix, so remove it.
     stripped_url = token_url.replace(metadata_prefix, '')
     mock_get_metadata.assert_called_once_with(
         stripped_url, recursive=False, retry_limit=3)
 
-    self.assertEqual(self.retriever.token, 'foo bar')
+    self.assertEqual(
+        self.retriever.token_provider.tokens['default'].authorization,
+        'foo bar')
 
     self.mock_logger.info.assert_called_once_with(
-        mock.ANY, auth_url, self.dest)
+        mock.ANY, auth_url, mock.ANY)
     self.assertEqual(self.mock_logger.warning.call_count, 1)
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.ScriptRetriever._DownloadUrl')
   @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
-  def testDownloadAuthUrlFallback(
-      self, mock_get_metadata, mock_download_url, mock_tempfile):
+  def testDownloadAuthUrlFallback(self, mock_get_metadata, mock_download_url):
     auth_url = 'https://storage.googleapis.com/fake/url'
     metadata_prefix = 'http://metadata.google.internal/computeMetadata/v1/'
     token_url = metadata_prefix + 'instance/service-accounts/default/token'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    self.retriever.token = None
 
     mock_get_metadata.return_value = None
     mock_download_url.return_value = None
 
     self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
 
-    mock_get_metadata.return_value = mock_get_metadata
     # GetMetadata includes a prefix, so remove it.
-    prefix = 'http://metadata.google.internal/computeMetadata/v1/'
-    stripped_url = token_url.replace(prefix, '')
+    stripped_url = token_url.replace(metadata_prefix, '')
     mock_get_metadata.assert_called_once_with(
         stripped_url, recursive=False, retry_limit=3)
     mock_download_url.assert_called_once_with(auth_url, self.dest_dir)
 
-    self.assertIsNone(self.retriever.token)
+    self.assertEqual(self.retriever.token_provider.tokens, {})
+    self.mock_logger.info.assert_called_once_with(mock.ANY)
 
-    expected_calls = [
-        mock.call(mock.ANY, auth_url, self.dest),
-        mock.call(mock.ANY),
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
+  def testDownloadAuthUrlUnauthorized(self, mock_get_metadata, mock_urlopen):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    content = b'echo foo\n'
+    mock_get_metadata.side_effect = [
+        {'token_type': 'Bearer', 'access_token': 'old', 'expires_in': 3600},
+        {'token_type': 'Bearer', 'access_token': 'new', 'expires_in': 3600},
+    ]
+    mock_urlopen.side_effect = [
+        urlerror.HTTPError(auth_url, 401, 'Unauthorized', {}, None),
+        self._CreateResponse(content),
     ]
-    self.assertEqual(self.mock_logger.info.mock_calls, expected_calls)
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrl(self, mock_retrieve, mock_tempfile):
+    dest = self.retriever._DownloadAuthUrl(auth_url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content)
+    self.assertEqual(os.listdir(self.dest_dir), [os.path.basename(dest)])
+    authorizations = [
+        call[1][0].unredirected_hdrs['Authorization']
+        for call in mock_urlopen.mock_calls]
+    self.assertEqual(authorizations, ['Bearer old', 'Bearer new'])
+    self.assertEqual(mock_get_metadata.call_count, 2)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
+  def testDownloadAuthUrlUnauthorizedAgain(
+      self, mock_get_metadata, mock_urlopen):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_get_metadata.return_value = {
+        'token_type': 'Bearer', 'access_token': 'foo', 'expires_in': 3600}
+    mock_urlopen.side_effect = urlerror.HTTPError(
+        auth_url, 401, 'Unauthorized', {}, None)
+
+    self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
+    self.assertEqual(mock_urlopen.call_count, 2)
+    self.assertEqual(self.mock_logger.warning.call_count, 1)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrl(self, mock_urlopen):
     url = 'http://www.google.com/fake/url'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
+    content = b'x' * 100
+    mock_response = self._CreateResponse(content)
+    mock_urlopen.return_value = mock_response
+    self.retriever.buffer_size = 32
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content)
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(request.get_full_url(), url)
+    self.assertEqual(request.unredirected_hdrs, {})
     self.assertEqual(
-        self.retriever._DownloadUrl(url, self.dest_dir), self.dest)
-    mock_tempfile.assert_called_once_with(dir=self.dest_dir, delete=False)
-    mock_tempfile.close.assert_called_once_with()
-    self.mock_logger.info.assert_called_once_with(mock.ANY, url, self.dest)
-    mock_retrieve.assert_called_once_with(url, self.dest)
-    self.mock_logger.warning.assert_not_called()
+        mock_response.read.mock_calls, [mock.call(32)] * 5)
+    mock_response.close.assert_called_once_with()
+    expected_calls = [
+        mock.call.info(mock.ANY, url, dest),
+        mock.call.info(mock.ANY, len(content), url),
+    ]
+    self.assertEqual(self.mock_logger.mock_calls, expected_calls)
 
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlProcessError(self, mock_retrieve, mock_tempfile, mock_time):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlProgress(self, mock_urlopen, mock_time):
+    url = 'http://www.google.com/fake/url'
+    mock_urlopen.return_value = self._CreateResponse(
+        b'abcdef', length=False, chunks=[b'ab', b'cd', b'ef'])
+    mock_time.time.side_effect = [0, 5, 10, 15]
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    self.assertIsNotNone(dest)
+    expected_calls = [
+        mock.call.info(mock.ANY, url, dest),
+        mock.call.info(mock.ANY, 4, 'unknown', url),
+        mock.call.info(mock.ANY, 6, url),
+    ]
+    self.assertEqual(self.mock_logger.mock_calls, expected_calls)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time.sleep')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlIncomplete(self, mock_urlopen, mock_sleep):
+    url = 'http://www.google.com/fake/url'
+    truncated = self._CreateResponse(b'abcdef', chunks=[b'abc'])
+    mock_urlopen.side_effect = [
+        truncated,
+        self._CreateResponse(b'abcdef'),
+    ]
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), b'abcdef')
+    self.assertEqual(mock_urlopen.call_count, 2)
+    truncated.close.assert_called_once_with()
+    mock_sleep.assert_called_once_with(5)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlChecksumMismatch(self, mock_urlopen):
+    url = 'https://storage.googleapis.com/fake/url'
+    md5 = base64.b64encode(hashlib.md5(b'foo').digest()).decode('ascii')
+    mock_urlopen.return_value = self._CreateResponse(b'bar', md5=md5)
+
+    self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
+    self.assertEqual(mock_urlopen.call_count, 1)
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, url, 'MD5 hash mismatch for %s.' % url)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time.sleep')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlProcessError(self, mock_urlopen, mock_sleep):
     url = 'http://www.google.com/fake/url'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    mock_success = mock.Mock()
-    mock_success.getcode.return_value = script_retriever.httpclient.OK
     # Success after 3 timeout. Since max_retry = 3, the final result is fail.
-    mock_retrieve.side_effect = [
+    mock_urlopen.side_effect = [
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
-        mock_success,
+        self._CreateResponse(b'foo'),
     ]
     self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlWithRetry(self, mock_retrieve, mock_tempfile, mock_time):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time.sleep')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlWithRetry(self, mock_urlopen, mock_sleep):
     url = 'http://www.google.com/fake/url'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    mock_success = mock.Mock()
-    mock_success.getcode.return_value = script_retriever.httpclient.OK
     # Success after 2 timeout. Since max_retry = 3, the final result is success.
-    mock_retrieve.side_effect = [
+    mock_urlopen.side_effect = [
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
-        mock_success,
+        self._CreateResponse(b'foo'),
     ]
     self.assertIsNotNone(self.retriever._DownloadUrl(url, self.dest_dir))
 
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.CURL_FALLBACK', True)
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlException(self, mock_retrieve, mock_tempfile):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlCurlFallback(self, mock_urlopen, mock_retrieve):
+    url = 'https://www.google.com/fake/url'
+
+    def _Retrieve(url, dest):
+      with open(dest, 'wb') as dest_file:
+        dest_file.write(b'foo')
+
+    mock_retrieve.side_effect = _Retrieve
+    self.retriever.cache = mock.Mock()
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), b'foo')
+    mock_retrieve.assert_called_once_with(url, dest)
+    mock_urlopen.assert_not_called()
+    self.retriever.cache.Store.assert_not_called()
+
+    # Requests with an authentication token are still sent natively.
+    mock_urlopen.return_value = self._CreateResponse(b'bar')
+    self.retriever.cache = None
+    dest = self.retriever._DownloadUrl(
+        url, self.dest_dir, headers={'Authorization': 'token'})
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), b'bar')
+    self.assertEqual(mock_retrieve.call_count, 1)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlException(self, mock_urlopen):
     url = 'http://www.google.com/fake/url'
-    mock_tempfile.return_value = mock_tempfile
-    mock_tempfile.name = self.dest
-    mock_retrieve.side_effect = Exception('Error.')
+    mock_urlopen.side_effect = Exception('Error.')
     self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
 
+  def _StartServer(self, content, etag, ranges=True):
+    """Start a local HTTP server that supports conditional and range requests.
+
+    Args:
+      content: list, the body of the response in the first element.
+      etag: list, the ETag of the content in the first element.
+      ranges: bool, False if range requests are advertised but ignored.
+
+    Returns:
+      (string, list): the URL of the script and the handled request headers.
+    """
+    requests = []
+
+    class Handler(httpserver.BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        requests.append(dict(self.headers.items()))
+        if self.headers.get('If-None-Match') == etag[0]:
+          self.send_response(304)
+          self.end_headers()
+          return
+        if self.headers.get('If-Match', etag[0]) != etag[0]:
+          self.send_response(412)
+          self.end_headers()
+          return
+        body = content[0]
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match and ranges:
+          start = int(match.group(1))
+          end = min(int(match.group(2)), len(content[0]) - 1)
+          if start > end:
+            self.send_response(416)
+            self.end_headers()
+            return
+          body = content[0][start:end + 1]
+          self.send_response(206)
+          self.send_header(
+              'Content-Range',
+              'bytes %s-%s/%s' % (start, end, len(content[0])))
+        else:
+          self.send_response(200)
+        # Google Storage sends the hash of the whole object with every part.
+        md5 = hashlib.md5(content[0]).digest()
+        self.send_header(
+            'x-goog-hash', 'md5=%s' % base64.b64encode(md5).decode('ascii'))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag[0])
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    server = httpserver.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    url = 'http://127.0.0.1:%s/script' % server.server_address[1]
+    return url, requests
+
+  def testDownloadUrlCache(self):
+    content = [b'#!/bin/bash\necho foo\n']
+    etag = ['"1"']
+    url, requests = self._StartServer(content, etag)
+    cache_dir = os.path.join(self.dest_dir, 'cache')
+    self.retriever.cache = script_cache.ScriptCache(
+        self.mock_logger, cache_dir=cache_dir)
+
+    def _Download():
+      with open(self.retriever._DownloadUrl(url, self.dest_dir), 'rb') as f:
+        return f.read()
+
+    # The first download populates the cache.
+    self.assertEqual(_Download(), content[0])
+    self.assertNotIn('If-None-Match', requests[-1])
+
+    # An unchanged script is revalidated and served from the cache.
+    self.assertEqual(_Download(), content[0])
+    self.assertEqual(requests[-1].get('If-None-Match'), '"1"')
+    self.mock_logger.info.assert_any_call(mock.ANY, url)
+
+    # A changed script is downloaded and replaces the cached copy.
+    content[0] = b'#!/bin/bash\necho bar\n'
+    etag[0] = '"2"'
+    self.assertEqual(_Download(), content[0])
+    self.assertEqual(requests[-1].get('If-None-Match'), '"1"')
+    self.assertEqual(_Download(), content[0])
+    self.assertEqual(requests[-1].get('If-None-Match'), '"2"')
+    self.assertEqual(len(requests), 4)
+
+    # A missing cached copy is downloaded again without validators.
+    shutil.rmtree(os.path.join(cache_dir, 'objects'))
+    self.assertEqual(_Download(), content[0])
+    self.assertNotIn('If-None-Match', requests[-1])
+    self.mock_logger.warning.assert_not_called()
+
+  def testDownloadUrlParts(self):
+    content = [bytes(bytearray(range(256))) * 100]
+    url, requests = self._StartServer(content, ['"1"'])
+    self.retriever.part_size = 4096
+    self.retriever.max_parts = 3
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content[0])
+    ranges = sorted(
+        request['Range'] for request in requests if 'Range' in request)
+    expected_ranges = sorted(
+        'bytes=%s-%s' % (start, min(start + 4096, 25600) - 1)
+        for start in range(0, 25600, 4096))
+    self.assertEqual(ranges, expected_ranges)
+    # The first request is reused as the first part.
+    self.assertEqual(len(requests), 7)
+    self.assertEqual(requests[0]['Range'], 'bytes=0-4095')
+    self.assertNotIn('If-Match', requests[0])
+    self.assertTrue(
+        all(request.get('If-Match') == '"1"' for request in requests[1:]))
+    self.mock_logger.info.assert_any_call(mock.ANY, 25600, url, 7)
+    self.mock_logger.warning.assert_not_called()
+
+  def testDownloadUrlPartsSmall(self):
+    content = [b'x' * 4096]
+    url, requests = self._StartServer(content, ['"1"'])
+    self.retriever.part_size = 4096
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content[0])
+    self.assertEqual(len(requests), 1)
+
+  def testDownloadUrlPartsIgnored(self):
+    content = [b'x' * 10000]
+    url, requests = self._StartServer(content, ['"1"'], ranges=False)
+    self.retriever.part_size = 4096
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content[0])
+    self.assertEqual(len(requests), 1)
+    self.mock_logger.warning.assert_not_called()
+
+  def testDownloadUrlPartsEmpty(self):
+    url, requests = self._StartServer([b''], ['"1"'])
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    self.assertEqual(os.path.getsize(dest), 0)
+    self.assertEqual(len(requests), 2)
+    self.assertNotIn('Range', requests[1])
+    self.mock_logger.warning.assert_not_called()
+
+  def testDownloadUrlPartsDisabled(self):
+    content = [b'x' * 10000]
+    url, requests = self._StartServer(content, ['"1"'])
+    self.retriever.max_parts = 1
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), content[0])
+    self.assertEqual(len(requests), 1)
+    self.assertNotIn('Range', requests[0])
+
+  def testGetContentRange(self):
+    headers = {'Content-Range': 'bytes 0-4095/10000'}
+    self.assertEqual(
+        script_retriever._GetContentRange('url', headers), (4095, 10000))
+    for content_range in ('bytes 10-4095/10000', 'bytes 0-4095/*', None):
+      with self.assertRaises(ValueError):
+        script_retriever._GetContentRange(
+            'url', {'Content-Range': content_range})
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time.sleep')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadPartRetry(self, mock_urlopen, mock_sleep):
+    url = 'http://www.google.com/fake/url'
+    dest = os.path.join(self.dest_dir, 'dest')
+    with open(dest, 'wb') as dest_file:
+      dest_file.write(b'xxxxxxxxxx')
+    mock_response = self._CreateResponse(b'abcd')
+    mock_response.getcode.return_value = 206
+    mock_urlopen.side_effect = [socket.error('Error.'), mock_response]
+    request = script_retriever._CreateRequest(
+        url, {'Authorization': 'foo'}, {'If-None-Match': '"1"'})
+
+    self.retriever._DownloadPart(request, dest, 3, 6, etag='"2"')
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), b'xxxabcdxxx')
+    self.assertEqual(mock_urlopen.call_count, 2)
+    mock_sleep.assert_called_once_with(5)
+    part_request = mock_urlopen.call_args[0][0]
+    self.assertEqual(
+        part_request.headers, {'Range': 'bytes=3-6', 'If-match': '"2"'})
+    self.assertEqual(part_request.unredirected_hdrs, {'Authorization': 'foo'})
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlCacheMissing(self, mock_urlopen):
+    url = 'http://www.google.com/fake/url'
+    mock_cache = mock.Mock()
+    mock_cache.GetValidators.return_value = {'If-None-Match': '"1"'}
+    mock_cache.Restore.return_value = False
+    self.retriever.cache = mock_cache
+    mock_urlopen.side_effect = [
+        urlerror.HTTPError(url, 304, 'Not Modified', {}, None),
+        self._CreateResponse(b'foo'),
+    ]
+
+    dest = self.retriever._DownloadUrl(url, self.dest_dir)
+    with open(dest, 'rb') as dest_file:
+      self.assertEqual(dest_file.read(), b'foo')
+    requests = [call[0][0] for call in mock_urlopen.call_args_list]
+    self.assertEqual(
+        requests[0].headers,
+        {'If-none-match': '"1"', 'Range': 'bytes=0-8388607'})
+    self.assertEqual(requests[1].headers, {'Range': 'bytes=0-8388607'})
+    mock_cache.Restore.assert_called_once_with(url, dest)
+    mock_cache.Store.assert_called_once_with(url, dest, mock.ANY)
+
+  def testIsUnmodified(self):
+    content = [b'#!/bin/bash\necho foo\n']
+    etag = ['"1"']
+    url, requests = self._StartServer(content, etag)
+    validators = {'If-None-Match': '"1"'}
+
+    self.assertTrue(self.retriever.IsUnmodified(url, validators, timeout=5))
+    self.assertEqual(requests[-1].get('If-None-Match'), '"1"')
+    # A changed script is not modified in place.
+    etag[0] = '"2"'
+    self.assertFalse(self.retriever.IsUnmodified(url, validators, timeout=5))
+    # A script without validators cannot be revalidated.
+    self.assertFalse(self.retriever.IsUnmodified(url, {}, timeout=5))
+    self.assertEqual(len(requests), 2)
+    self.mock_logger.info.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testIsUnmodifiedAuthUrl(self, mock_urlopen):
+    mock_token = mock.Mock(authorization='foo')
+    self.retriever.token_provider = mock.Mock()
+    self.retriever.token_provider.GetToken.return_value = mock_token
+    mock_urlopen.side_effect = [
+        urlerror.HTTPError('url', 304, 'Not Modified', {}, None),
+        socket.timeout('Test Error'),
+    ]
+    validators = {'If-None-Match': '"1"'}
+
+    self.assertTrue(self.retriever.IsUnmodified(
+        'gs://bucket/obj', validators, timeout=2))
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(
+        request.get_full_url(), 'https://storage.googleapis.com/bucket/obj')
+    self.assertEqual(request.unredirected_hdrs['Authorization'], 'foo')
+    self.assertEqual(request.headers, {'If-none-match': '"1"'})
+    mock_urlopen.assert_called_once_with(request, timeout=2)
+    self.assertFalse(self.retriever.IsUnmodified(
+        'gs://bucket/obj', validators, timeout=2))
+    self.mock_logger.info.assert_called_once_with(
+        mock.ANY, 'https://storage.googleapis.com/bucket/obj', 'Test Error')
+
+  def testGetValidators(self):
+    self.assertEqual(self.retriever.GetValidators('gs://bucket/obj'), {})
+    mock_cache = mock.Mock()
+    self.retriever.cache = mock_cache
+    self.assertEqual(
+        self.retriever.GetValidators('gs://bucket/obj'),
+        mock_cache.GetValidators.return_value)
+    mock_cache.GetValidators.assert_called_once_with(
+        'https://storage.googleapis.com/bucket/obj')
+
   def _CreateUrls(self, bucket, obj, gs_match=True):
     """Creates a URL for each of the supported Google Storage URL formats.
 
@@ -354,6 +753,135 @@ class ScriptRetrieverTest(unittest.TestCase):
     mock_dest.write.assert_called_once_with('a')
     mock_download.assert_called_once_with('b', self.dest_dir)
 
+  def testGetScriptsConcurrent(self):
+    written = threading.Event()
+    overlapped = []
+    named_temporary_file = tempfile.NamedTemporaryFile
+
+    def _DownloadScript(url, dest_dir):
+      # The inline script is written while the download is in progress.
+      overlapped.append(written.wait(5))
+      return os.path.join(dest_dir, 'downloaded')
+
+    def _NamedTemporaryFile(**kwargs):
+      written.set()
+      return named_temporary_file(**kwargs)
+
+    self.retriever._DownloadScript = mock.Mock(side_effect=_DownloadScript)
+    metadata = {
+        'instance': {
+            'attributes': {
+                'test-script': 'foo',
+                'test-script-url': 'https://foo.com/script',
+            },
+        },
+    }
+    with mock.patch(
+        'google_compute_engine.metadata_scripts.script_retriever.tempfile.'
+        'NamedTemporaryFile', side_effect=_NamedTemporaryFile):
+      script_dict = self.retriever.GetScripts(
+          self.dest_dir, metadata_dict=metadata)
+
+    self.assertEqual(overlapped, [True])
+    self.assertEqual(
+        script_dict['test-script-url'],
+        os.path.join(self.dest_dir, 'downloaded'))
+    with open(script_dict['test-script']) as script:
+      self.assertEqual(script.read(), 'foo')
+
+  def testGetScriptsMetadataDict(self):
+    metadata = {
+        'instance': {'attributes': {'test-script': 'foo'}},
+    }
+    self.retriever.watcher = self.mock_watcher
+    script_dict = self.retriever.GetScripts(
+        self.dest_dir, metadata_dict=metadata)
+    self.assertEqual(list(script_dict), ['test-script'])
+    self.mock_watcher.GetMetadata.assert_not_called()
+
+  def testGetScriptsNumbered(self):
+    self.retriever._DownloadScript = mock.Mock(return_value='/tmp/downloaded')
+    metadata = {
+        'instance': {
+            'attributes': {
+                'test-script-1': 'foo',
+                'test-script-1-group': 'bar',
+                'test-script-2-url': 'gs://bucket/object',
+            },
+        },
+        'project': {'attributes': {'test-script': 'baz'}},
+    }
+    script_dict = self.retriever.GetScripts(
+        self.dest_dir, metadata_dict=metadata)
+    self.assertEqual(
+        sorted(script_dict), ['test-script-1', 'test-script-2-url'])
+    self.assertEqual(script_dict['test-script-2-url'], '/tmp/downloaded')
+    self.retriever._DownloadScript.assert_called_once_with(
+        'gs://bucket/object', self.dest_dir)
+
+  def testGetDependencies(self):
+    metadata = {
+        'instance': {'attributes': {'test-script-1-group': 'foo'}},
+        'project': {
+            'attributes': {
+                'test-script-1': 'a',
+                'test-script-1-group': 'foo',
+                'test-script-2': 'b',
+                'test-script-2-group': 'foo',
+            },
+        },
+    }
+    expected_dependencies = {'test-script-1': [], 'test-script-2': []}
+    self.assertEqual(
+        self.retriever.GetDependencies(metadata), expected_dependencies)
+    self.assertEqual(self.retriever.GetDependencies(None), {})
+
+  def testGetUrls(self):
+    metadata = {
+        'instance': {
+            'attributes': {
+                'test-script': 'foo',
+                'test-script-url': 'gs://a/b',
+                'test-script-1-url': 'gs://a/c',
+                'test-script-2-url': '',
+                'other-url': 'gs://a/d',
+            },
+        },
+        'project': {'attributes': {'test-script-3-url': 'gs://a/e'}},
+    }
+    self.assertEqual(
+        self.retriever.GetUrls(metadata),
+        {'test-script-url': 'gs://a/b', 'test-script-1-url': 'gs://a/c'})
+    self.assertEqual(self.retriever.GetUrls(None), {})
+
+  def testGetFingerprint(self):
+    metadata = {
+        'instance': {'attributes': {'test-script': 'foo', 'other': 'a'}},
+        'project': {'attributes': {'test-script-url': 'gs://a/b'}},
+    }
+    fingerprint = self.retriever.GetFingerprint(metadata)
+    self.assertEqual(len(fingerprint), 64)
+
+    # Numbered scripts and their annotations change the fingerprint.
+    for key in ('test-script-1', 'test-script-1-after', 'test-script-1-group'):
+      metadata['instance']['attributes'][key] = 'foo'
+      changed = self.retriever.GetFingerprint(metadata)
+      self.assertNotEqual(changed, fingerprint)
+      del metadata['instance']['attributes'][key]
+
+    # Attributes unrelated to the script type do not change the fingerprint.
+    metadata['instance']['attributes']['other'] = 'b'
+    metadata['instance']['attributes']['startup-script'] = 'bar'
+    self.assertEqual(self.retriever.GetFingerprint(metadata), fingerprint)
+
+    # A script moving from project to instance metadata is a change.
+    metadata['instance']['attributes']['test-script-url'] = 'gs://a/b'
+    del metadata['project']['attributes']['test-script-url']
+    self.assertNotEqual(self.retriever.GetFingerprint(metadata), fingerprint)
+    self.assertNotEqual(
+        self.retriever.GetFingerprint(None),
+        self.retriever.GetFingerprint(metadata))
+
   def testGetScriptsNone(self):
     metadata = {
         'instance': {
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for script_stager.py module."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from google_compute_engine.metadata_scripts import script_retriever
+from google_compute_engine.metadata_scripts import script_stager
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class ScriptStagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.staging_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.staging_dir)
+    self.mock_logger = mock.Mock()
+    self.retriever = script_retriever.ScriptRetriever(
+        self.mock_logger, 'shutdown')
+    self.retriever.watcher = mock.Mock()
+    self.stager = script_stager.ScriptStager(
+        self.mock_logger, self.retriever,
+        staging_dir=os.path.join(self.staging_dir, 'staged'))
+    self.metadata = {
+        'instance': {'attributes': {'shutdown-script': 'echo foo'}},
+    }
+    self.retriever.watcher.GetMetadata.return_value = self.metadata
+
+  def _ReadScript(self, path):
+    with open(path) as script:
+      return script.read()
+
+  def testStage(self):
+    self.assertTrue(self.stager.Stage(self.metadata))
+    script_dict, _, _ = self.stager.GetStagedScripts(timeout=1)
+    self.assertEqual(list(script_dict), ['shutdown-script'])
+    self.assertEqual(
+        os.path.dirname(script_dict['shutdown-script']),
+        self.stager.staging_dir)
+    self.assertEqual(
+        self._ReadScript(script_dict['shutdown-script']), 'echo foo')
+    self.assertEqual(os.listdir(self.stager.base_dir), ['shutdown'])
+    self.mock_logger.info.assert_any_call(
+        mock.ANY, 'shutdown', self.stager.staging_dir)
+
+  def testStageRetrievesMetadata(self):
+    self.assertTrue(self.stager.Stage())
+    self.retriever.watcher.GetMetadata.assert_called_once_with()
+    manifest = self.stager._ReadManifest()
+    self.assertEqual(
+        manifest['fingerprint'], self.retriever.GetFingerprint(self.metadata))
+
+  def testStageUnchanged(self):
+    self.assertTrue(self.stager.Stage(self.metadata))
+    with mock.patch.object(self.retriever, 'GetScripts') as mock_get_scripts:
+      self.assertTrue(self.stager.Stage(self.metadata))
+      mock_get_scripts.assert_not_called()
+
+  def testStageChanged(self):
+    self.assertTrue(self.stager.Stage(self.metadata))
+    self.metadata['instance']['attributes']['shutdown-script'] = 'echo bar'
+    self.assertTrue(self.stager.Stage(self.metadata))
+    script_dict, _, _ = self.stager.GetStagedScripts(timeout=1)
+    self.assertEqual(
+        self._ReadScript(script_dict['shutdown-script']), 'echo bar')
+    self.assertEqual(os.listdir(self.stager.base_dir), ['shutdown'])
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.ScriptRetriever._DownloadScript')
+  def testStageDownloadFailure(self, mock_download):
+    self.assertTrue(self.stager.Stage(self.metadata))
+    mock_download.return_value = None
+    self.metadata['instance']['attributes']['shutdown-script-url'] = 'gs://a/b'
+    self.assertFalse(self.stager.Stage(self.metadata))
+    self.assertEqual(
+        self.stager.GetStagedScripts(timeout=1), (None, None, None))
+    self.assertEqual(os.listdir(self.stager.base_dir), [])
+    self.mock_logger.warning.assert_any_call(mock.ANY, 'shutdown')
+
+  def testStageError(self):
+    with open(self.stager.base_dir, 'w'):
+      pass
+    self.assertFalse(self.stager.Stage(self.metadata))
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, 'shutdown', mock.ANY)
+
+  def testWatchMetadata(self):
+    self.stager.WatchMetadata()
+    self.retriever.watcher.WatchMetadata.assert_called_once_with(
+        self.stager.Stage, recursive=True)
+
+  def testGetStagedScriptsMissing(self):
+    self.assertEqual(self.stager.GetStagedScripts(), (None, None, None))
+    self.retriever.watcher.GetMetadata.assert_not_called()
+
+  def testGetStagedScriptsCurrent(self):
+    self.stager.Stage(self.metadata)
+    script_dict, dependencies, metadata_dict = self.stager.GetStagedScripts(
+        timeout=1)
+    self.assertEqual(list(script_dict), ['shutdown-script'])
+    self.assertEqual(dependencies, {'shutdown-script': []})
+    self.assertEqual(metadata_dict, self.metadata)
+    self.retriever.watcher.GetMetadata.assert_called_once_with(
+        timeout=1, retry_limit=0)
+
+  def testGetStagedScriptsStale(self):
+    self.stager.Stage(self.metadata)
+    metadata = {'instance': {'attributes': {'shutdown-script': 'echo bar'}}}
+    self.retriever.watcher.GetMetadata.return_value = metadata
+    self.assertEqual(
+        self.stager.GetStagedScripts(timeout=1), (None, None, metadata))
+
+  def testGetStagedScriptsTimeout(self):
+    self.stager.Stage(self.metadata)
+    event = threading.Event()
+    self.addCleanup(event.set)
+    self.retriever.watcher.GetMetadata.side_effect = (
+        lambda **kwargs: event.wait())
+    script_dict, _, metadata_dict = self.stager.GetStagedScripts(timeout=0.1)
+    self.assertEqual(list(script_dict), ['shutdown-script'])
+    self.assertIsNone(metadata_dict)
+    self.mock_logger.warning.assert_any_call(mock.ANY, 0.1, 'shutdown')
+
+  def _StageUrl(self, url='gs://a/b'):
+    """Stage a script downloaded from a URL with cached validators.
+
+    Args:
+      url: string, the URL of the script in metadata.
+    """
+    self.metadata['instance']['attributes']['shutdown-script-url'] = url
+
+    def _Download(url, dest_dir):
+      with tempfile.NamedTemporaryFile(
+          mode='w', dir=dest_dir, delete=False) as dest:
+        dest.write('echo url')
+        return dest.name
+
+    with mock.patch.object(self.retriever, '_DownloadScript') as mock_download:
+      mock_download.side_effect = _Download
+      with mock.patch.object(self.retriever, 'GetValidators') as mock_get:
+        mock_get.return_value = {'If-None-Match': '"1"'}
+        self.assertTrue(self.stager.Stage(self.metadata))
+
+  def testStageUrl(self):
+    self._StageUrl()
+    manifest = self.stager._ReadManifest()
+    self.assertEqual(
+        manifest['urls'], {
+            'shutdown-script-url': {
+                'url': 'gs://a/b',
+                'validators': {'If-None-Match': '"1"'},
+            },
+        })
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.ScriptRetriever.IsUnmodified')
+  def testGetStagedScriptsUrlCurrent(self, mock_unmodified):
+    self._StageUrl()
+    mock_unmodified.return_value = True
+    script_dict, _, _ = self.stager.GetStagedScripts(timeout=1)
+    self.assertEqual(
+        sorted(script_dict), ['shutdown-script', 'shutdown-script-url'])
+    self.assertEqual(
+        self._ReadScript(script_dict['shutdown-script-url']), 'echo url')
+    mock_unmodified.assert_called_once_with(
+        'gs://a/b', {'If-None-Match': '"1"'}, timeout=mock.ANY)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.ScriptRetriever.IsUnmodified')
+  def testGetStagedScriptsUrlModified(self, mock_unmodified):
+    self._StageUrl()
+    # The object changed at the same URL without a metadata change.
+    mock_unmodified.return_value = False
+    self.assertEqual(
+        self.stager.GetStagedScripts(timeout=1), (None, None, self.metadata))
+    self.mock_logger.info.assert_any_call(mock.ANY, 'shutdown')
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.ScriptRetriever.IsUnmodified')
+  def testGetStagedScriptsUrlTimeout(self, mock_unmodified):
+    self._StageUrl()
+    event = threading.Event()
+    self.addCleanup(event.set)
+    mock_unmodified.side_effect = lambda *args, **kwargs: event.wait()
+    self.assertEqual(
+        self.stager.GetStagedScripts(timeout=0.1),
+        (None, None, self.metadata))
+
+  def testGetStagedScriptsNoUrls(self):
+    # A manifest staged without URL validators cannot be revalidated.
+    self.stager.Stage(self.metadata)
+    manifest = self.stager._ReadManifest()
+    del manifest['urls']
+    with open(self.stager.manifest_file, 'w') as manifest_file:
+      json.dump(manifest, manifest_file)
+    self.assertEqual(
+        self.stager.GetStagedScripts(timeout=1), (None, None, self.metadata))
+
+
+if __name__ == '__main__':
+  unittest.main()
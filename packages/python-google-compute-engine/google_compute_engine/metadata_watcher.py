@@ -22,6 +22,7 @@ import os
 import socket
 import time
 
+from google_compute_engine import tracing
 from google_compute_engine.compat import httpclient
 from google_compute_engine.compat import urlerror
 from google_compute_engine.compat import urlparse
@@ -171,9 +172,11 @@ class MetadataWatcher(object):
     exception = None
     while retry_limit is None or retry_limit >= 0:
       try:
-        return self._GetMetadataUpdate(
+        response = self._GetMetadataUpdate(
             metadata_key=metadata_key, recursive=recursive, wait=wait,
             timeout=timeout)
+        tracing.Mark('first_metadata_response')
+        return response
       except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
         if retry_limit is not None:
           retry_limit -= 1
@@ -218,3 +221,51 @@ class MetadataWatcher(object):
     return self._HandleMetadataUpdate(
         metadata_key=metadata_key, recursive=recursive, wait=False,
         timeout=timeout, retry_limit=retry_limit)
+
+
+class MetadataContext(object):
+  """A snapshot of the metadata server shared by the steps of one process.
+
+  The metadata tree is fetched once and the steps read from the snapshot
+  instead of requesting keys themselves. The steps also share the watcher
+  and logger of the process.
+  """
+
+  def __init__(self, watcher, logger=None):
+    """Constructor.
+
+    Args:
+      watcher: MetadataWatcher object, used to fetch the metadata.
+      logger: logger object, used to write to SysLog and serial port.
+    """
+    self.watcher = watcher
+    self.logger = logger or watcher.logger
+    self.metadata_dict = None
+
+  def Fetch(self):
+    """Retrieve the contents of the metadata server into the snapshot.
+
+    Returns:
+      json, the deserialized contents of the metadata server or None if error.
+    """
+    self.metadata_dict = self.watcher.GetMetadata()
+    return self.metadata_dict
+
+  def Get(self, metadata_key, default=None):
+    """Look up a value in the snapshot.
+
+    Args:
+      metadata_key: string, the slash separated path of keys in the
+          deserialized metadata, such as project/numericProjectId.
+      default: the value returned if the key is not in the snapshot.
+
+    Returns:
+      the value of the key in the snapshot or the default.
+    """
+    value = self.metadata_dict
+    for key in metadata_key.split('/'):
+      try:
+        value = value[key]
+      except (KeyError, TypeError):
+        return default
+    return value
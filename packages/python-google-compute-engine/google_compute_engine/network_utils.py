@@ -18,6 +18,7 @@
 import logging
 import os
 import re
+import time
 try:
   import netifaces
 except ImportError:
@@ -25,19 +26,23 @@ except ImportError:
 
 
 MAC_REGEX = re.compile(r'\A([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})\Z')
+SYSFS_NET = '/sys/class/net'
 
 
 class NetworkUtils(object):
   """System network Ethernet interface utilities."""
 
-  def __init__(self, logger=logging):
+  def __init__(self, logger=logging, rescan_interval=5):
     """Constructor.
 
     Args:
       logger: logger object, used to write to SysLog and serial port.
+      rescan_interval: int, minimum seconds between rescans of the interfaces.
     """
     self.logger = logger
+    self.rescan_interval = rescan_interval
     self.interfaces = self._CreateInterfaceMap()
+    self.rescan_time = time.time()
 
   def _CreateInterfaceMap(self):
     """Generate a dictionary mapping MAC address to Ethernet interfaces.
@@ -57,10 +62,10 @@ class NetworkUtils(object):
       dict, string MAC addresses mapped to the string network interface name.
     """
     interfaces = {}
-    for interface in os.listdir('/sys/class/net'):
+    for interface in os.listdir(SYSFS_NET):
       try:
         mac_address = open(
-            '/sys/class/net/%s/address' % interface).read().strip()
+            '%s/%s/address' % (SYSFS_NET, interface)).read().strip()
       except (IOError, OSError) as e:
         message = 'Unable to determine MAC address for %s. %s.'
         self.logger.warning(message, interface, str(e))
@@ -89,6 +94,37 @@ class NetworkUtils(object):
         self.logger.warning(message, interface)
     return interfaces
 
+  def _InterfaceExists(self, interface):
+    """Check whether a network interface is still present on the system.
+
+    Args:
+      interface: string, the network interface name.
+
+    Returns:
+      bool, False if sysfs is available and the interface is not listed.
+    """
+    if not os.path.isdir(SYSFS_NET):
+      return True
+    return os.path.exists(os.path.join(SYSFS_NET, interface))
+
+  def _RescanInterfaceMap(self):
+    """Rebuild the interface map unless it was rebuilt too recently.
+
+    Network interfaces may be hot-added or renamed by udev after the map is
+    first created. Rescans are rate limited so repeated lookups of an unknown
+    MAC address do not rescan every interface on every call.
+
+    Returns:
+      bool, True if the interface map was rebuilt.
+    """
+    now = time.time()
+    if 0 <= now - self.rescan_time < self.rescan_interval:
+      return False
+    self.rescan_time = now
+    self.interfaces = self._CreateInterfaceMap()
+    self.logger.info('Rescanned network interfaces: %s.', self.interfaces)
+    return True
+
   def GetNetworkInterface(self, mac_address):
     """Get the name of the network interface associated with a MAC address.
 
@@ -98,4 +134,9 @@ class NetworkUtils(object):
     Returns:
       string, the network interface associated with a MAC address or None.
     """
-    return self.interfaces.get(mac_address)
+    interface = self.interfaces.get(mac_address)
+    if interface and self._InterfaceExists(interface):
+      return interface
+    if self._RescanInterfaceMap():
+      return self.interfaces.get(mac_address)
+    return interface
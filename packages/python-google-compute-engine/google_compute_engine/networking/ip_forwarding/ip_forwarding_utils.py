@@ -15,11 +15,11 @@
 
 """Utilities for configuring IP address forwarding."""
 
-from google_compute_engine.compat import distro_utils
+from google_compute_engine import compat
 
 
 class IpForwardingUtils(object):
   """Deprecated. Overridden for backwards compatibility."""
 
   def __new__(self, logger, proto_id=None):
-    return distro_utils.Utils().IpForwardingUtils(logger, proto_id)
+    return compat.GetDistroUtils().Utils().IpForwardingUtils(logger, proto_id)
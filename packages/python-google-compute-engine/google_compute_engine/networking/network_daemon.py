@@ -23,6 +23,7 @@ import logging.handlers
 import optparse
 import random
 import socket
+import time
 
 from google_compute_engine import config_manager
 from google_compute_engine import constants
@@ -30,6 +31,8 @@ from google_compute_engine import file_utils
 from google_compute_engine import logger
 from google_compute_engine import metadata_watcher
 from google_compute_engine import network_utils
+from google_compute_engine import tracing
+from google_compute_engine import worker_pool
 from google_compute_engine.networking.ip_forwarding import ip_forwarding
 from google_compute_engine.networking.network_setup import network_setup
 
@@ -40,10 +43,13 @@ class NetworkDaemon(object):
   """Manage networking based on changes to network metadata."""
 
   network_interface_metadata_key = 'instance/network-interfaces'
+  # Maximum number of network interfaces configured concurrently.
+  max_workers = 4
 
   def __init__(
       self, ip_forwarding_enabled, proto_id, ip_aliases, target_instance_ips,
-      dhclient_script, dhcp_command, network_setup_enabled, debug=False):
+      dhclient_script, dhcp_command, network_setup_enabled, debug=False,
+      context=None):
     """Constructor.
 
     Args:
@@ -55,10 +61,16 @@ class NetworkDaemon(object):
       dhcp_command: string, a command to enable Ethernet interfaces.
       network_setup_enabled: bool, True if network setup is enabled.
       debug: bool, True if debug output should write to the console.
+      context: MetadataContext object, the watcher and logger of the guest
+          agent hosting the daemon. The agent watches metadata and calls the
+          handler, so the daemon does not start watching.
     """
-    facility = logging.handlers.SysLogHandler.LOG_DAEMON
-    self.logger = logger.Logger(
-        name='google-networking', debug=debug, facility=facility)
+    if context:
+      self.logger = context.logger
+    else:
+      facility = logging.handlers.SysLogHandler.LOG_DAEMON
+      self.logger = logger.Logger(
+          name='google-networking', debug=debug, facility=facility)
     self.ip_aliases = ip_aliases
     self.ip_forwarding_enabled = ip_forwarding_enabled
     self.network_setup_enabled = network_setup_enabled
@@ -69,6 +81,9 @@ class NetworkDaemon(object):
     self.network_setup = network_setup.NetworkSetup(
         dhclient_script=dhclient_script, dhcp_command=dhcp_command, debug=debug)
     self.network_utils = network_utils.NetworkUtils(logger=self.logger)
+    if context:
+      self.watcher = context.watcher
+      return
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
 
     try:
@@ -85,24 +100,49 @@ class NetworkDaemon(object):
   def HandleNetworkInterfaces(self, result):
     """Called when network interface metadata changes.
 
+    The default network interface is configured first. Secondary network
+    interfaces are then enabled and their forwarded IPs are configured
+    concurrently, so a slow interface does not delay unrelated interfaces.
+
     Args:
       result: dict, the metadata response with the network interfaces.
     """
-    network_interfaces = self._ExtractInterfaceMetadata(result)
+    with tracing.Span('network_setup'):
+      network_interfaces = self._ExtractInterfaceMetadata(result)
+      if not network_interfaces:
+        return
 
-    if self.network_setup_enabled:
       default_interface = network_interfaces[0]
-      if default_interface.ipv6:
-        self.network_setup.EnableIpv6([default_interface.name])
+      self._HandleNetworkInterface(default_interface, default=True)
+
+      if self.network_setup_enabled:
+        self.network_setup.EnableNetworkInterfaces(
+            [interface.name for interface in network_interfaces[1:]])
+
+      worker_pool.ParallelMap(
+          self._HandleNetworkInterface, network_interfaces[1:],
+          max_workers=self.max_workers, logger=self.logger)
+
+  def _HandleNetworkInterface(self, interface, default=False):
+    """Configure a single network interface.
+
+    Args:
+      interface: NetworkInterface, the network interface to configure.
+      default: bool, True if the interface is the default network interface.
+    """
+    start_time = time.time()
+    if self.network_setup_enabled and default:
+      if interface.ipv6:
+        self.network_setup.EnableIpv6([interface.name])
       else:
-        self.network_setup.DisableIpv6([default_interface.name])
-      self.network_setup.EnableNetworkInterfaces(
-          [interface.name for interface in network_interfaces[1:]])
+        self.network_setup.DisableIpv6([interface.name])
 
     if self.ip_forwarding_enabled:
-      for interface in network_interfaces:
-        self.ip_forwarding.HandleForwardedIps(
-            interface.name, interface.forwarded_ips, interface.ip)
+      self.ip_forwarding.HandleForwardedIps(
+          interface.name, interface.forwarded_ips, interface.ip)
+    self.logger.debug(
+        'Configured network interface %s in %.3f seconds.', interface.name,
+        time.time() - start_time)
 
   def _ExtractInterfaceMetadata(self, metadata):
     """Extracts network interface metadata.
@@ -143,22 +183,21 @@ class NetworkDaemon(object):
       self.ipv6 = ipv6
 
 
-def main():
-  parser = optparse.OptionParser()
-  parser.add_option(
-      '-d', '--debug', action='store_true', dest='debug',
-      help='print debug output to the console.')
-  (options, _) = parser.parse_args()
-  debug = bool(options.debug)
-  instance_config = config_manager.ConfigManager()
+def GetOptions(instance_config):
+  """Get the network daemon options from the instance configuration.
+
+  Args:
+    instance_config: ConfigManager object, the instance configuration.
+
+  Returns:
+    dict, the keyword arguments for the network daemon.
+  """
   ip_forwarding_daemon_enabled = instance_config.GetOptionBool(
       'Daemons', 'ip_forwarding_daemon')
   ip_forwarding_enabled = instance_config.GetOptionBool(
       'NetworkInterfaces', 'ip_forwarding') or ip_forwarding_daemon_enabled
   network_setup_enabled = instance_config.GetOptionBool(
       'NetworkInterfaces', 'setup')
-  network_daemon_enabled = instance_config.GetOptionBool(
-      'Daemons', 'network_daemon')
   proto_id = instance_config.GetOptionString(
       'IpForwarding', 'ethernet_proto_id')
   ip_aliases = instance_config.GetOptionBool(
@@ -169,17 +208,29 @@ def main():
       'NetworkInterfaces', 'dhclient_script')
   dhcp_command = instance_config.GetOptionString(
       'NetworkInterfaces', 'dhcp_command')
+  return {
+      'ip_forwarding_enabled': ip_forwarding_enabled,
+      'proto_id': proto_id,
+      'ip_aliases': ip_aliases,
+      'target_instance_ips': target_instance_ips,
+      'dhclient_script': dhclient_script,
+      'dhcp_command': dhcp_command,
+      'network_setup_enabled': network_setup_enabled,
+  }
+
 
-  if network_daemon_enabled:
-    NetworkDaemon(
-        ip_forwarding_enabled=ip_forwarding_enabled,
-        proto_id=proto_id,
-        ip_aliases=ip_aliases,
-        target_instance_ips=target_instance_ips,
-        dhclient_script=dhclient_script,
-        dhcp_command=dhcp_command,
-        network_setup_enabled=network_setup_enabled,
-        debug=debug)
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option(
+      '-d', '--debug', action='store_true', dest='debug',
+      help='print debug output to the console.')
+  (options, _) = parser.parse_args()
+  instance_config = config_manager.ConfigManager()
+  tracing.Configure(
+      'network_daemon',
+      trace_file=instance_config.GetOptionString('Tracing', 'trace_file'))
+  if instance_config.GetOptionBool('Daemons', 'network_daemon'):
+    NetworkDaemon(debug=bool(options.debug), **GetOptions(instance_config))
 
 
 if __name__ == '__main__':
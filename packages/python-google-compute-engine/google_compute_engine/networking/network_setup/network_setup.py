@@ -17,9 +17,12 @@
 
 import logging.handlers
 import subprocess
+import threading
+import time
 
+from google_compute_engine import compat
 from google_compute_engine import logger
-from google_compute_engine.compat import distro_utils
+from google_compute_engine.distro_lib import helpers
 
 
 class NetworkSetup(object):
@@ -41,9 +44,114 @@ class NetworkSetup(object):
     facility = logging.handlers.SysLogHandler.LOG_DAEMON
     self.logger = logger.Logger(
         name='network-setup', debug=debug, facility=facility)
-    self.distro_utils = distro_utils.Utils(debug=debug)
+    self.distro_utils = compat.GetDistroUtils().Utils(debug=debug)
     self.ipv6_initialized = False
     self.ipv6_interfaces = set()
+    self.dhcp_lock = threading.Lock()
+    self.dhcp_pending = {}
+    self.dhcp_running = set()
+    self.dhcp_threads = {}
+
+  def _StartDhcpStep(self, step, func, interfaces, **kwargs):
+    """Run DHCP work for network interfaces in a supervised thread.
+
+    Steps with the same name run one at a time. A step requested while the
+    previous one is still running replaces any step already waiting, so only
+    the most recent request runs next. The caller does not block.
+
+    Args:
+      step: string, the name identifying the kind of DHCP work.
+      func: callable, the function running the DHCP work. It returns False
+          when the work failed.
+      interfaces: list of string, the output device names to configure.
+      **kwargs: dict, additional keyword arguments passed to func.
+    """
+    with self.dhcp_lock:
+      if step in self.dhcp_running:
+        self.dhcp_pending[step] = (func, interfaces, kwargs)
+        return
+      self.dhcp_running.add(step)
+      thread = threading.Thread(
+          target=self._RunDhcpStep, args=(step, func, interfaces, kwargs))
+      thread.daemon = True
+      self.dhcp_threads[step] = thread
+    thread.start()
+
+  def _RunDhcpStep(self, step, func, interfaces, kwargs):
+    """Run a DHCP step and any step of the same name queued behind it.
+
+    Args:
+      step: string, the name identifying the kind of DHCP work.
+      func: callable, the function running the DHCP work.
+      interfaces: list of string, the output device names to configure.
+      kwargs: dict, additional keyword arguments passed to func.
+    """
+    while True:
+      start_time = time.time()
+      try:
+        success = func(interfaces, self.logger, **kwargs) is not False
+      except Exception as e:
+        success = False
+        self.logger.warning(
+            'Exception running DHCP %s on %s. %s.', step, interfaces, e)
+      self._HandleDhcpComplete(
+          step, interfaces, success, time.time() - start_time)
+      with self.dhcp_lock:
+        if step not in self.dhcp_pending:
+          self.dhcp_running.discard(step)
+          return
+        func, interfaces, kwargs = self.dhcp_pending.pop(step)
+
+  def _HandleDhcpComplete(self, step, interfaces, success, duration):
+    """Called when a DHCP step completes.
+
+    A failed step clears the interface state so the work is retried the next
+    time the interfaces are requested.
+
+    Args:
+      step: string, the name identifying the kind of DHCP work.
+      interfaces: list of string, the output device names configured.
+      success: bool, True if the DHCP work completed without failing.
+      duration: float, the number of seconds the DHCP work took.
+    """
+    self.logger.debug(
+        'DHCP %s on %s completed in %.3f seconds.', step, interfaces, duration)
+    if success:
+      return
+    with self.dhcp_lock:
+      if step == 'interfaces':
+        self.interfaces = set()
+      elif step == 'ipv6':
+        self.ipv6_initialized = False
+        self.ipv6_interfaces = self.ipv6_interfaces.difference(interfaces)
+
+  def _RunDhcpCommand(self, interfaces, logger):
+    """Run the user supplied command to enable network interfaces.
+
+    Args:
+      interfaces: list of string, the output device names to enable.
+      logger: logger object, used to write to SysLog and serial port.
+
+    Returns:
+      bool, True if the command enabled the interfaces.
+    """
+    try:
+      helpers.CheckCall([self.dhcp_command], timeout=helpers.DHCLIENT_TIMEOUT)
+    except subprocess.CalledProcessError:
+      logger.warning('Could not enable Ethernet interfaces.')
+      return False
+    return True
+
+  def WaitForDhcp(self, timeout=None):
+    """Wait for running DHCP steps to complete.
+
+    Args:
+      timeout: float, the maximum number of seconds to wait for each step.
+    """
+    with self.dhcp_lock:
+      threads = list(self.dhcp_threads.values())
+    for thread in threads:
+      thread.join(timeout)
 
   def EnableIpv6(self, interfaces):
     """Enable IPv6 on the list of network interfaces.
@@ -51,16 +159,18 @@ class NetworkSetup(object):
     Args:
       interfaces: list of string, the output device names for enabling IPv6.
     """
-    if not interfaces or self.ipv6_interfaces == set(interfaces):
-      return
+    with self.dhcp_lock:
+      if not interfaces or self.ipv6_interfaces == set(interfaces):
+        return
+      self.ipv6_interfaces = self.ipv6_interfaces.union(set(interfaces))
+      self.ipv6_initialized = True
 
     self.logger.info('Enabling IPv6 on Ethernet interface: %s.', interfaces)
-    self.ipv6_interfaces = self.ipv6_interfaces.union(set(interfaces))
-    self.ipv6_initialized = True
 
     # Distro-specific setup for enabling IPv6 on network interfaces.
-    self.distro_utils.EnableIpv6(
-        interfaces, self.logger, dhclient_script=self.dhclient_script)
+    self._StartDhcpStep(
+        'ipv6', self.distro_utils.EnableIpv6, interfaces,
+        dhclient_script=self.dhclient_script)
 
   def DisableIpv6(self, interfaces):
     """Disable IPv6 on the list of network interfaces.
@@ -70,17 +180,18 @@ class NetworkSetup(object):
     """
     # Allow to run once during Initialization and after that only when an
     # interface is found in the ipv6_interfaces set.
-    if not interfaces or (
-        self.ipv6_initialized and not self.ipv6_interfaces.intersection(
-            set(interfaces))):
-      return
+    with self.dhcp_lock:
+      if not interfaces or (
+          self.ipv6_initialized and not self.ipv6_interfaces.intersection(
+              set(interfaces))):
+        return
+      self.ipv6_interfaces = self.ipv6_interfaces.difference(interfaces)
+      self.ipv6_initialized = True
 
     self.logger.info('Disabling IPv6 on Ethernet interface: %s.', interfaces)
-    self.ipv6_interfaces.difference_update(interfaces)
-    self.ipv6_initialized = True
 
     # Distro-specific setup for disabling IPv6 on network interfaces.
-    self.distro_utils.DisableIpv6(interfaces, self.logger)
+    self._StartDhcpStep('ipv6', self.distro_utils.DisableIpv6, interfaces)
 
   def EnableNetworkInterfaces(self, interfaces):
     """Enable the list of network interfaces.
@@ -90,19 +201,18 @@ class NetworkSetup(object):
     """
     # The default Ethernet interface is enabled by default. Do not attempt to
     # enable interfaces if only one interface is specified in metadata.
-    if not interfaces or set(interfaces) == self.interfaces:
-      return
+    with self.dhcp_lock:
+      if not interfaces or set(interfaces) == self.interfaces:
+        return
+      self.interfaces = set(interfaces)
 
     self.logger.info('Ethernet interfaces: %s.', interfaces)
-    self.interfaces = set(interfaces)
 
     if self.dhcp_command:
-      try:
-        subprocess.check_call([self.dhcp_command])
-      except subprocess.CalledProcessError:
-        self.logger.warning('Could not enable Ethernet interfaces.')
+      self._StartDhcpStep('interfaces', self._RunDhcpCommand, interfaces)
       return
 
     # Distro-specific setup for network interfaces.
-    self.distro_utils.EnableNetworkInterfaces(
-        interfaces, self.logger, dhclient_script=self.dhclient_script)
+    self._StartDhcpStep(
+        'interfaces', self.distro_utils.EnableNetworkInterfaces, interfaces,
+        dhclient_script=self.dhclient_script)
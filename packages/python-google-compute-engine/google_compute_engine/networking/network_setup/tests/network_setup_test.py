@@ -16,6 +16,7 @@
 """Unittest for network_setup.py module."""
 
 import subprocess
+import threading
 
 from google_compute_engine.networking.network_setup import network_setup
 from google_compute_engine.test_compat import mock
@@ -29,13 +30,14 @@ class NetworkSetupTest(unittest.TestCase):
     self.mock_distro_utils = mock.Mock()
     self.dhclient_script = '/bin/script'
     self.dhcp_command = ''
-    self.setup = network_setup.NetworkSetup(
-        dhclient_script=self.dhclient_script, dhcp_command=self.dhcp_command,
-        debug=False)
+    with mock.patch.object(network_setup.compat, 'GetDistroUtils'):
+      self.setup = network_setup.NetworkSetup(
+          dhclient_script=self.dhclient_script,
+          dhcp_command=self.dhcp_command, debug=False)
     self.setup.distro_utils = self.mock_distro_utils
     self.setup.logger = self.mock_logger
 
-  @mock.patch('google_compute_engine.networking.network_setup.network_setup.subprocess.check_call')
+  @mock.patch('google_compute_engine.networking.network_setup.network_setup.helpers.CheckCall')
   def testEnableIpv6(self, mock_call):
     mocks = mock.Mock()
     mocks.attach_mock(mock_call, 'call')
@@ -45,26 +47,34 @@ class NetworkSetupTest(unittest.TestCase):
 
     # Return immediately with no interfaces.
     network_setup.NetworkSetup.EnableIpv6(self.setup, None)
+    self.setup.WaitForDhcp()
     network_setup.NetworkSetup.EnableIpv6(self.setup, [])
+    self.setup.WaitForDhcp()
     # Enable interfaces.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A', 'B'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['A', 'B']))
     # Add a new interface.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A', 'B', 'C'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['A', 'B', 'C']))
     # Interfaces are already enabled, do nothing.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A', 'B', 'C'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['A', 'B', 'C']))
     expected_calls = [
         mock.call.logger.info(mock.ANY, ['A', 'B']),
         mock.call.enable(['A', 'B'], mock.ANY, dhclient_script='/bin/script'),
+        mock.call.logger.debug(mock.ANY, 'ipv6', ['A', 'B'], mock.ANY),
         mock.call.logger.info(mock.ANY, ['A', 'B', 'C']),
         mock.call.enable(
             ['A', 'B', 'C'], mock.ANY, dhclient_script='/bin/script'),
+        mock.call.logger.debug(
+            mock.ANY, 'ipv6', ['A', 'B', 'C'], mock.ANY),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  @mock.patch('google_compute_engine.networking.network_setup.network_setup.subprocess.check_call')
+  @mock.patch('google_compute_engine.networking.network_setup.network_setup.helpers.CheckCall')
   def testDisableIpv6(self, mock_call):
     mocks = mock.Mock()
     mocks.attach_mock(mock_call, 'call')
@@ -75,74 +85,92 @@ class NetworkSetupTest(unittest.TestCase):
 
     # Clean run, run disable once e.g. at boot.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set([]))
     # No more disables allowed, have to follow the contract of Enable and then
     # Disable.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A']),
             mock.call.disable(['A'], mock.ANY),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['A'], mock.ANY),
         ])
     # Enable interfaces.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A', 'B', 'C'])
+    self.setup.WaitForDhcp()
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A', 'B', 'C']),
             mock.call.enable(
                 ['A', 'B', 'C'], mock.ANY, dhclient_script='/bin/script'),
+            mock.call.logger.debug(
+                mock.ANY, 'ipv6', ['A', 'B', 'C'], mock.ANY),
         ])
     # Remove interface.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['B', 'C']))
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A']),
             mock.call.disable(['A'], mock.ANY),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['A'], mock.ANY),
         ])
 
     # Add it back.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['A', 'B', 'C']))
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A']),
             mock.call.enable(['A'], mock.ANY, dhclient_script='/bin/script'),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['A'], mock.ANY),
         ])
 
     # Remove list.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A', 'B'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['C']))
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A', 'B']),
             mock.call.disable(['A', 'B'], mock.ANY),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['A', 'B'], mock.ANY),
         ])
 
     # Try removing again, these are no ops.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['A', 'B'])
+    self.setup.WaitForDhcp()
 
     # Remove the last element.
     network_setup.NetworkSetup.DisableIpv6(self.setup, ['C'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set([]))
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['C']),
             mock.call.disable(['C'], mock.ANY),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['C'], mock.ANY),
         ])
 
     # Empty list, allow adds back again.
     network_setup.NetworkSetup.EnableIpv6(self.setup, ['A'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.ipv6_interfaces, set(['A']))
     expected_calls.extend(
         [
             mock.call.logger.info(mock.ANY, ['A']),
             mock.call.enable(['A'], mock.ANY, dhclient_script='/bin/script'),
+            mock.call.logger.debug(mock.ANY, 'ipv6', ['A'], mock.ANY),
         ])
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  @mock.patch('google_compute_engine.networking.network_setup.network_setup.subprocess.check_call')
+  @mock.patch('google_compute_engine.networking.network_setup.network_setup.helpers.CheckCall')
   def testEnableNetworkInterfaces(self, mock_call):
     mocks = mock.Mock()
     mocks.attach_mock(mock_call, 'call')
@@ -152,39 +180,113 @@ class NetworkSetupTest(unittest.TestCase):
 
     # Return immediately with no interfaces.
     network_setup.NetworkSetup.EnableNetworkInterfaces(self.setup, None)
+    self.setup.WaitForDhcp()
     network_setup.NetworkSetup.EnableNetworkInterfaces(self.setup, [])
+    self.setup.WaitForDhcp()
     # Enable interfaces.
     network_setup.NetworkSetup.EnableNetworkInterfaces(
         self.setup, ['A', 'B'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.interfaces, set(['A', 'B']))
     # Add a new interface.
     network_setup.NetworkSetup.EnableNetworkInterfaces(
         self.setup, ['A', 'B', 'C'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.interfaces, set(['A', 'B', 'C']))
     # Interfaces are already enabled.
     network_setup.NetworkSetup.EnableNetworkInterfaces(
         self.setup, ['A', 'B', 'C'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.interfaces, set(['A', 'B', 'C']))
     # Run a user supplied command successfully.
     self.setup.dhcp_command = 'success'
     network_setup.NetworkSetup.EnableNetworkInterfaces(
         self.setup, ['D', 'E'])
+    self.setup.WaitForDhcp()
     self.assertEqual(self.setup.interfaces, set(['D', 'E']))
-    # Run a user supplied command and logger error messages.
+    # Run a user supplied command and logger error messages. The failed
+    # interfaces are cleared so they are enabled again on the next update.
     self.setup.dhcp_command = 'failure'
     network_setup.NetworkSetup.EnableNetworkInterfaces(
         self.setup, ['F', 'G'])
-    self.assertEqual(self.setup.interfaces, set(['F', 'G']))
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.interfaces, set())
     expected_calls = [
         mock.call.logger.info(mock.ANY, ['A', 'B']),
         mock.call.enable(['A', 'B'], mock.ANY, dhclient_script='/bin/script'),
+        mock.call.logger.debug(mock.ANY, 'interfaces', ['A', 'B'], mock.ANY),
         mock.call.logger.info(mock.ANY, ['A', 'B', 'C']),
         mock.call.enable(
             ['A', 'B', 'C'], mock.ANY, dhclient_script='/bin/script'),
+        mock.call.logger.debug(
+            mock.ANY, 'interfaces', ['A', 'B', 'C'], mock.ANY),
         mock.call.logger.info(mock.ANY, ['D', 'E']),
-        mock.call.call(['success']),
+        mock.call.call(['success'], timeout=mock.ANY),
+        mock.call.logger.debug(mock.ANY, 'interfaces', ['D', 'E'], mock.ANY),
         mock.call.logger.info(mock.ANY, ['F', 'G']),
-        mock.call.call(['failure']),
+        mock.call.call(['failure'], timeout=mock.ANY),
         mock.call.logger.warning(mock.ANY),
+        mock.call.logger.debug(mock.ANY, 'interfaces', ['F', 'G'], mock.ANY),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
+
+  def testEnableNetworkInterfacesPending(self):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def _Enable(interfaces, logger, dhclient_script=None):
+      calls.append(interfaces)
+      started.set()
+      release.wait(5)
+
+    self.mock_distro_utils.EnableNetworkInterfaces.side_effect = _Enable
+    self.setup.EnableNetworkInterfaces(['A'])
+    started.wait(5)
+    # The caller is not blocked while DHCP is running.
+    self.setup.EnableNetworkInterfaces(['A', 'B'])
+    self.setup.EnableNetworkInterfaces(['A', 'B', 'C'])
+    release.set()
+    self.setup.WaitForDhcp()
+    self.assertEqual(calls, [['A'], ['A', 'B', 'C']])
+    self.assertEqual(self.setup.dhcp_running, set())
+    self.assertEqual(self.setup.dhcp_pending, {})
+
+  def testEnableNetworkInterfacesFailure(self):
+    self.mock_distro_utils.EnableNetworkInterfaces.side_effect = (
+        ValueError('Test Error'))
+
+    self.setup.EnableNetworkInterfaces(['A', 'B'])
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.interfaces, set())
+    self.mock_logger.warning.assert_called_once_with(
+        mock.ANY, 'interfaces', ['A', 'B'], mock.ANY)
+
+  def testEnableNetworkInterfacesRetry(self):
+    # A failed dhclient call is reported without raising.
+    self.mock_distro_utils.EnableNetworkInterfaces.side_effect = [False, True]
+
+    self.setup.EnableNetworkInterfaces(['A', 'B'])
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.interfaces, set())
+    self.setup.EnableNetworkInterfaces(['A', 'B'])
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.interfaces, set(['A', 'B']))
+    self.assertEqual(
+        self.mock_distro_utils.EnableNetworkInterfaces.call_count, 2)
+
+  def testEnableIpv6Retry(self):
+    self.mock_distro_utils.EnableIpv6.return_value = False
+
+    self.setup.EnableIpv6(['A'])
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.ipv6_interfaces, set())
+    self.assertFalse(self.setup.ipv6_initialized)
+
+  def testEnableIpv6Failure(self):
+    self.mock_distro_utils.EnableIpv6.side_effect = ValueError('Test Error')
+
+    self.setup.EnableIpv6(['A'])
+    self.setup.WaitForDhcp()
+    self.assertEqual(self.setup.ipv6_interfaces, set())
+    self.assertFalse(self.setup.ipv6_initialized)
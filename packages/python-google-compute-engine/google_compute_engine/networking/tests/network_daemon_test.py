@@ -129,107 +129,163 @@ class NetworkDaemonTest(unittest.TestCase):
       ]
       self.assertEqual(mocks.mock_calls, expected_calls)
 
+  @mock.patch('google_compute_engine.networking.network_daemon.ip_forwarding')
+  @mock.patch('google_compute_engine.networking.network_daemon.network_setup')
+  @mock.patch('google_compute_engine.networking.network_daemon.network_utils')
+  @mock.patch('google_compute_engine.networking.network_daemon.metadata_watcher')
+  @mock.patch('google_compute_engine.networking.network_daemon.logger')
+  @mock.patch('google_compute_engine.networking.network_daemon.file_utils')
+  def testNetworkDaemonContext(
+      self, mock_lock, mock_logger, mock_watcher, mock_network_utils,
+      mock_network_setup, mock_ip_forwarding):
+    mock_context = mock.Mock()
+    daemon = network_daemon.NetworkDaemon(
+        ip_forwarding_enabled=True,
+        proto_id='66',
+        ip_aliases=None,
+        target_instance_ips=None,
+        dhclient_script='x',
+        dhcp_command='y',
+        network_setup_enabled=True,
+        context=mock_context)
+    self.assertEqual(daemon.logger, mock_context.logger)
+    self.assertEqual(daemon.watcher, mock_context.watcher)
+    mock_network_utils.NetworkUtils.assert_called_once_with(
+        logger=mock_context.logger)
+    mock_logger.Logger.assert_not_called()
+    mock_watcher.MetadataWatcher.assert_not_called()
+    mock_lock.LockFile.assert_not_called()
+
+  def testGetOptions(self):
+    mock_config = mock.Mock()
+    mock_config.GetOptionBool.side_effect = (
+        lambda section, option: option != 'ip_forwarding_daemon')
+    mock_config.GetOptionString.side_effect = lambda section, option: option
+    self.assertEqual(
+        network_daemon.GetOptions(mock_config), {
+            'ip_forwarding_enabled': True,
+            'proto_id': 'ethernet_proto_id',
+            'ip_aliases': True,
+            'target_instance_ips': True,
+            'dhclient_script': 'dhclient_script',
+            'dhcp_command': 'dhcp_command',
+            'network_setup_enabled': True,
+        })
+
   def testHandleNetworkInterfaces(self):
     mocks = mock.Mock()
-    mocks.attach_mock(self.mock_ip_forwarding, 'forwarding')
     mocks.attach_mock(self.mock_network_setup, 'network_setup')
     mocks.attach_mock(self.mock_setup, 'setup')
-    self.mock_setup.ip_aliases = None
-    self.mock_setup.target_instance_ips = None
-    self.mock_setup.ip_forwarding_enabled = True
+    self.mock_setup.max_workers = 1
     self.mock_setup.network_setup_enabled = True
-    self.mock_setup._ExtractInterfaceMetadata.return_value = [
-        network_daemon.NetworkDaemon.NetworkInterface(
-            'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=False),
-        network_daemon.NetworkDaemon.NetworkInterface('eth1'),
-    ]
+    eth0 = network_daemon.NetworkDaemon.NetworkInterface(
+        'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=False)
+    eth1 = network_daemon.NetworkDaemon.NetworkInterface('eth1')
+    eth2 = network_daemon.NetworkDaemon.NetworkInterface('eth2')
+    self.mock_setup._ExtractInterfaceMetadata.return_value = [eth0, eth1, eth2]
     result = mock.Mock()
 
     network_daemon.NetworkDaemon.HandleNetworkInterfaces(
         self.mock_setup, result)
     expected_calls = [
         mock.call.setup._ExtractInterfaceMetadata(result),
-        mock.call.network_setup.DisableIpv6(['eth0']),
-        mock.call.network_setup.EnableNetworkInterfaces(['eth1']),
-        mock.call.forwarding.HandleForwardedIps(
-            'eth0', ['a'], '1.1.1.1'),
-        mock.call.forwarding.HandleForwardedIps('eth1', None, None),
+        mock.call.setup._HandleNetworkInterface(eth0, default=True),
+        mock.call.network_setup.EnableNetworkInterfaces(['eth1', 'eth2']),
+        mock.call.setup._HandleNetworkInterface(eth1),
+        mock.call.setup._HandleNetworkInterface(eth2),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  def testHandleNetworkInterfacesIpv6(self):
+  def testHandleNetworkInterfacesConcurrent(self):
+    self.mock_setup.max_workers = 4
+    self.mock_setup.network_setup_enabled = False
+    interfaces = [
+        network_daemon.NetworkDaemon.NetworkInterface('eth%s' % i)
+        for i in range(8)
+    ]
+    self.mock_setup._ExtractInterfaceMetadata.return_value = interfaces
+    handled = []
+    self.mock_setup._HandleNetworkInterface.side_effect = (
+        lambda interface, default=False: handled.append(interface.name))
+
+    network_daemon.NetworkDaemon.HandleNetworkInterfaces(
+        self.mock_setup, mock.Mock())
+    self.assertEqual(handled[0], 'eth0')
+    self.assertEqual(
+        sorted(handled), sorted(interface.name for interface in interfaces))
+    self.mock_network_setup.EnableNetworkInterfaces.assert_not_called()
+
+  def testHandleNetworkInterfacesEmpty(self):
+    self.mock_setup._ExtractInterfaceMetadata.return_value = []
+
+    network_daemon.NetworkDaemon.HandleNetworkInterfaces(
+        self.mock_setup, mock.Mock())
+    self.mock_setup._HandleNetworkInterface.assert_not_called()
+    self.mock_network_setup.EnableNetworkInterfaces.assert_not_called()
+
+  def testHandleNetworkInterface(self):
     mocks = mock.Mock()
     mocks.attach_mock(self.mock_ip_forwarding, 'forwarding')
     mocks.attach_mock(self.mock_network_setup, 'network_setup')
-    mocks.attach_mock(self.mock_setup, 'setup')
-    self.mock_setup.ip_aliases = None
-    self.mock_setup.target_instance_ips = None
     self.mock_setup.ip_forwarding_enabled = True
     self.mock_setup.network_setup_enabled = True
-    self.mock_setup._ExtractInterfaceMetadata.return_value = [
-        network_daemon.NetworkDaemon.NetworkInterface(
-            'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=True),
+    interface = network_daemon.NetworkDaemon.NetworkInterface(
+        'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=False)
+
+    network_daemon.NetworkDaemon._HandleNetworkInterface(
+        self.mock_setup, interface, default=True)
+    expected_calls = [
+        mock.call.network_setup.DisableIpv6(['eth0']),
+        mock.call.forwarding.HandleForwardedIps('eth0', ['a'], '1.1.1.1'),
     ]
-    result = mock.Mock()
+    self.assertEqual(mocks.mock_calls, expected_calls)
+    self.mock_logger.debug.assert_called_once_with(
+        mock.ANY, 'eth0', mock.ANY)
 
-    network_daemon.NetworkDaemon.HandleNetworkInterfaces(
-        self.mock_setup, result)
+  def testHandleNetworkInterfaceIpv6(self):
+    mocks = mock.Mock()
+    mocks.attach_mock(self.mock_ip_forwarding, 'forwarding')
+    mocks.attach_mock(self.mock_network_setup, 'network_setup')
+    self.mock_setup.ip_forwarding_enabled = True
+    self.mock_setup.network_setup_enabled = True
+    interface = network_daemon.NetworkDaemon.NetworkInterface(
+        'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=True)
+
+    network_daemon.NetworkDaemon._HandleNetworkInterface(
+        self.mock_setup, interface, default=True)
     expected_calls = [
-        mock.call.setup._ExtractInterfaceMetadata(result),
         mock.call.network_setup.EnableIpv6(['eth0']),
-        mock.call.network_setup.EnableNetworkInterfaces([]),
-        mock.call.forwarding.HandleForwardedIps(
-            'eth0', ['a'], '1.1.1.1'),
+        mock.call.forwarding.HandleForwardedIps('eth0', ['a'], '1.1.1.1'),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  def testHandleNetworkInterfacesIpv6Disabled(self):
+  def testHandleNetworkInterfaceSecondary(self):
     mocks = mock.Mock()
     mocks.attach_mock(self.mock_ip_forwarding, 'forwarding')
     mocks.attach_mock(self.mock_network_setup, 'network_setup')
-    mocks.attach_mock(self.mock_setup, 'setup')
-    self.mock_setup.ip_aliases = None
-    self.mock_setup.target_instance_ips = None
     self.mock_setup.ip_forwarding_enabled = True
     self.mock_setup.network_setup_enabled = True
-    self.mock_setup._ExtractInterfaceMetadata.return_value = [
-        network_daemon.NetworkDaemon.NetworkInterface(
-            'eth0', forwarded_ips=['a'], ip='1.1.1.1', ipv6=False),
-    ]
-    result = mock.Mock()
+    interface = network_daemon.NetworkDaemon.NetworkInterface(
+        'eth1', forwarded_ips=['b'], ip='2.2.2.2', ipv6=True)
 
-    network_daemon.NetworkDaemon.HandleNetworkInterfaces(
-        self.mock_setup, result)
+    network_daemon.NetworkDaemon._HandleNetworkInterface(
+        self.mock_setup, interface)
     expected_calls = [
-        mock.call.setup._ExtractInterfaceMetadata(result),
-        mock.call.network_setup.DisableIpv6(['eth0']),
-        mock.call.network_setup.EnableNetworkInterfaces([]),
-        mock.call.forwarding.HandleForwardedIps(
-            'eth0', ['a'], '1.1.1.1'),
+        mock.call.forwarding.HandleForwardedIps('eth1', ['b'], '2.2.2.2'),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  def testHandleNetworkInterfacesDisabled(self):
+  def testHandleNetworkInterfaceDisabled(self):
     mocks = mock.Mock()
     mocks.attach_mock(self.mock_ip_forwarding, 'forwarding')
     mocks.attach_mock(self.mock_network_setup, 'network_setup')
-    mocks.attach_mock(self.mock_setup, 'setup')
-    self.mock_setup.ip_aliases = None
-    self.mock_setup.target_instance_ips = None
     self.mock_setup.ip_forwarding_enabled = False
     self.mock_setup.network_setup_enabled = False
-    self.mock_setup._ExtractInterfaceMetadata.return_value = [
-        network_daemon.NetworkDaemon.NetworkInterface('a'),
-        network_daemon.NetworkDaemon.NetworkInterface('b'),
-    ]
-    result = mock.Mock()
+    interface = network_daemon.NetworkDaemon.NetworkInterface('a')
 
-    network_daemon.NetworkDaemon.HandleNetworkInterfaces(
-        self.mock_setup, result)
-    expected_calls = [
-        mock.call.setup._ExtractInterfaceMetadata(result),
-    ]
-    self.assertEqual(mocks.mock_calls, expected_calls)
+    network_daemon.NetworkDaemon._HandleNetworkInterface(
+        self.mock_setup, interface, default=True)
+    self.assertEqual(mocks.mock_calls, [])
 
   def testExtractInterfaceMetadata(self):
     self.mock_setup.ip_aliases = True
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A library for logging the output of child processes efficiently."""
+
+import os
+import threading
+import time
+
+from google_compute_engine import logger
+
+CHUNK_SIZE = 64 * 1024
+BURST_SECONDS = 10
+BACKUP_COUNT = 5
+
+
+class RunLog(object):
+  """A log file storing the complete output of one run.
+
+  Opening the log rotates the logs of previous runs, keeping a fixed number
+  of them. Writes from concurrent threads are serialized.
+  """
+
+  def __init__(self, path, backup_count=BACKUP_COUNT):
+    """Constructor.
+
+    Args:
+      path: string, the path of the log file.
+      backup_count: int, the number of logs from previous runs to keep.
+
+    Raises:
+      IOError, OSError: the log file could not be opened.
+    """
+    for index in range(backup_count, 0, -1):
+      source = '%s.%s' % (path, index - 1) if index > 1 else path
+      if os.path.exists(source):
+        os.rename(source, '%s.%s' % (path, index))
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory, 0o755)
+    self.log_file = open(path, 'w')
+    self.lock = threading.Lock()
+
+  def Write(self, lines):
+    """Append lines to the log file.
+
+    Args:
+      lines: list, the lines of text to write.
+    """
+    with self.lock:
+      self.log_file.write(''.join(line + '\n' for line in lines))
+      self.log_file.flush()
+
+  def Close(self):
+    """Close the log file."""
+    with self.lock:
+      self.log_file.close()
+
+
+class OutputPump(object):
+  """Reads process output in large chunks and logs one record per line.
+
+  The lines of each chunk are passed to the log handlers in one batch.
+
+  Output is not rate limited unless a rate is provided. Lines beyond the rate
+  limit are not logged and are reported with a count of the lines
+  suppressed. A run log, if provided, receives every line.
+  """
+
+  def __init__(
+      self, logger, prefix=None, run_log=None, rate=None, burst=None,
+      chunk_size=CHUNK_SIZE):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      prefix: string, the text prepended to each logged line.
+      run_log: RunLog object, receives the complete output.
+      rate: float, the number of lines per second allowed on average, or
+          None to log every line.
+      burst: int, the number of lines allowed at once. Defaults to ten
+          seconds worth of lines.
+      chunk_size: int, the number of bytes to read at a time.
+    """
+    self.logger = logger
+    self.prefix = prefix
+    self.run_log = run_log
+    self.rate = rate
+    self.burst = burst or (rate or 0) * BURST_SECONDS
+    self.chunk_size = chunk_size
+    self.tokens = self.burst
+    self.last_time = time.time()
+    self.suppressed = 0
+
+  def _Allow(self, count):
+    """Take tokens for logging lines from the rate limiting bucket.
+
+    Args:
+      count: int, the number of lines to log.
+
+    Returns:
+      int, the number of lines allowed.
+    """
+    if not self.rate:
+      return count
+    now = time.time()
+    self.tokens = min(
+        self.burst, self.tokens + max(now - self.last_time, 0) * self.rate)
+    self.last_time = now
+    allowed = min(count, int(self.tokens))
+    self.tokens -= allowed
+    return allowed
+
+  def _ReportSuppressed(self):
+    """Log the number of lines suppressed since the last report."""
+    if self.suppressed:
+      message = '%s lines suppressed.' % self.suppressed
+      if self.prefix:
+        message = '%s: %s' % (self.prefix, message)
+      self.logger.warning(message)
+      self.suppressed = 0
+
+  def _Emit(self, lines):
+    """Log lines subject to the rate limit.
+
+    Args:
+      lines: list, the lines of text to log.
+    """
+    lines = [line for line in lines if line]
+    if not lines:
+      return
+    if self.prefix:
+      lines = ['%s: %s' % (self.prefix, line) for line in lines]
+    if self.run_log:
+      self.run_log.Write(lines)
+    allowed = self._Allow(len(lines))
+    if allowed:
+      self._ReportSuppressed()
+    self.suppressed += len(lines) - allowed
+    logger.LogLines(self.logger, lines[:allowed])
+
+  def Pump(self, stream):
+    """Log the output of a stream until it is closed.
+
+    Args:
+      stream: file object, the output of a child process.
+    """
+    fd = stream.fileno()
+    pending = b''
+    while True:
+      chunk = os.read(fd, self.chunk_size)
+      if not chunk:
+        break
+      pending += chunk
+      end = pending.rfind(b'\n')
+      if end < 0 and len(pending) < self.chunk_size:
+        continue
+      if end < 0:
+        # Log an overly long line without waiting for its end.
+        end = len(pending)
+      data = pending[:end].decode('utf-8', 'replace')
+      pending = pending[end + 1:]
+      self._Emit(data.split('\n'))
+    if pending:
+      self._Emit(pending.decode('utf-8', 'replace').split('\n'))
+    self._ReportSuppressed()
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A library for running tasks concurrently in dependency order."""
+
+import logging
+import threading
+import time
+
+from google_compute_engine import tracing
+
+
+class Task(object):
+  """A named step that runs once the tasks it depends on succeed."""
+
+  def __init__(self, name, func, after=None):
+    """Constructor.
+
+    Args:
+      name: string, the name of the task.
+      func: callable, the function called with no arguments to run the task.
+      after: list, the names of the tasks that must succeed first.
+    """
+    self.name = name
+    self.func = func
+    self.after = list(after or [])
+    self.start_time = None
+    self.end_time = None
+    self.error = None
+    self.skipped = False
+
+  @property
+  def duration(self):
+    """float, the number of seconds the task ran or None if it did not run."""
+    if self.start_time is None or self.end_time is None:
+      return None
+    return self.end_time - self.start_time
+
+  @property
+  def succeeded(self):
+    """bool, True if the task ran without raising an exception."""
+    return self.end_time is not None and self.error is None
+
+
+def GetCriticalPath(tasks):
+  """Get the chain of dependent tasks that determined the finishing time.
+
+  Starting from the task that finished last, the path follows the dependency
+  that finished last until it reaches a task with no dependencies that
+  finished before it started.
+
+  Args:
+    tasks: list, the Task objects that were run.
+
+  Returns:
+    list, the Task objects on the critical path in execution order.
+  """
+  finished = dict(
+      (task.name, task) for task in tasks if task.end_time is not None)
+  if not finished:
+    return []
+  task = max(finished.values(), key=lambda item: item.end_time)
+  path = [task]
+  while True:
+    dependencies = [
+        finished[name] for name in task.after
+        if name in finished and finished[name].end_time <= task.start_time]
+    if not dependencies:
+      break
+    task = max(dependencies, key=lambda item: item.end_time)
+    path.append(task)
+  return list(reversed(path))
+
+
+def _LogTimings(tasks, start_time, logger):
+  """Log the duration of each task and the critical path.
+
+  Args:
+    tasks: list, the Task objects that were run.
+    start_time: float, the time the first task was scheduled.
+    logger: logger object, used to write to SysLog and serial port.
+  """
+  timings = []
+  for task in tasks:
+    if task.skipped:
+      timings.append('%s skipped' % task.name)
+    elif task.duration is not None:
+      status = '' if task.succeeded else ' failed'
+      timings.append('%s %.3fs%s' % (task.name, task.duration, status))
+  logger.info(
+      'Finished %s tasks in %.3f seconds: %s.', len(tasks),
+      time.time() - start_time, ', '.join(timings))
+  path = GetCriticalPath(tasks)
+  if path:
+    logger.info(
+        'Critical path: %s.', ' -> '.join(
+            '%s %.3fs' % (task.name, task.duration) for task in path))
+
+
+def RunTasks(tasks, max_workers=None, logger=logging, log_timings=True):
+  """Run tasks concurrently once the tasks they depend on succeed.
+
+  An exception raised by a task is logged, and the tasks depending on it are
+  skipped. Unrelated tasks continue to run. Dependencies on task names that
+  are not in the list are ignored.
+
+  Args:
+    tasks: list, the Task objects to run.
+    max_workers: int, the maximum number of tasks running at once. Defaults
+        to the number of tasks.
+    logger: logger object, used to write to SysLog and serial port.
+    log_timings: bool, True if the duration of each task and the critical
+        path are logged once the tasks finish.
+
+  Returns:
+    list, the Task objects with their timing and status recorded.
+  """
+  start_time = time.time()
+  max_workers = max_workers or len(tasks)
+  names = set(task.name for task in tasks)
+  pending = list(tasks)
+  waiting = dict(
+      (task.name, set(task.after).intersection(names)) for task in tasks)
+  failed = set()
+  running = set()
+  condition = threading.Condition()
+
+  def _Run(task):
+    task.start_time = time.time()
+    try:
+      with tracing.Span(task.name):
+        task.func()
+    except Exception as e:
+      task.error = e
+      logger.warning('Exception running %s. %s.', task.name, e)
+    finally:
+      task.end_time = time.time()
+      with condition:
+        running.discard(task.name)
+        if task.error is not None:
+          failed.add(task.name)
+        for keys in waiting.values():
+          keys.discard(task.name)
+        condition.notify_all()
+
+  threads = []
+  with condition:
+    while pending:
+      skipping = True
+      while skipping:
+        skipping = False
+        for task in list(pending):
+          failed_dependencies = failed.intersection(task.after)
+          if failed_dependencies:
+            logger.warning(
+                'Skipping %s since %s failed.', task.name,
+                ', '.join(sorted(failed_dependencies)))
+            task.skipped = True
+            pending.remove(task)
+            failed.add(task.name)
+            skipping = True
+      ready = [task for task in pending if not waiting[task.name]]
+      if not ready and not running and pending:
+        logger.warning(
+            'Dependency cycle in tasks. Running %s.', pending[0].name)
+        ready = pending[:1]
+      for task in ready:
+        if len(running) >= max_workers:
+          break
+        pending.remove(task)
+        running.add(task.name)
+        thread = threading.Thread(target=_Run, args=(task,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+      if pending:
+        condition.wait()
+  for thread in threads:
+    thread.join()
+  if log_timings:
+    _LogTimings(tasks, start_time, logger)
+  return tasks
@@ -24,6 +24,13 @@ from google_compute_engine.compat import urlparse
 from google_compute_engine.compat import urlrequest
 from google_compute_engine.compat import urlretrieve
 
+if sys.version_info >= (3, 0):
+  import http.server as httpserver
+  import socketserver
+else:
+  import BaseHTTPServer as httpserver
+  import SocketServer as socketserver
+
 # Import the mock module in Python 3.2.
 if sys.version_info >= (3, 3):
   import unittest.mock as mock
@@ -15,11 +15,20 @@
 
 """Unittest for compat.py module."""
 
+import json
+import os
+import shutil
+import subprocess
 import sys
-
-import google_compute_engine.compat
+import tempfile
+
+from google_compute_engine import compat
+import google_compute_engine.distro_lib.debian_9.utils
+import google_compute_engine.distro_lib.el_6.utils
+import google_compute_engine.distro_lib.el_7.utils
+import google_compute_engine.distro_lib.freebsd_11.utils
+import google_compute_engine.distro_lib.sles_12.utils
 from google_compute_engine.test_compat import mock
-from google_compute_engine.test_compat import reload_import
 from google_compute_engine.test_compat import unittest
 from google_compute_engine.test_compat import urlretrieve
 
@@ -68,8 +77,11 @@ class CompatTest(unittest.TestCase):
     else:
       pass
 
-  @mock.patch('google_compute_engine.compat.distro.linux_distribution')
-  def testDistroCompatLinux(self, mock_call):
+  @mock.patch('google_compute_engine.compat._WriteDistroCache')
+  @mock.patch('google_compute_engine.compat._ReadDistroCache')
+  @mock.patch('google_compute_engine.compat._LinuxDistribution')
+  def testDistroCompatLinux(self, mock_call, mock_read, mock_write):
+    mock_read.return_value = None
     test_cases = {
         ('Fedora', '28', ''):
             google_compute_engine.distro_lib.el_7.utils,
@@ -101,16 +113,118 @@ class CompatTest(unittest.TestCase):
 
     for distro in test_cases:
       mock_call.return_value = distro
-      reload_import(google_compute_engine.compat)
-      self.assertEqual(
-          test_cases[distro], google_compute_engine.compat.distro_utils)
+      with mock.patch.object(compat, '_distro', None):
+        self.assertEqual(test_cases[distro], compat.GetDistroUtils())
 
+  @mock.patch('google_compute_engine.compat._LinuxDistribution')
   @mock.patch('google_compute_engine.compat.sys.platform', 'freebsd11')
-  def testDistroCompatFreeBSD(self):
-    reload_import(google_compute_engine.compat)
-    self.assertEqual(
-        google_compute_engine.distro_lib.freebsd_11.utils,
-        google_compute_engine.compat.distro_utils)
+  def testDistroCompatFreeBSD(self, mock_call):
+    with mock.patch.object(compat, '_distro', None):
+      self.assertEqual(
+          google_compute_engine.distro_lib.freebsd_11.utils,
+          compat.GetDistroUtils())
+    mock_call.assert_not_called()
+
+  @mock.patch('google_compute_engine.compat._LinuxDistribution')
+  def testGetDistroCache(self, mock_call):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    os_release = os.path.join(temp_dir, 'os-release')
+    cache = os.path.join(temp_dir, 'run', 'distro.json')
+    with open(os_release, 'w') as f:
+      f.write('ID=debian\n')
+    mock_call.return_value = ('Debian GNU/Linux', '10.3', 'buster')
+
+    with mock.patch.object(compat, 'OS_RELEASE', os_release):
+      with mock.patch.object(compat, 'DISTRO_CACHE', cache):
+        with mock.patch.object(compat, '_distro', None):
+          self.assertEqual(compat.GetDistro(), ('debian gnu/linux', '10'))
+          # The result is cached within the process.
+          self.assertEqual(compat.GetDistro(), ('debian gnu/linux', '10'))
+        self.assertEqual(mock_call.call_count, 1)
+        self.assertEqual(os.stat(cache).st_mode & 0o777, 0o644)
+
+        # Another process reads the cached result.
+        with mock.patch.object(compat, '_distro', None):
+          self.assertEqual(compat.GetDistro(), ('debian gnu/linux', '10'))
+        self.assertEqual(mock_call.call_count, 1)
+
+        # The cache is ignored once os-release changes.
+        mtime = os.stat(os_release).st_mtime
+        os.utime(os_release, (mtime + 10, mtime + 10))
+        mock_call.return_value = ('Debian GNU/Linux', '11', 'bullseye')
+        with mock.patch.object(compat, '_distro', None):
+          self.assertEqual(compat.GetDistro(), ('debian gnu/linux', '11'))
+        self.assertEqual(mock_call.call_count, 2)
+    self.assertEqual(os.listdir(os.path.dirname(cache)), ['distro.json'])
+
+  @mock.patch('google_compute_engine.compat._LinuxDistribution')
+  def testGetDistroCacheNoOsRelease(self, mock_call):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    os_release = os.path.join(temp_dir, 'os-release')
+    cache = os.path.join(temp_dir, 'distro.json')
+    # A cache written without an os-release file is not trusted.
+    with open(cache, 'w') as f:
+      json.dump(
+          {'name': 'centos linux', 'version': '6', 'os_release_mtime': None},
+          f)
+    mock_call.return_value = ('CentOS Linux', '7.4.1708', 'Core')
+
+    with mock.patch.object(compat, 'OS_RELEASE', os_release):
+      with mock.patch.object(compat, 'DISTRO_CACHE', cache):
+        for _ in range(2):
+          with mock.patch.object(compat, '_distro', None):
+            self.assertEqual(compat.GetDistro(), ('centos linux', '7'))
+    self.assertEqual(mock_call.call_count, 2)
+    with open(cache) as f:
+      self.assertEqual(json.load(f)['version'], '6')
+
+  @mock.patch('google_compute_engine.compat._LinuxDistribution')
+  def testGetDistroCacheError(self, mock_call):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    # The cache directory cannot be created under a file.
+    blocker = os.path.join(temp_dir, 'file')
+    with open(blocker, 'w') as f:
+      f.write('')
+    cache = os.path.join(blocker, 'distro.json')
+    mock_call.return_value = ('CentOS Linux', '7.4.1708', 'Core')
+
+    with mock.patch.object(compat, 'DISTRO_CACHE', cache):
+      with mock.patch.object(compat, '_distro', None):
+        self.assertEqual(compat.GetDistro(), ('centos linux', '7'))
+    self.assertEqual(os.listdir(temp_dir), ['file'])
+
+  @unittest.skipIf(sys.version_info < (3, 7), 'Requires -X importtime.')
+  def testImportTime(self):
+    package_dir = os.path.dirname(os.path.dirname(compat.__file__))
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    modules = [
+        'google_compute_engine.compat',
+        'google_compute_engine.logger',
+        'google_compute_engine.metadata_watcher',
+        'google_compute_engine.token_provider',
+    ]
+    for module in modules:
+      process = subprocess.Popen(
+          [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+          cwd=package_dir, env=env, stdout=subprocess.PIPE,
+          stderr=subprocess.PIPE)
+      _, stderr = process.communicate()
+      self.assertEqual(process.returncode, 0, stderr)
+      imported = [
+          line.split('|')[-1].strip()
+          for line in stderr.decode('utf-8').splitlines()
+          if line.startswith('import time:')]
+      self.assertIn(module, imported)
+      # Distribution detection and the distro specific utilities are only
+      # loaded when they are used.
+      self.assertEqual(
+          [name for name in imported
+           if name.split('.')[0] == 'distro' or name.startswith(
+               'google_compute_engine.distro_lib')],
+          [], module)
 
 
 if __name__ == '__main__':
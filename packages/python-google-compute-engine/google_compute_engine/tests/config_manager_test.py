@@ -15,9 +15,15 @@
 
 """Unittest for config_manager.py module."""
 
+import json
+import os
+import shutil
+import tempfile
+
 from google_compute_engine import config_manager
 from google_compute_engine.test_compat import builtin
 from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import parser
 from google_compute_engine.test_compat import unittest
 
 
@@ -173,5 +179,131 @@ class ConfigManagerTest(unittest.TestCase):
     mock_lock.LockFile.assert_called_once_with('/var/lock/google_test.lock')
 
 
+class ReadConfigTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.config_file = os.path.join(self.temp_dir, 'instance_configs.cfg')
+    self.snapshot_dir = os.path.join(self.temp_dir, 'snapshots')
+    self._WriteConfig('[Section]\noption = value\nother = 1\n\n[Empty]\n')
+    snapshot_dir_patcher = mock.patch.object(
+        config_manager, 'SNAPSHOT_DIR', self.snapshot_dir)
+    snapshots_patcher = mock.patch.object(config_manager, '_snapshots', {})
+    snapshot_dir_patcher.start()
+    snapshots_patcher.start()
+    self.addCleanup(snapshot_dir_patcher.stop)
+    self.addCleanup(snapshots_patcher.stop)
+
+  def _WriteConfig(self, contents):
+    with open(self.config_file, 'w') as config_file:
+      config_file.write(contents)
+
+  def _Read(self, parse=True):
+    """Read the config file into a new parser.
+
+    Args:
+      parse: bool, False if the config file must not be parsed.
+
+    Returns:
+      Parser object, the parser the config file was read into.
+    """
+    config = parser.ConfigParser()
+    if not parse:
+      config.read = mock.Mock()
+    config_manager.ReadConfig(config, self.config_file)
+    return config
+
+  def testReadConfig(self):
+    config = self._Read()
+    self.assertEqual(config.sections(), ['Section', 'Empty'])
+    self.assertEqual(os.listdir(self.snapshot_dir), [
+        self.config_file.strip('/').replace('/', '_') + '.json'])
+    # Another process loads the snapshot without parsing the file.
+    config_manager._snapshots.clear()
+    config = self._Read(parse=False)
+    self.assertEqual(config.sections(), ['Section', 'Empty'])
+    self.assertEqual(
+        config.items('Section'), [('option', 'value'), ('other', '1')])
+
+  def testReadConfigChanged(self):
+    self._Read()
+    self._WriteConfig('[Section]\noption = changed\n')
+    config = self._Read()
+    self.assertEqual(config.get('Section', 'option'), 'changed')
+    config_manager._snapshots.clear()
+    config = self._Read(parse=False)
+    self.assertEqual(config.get('Section', 'option'), 'changed')
+
+  def testReadConfigMissing(self):
+    os.remove(self.config_file)
+    self.assertEqual(self._Read().sections(), [])
+    self.assertFalse(os.path.exists(self.snapshot_dir))
+
+  def testReadConfigCorruptSnapshot(self):
+    self._Read()
+    config_manager._snapshots.clear()
+    snapshot = os.path.join(self.snapshot_dir, os.listdir(self.snapshot_dir)[0])
+    with open(snapshot, 'w') as snapshot_file:
+      snapshot_file.write('{')
+    self.assertEqual(self._Read().get('Section', 'option'), 'value')
+
+  def testReadConfigInvalidSnapshot(self):
+    self._Read()
+    config_manager._snapshots.clear()
+    snapshot = os.path.join(self.snapshot_dir, os.listdir(self.snapshot_dir)[0])
+    with open(snapshot) as snapshot_file:
+      contents = json.load(snapshot_file)
+    # The second section fails after the first one was loaded.
+    contents['sections'] = [
+        ['Section', [['option', 'stale']]], ['Empty', None]]
+    with open(snapshot, 'w') as snapshot_file:
+      json.dump(contents, snapshot_file)
+    config = self._Read()
+    self.assertEqual(config.sections(), ['Section', 'Empty'])
+    self.assertEqual(
+        config.items('Section'), [('option', 'value'), ('other', '1')])
+
+  def testReadConfigPercent(self):
+    self._WriteConfig('[Section]\noption = 50%\nother = 1\n')
+    for _ in range(2):
+      config_manager._snapshots.clear()
+      config = self._Read()
+      self.assertEqual(config.get('Section', 'option', raw=True), '50%')
+      self.assertEqual(config.get('Section', 'other'), '1')
+    self.assertFalse(os.path.exists(self.snapshot_dir))
+
+  def testReadConfigPercentSnapshot(self):
+    # A snapshot with a percent sign written by an earlier version is parsed.
+    self._Read()
+    config_manager._snapshots.clear()
+    snapshot = os.path.join(self.snapshot_dir, os.listdir(self.snapshot_dir)[0])
+    with open(snapshot) as snapshot_file:
+      contents = json.load(snapshot_file)
+    contents['sections'] = [['Section', [['option', '50%']]]]
+    with open(snapshot, 'w') as snapshot_file:
+      json.dump(contents, snapshot_file)
+    config = self._Read()
+    self.assertEqual(config.get('Section', 'option'), 'value')
+
+  def testReadConfigDefaults(self):
+    self._WriteConfig('[DEFAULT]\nshared = 1\n\n[Section]\noption = value\n')
+    config = self._Read()
+    self.assertEqual(config.get('Section', 'shared'), '1')
+    self.assertFalse(os.path.exists(self.snapshot_dir))
+
+  @mock.patch('google_compute_engine.config_manager.file_utils')
+  def testWriteConfig(self, _):
+    with mock.patch.object(
+        config_manager.parser, 'Parser', parser.ConfigParser):
+      config = config_manager.ConfigManager(config_file=self.config_file)
+      config.SetOption('Section', 'option', 'updated')
+      config.WriteConfig()
+    # The written file is loaded from its snapshot without parsing.
+    config_manager._snapshots.clear()
+    config = self._Read(parse=False)
+    self.assertEqual(config.get('Section', 'option'), 'updated')
+
+
 if __name__ == '__main__':
   unittest.main()
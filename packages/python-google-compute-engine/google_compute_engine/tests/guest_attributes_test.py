@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for guest_attributes.py module."""
+
+import threading
+
+from google_compute_engine import guest_attributes
+from google_compute_engine.test_compat import httpserver
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import socketserver
+from google_compute_engine.test_compat import unittest
+
+
+class GuestAttributesWriterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.requests = []
+    self.connections = []
+    self.statuses = []
+    self.received = threading.Event()
+    self.release = threading.Event()
+    self.release.set()
+    self.addCleanup(self.release.set)
+    self.port = self._StartServer()
+
+  def _StartServer(self):
+    """Start a local HTTP/1.1 server recording PUT requests.
+
+    Returns:
+      int, the port of the server.
+    """
+    test = self
+
+    class Handler(httpserver.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def setup(self):
+        httpserver.BaseHTTPRequestHandler.setup(self)
+        test.connections.append(self)
+        self.count = 0
+
+      def do_PUT(self):
+        self.count += 1
+        length = int(self.headers.get('Content-Length'))
+        body = self.rfile.read(length).decode('utf-8')
+        if self.count > 1 and self.path.endswith('/stale'):
+          # Close the connection as if it timed out while idle.
+          self.close_connection = True
+          return
+        test.requests.append(
+            (self.path, body, self.headers.get('Metadata-Flavor')))
+        test.received.set()
+        test.release.wait(5)
+        status = test.statuses.pop(0) if test.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+      def log_message(self, *args):
+        pass
+
+    class Server(socketserver.ThreadingMixIn, httpserver.HTTPServer):
+      daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server.server_address[1]
+
+  def _Writer(self, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return guest_attributes.GuestAttributesWriter(
+        logger=self.mock_logger, host='127.0.0.1', port=self.port, timeout=5,
+        **kwargs)
+
+  def _Path(self, namespace, key):
+    return '%s/%s/%s' % (guest_attributes.GUEST_ATTRIBUTES_PATH, namespace, key)
+
+  def testWrite(self):
+    writer = self._Writer(max_connections=1)
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    writer.Write('hostkeys', 'ssh-ed25519', 'bar')
+    writer.Write('timings', 'boot', '1.5')
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(
+        self.requests, [
+            (self._Path('hostkeys', 'ssh-rsa'), 'foo', 'Google'),
+            (self._Path('hostkeys', 'ssh-ed25519'), 'bar', 'Google'),
+            (self._Path('timings', 'boot'), '1.5', 'Google'),
+        ])
+    # Every write reuses the same connection.
+    self.assertEqual(len(self.connections), 1)
+    self.mock_logger.debug.assert_any_call(
+        'Wrote guest attribute %s/%s.', 'timings', 'boot')
+
+  def testWriteConcurrent(self):
+    writer = self._Writer(max_connections=2)
+    self.release.clear()
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    writer.Write('hostkeys', 'ssh-ed25519', 'bar')
+    self.assertTrue(self.received.wait(5))
+    # The second write is sent while the first is still waiting.
+    self.assertFalse(writer.Flush(0.5))
+    self.assertEqual(len(self.requests), 2)
+    self.release.set()
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(len(self.connections), 2)
+
+  def testWriteCoalesce(self):
+    writer = self._Writer(max_connections=2)
+    self.release.clear()
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(self.received.wait(5))
+    writer.Write('hostkeys', 'ssh-rsa', 'bar')
+    writer.Write('hostkeys', 'ssh-rsa', 'baz')
+    self.release.set()
+    self.assertTrue(writer.Flush(5))
+    # The key is not sent twice at once and only its latest value is resent.
+    self.assertEqual(
+        [body for _, body, _ in self.requests], ['foo', 'baz'])
+
+  def testWriteRetry(self):
+    self.statuses = [500, 429, 200]
+    writer = self._Writer()
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(len(self.requests), 3)
+    self.mock_logger.debug.assert_called_once_with(
+        'Wrote guest attribute %s/%s.', 'hostkeys', 'ssh-rsa')
+    self.mock_logger.info.assert_not_called()
+
+  def testWriteRetryLimit(self):
+    self.statuses = [503] * 5
+    writer = self._Writer(retry_limit=2)
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(len(self.requests), 3)
+    self.mock_logger.info.assert_called_once_with(
+        'Unable to write guest attribute %s/%s. %s.', 'hostkeys', 'ssh-rsa',
+        'HTTP status 503')
+
+  def testWriteClientError(self):
+    self.statuses = [403]
+    writer = self._Writer()
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(len(self.requests), 1)
+    self.mock_logger.info.assert_called_once_with(
+        'Unable to write guest attribute %s/%s. %s.', 'hostkeys', 'ssh-rsa',
+        'HTTP status 403')
+
+  def testWriteReconnect(self):
+    # A long backoff shows the closed connection is replaced without waiting.
+    writer = self._Writer(max_connections=1, backoff=60)
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(writer.Flush(5))
+    writer.Write('hostkeys', 'stale', 'bar')
+    self.assertTrue(writer.Flush(5))
+    self.assertEqual(
+        [body for _, body, _ in self.requests], ['foo', 'bar'])
+    self.assertEqual(len(self.connections), 2)
+    self.mock_logger.info.assert_not_called()
+
+  def testWriteConnectionError(self):
+    writer = self._Writer(retry_limit=1)
+    # Nothing listens on port 0, so every connection is refused.
+    writer.port = 0
+    writer.Write('hostkeys', 'ssh-rsa', 'foo')
+    self.assertTrue(writer.Flush(5))
+    self.mock_logger.info.assert_called_once_with(
+        'Unable to write guest attribute %s/%s. %s.', 'hostkeys', 'ssh-rsa',
+        mock.ANY)
+
+  def testFlushEmpty(self):
+    writer = self._Writer()
+    self.assertTrue(writer.Flush(0))
+    self.assertEqual(writer.workers, [])
+
+  def testGetGuestAttributesWriter(self):
+    with mock.patch.object(guest_attributes, '_shared_writer', None):
+      writer = guest_attributes.GetGuestAttributesWriter(
+          logger=self.mock_logger)
+      self.assertIs(guest_attributes.GetGuestAttributesWriter(), writer)
+      self.assertEqual(writer.logger, self.mock_logger)
+
+
+if __name__ == '__main__':
+  unittest.main()
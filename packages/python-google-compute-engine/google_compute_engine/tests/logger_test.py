@@ -50,5 +50,74 @@ class LoggerTest(unittest.TestCase):
     self.assertEqual(named_logger.handlers, [mock_null])
 
 
+class _RecordingHandler(logger.logging.Handler):
+  """A handler recording its records and the number of times it is locked."""
+
+  def __init__(self, level=logger.logging.NOTSET):
+    logger.logging.Handler.__init__(self, level=level)
+    self.records = []
+    self.acquired = 0
+
+  def acquire(self):
+    self.acquired += 1
+    logger.logging.Handler.acquire(self)
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+class LogLinesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.logger = logger.logging.getLogger('log-lines-test')
+    self.logger.handlers = []
+    self.logger.propagate = False
+    self.logger.setLevel(logger.logging.DEBUG)
+    self.handler = _RecordingHandler()
+    self.logger.addHandler(self.handler)
+    self.addCleanup(setattr, self.logger, 'handlers', [])
+
+  def testLogLines(self):
+    lines = ['line %s' % index for index in range(1000)]
+    with mock.patch.object(
+        logger.logging.LogRecord, '__init__',
+        side_effect=logger.logging.LogRecord.__init__,
+        autospec=True) as mock_init:
+      logger.LogLines(self.logger, lines)
+    self.assertEqual(
+        [record.getMessage() for record in self.handler.records], lines)
+    self.assertEqual(
+        set((record.levelno, record.name) for record in self.handler.records),
+        set([(logger.logging.INFO, 'log-lines-test')]))
+    # The handler is locked and a full record is created once per batch.
+    self.assertEqual(self.handler.acquired, 1)
+    self.assertEqual(mock_init.call_count, 1)
+
+  def testLogLinesFormat(self):
+    self.handler.setFormatter(
+        logger.logging.Formatter('test: %(levelname)s %(message)s'))
+    logger.LogLines(self.logger, ['50% done'])
+    self.assertEqual(
+        self.handler.format(self.handler.records[0]), 'test: INFO 50% done')
+
+  def testLogLinesLevel(self):
+    warning_handler = _RecordingHandler(level=logger.logging.WARNING)
+    self.logger.addHandler(warning_handler)
+    logger.LogLines(self.logger, ['a'])
+    self.assertEqual(len(self.handler.records), 1)
+    self.assertEqual(warning_handler.records, [])
+    self.assertEqual(warning_handler.acquired, 0)
+
+    self.logger.setLevel(logger.logging.WARNING)
+    logger.LogLines(self.logger, ['b'])
+    self.assertEqual(len(self.handler.records), 1)
+
+  def testLogLinesMockLogger(self):
+    mock_logger = mock.Mock()
+    logger.LogLines(mock_logger, ['a', 'b'])
+    self.assertEqual(
+        mock_logger.info.mock_calls, [mock.call('a'), mock.call('b')])
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -355,5 +355,27 @@ class MetadataWatcherTest(unittest.TestCase):
     self.mock_watcher.logger.exception.assert_not_called()
 
 
+class MetadataContextTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_watcher = mock.Mock()
+    self.context = metadata_watcher.MetadataContext(self.mock_watcher)
+
+  def testMetadataContext(self):
+    self.assertEqual(self.context.logger, self.mock_watcher.logger)
+    self.assertIsNone(self.context.Get('instance/id'))
+
+  def testFetch(self):
+    metadata = {'instance': {'id': 123, 'attributes': {'foo': 'bar'}}}
+    self.mock_watcher.GetMetadata.return_value = metadata
+    self.assertEqual(self.context.Fetch(), metadata)
+    self.assertEqual(self.context.Get('instance/id'), 123)
+    self.assertEqual(self.context.Get('instance/attributes/foo'), 'bar')
+    self.assertEqual(self.context.Get('instance/attributes/baz', ''), '')
+    self.assertIsNone(self.context.Get('instance/id/foo'))
+    self.assertIsNone(self.context.Get('project'))
+    self.mock_watcher.GetMetadata.assert_called_once_with()
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -104,3 +104,32 @@ class NetworkUtilsTest(unittest.TestCase):
     self.assertIsNone(self.mock_utils.GetNetworkInterface('invalid'))
     self.assertEqual(
         self.mock_utils.GetNetworkInterface('address'), 'interface')
+
+  @mock.patch('google_compute_engine.network_utils.os.path')
+  def testGetNetworkInterfaceRemoved(self, mock_path):
+    mock_path.isdir.return_value = True
+    mock_path.exists.return_value = False
+    self.mock_utils.rescan_time = 0
+    self.mock_utils._CreateInterfaceMap = mock.Mock(
+        return_value={'address': 'renamed'})
+    self.assertEqual(
+        self.mock_utils.GetNetworkInterface('address'), 'renamed')
+    self.mock_utils._CreateInterfaceMap.assert_called_once_with()
+
+  @mock.patch('google_compute_engine.network_utils.time')
+  def testGetNetworkInterfaceRescan(self, mock_time):
+    mock_time.time.return_value = 100
+    self.mock_utils.rescan_time = 0
+    self.mock_utils._CreateInterfaceMap = mock.Mock(
+        return_value={'address': 'interface', 'new': 'hotplug'})
+    self.assertEqual(self.mock_utils.GetNetworkInterface('new'), 'hotplug')
+    self.assertEqual(self.mock_utils.rescan_time, 100)
+
+    # A second miss within the rescan interval does not rescan.
+    mock_time.time.return_value = 102
+    self.assertIsNone(self.mock_utils.GetNetworkInterface('invalid'))
+    self.mock_utils._CreateInterfaceMap.assert_called_once_with()
+
+    mock_time.time.return_value = 106
+    self.assertIsNone(self.mock_utils.GetNetworkInterface('invalid'))
+    self.assertEqual(self.mock_utils._CreateInterfaceMap.call_count, 2)
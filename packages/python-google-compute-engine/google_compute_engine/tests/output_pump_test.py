@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for output_pump.py module."""
+
+import os
+import shutil
+import tempfile
+
+from google_compute_engine import output_pump
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class OutputPumpTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+
+  def _CreateStream(self, data):
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, data)
+    os.close(write_fd)
+    stream = os.fdopen(read_fd, 'rb')
+    self.addCleanup(stream.close)
+    return stream
+
+  def testPump(self):
+    pump = output_pump.OutputPump(self.mock_logger, prefix='foo')
+    pump.Pump(self._CreateStream(b'a\n\nb\nc'))
+    self.assertEqual(
+        self.mock_logger.info.mock_calls,
+        [mock.call('foo: a'), mock.call('foo: b'), mock.call('foo: c')])
+    self.mock_logger.warning.assert_not_called()
+
+  def testPumpBatchesRecords(self):
+    pump_logger = output_pump.logger.logging.getLogger('output-pump-test')
+    pump_logger.propagate = False
+    pump_logger.setLevel(output_pump.logger.logging.DEBUG)
+    mock_handler = mock.Mock(level=0)
+    pump_logger.handlers = [mock_handler]
+    self.addCleanup(setattr, pump_logger, 'handlers', [])
+    pump = output_pump.OutputPump(pump_logger, prefix='foo')
+    pump.Pump(self._CreateStream(b'a\nb\nc\n'))
+    self.assertEqual(
+        [call[1][0].getMessage() for call in mock_handler.emit.mock_calls],
+        ['foo: a', 'foo: b', 'foo: c'])
+    mock_handler.acquire.assert_called_once_with()
+
+  def testPumpSmallChunks(self):
+    pump = output_pump.OutputPump(self.mock_logger, chunk_size=4)
+    pump.Pump(self._CreateStream(b'abcdefghij\nk\n'))
+    self.assertEqual(
+        self.mock_logger.info.mock_calls,
+        [mock.call('abcd'), mock.call('efgh'), mock.call('ij'),
+         mock.call('k')])
+
+  def testPumpDecodeError(self):
+    pump = output_pump.OutputPump(self.mock_logger)
+    pump.Pump(self._CreateStream(b'\xff\n'))
+    self.mock_logger.info.assert_called_once_with(u'\ufffd')
+
+  def testPumpNoRateLimit(self):
+    pump = output_pump.OutputPump(self.mock_logger)
+    pump.Pump(self._CreateStream(b'x\n' * 5000))
+    self.assertEqual(self.mock_logger.info.call_count, 5000)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.output_pump.time.time')
+  def testPumpRateLimit(self, mock_time):
+    mock_time.side_effect = [0, 0, 10]
+    pump = output_pump.OutputPump(self.mock_logger, rate=0.1, burst=2)
+    pump._Emit(['a', 'b', 'c', 'd'])
+    self.mock_logger.warning.assert_not_called()
+    pump._Emit(['e', 'f'])
+    pump._ReportSuppressed()
+    self.assertEqual(
+        self.mock_logger.mock_calls, [
+            mock.call.info('a'),
+            mock.call.info('b'),
+            mock.call.warning('2 lines suppressed.'),
+            mock.call.info('e'),
+            mock.call.warning('1 lines suppressed.'),
+        ])
+
+  def testPumpRunLog(self):
+    path = os.path.join(self.temp_dir, 'output.log')
+    run_log = output_pump.RunLog(path)
+    pump = output_pump.OutputPump(
+        self.mock_logger, prefix='foo', run_log=run_log, rate=0.1, burst=1)
+    pump.Pump(self._CreateStream(b'a\nb\n'))
+    run_log.Close()
+    with open(path) as log_file:
+      self.assertEqual(log_file.read(), 'foo: a\nfoo: b\n')
+    self.mock_logger.info.assert_called_once_with('foo: a')
+    self.mock_logger.warning.assert_called_once_with(
+        'foo: 1 lines suppressed.')
+
+  def testRunLogRotate(self):
+    path = os.path.join(self.temp_dir, 'logs', 'output.log')
+    for run in range(4):
+      run_log = output_pump.RunLog(path, backup_count=2)
+      run_log.Write(['run %s' % run])
+      run_log.Close()
+    self.assertEqual(
+        sorted(os.listdir(os.path.dirname(path))),
+        ['output.log', 'output.log.1', 'output.log.2'])
+    for suffix, run in (('', 3), ('.1', 2), ('.2', 1)):
+      with open(path + suffix) as log_file:
+        self.assertEqual(log_file.read(), 'run %s\n' % run)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for task_graph.py module."""
+
+import threading
+
+from google_compute_engine import task_graph
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class TaskGraphTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.order = []
+    self.lock = threading.Lock()
+
+  def _Record(self, name, error=None):
+    def _Func():
+      with self.lock:
+        self.order.append(name)
+      if error:
+        raise error
+    return _Func
+
+  def testRunTasksOrder(self):
+    tasks = [
+        task_graph.Task('c', self._Record('c'), after=['a', 'b']),
+        task_graph.Task('b', self._Record('b'), after=['a']),
+        task_graph.Task('a', self._Record('a')),
+    ]
+    result = task_graph.RunTasks(tasks, logger=self.mock_logger)
+    self.assertEqual(result, tasks)
+    self.assertEqual(self.order, ['a', 'b', 'c'])
+    self.assertTrue(all(task.succeeded for task in tasks))
+    self.mock_logger.warning.assert_not_called()
+
+  def testRunTasksConcurrent(self):
+    barrier = threading.Event()
+    started = []
+    waited = []
+
+    def _Wait(name):
+      def _Func():
+        started.append(name)
+        if len(started) == 2:
+          barrier.set()
+        # Both tasks must be running at once for the barrier to be set.
+        waited.append(barrier.wait(5))
+      return _Func
+
+    tasks = [
+        task_graph.Task('a', _Wait('a')),
+        task_graph.Task('b', _Wait('b')),
+    ]
+    task_graph.RunTasks(tasks, logger=self.mock_logger)
+    self.assertEqual(sorted(started), ['a', 'b'])
+    self.assertEqual(waited, [True, True])
+
+  def testRunTasksMaxWorkers(self):
+    running = []
+    counts = []
+
+    def _Func():
+      with self.lock:
+        running.append(1)
+        counts.append(len(running))
+      with self.lock:
+        running.pop()
+
+    tasks = [task_graph.Task(str(index), _Func) for index in range(5)]
+    task_graph.RunTasks(tasks, max_workers=1, logger=self.mock_logger)
+    self.assertEqual(counts, [1] * 5)
+
+  def testRunTasksFailure(self):
+    tasks = [
+        task_graph.Task('a', self._Record('a', ValueError('Error'))),
+        task_graph.Task('b', self._Record('b'), after=['a']),
+        task_graph.Task('c', self._Record('c'), after=['b']),
+        task_graph.Task('d', self._Record('d')),
+        task_graph.Task('e', self._Record('e'), after=['d']),
+    ]
+    task_graph.RunTasks(tasks, logger=self.mock_logger)
+    self.assertEqual(sorted(self.order), ['a', 'd', 'e'])
+    self.assertFalse(tasks[0].succeeded)
+    self.assertTrue(tasks[1].skipped)
+    self.assertTrue(tasks[2].skipped)
+    self.assertIsNone(tasks[2].duration)
+    self.assertTrue(tasks[4].succeeded)
+    self.assertEqual(
+        self.mock_logger.warning.mock_calls, [
+            mock.call('Exception running %s. %s.', 'a', tasks[0].error),
+            mock.call('Skipping %s since %s failed.', 'b', 'a'),
+            mock.call('Skipping %s since %s failed.', 'c', 'b'),
+        ])
+
+  def testRunTasksUnknownDependency(self):
+    tasks = [task_graph.Task('a', self._Record('a'), after=['unknown'])]
+    task_graph.RunTasks(tasks, logger=self.mock_logger)
+    self.assertEqual(self.order, ['a'])
+
+  def testRunTasksCycle(self):
+    tasks = [
+        task_graph.Task('a', self._Record('a'), after=['b']),
+        task_graph.Task('b', self._Record('b'), after=['a']),
+    ]
+    task_graph.RunTasks(tasks, logger=self.mock_logger)
+    self.assertEqual(self.order, ['a', 'b'])
+    self.mock_logger.warning.assert_called_once_with(
+        'Dependency cycle in tasks. Running %s.', 'a')
+
+  def testRunTasksNoTimings(self):
+    tasks = [task_graph.Task('a', self._Record('a'))]
+    task_graph.RunTasks(tasks, logger=self.mock_logger, log_timings=False)
+    self.assertEqual(self.order, ['a'])
+    self.mock_logger.info.assert_not_called()
+
+  def testRunTasksEmpty(self):
+    self.assertEqual(task_graph.RunTasks([], logger=self.mock_logger), [])
+
+  def testGetCriticalPath(self):
+    tasks = [
+        task_graph.Task('a', None),
+        task_graph.Task('b', None),
+        task_graph.Task('c', None, after=['a', 'b']),
+        task_graph.Task('d', None, after=['a']),
+        task_graph.Task('e', None, after=['missing']),
+    ]
+    times = {'a': (0, 1), 'b': (0, 3), 'c': (3, 5), 'd': (1, 4)}
+    for task in tasks:
+      if task.name in times:
+        task.start_time, task.end_time = times[task.name]
+    path = task_graph.GetCriticalPath(tasks)
+    self.assertEqual([task.name for task in path], ['b', 'c'])
+    self.assertEqual(task_graph.GetCriticalPath(tasks[4:]), [])
+
+  @mock.patch('google_compute_engine.task_graph.time.time')
+  def testLogTimings(self, mock_time):
+    mock_time.return_value = 10
+    tasks = [
+        task_graph.Task('a', None),
+        task_graph.Task('b', None, after=['a']),
+        task_graph.Task('c', None, after=['b']),
+    ]
+    tasks[0].start_time, tasks[0].end_time = 0, 2
+    tasks[1].start_time, tasks[1].end_time = 2, 3
+    tasks[1].error = ValueError()
+    tasks[2].skipped = True
+    task_graph._LogTimings(tasks, 0, self.mock_logger)
+    self.assertEqual(
+        self.mock_logger.info.mock_calls, [
+            mock.call(
+                'Finished %s tasks in %.3f seconds: %s.', 3, 10,
+                'a 2.000s, b 1.000s failed, c skipped'),
+            mock.call('Critical path: %s.', 'a 2.000s -> b 1.000s'),
+        ])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for token_provider.py module."""
+
+import threading
+
+from google_compute_engine import token_provider
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class TokenProviderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.provider = token_provider.TokenProvider(
+        logger=self.mock_logger, refresh_margin=60)
+    self.provider.watcher = mock.Mock()
+    self.mock_get_metadata = self.provider.watcher.GetMetadata
+
+  def _Response(self, access_token, expires_in=3600):
+    return {
+        'access_token': access_token,
+        'expires_in': expires_in,
+        'token_type': 'Bearer',
+    }
+
+  @mock.patch('google_compute_engine.token_provider.time.time')
+  def testGetToken(self, mock_time):
+    mock_time.return_value = 1000
+    self.mock_get_metadata.return_value = self._Response('foo')
+    token = self.provider.GetToken()
+    self.assertEqual(token.authorization, 'Bearer foo')
+    self.assertEqual(token.expiry, 4600)
+    self.assertEqual(self.provider.GetToken(), token)
+    self.mock_get_metadata.assert_called_once_with(
+        'instance/service-accounts/default/token', recursive=False,
+        retry_limit=3)
+
+  @mock.patch('google_compute_engine.token_provider.time.time')
+  def testGetTokenByServiceAccount(self, mock_time):
+    mock_time.return_value = 1000
+    self.mock_get_metadata.side_effect = [
+        self._Response('foo'), self._Response('bar')]
+    self.assertEqual(self.provider.GetToken('a').access_token, 'foo')
+    self.assertEqual(self.provider.GetToken('b').access_token, 'bar')
+    self.assertEqual(self.provider.GetToken('a').access_token, 'foo')
+    self.assertEqual(
+        self.mock_get_metadata.mock_calls, [
+            mock.call('instance/service-accounts/a/token', recursive=False,
+                      retry_limit=3),
+            mock.call('instance/service-accounts/b/token', recursive=False,
+                      retry_limit=3),
+        ])
+
+  @mock.patch('google_compute_engine.token_provider.time.time')
+  def testGetTokenRefresh(self, mock_time):
+    mock_time.return_value = 1000
+    self.mock_get_metadata.side_effect = [
+        self._Response('foo', expires_in=100), self._Response('bar')]
+    self.assertEqual(self.provider.GetToken().access_token, 'foo')
+    mock_time.return_value = 1039
+    self.assertEqual(self.provider.GetToken().access_token, 'foo')
+    # The token is refreshed within a minute of expiring.
+    mock_time.return_value = 1041
+    self.assertEqual(self.provider.GetToken().access_token, 'bar')
+
+  @mock.patch('google_compute_engine.token_provider.time.time')
+  def testGetTokenRefreshFailure(self, mock_time):
+    mock_time.return_value = 1000
+    self.mock_get_metadata.side_effect = [
+        self._Response('foo', expires_in=100), None, None]
+    self.provider.GetToken()
+    mock_time.return_value = 1050
+    self.assertEqual(self.provider.GetToken().access_token, 'foo')
+    mock_time.return_value = 1100
+    self.assertIsNone(self.provider.GetToken())
+    self.mock_logger.debug.assert_called_once_with(mock.ANY, 'default')
+
+  def testGetTokenSingleFlight(self):
+    event = threading.Event()
+    results = []
+
+    def _GetMetadata(*args, **kwargs):
+      event.wait()
+      return self._Response('foo')
+
+    self.mock_get_metadata.side_effect = _GetMetadata
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(self.provider.GetToken()))
+        for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    event.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(len(results), 5)
+    self.assertEqual(len(set(id(token) for token in results)), 1)
+    self.mock_get_metadata.assert_called_once_with(
+        mock.ANY, recursive=False, retry_limit=3)
+    self.assertEqual(self.provider.refreshing, {})
+
+  def testInvalidate(self):
+    self.mock_get_metadata.side_effect = [
+        self._Response('foo'), self._Response('bar')]
+    token = self.provider.GetToken()
+    self.provider.Invalidate(token)
+    new_token = self.provider.GetToken()
+    self.assertEqual(new_token.access_token, 'bar')
+    # Invalidating a token that was already replaced keeps the new token.
+    self.provider.Invalidate(token)
+    self.assertEqual(self.provider.GetToken(), new_token)
+
+  def testInvalidExpiry(self):
+    self.mock_get_metadata.return_value = self._Response('foo', 'invalid')
+    self.assertEqual(self.provider.GetToken().access_token, 'foo')
+    self.provider.GetToken()
+    self.assertEqual(self.mock_get_metadata.call_count, 2)
+
+  def testGetTokenProvider(self):
+    with mock.patch.object(token_provider, '_shared_provider', None):
+      provider = token_provider.GetTokenProvider(logger=self.mock_logger)
+      self.assertIs(token_provider.GetTokenProvider(), provider)
+      self.assertEqual(provider.logger, self.mock_logger)
+
+
+if __name__ == '__main__':
+  unittest.main()
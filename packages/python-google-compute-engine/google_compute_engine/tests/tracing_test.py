@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for tracing.py module."""
+
+import json
+import os
+import shutil
+import tempfile
+
+from google_compute_engine import tracing
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class TracingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.path = os.path.join(self.temp_dir, 'trace', 'boot_trace.json')
+    patcher = mock.patch.object(tracing, '_tracer', None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _ReadEvents(self):
+    with open(self.path) as trace_file:
+      data = trace_file.read()
+    self.assertTrue(data.startswith('[\n'))
+    # Trace viewers accept the array without its closing bracket.
+    return json.loads(data.rstrip(',\n') + ']')
+
+  @mock.patch('google_compute_engine.tracing._Now')
+  def testSpan(self, mock_now):
+    mock_now.side_effect = [1.5, 2.25]
+    tracer = tracing.Tracer(self.path, 'test', logger=self.mock_logger)
+    with tracer.Span('step', key='value') as span_args:
+      span_args['result'] = 0
+    tracer.Close()
+    events = self._ReadEvents()
+    self.assertEqual(events[0], {
+        'name': 'process_name',
+        'ph': 'M',
+        'pid': os.getpid(),
+        'args': {'name': 'test'},
+    })
+    self.assertEqual(events[1], {
+        'name': 'step',
+        'cat': 'boot',
+        'ph': 'X',
+        'ts': 1500000,
+        'dur': 750000,
+        'pid': os.getpid(),
+        'tid': mock.ANY,
+        'args': {'key': 'value', 'result': 0},
+    })
+
+  def testSpanException(self):
+    tracer = tracing.Tracer(self.path, 'test', logger=self.mock_logger)
+    with self.assertRaises(ValueError):
+      with tracer.Span('step'):
+        raise ValueError()
+    events = self._ReadEvents()
+    self.assertEqual([event['name'] for event in events],
+                     ['process_name', 'step'])
+
+  def testMark(self):
+    tracer = tracing.Tracer(self.path, 'test', logger=self.mock_logger)
+    tracer.Mark('first', key='value')
+    tracer.Mark('first')
+    events = self._ReadEvents()
+    self.assertEqual(len(events), 2)
+    self.assertEqual(events[1]['name'], 'first')
+    self.assertEqual(events[1]['ph'], 'i')
+    self.assertEqual(events[1]['s'], 'p')
+    self.assertEqual(events[1]['args'], {'key': 'value'})
+
+  def testSharedTraceFile(self):
+    first = tracing.Tracer(self.path, 'first', logger=self.mock_logger)
+    second = tracing.Tracer(self.path, 'second', logger=self.mock_logger)
+    with first.Span('a'):
+      with second.Span('b'):
+        pass
+    events = self._ReadEvents()
+    self.assertEqual(
+        [event['name'] for event in events],
+        ['process_name', 'process_name', 'b', 'a'])
+    self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                     ['boot_trace.json'])
+
+  def testMaxSize(self):
+    tracer = tracing.Tracer(
+        self.path, 'test', logger=self.mock_logger, max_size=200)
+    for _ in range(5):
+      with tracer.Span('step'):
+        pass
+    self.assertIsNone(tracer.fd)
+    self.assertLessEqual(os.path.getsize(self.path), 200)
+    self.mock_logger.debug.assert_called_once_with(
+        'Trace file is full. Not recording trace events.')
+    self._ReadEvents()
+
+  def testOpenError(self):
+    os.chmod(self.temp_dir, 0o500)
+    self.addCleanup(os.chmod, self.temp_dir, 0o700)
+    if os.access(self.temp_dir, os.W_OK):
+      self.skipTest('Directory permissions are not enforced.')
+    tracer = tracing.Tracer(self.path, 'test', logger=self.mock_logger)
+    with tracer.Span('step'):
+      pass
+    self.assertIsNone(tracer.fd)
+    self.mock_logger.debug.assert_called_once_with(
+        'Not recording trace events. %s.', mock.ANY)
+
+  def testConfigure(self):
+    with tracing.Span('ignored') as span_args:
+      span_args['key'] = 'value'
+    tracing.Mark('ignored')
+    self.assertFalse(os.path.exists(self.path))
+
+    tracing.Configure('test', trace_file=self.path, logger=self.mock_logger)
+    with tracing.Span('step'):
+      tracing.Mark('mark')
+    self.assertEqual(
+        [event['name'] for event in self._ReadEvents()],
+        ['process_name', 'mark', 'step'])
+
+    tracing.Configure('test', trace_file='')
+    self.assertIsNone(tracing._tracer)
+
+  @mock.patch('google_compute_engine.tracing.Tracer')
+  def testConfigureDefault(self, mock_tracer):
+    tracing.Configure('test')
+    mock_tracer.assert_called_once_with(
+        tracing.TRACE_FILE, 'test', logger=mock.ANY)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for worker_pool.py module."""
+
+import threading
+
+from google_compute_engine import worker_pool
+from google_compute_engine.test_compat import mock
+from google_compute_engine.test_compat import unittest
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.mock_logger = mock.Mock()
+
+  def testParallelMap(self):
+    results = worker_pool.ParallelMap(
+        lambda x: x * 2, [1, 2, 3, 4, 5], max_workers=2,
+        logger=self.mock_logger)
+    self.assertEqual(results, [2, 4, 6, 8, 10])
+    self.mock_logger.exception.assert_not_called()
+
+  def testParallelMapEmpty(self):
+    self.assertEqual(worker_pool.ParallelMap(lambda x: x, []), [])
+
+  def testParallelMapConcurrent(self):
+    barrier = threading.Event()
+    started = []
+
+    def _Wait(item):
+      started.append(item)
+      if len(started) == 3:
+        barrier.set()
+      # Every item blocks until all three workers are running.
+      return barrier.wait(5)
+
+    results = worker_pool.ParallelMap(
+        _Wait, ['a', 'b', 'c'], max_workers=3, logger=self.mock_logger)
+    self.assertEqual(results, [True, True, True])
+
+  def testParallelMapBounded(self):
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def _Track(item):
+      with lock:
+        state['active'] += 1
+        state['peak'] = max(state['peak'], state['active'])
+      threading.Event().wait(0.01)
+      with lock:
+        state['active'] -= 1
+      return item
+
+    results = worker_pool.ParallelMap(
+        _Track, list(range(10)), max_workers=2, logger=self.mock_logger)
+    self.assertEqual(results, list(range(10)))
+    self.assertLessEqual(state['peak'], 2)
+
+  def testParallelMapException(self):
+
+    def _Raise(item):
+      if item == 'b':
+        raise ValueError('Test Error')
+      return item
+
+    results = worker_pool.ParallelMap(
+        _Raise, ['a', 'b', 'c'], max_workers=1, logger=self.mock_logger)
+    self.assertEqual(results, ['a', None, 'c'])
+    self.mock_logger.exception.assert_called_once_with(
+        mock.ANY, 'b', mock.ANY)
+
+
+if __name__ == '__main__':
+  unittest.main()
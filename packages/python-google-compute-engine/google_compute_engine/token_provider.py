@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache of service account access tokens from the metadata server."""
+
+import logging
+import threading
+import time
+
+from google_compute_engine import metadata_watcher
+
+REFRESH_MARGIN = 60
+TOKEN_METADATA_KEY = 'instance/service-accounts/%s/token'
+
+_shared_provider = None
+_shared_lock = threading.Lock()
+
+
+class Token(object):
+  """An OAuth 2.0 access token for a service account."""
+
+  def __init__(self, service_account, token_type, access_token, expiry):
+    """Constructor.
+
+    Args:
+      service_account: string, the service account the token belongs to.
+      token_type: string, the type of the token, such as Bearer.
+      access_token: string, the access token.
+      expiry: float, the time in seconds since the epoch the token expires.
+    """
+    self.service_account = service_account
+    self.token_type = token_type
+    self.access_token = access_token
+    self.expiry = expiry
+
+  @property
+  def authorization(self):
+    """string, the value of an Authorization header using the token."""
+    return '%s %s' % (self.token_type, self.access_token)
+
+
+class TokenProvider(object):
+  """Retrieves access tokens and reuses them until shortly before expiry.
+
+  Tokens are cached by service account. A token is refreshed once it is
+  within the refresh margin of expiring. Concurrent callers needing a refresh
+  wait for a single request to the metadata server. If the refresh fails, the
+  cached token is used until it expires.
+  """
+
+  def __init__(self, logger=None, refresh_margin=REFRESH_MARGIN):
+    """Constructor.
+
+    Args:
+      logger: logger object, used to write to SysLog and serial port.
+      refresh_margin: int, the number of seconds before expiry a token is
+          refreshed.
+    """
+    self.logger = logger or logging
+    self.refresh_margin = refresh_margin
+    self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    self.tokens = {}
+    self.refreshing = {}
+    self.lock = threading.Lock()
+
+  def _FetchToken(self, service_account):
+    """Retrieve a new access token from the metadata server.
+
+    Args:
+      service_account: string, the service account to get a token for.
+
+    Returns:
+      Token, the access token or None if not retrieved.
+    """
+    now = time.time()
+    response = self.watcher.GetMetadata(
+        TOKEN_METADATA_KEY % service_account, recursive=False, retry_limit=3)
+    if not response:
+      return None
+    try:
+      expires_in = int(response.get('expires_in', 0))
+    except (TypeError, ValueError):
+      expires_in = 0
+    return Token(
+        service_account, response.get('token_type', ''),
+        response.get('access_token', ''), now + expires_in)
+
+  def _GetCachedToken(self, service_account, fresh):
+    """Get a cached token that has not expired.
+
+    Args:
+      service_account: string, the service account to get a token for.
+      fresh: bool, True if the token must be outside the refresh margin.
+
+    Returns:
+      Token, the cached access token or None if not usable.
+    """
+    token = self.tokens.get(service_account)
+    margin = self.refresh_margin if fresh else 0
+    if token and token.expiry - margin > time.time():
+      return token
+    return None
+
+  def GetToken(self, service_account='default'):
+    """Get an access token, refreshing it if it is about to expire.
+
+    Args:
+      service_account: string, the service account to get a token for.
+
+    Returns:
+      Token, the access token or None if no token is available.
+    """
+    with self.lock:
+      token = self._GetCachedToken(service_account, fresh=True)
+      if token:
+        return token
+      event = self.refreshing.get(service_account)
+      leader = event is None
+      if leader:
+        event = threading.Event()
+        self.refreshing[service_account] = event
+
+    if not leader:
+      event.wait()
+      with self.lock:
+        return self._GetCachedToken(service_account, fresh=False)
+
+    token = None
+    try:
+      token = self._FetchToken(service_account)
+    finally:
+      with self.lock:
+        if token:
+          self.tokens[service_account] = token
+        else:
+          token = self._GetCachedToken(service_account, fresh=False)
+        del self.refreshing[service_account]
+        event.set()
+    if not token:
+      self.logger.debug(
+          'Access token for %s service account not found.', service_account)
+    return token
+
+  def Invalidate(self, token):
+    """Remove a token rejected by a server so the next request refreshes it.
+
+    Args:
+      token: Token, the access token that was rejected.
+    """
+    with self.lock:
+      if self.tokens.get(token.service_account) is token:
+        del self.tokens[token.service_account]
+
+
+def GetTokenProvider(logger=None):
+  """Get the token provider shared within this process.
+
+  Args:
+    logger: logger object, used by the provider if it is created.
+
+  Returns:
+    TokenProvider, the shared token provider.
+  """
+  global _shared_provider
+  with _shared_lock:
+    if _shared_provider is None:
+      _shared_provider = TokenProvider(logger=logger)
+    return _shared_provider
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A library for recording a boot timeline in the Chrome trace format.
+
+Each process appends events to a shared trace file with one write per event.
+The file is a JSON array without the closing bracket, which trace viewers
+such as chrome://tracing and Perfetto accept. Timestamps use the monotonic
+clock, so events from different processes share a timeline.
+"""
+
+import contextlib
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+TRACE_FILE = '/run/google-compute-engine/boot_trace.json'
+MAX_SIZE = 4 * 1024 * 1024
+
+_Now = getattr(time, 'monotonic', time.time)
+
+_tracer = None
+
+
+class Tracer(object):
+  """Appends trace events for one process to a trace file."""
+
+  def __init__(self, path, process_name, logger=logging, max_size=MAX_SIZE):
+    """Constructor.
+
+    Args:
+      path: string, the path of the trace file.
+      process_name: string, the name shown for the process in the trace.
+      logger: logger object, used to write to SysLog and serial port.
+      max_size: int, the size in bytes after which events are dropped.
+    """
+    self.path = path
+    self.logger = logger
+    self.max_size = max_size
+    self.pid = os.getpid()
+    self.marks = set()
+    self.lock = threading.Lock()
+    self.fd = None
+    try:
+      self.fd = self._Open()
+    except (IOError, OSError) as e:
+      self.logger.debug('Not recording trace events. %s.', e)
+    self._Write({
+        'name': 'process_name',
+        'ph': 'M',
+        'pid': self.pid,
+        'args': {'name': process_name},
+    })
+
+  def _Open(self):
+    """Open the trace file for appending, creating it if needed.
+
+    The file is created with its opening bracket by linking a complete
+    temporary file into place, so concurrent processes never append events
+    before the bracket.
+
+    Returns:
+      int, the file descriptor of the trace file.
+    """
+    directory = os.path.dirname(self.path)
+    if not os.path.isdir(directory):
+      os.makedirs(directory, 0o755)
+    if not os.path.exists(self.path):
+      fd, temp_path = tempfile.mkstemp(dir=directory)
+      try:
+        os.write(fd, b'[\n')
+        os.close(fd)
+        os.link(temp_path, self.path)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+      finally:
+        os.remove(temp_path)
+    return os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+  def _Write(self, event):
+    """Append an event to the trace file.
+
+    Args:
+      event: dict, the trace event.
+    """
+    if self.fd is None:
+      return
+    data = (json.dumps(event, separators=(',', ':')) + ',\n').encode('utf-8')
+    try:
+      if os.fstat(self.fd).st_size + len(data) > self.max_size:
+        self.logger.debug('Trace file is full. Not recording trace events.')
+        self.Close()
+        return
+      os.write(self.fd, data)
+    except (IOError, OSError) as e:
+      self.logger.debug('Could not record trace event. %s.', e)
+      self.Close()
+
+  def _Event(self, name, phase, args):
+    """Create a trace event for the current thread.
+
+    Args:
+      name: string, the name of the event.
+      phase: string, the trace event type.
+      args: dict, attributes of the event.
+
+    Returns:
+      dict, the trace event.
+    """
+    event = {
+        'name': name,
+        'cat': 'boot',
+        'ph': phase,
+        'ts': int(_Now() * 1000000),
+        'pid': self.pid,
+        'tid': threading.current_thread().ident,
+    }
+    if args:
+      event['args'] = args
+    return event
+
+  @contextlib.contextmanager
+  def Span(self, name, **args):
+    """Record the duration of a block of code.
+
+    Args:
+      name: string, the name of the span.
+      **args: attributes of the span.
+
+    Yields:
+      dict, the attributes of the span, which may be updated in the block.
+    """
+    event = self._Event(name, 'X', args)
+    try:
+      yield args
+    finally:
+      event['dur'] = int(_Now() * 1000000) - event['ts']
+      if args:
+        event['args'] = args
+      self._Write(event)
+
+  def Mark(self, name, **args):
+    """Record an instant event the first time it occurs in the process.
+
+    Args:
+      name: string, the name of the event.
+      **args: attributes of the event.
+    """
+    with self.lock:
+      if name in self.marks:
+        return
+      self.marks.add(name)
+    event = self._Event(name, 'i', args)
+    event['s'] = 'p'
+    self._Write(event)
+
+  def Close(self):
+    """Stop recording trace events."""
+    fd, self.fd = self.fd, None
+    if fd is not None:
+      try:
+        os.close(fd)
+      except OSError:
+        pass
+
+
+def Configure(process_name, trace_file=None, logger=logging):
+  """Start recording trace events for this process.
+
+  Args:
+    process_name: string, the name shown for the process in the trace.
+    trace_file: string, the path of the trace file. The default path is used
+        when None and tracing is disabled when empty.
+    logger: logger object, used to write to SysLog and serial port.
+  """
+  global _tracer
+  if _tracer:
+    _tracer.Close()
+  if trace_file is None:
+    trace_file = TRACE_FILE
+  if trace_file:
+    _tracer = Tracer(trace_file, process_name, logger=logger)
+  else:
+    _tracer = None
+
+
+@contextlib.contextmanager
+def Span(name, **args):
+  """Record the duration of a block of code if tracing is configured.
+
+  Args:
+    name: string, the name of the span.
+    **args: attributes of the span.
+
+  Yields:
+    dict, the attributes of the span, which may be updated in the block.
+  """
+  tracer = _tracer
+  if tracer:
+    with tracer.Span(name, **args) as span_args:
+      yield span_args
+  else:
+    yield args
+
+
+def Mark(name, **args):
+  """Record an instant event once per process if tracing is configured.
+
+  Args:
+    name: string, the name of the event.
+    **args: attributes of the event.
+  """
+  tracer = _tracer
+  if tracer:
+    tracer.Mark(name, **args)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# Copyright 2020 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A library for running independent tasks on a bounded set of threads."""
+
+import logging
+import threading
+
+
+def ParallelMap(func, items, max_workers=4, logger=logging):
+  """Call a function on each item using a bounded number of worker threads.
+
+  An exception raised for one item is logged and does not prevent the
+  remaining items from being processed.
+
+  Args:
+    func: callable, the function to call with each item.
+    items: list, the arguments passed to the function.
+    max_workers: int, the maximum number of concurrent worker threads.
+    logger: logger object, used to write to SysLog and serial port.
+
+  Returns:
+    list, the function results in the order of items. The result is None for
+        an item that raised an exception.
+  """
+  items = list(items)
+  results = [None] * len(items)
+  if not items:
+    return results
+
+  lock = threading.Lock()
+  pending = iter(enumerate(items))
+
+  def _Worker():
+    while True:
+      with lock:
+        try:
+          index, item = next(pending)
+        except StopIteration:
+          return
+      try:
+        results[index] = func(item)
+      except Exception as e:
+        logger.exception('Exception processing %s. %s.', item, e)
+
+  if len(items) == 1 or max_workers <= 1:
+    _Worker()
+    return results
+
+  threads = []
+  for _ in range(min(max_workers, len(items))):
+    thread = threading.Thread(target=_Worker)
+    thread.daemon = True
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  return results